@@ -0,0 +1,138 @@
+"""
+Cold Start Benchmark of the Scoring API
+Stripe Data Architecture - ML Module
+
+Purpose: Time-to-ready of a fresh scoring worker (new interpreter per run),
+         loading the model from:
+             - pickle: joblib + xgboost / sklearn imports, compilation and
+               TreeSHAP paths built at startup
+             - bundle: precompiled .npz (deployment/api/compiled_model.py),
+               without and with warm-up
+         Reports the import of app.py, model load, warm-up, time-to-ready
+         (as exported on /metrics), then the first /score request and the
+         steady-state P50.
+
+Usage:
+    python bench_cold_start.py --trees 100 --depth 6 --repeat 3
+    python bench_cold_start.py --trees 300 --depth 8 --save results/cold_start.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(HERE, '..', 'deployment', 'api')
+sys.path.insert(0, API_DIR)
+
+from run_benchmarks import build_model_artifact  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('cold_start_benchmark')
+
+# Run in a fresh interpreter: start the API, then time requests
+WORKER = """
+import json, logging, os, statistics, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {api_dir!r})
+import app
+imported = time.perf_counter()
+logging.getLogger('app').setLevel(logging.ERROR)
+app.MODEL_PATH = {model_path!r}
+app.start()
+client = app.app.test_client()
+payload = {{'features': {{name: 0.5 for name in app.FEATURE_NAMES}}, 'explain': 'always'}}
+health = client.get('/health').status_code
+first_start = time.perf_counter()
+client.post('/api/v1/fraud/score', json=payload)
+first = time.perf_counter() - first_start
+steady = []
+for _ in range(50):
+    request_start = time.perf_counter()
+    client.post('/api/v1/fraud/score', json=payload)
+    steady.append(time.perf_counter() - request_start)
+phases = {{sample.labels['phase']: sample.value for metric in app.STARTUP_PHASE.collect()
+          for sample in metric.samples}}
+print(json.dumps({{
+    'import_s': imported - started, 'model_load_s': phases['model_load'], 'warmup_s': phases['warmup'],
+    'time_to_ready_s': app.time_to_ready, 'health': health, 'first_request_ms': first * 1000,
+    'steady_p50_ms': statistics.median(steady) * 1000,
+    'heavy_modules': [m for m in ('pandas', 'xgboost', 'sklearn', 'scipy') if m in sys.modules],
+}}))
+"""
+
+
+def run_worker(model_path: str, env: Dict[str, str]) -> Dict:
+    """One cold start in a new interpreter; also times the interpreter itself (spawn to exit)."""
+    code = WORKER.format(api_dir=API_DIR, model_path=model_path)
+    start = time.perf_counter()
+    # No label store: the API's default SQLite file would be left in API_DIR
+    env = {**os.environ, 'FRAUD_MONITOR_LABEL_STORE': 'off', **env}
+    output = subprocess.run([sys.executable, '-c', code], env=env, cwd=API_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scoring worker cold start: pickle vs compiled bundle')
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--repeat', type=int, default=3, help='Cold starts per mode (median reported)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results JSON')
+    args = parser.parse_args()
+
+    import joblib
+    from compiled_model import compile_model, save_bundle
+    from feature_registry import FEATURE_NAMES
+
+    workdir = tempfile.mkdtemp(prefix='fraud_cold_start_')
+    model_path = os.path.join(workdir, 'fraud_model.pkl')
+    bundle_path = os.path.join(workdir, 'fraud_model.npz')
+    build_model_artifact(model_path, FEATURE_NAMES, n_estimators=args.trees, max_depth=args.depth,
+                         seed=args.seed)
+    start = time.perf_counter()
+    save_bundle(bundle_path, *compile_model(joblib.load(model_path), FEATURE_NAMES))
+    compile_seconds = time.perf_counter() - start
+
+    modes = {
+        'pickle': {'FRAUD_MODEL_BUNDLE': os.path.join(workdir, 'missing.npz'), 'FRAUD_API_WARMUP_ROWS': '0'},
+        'bundle, no warm-up': {'FRAUD_MODEL_BUNDLE': bundle_path, 'FRAUD_API_WARMUP_ROWS': '0'},
+        'bundle': {'FRAUD_MODEL_BUNDLE': bundle_path},
+    }
+    results = {}
+    for mode, env in modes.items():
+        runs = [run_worker(model_path, env) for _ in range(args.repeat)]
+        results[mode] = {key: round(statistics.median(run[key] for run in runs), 4)
+                         for key in runs[0] if isinstance(runs[0][key], float)}
+        results[mode]['health'] = runs[0]['health']
+        results[mode]['heavy_modules'] = runs[0]['heavy_modules']
+
+    print(f"model: {args.trees} trees, depth {args.depth}; bundle "
+          f"{os.path.getsize(bundle_path) / 2 ** 20:.1f} MB, compiled in {compile_seconds:.2f} s")
+    print(f"{'mode':<20} {'import s':>9} {'load s':>8} {'warmup s':>9} {'ready s':>8} {'process s':>10} "
+          f"{'1st req ms':>11} {'p50 ms':>7}  heavy imports")
+    for mode, r in results.items():
+        print(f"{mode:<20} {r['import_s']:>9.3f} {r['model_load_s']:>8.3f} {r['warmup_s']:>9.3f} "
+              f"{r['time_to_ready_s']:>8.3f} {r['process_s']:>10.3f} {r['first_request_ms']:>11.2f} "
+              f"{r['steady_p50_ms']:>7.2f}  {', '.join(r['heavy_modules']) or '-'}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args),
+                       'compile_seconds': round(compile_seconds, 3), 'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Distributed Training Scaling Benchmark
+Stripe Data Architecture - ML Module
+
+Purpose: Scaling of the data-parallel trainer
+         (models/fraud_detection/distributed_train.py) from 1 to N worker
+         processes on the same training partitions (generated by
+         pipelines/synthetic when --data is not given). Boosting runs a
+         fixed number of rounds (no early stopping) so every run does the
+         same work. Reports per worker count: load / train / evaluate time
+         (slowest worker), rows trained per second, speedup over 1 worker,
+         peak RSS of the largest worker (shard memory) and test AUC.
+
+Usage:
+    python bench_distributed_training.py --transactions 2000000 --workers 1 2 4 8
+    python bench_distributed_training.py --data ../../data/synthetic/ml/training --save results/distributed.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'models', 'fraud_detection'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'pipelines', 'synthetic'))
+
+from distributed_train import DistributedJob, train_distributed  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('distributed_training_benchmark')
+
+
+def generate_partitions(out: str, transactions: int, seed: int) -> str:
+    """Training partitions of `transactions` synthetic transactions under out/ml/training."""
+    from generate import generate
+    from synthetic_data import GeneratorConfig
+
+    logging.getLogger('generate').setLevel(logging.WARNING)
+    generate(out, GeneratorConfig(n_transactions=transactions, seed=seed, chunk_rows=100_000),
+             outputs=['training'])
+    return os.path.join(out, 'ml', 'training')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data-parallel XGBoost training: 1 -> N workers')
+    parser.add_argument('--data', help='Existing training partitions (default: generated)')
+    parser.add_argument('--transactions', type=int, default=1_000_000, help='Generated transactions')
+    parser.add_argument('--start-date', default='2024-01-01')
+    parser.add_argument('--end-date', default='2026-01-01')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--trees', type=int, default=200, help='Boosting rounds (fixed)')
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--threads', type=int, help='XGBoost threads per worker (default: CPUs / workers)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results JSON')
+    args = parser.parse_args()
+
+    params = {'n_estimators': args.trees, 'max_depth': args.depth, 'learning_rate': 0.05, 'subsample': 0.8,
+              'colsample_bytree': 0.8, 'objective': 'binary:logistic', 'eval_metric': 'auc',
+              'tree_method': 'hist', 'random_state': args.seed}
+    with tempfile.TemporaryDirectory(prefix='bench_distributed_') as tmp:
+        root = args.data or generate_partitions(tmp, args.transactions, args.seed)
+        results = []
+        for workers in args.workers:
+            threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+            job = DistributedJob(root, args.start_date, args.end_date, params, threads)
+            _, metrics, info = train_distributed(job, workers)
+            results.append({'workers': workers, 'threads_per_worker': threads, **info['seconds'],
+                            'rows_train': info['rows']['train'],
+                            'train_rows_per_s': round(info['rows']['train'] / info['seconds']['train']),
+                            'peak_rss_mb': info['peak_rss_mb'], 'auc_roc': round(metrics['auc_roc'], 5)})
+
+    base = results[0]['total']
+    print(f"{results[0]['rows_train']:,} training rows, {args.trees} trees of depth {args.depth}, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'threads':>7} {'load s':>7} {'train s':>8} {'eval s':>7} {'total s':>8} "
+          f"{'rows/s':>9} {'speedup':>8} {'RSS MB':>7} {'AUC':>8}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['threads_per_worker']:>7} {r['load']:>7.2f} {r['train']:>8.2f} "
+              f"{r['evaluate']:>7.2f} {r['total']:>8.2f} {r['train_rows_per_s']:>9,} {base / r['total']:>7.2f}x "
+              f"{r['peak_rss_mb']:>7.0f} {r['auc_roc']:>8.5f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args), 'results': results},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Explanation Latency Benchmark
+Stripe Data Architecture - ML Module
+
+Purpose: Cost of the TreeSHAP reasons of the fraud API
+         (deployment/api/tree_explainer.py) against the former rule-based
+         explain_prediction, on a freshly trained model:
+             - exactness: contributions vs Booster.predict(pred_contribs=True)
+             - explainer load time (path extraction + pattern tables)
+             - per-row latency: rules, TreeSHAP one row per call, TreeSHAP
+               vectorized over a batch
+             - /api/v1/fraud/score end to end with explain "never" / "always"
+               (new payment_ids), and a retry asking explain "always" for a
+               payment first scored with "never" (replayed, reasons added)
+
+Usage:
+    python bench_explanations.py --trees 100 --depth 6 --rows 500
+    python bench_explanations.py --trees 300 --depth 8 --save results/explain.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'deployment', 'api'))
+
+import numpy as np  # noqa: E402
+
+from run_benchmarks import build_model_artifact, percentile, synthetic_feature_payload  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('explanation_benchmark')
+
+
+def timed(call: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """P50/P99 (ms) of `repeat` calls."""
+    latencies: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {'p50': round(percentile(latencies, 50), 4), 'p99': round(percentile(latencies, 99), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TreeSHAP vs rule-based explanation latency')
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--rows', type=int, default=500, help='Rows explained per measurement')
+    parser.add_argument('--batch', type=int, default=100, help='Rows per vectorized call')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results JSON')
+    args = parser.parse_args()
+
+    import app as fraud_api
+    import joblib
+    import xgboost as xgb
+    from tree_explainer import TreeExplainer
+
+    logging.getLogger('app').setLevel(logging.ERROR)
+    model_path = os.path.join(tempfile.mkdtemp(prefix='fraud_explain_'), 'fraud_model.pkl')
+    build_model_artifact(model_path, fraud_api.FEATURE_NAMES, n_estimators=args.trees,
+                         max_depth=args.depth, seed=args.seed)
+    fraud_api.MODEL_PATH = model_path
+    fraud_api.load_model()
+    model = joblib.load(model_path)
+
+    start = time.perf_counter()
+    explainer = TreeExplainer(model, fraud_api.FEATURE_NAMES)
+    load_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed)
+    payloads = [synthetic_feature_payload(rng, fraud_api.FEATURE_NAMES, f"pi_explain_{i}")
+                for i in range(args.rows)]
+    X = np.array([[p['features'][name] for name in fraud_api.FEATURE_NAMES] for p in payloads])
+
+    # Exactness against XGBoost's own TreeSHAP
+    matrix = xgb.DMatrix(X, feature_names=fraud_api.FEATURE_NAMES)
+    reference = model.get_booster().predict(matrix, pred_contribs=True)
+    values = explainer.shap_values(X)
+    max_error = float(np.abs(reference[:, :-1] - values).max())
+
+    rows = iter(range(10 ** 9))
+    rules = timed(lambda: fraud_api.explain_prediction(payloads[next(rows) % args.rows]['features'], 0.9),
+                  args.rows)
+    rows = iter(range(10 ** 9))
+    single = timed(lambda: explainer.explain(X[next(rows) % args.rows][None, :]), args.rows)
+    batches = [X[i:i + args.batch] for i in range(0, args.rows, args.batch)]
+    batch = timed(lambda: [explainer.explain(b) for b in batches], 3)
+    batch_per_row = round(batch['p50'] / args.rows, 4)
+
+    client = fraud_api.app.test_client()
+    endpoint = {}
+    requests = iter(range(10 ** 9))
+
+    def score(mode: str):
+        # A new payment_id per request: scored, not replayed from the idempotency cache
+        n = next(requests)
+        return client.post('/api/v1/fraud/score', json={**payloads[n % args.rows], 'explain': mode,
+                                                         'payment_id': f"pi_explain_{n}"})
+
+    for mode in ('never', 'always'):
+        endpoint[mode] = timed(lambda: score(mode), args.rows)
+
+    # Retry asking for reasons of a payment first scored with explain=never
+    replays = []
+
+    def retry_with_reasons():
+        n = next(requests)
+        payload = {**payloads[n % args.rows], 'payment_id': f"pi_explain_{n}"}
+        client.post('/api/v1/fraud/score', json={**payload, 'explain': 'never'})
+        start = time.perf_counter()
+        replay = client.post('/api/v1/fraud/score', json={**payload, 'explain': 'always'})
+        replays.append(((time.perf_counter() - start) * 1000, replay))
+
+    for _ in range(args.rows):
+        retry_with_reasons()
+    replay_latencies = sorted(latency for latency, _ in replays)
+    endpoint['retry_always_after_never'] = {'p50': round(percentile(replay_latencies, 50), 4),
+                                            'p99': round(percentile(replay_latencies, 99), 4)}
+    unexplained = sum(1 for _, r in replays
+                      if r.headers.get('Idempotent-Replayed') != 'true' or not r.get_json()['reasons'])
+
+    results = {
+        'model': {'trees': args.trees, 'depth': args.depth, 'paths': explainer.n_paths,
+                  'table_mb': round(explainer.table_bytes / 2 ** 20, 1)},
+        'max_abs_error_vs_xgboost': max_error,
+        'load_seconds': round(load_seconds, 3),
+        'rules_ms': rules,
+        'treeshap_single_ms': single,
+        'treeshap_batch_ms_per_row': batch_per_row,
+        'score_endpoint_ms': endpoint,
+    }
+
+    print(f"model: {args.trees} trees, depth {args.depth}, {explainer.n_paths} paths, "
+          f"tables {results['model']['table_mb']} MB, explainer load {load_seconds:.2f} s")
+    print(f"max |TreeSHAP - pred_contribs|: {max_error:.2e}")
+    print(f"{'explanation':<32} {'p50 ms':>9} {'p99 ms':>9}")
+    print(f"{'rules (explain_prediction)':<32} {rules['p50']:>9.4f} {rules['p99']:>9.4f}")
+    print(f"{'TreeSHAP, one row per call':<32} {single['p50']:>9.4f} {single['p99']:>9.4f}")
+    print(f"{f'TreeSHAP, batch of {args.batch} (per row)':<32} {batch_per_row:>9.4f}")
+    for mode, r in endpoint.items():
+        label = '/score retry, never -> always' if mode == 'retry_always_after_never' else f'/score explain={mode}'
+        print(f"{label:<32} {r['p50']:>9.4f} {r['p99']:>9.4f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args), 'results': results},
+                      f, indent=2)
+    if max_error > 1e-4:
+        print("FAIL contributions differ from XGBoost pred_contribs")
+        sys.exit(1)
+    if unexplained:
+        print(f"FAIL {unexplained} replayed retries with explain=always returned no reasons")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
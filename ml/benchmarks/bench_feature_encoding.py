@@ -0,0 +1,144 @@
+"""
+Feature Document Encoding Benchmark
+Stripe Data Architecture - ML Module
+
+Purpose: Compare the two forms of a fraud_features document
+         (features/feature_encoding.py) on feature dicts computed by
+         FeatureEngineer against the local SQLite backend:
+             - json: one JSON property per feature (previous format)
+             - compact: packed, versioned vector (fv) + plain indexed fields
+         Reports serialized size, properties indexed by the container's
+         policy (drives write RU), encode throughput (dict -> JSON text),
+         bulk decode throughput (JSON text -> training matrix) and the
+         precision of the stored values.
+
+Usage:
+    python bench_feature_encoding.py --documents 2000 --rows 100000
+    python bench_feature_encoding.py --save results/feature_encoding.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'features'))
+
+from local_stores import SyntheticDataset  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('feature_encoding_benchmark')
+
+# Paths excluded from indexing in fraud_features (models/nosql/collections.json)
+EXCLUDED_PATHS = ('raw_features', 'fv')
+
+
+def computed_features(n: int, seed: int) -> List[Dict]:
+    """Feature dicts as store_features receives them, with the API's score fields."""
+    from data_sources import SQLiteDataSource
+    from feature_engineering import FeatureEngineer
+
+    logging.getLogger('feature_engineering').setLevel(logging.WARNING)
+    dataset = SyntheticDataset(200, 50, 20, seed=seed)
+    source = SQLiteDataSource()
+    dataset.load_local(source)
+    engineer = FeatureEngineer(data_source=source)
+    rng = random.Random(seed)
+    documents = []
+    for txn in dataset.transactions(n):
+        features = engineer.compute_features(txn)
+        score = rng.random()
+        features.update(fraud_score=round(score, 4), model_version='2.3.1',
+                        risk_level='high' if score >= 0.7 else 'medium' if score >= 0.3 else 'low')
+        documents.append(features)
+    source.close()
+    return documents
+
+
+def indexed_properties(document: Dict) -> int:
+    """Leaf properties indexed under the fraud_features policy (/* minus excluded paths)."""
+    return sum(1 for key in document if key not in EXCLUDED_PATHS)
+
+
+def throughput(fn: Callable[[], object], items: int, repeat: int = 3) -> float:
+    """Best of `repeat` runs, items per second."""
+    best = min(_timed(fn) for _ in range(repeat))
+    return items / best
+
+
+def _timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fraud_features documents: JSON vs compact encoding')
+    parser.add_argument('--documents', type=int, default=2000, help='Feature dicts computed by FeatureEngineer')
+    parser.add_argument('--rows', type=int, default=100_000, help='Documents decoded in bulk (cycled)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results JSON')
+    args = parser.parse_args()
+
+    from feature_encoding import CURRENT_SCHEMA_ID, SCHEMAS, decode_matrix, encode_document
+    from feature_registry import FEATURE_NAMES
+
+    features = computed_features(args.documents, args.seed)
+    corpus = [dict(features[i % len(features)], payment_id=f"pi_bench_{i}") for i in range(args.rows)]
+    forms = {
+        'json': lambda f: dict(f, id=f['payment_id']),
+        'compact': encode_document,
+    }
+
+    results = {'schema': CURRENT_SCHEMA_ID, 'vector_bytes': SCHEMAS[CURRENT_SCHEMA_ID].size}
+    for form, encode in forms.items():
+        texts = [json.dumps(encode(f)) for f in corpus]
+        results[form] = {
+            'bytes_per_document': round(sum(len(t) for t in texts) / len(texts), 1),
+            'indexed_properties': indexed_properties(encode(corpus[0])),
+            'encode_docs_per_s': round(throughput(lambda: [json.dumps(encode(f)) for f in corpus], len(corpus))),
+            'decode_rows_per_s': round(throughput(
+                lambda: decode_matrix([json.loads(t) for t in texts], FEATURE_NAMES), len(texts))),
+        }
+
+    # Precision: stored (decoded) vs computed values, per storage type
+    reference = decode_matrix(features, FEATURE_NAMES).astype(np.float64)
+    decoded = decode_matrix([encode_document(f) for f in features], FEATURE_NAMES).astype(np.float64)
+    schema = SCHEMAS[CURRENT_SCHEMA_ID]
+    error = np.abs(decoded - reference) / np.maximum(1.0, np.abs(reference))
+    results['max_error'] = {
+        storage: float(np.nanmax(error[:, [FEATURE_NAMES.index(n) for n in names]]))
+        for storage, names in (('float32', schema.float32), ('float16', schema.float16), ('int8', schema.int8))
+    }
+    results['missing_preserved'] = bool((np.isnan(decoded) == np.isnan(reference)).all())
+
+    json_form, compact = results['json'], results['compact']
+    print(f"schema {CURRENT_SCHEMA_ID}: {results['vector_bytes']} bytes per packed vector, "
+          f"{args.rows} documents ({args.documents} distinct feature dicts)")
+    print(f"{'form':<9} {'bytes/doc':>10} {'indexed':>8} {'encode docs/s':>14} {'decode rows/s':>14}")
+    for form in forms:
+        r = results[form]
+        print(f"{form:<9} {r['bytes_per_document']:>10.0f} {r['indexed_properties']:>8} "
+              f"{r['encode_docs_per_s']:>14,} {r['decode_rows_per_s']:>14,}")
+    print(f"compact / json: size {compact['bytes_per_document'] / json_form['bytes_per_document']:.2f}x, "
+          f"decode {compact['decode_rows_per_s'] / json_form['decode_rows_per_s']:.1f}x faster")
+    print("max relative error: " + ", ".join(f"{k} {v:.1e}" for k, v in results['max_error'].items())
+          + f"; missing values preserved: {results['missing_preserved']}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args), 'results': results},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
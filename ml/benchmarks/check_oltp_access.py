@@ -0,0 +1,154 @@
+"""
+OLTP Access Plan & Latency Check
+Stripe Data Architecture - ML Module
+
+Purpose: Regression check for the feature lookups of
+         features/oltp_access.py against a local load of
+         models/oltp/schema.sql (SQLite):
+             - schema: every lookup seeks a declared index that covers it
+               (check_lookups)
+             - plans: EXPLAIN QUERY PLAN searches each lookup table through
+               the expected index, no table scan
+             - latency: P50/P99 of single-key and multi-key calls, compared
+               with a saved baseline
+
+Usage:
+    python check_oltp_access.py --customers 5000 --history 40 --save results/oltp_baseline.json
+    python check_oltp_access.py --baseline results/oltp_baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'features'))
+
+from data_sources import SQLITE_TIME_FORMAT, SQLiteDataSource  # noqa: E402
+from local_stores import SyntheticDataset  # noqa: E402
+from oltp_access import LOOKUPS, check_lookups  # noqa: E402
+from run_benchmarks import percentile  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('oltp_access_check')
+
+# Lookups taking a `since` timestamp (days back), as called by FeatureEngineer
+WINDOWS = {'payment_diversity': 30, 'amount_stats': 7, 'merchant_activity': 30}
+MERCHANT_LOOKUPS = ('merchant_activity', 'merchants')
+
+
+def check_plans(source: SQLiteDataSource) -> List[str]:
+    """Lookups whose SQLite plan does not search every seek table through its index."""
+    problems = []
+    for name, lookup in LOOKUPS.items():
+        params = ['[1]'] + (['2000-01-01 00:00:00'] if name in WINDOWS else [])
+        plan = [row[3] for row in source._db.execute(f"EXPLAIN QUERY PLAN {source.oltp.sql(name)}", params)]
+        for seek in lookup.seeks:
+            expected = seek.index or f"sqlite_autoindex_{seek.table}"
+            if not any(re.match(rf"SEARCH {seek.alias} USING (COVERING )?INDEX {expected}(_\d+)?\b", step)
+                       for step in plan):
+                problems.append(f"{name}: {seek.alias} ({seek.table}) not searched through {expected}: "
+                                + ' | '.join(plan))
+    return problems
+
+
+def measure(source: SQLiteDataSource, dataset: SyntheticDataset, samples: int, batch: int,
+            seed: int, rtt_ms: float) -> Dict[str, Dict]:
+    """Single-key and multi-key latency per lookup (ms); speedup counts one round trip per call."""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    results = {}
+    for name in LOOKUPS:
+        population = dataset.merchants if name in MERCHANT_LOOKUPS else dataset.customers
+        params = [(now - timedelta(days=WINDOWS[name])).strftime(SQLITE_TIME_FORMAT)] if name in WINDOWS else []
+        single, bulk = [], []
+        for _ in range(samples):
+            key = rng.choice(population)
+            start = time.perf_counter()
+            source.oltp.fetch(name, [key], *params)
+            single.append((time.perf_counter() - start) * 1000)
+        for _ in range(max(1, samples // 10)):
+            keys = rng.sample(population, min(batch, len(population)))
+            start = time.perf_counter()
+            source.oltp.fetch(name, keys, *params)
+            bulk.append((time.perf_counter() - start) * 1000)
+        single.sort()
+        bulk.sort()
+        results[name] = {
+            'single_ms': {'p50': percentile(single, 50), 'p99': percentile(single, 99)},
+            'bulk_ms': {'p50': percentile(bulk, 50), 'p99': percentile(bulk, 99)},
+            'bulk_keys': min(batch, len(population)),
+        }
+        results[name]['bulk_speedup'] = round(
+            (results[name]['single_ms']['p50'] + rtt_ms) * results[name]['bulk_keys']
+            / (results[name]['bulk_ms']['p50'] + rtt_ms), 1
+        ) if results[name]['bulk_ms']['p50'] else 0.0
+    return results
+
+
+def compare(baseline: Dict, results: Dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, new in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for kind in ('single_ms', 'bulk_ms'):
+            before, after = old[kind]['p50'], new[kind]['p50']
+            if before and (after - before) / before > threshold:
+                regressions.append(f"{name} {kind} p50 {before:.3f} -> {after:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OLTP lookup plan / latency regression check')
+    parser.add_argument('--customers', type=int, default=5_000)
+    parser.add_argument('--merchants', type=int, default=200)
+    parser.add_argument('--history', type=int, default=40)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=200, help='Keys per multi-key call')
+    parser.add_argument('--rtt-ms', type=float, default=1.0, help='Network round trip added per call (speedup)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', help='Results JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed P50 increase')
+    parser.add_argument('--save', help='Write results JSON (new baseline)')
+    args = parser.parse_args()
+
+    source = SQLiteDataSource()
+    problems = check_lookups(source.oltp.schema)
+
+    dataset = SyntheticDataset(args.customers, args.merchants, args.history, seed=args.seed)
+    dataset.load_local(source)
+    source._db.execute("ANALYZE")
+    problems += check_plans(source)
+    results = measure(source, dataset, args.samples, args.batch, args.seed, args.rtt_ms)
+    source.close()
+
+    print(f"{'lookup':<20} {'single p50':>11} {'single p99':>11} {'bulk p50':>10} {'keys':>6} {'speedup':>8}")
+    for name, r in results.items():
+        print(f"{name:<20} {r['single_ms']['p50']:>11.3f} {r['single_ms']['p99']:>11.3f} "
+              f"{r['bulk_ms']['p50']:>10.3f} {r['bulk_keys']:>6} {r['bulk_speedup']:>7.1f}x")
+    print(f"(ms; speedup: single-key calls for the same keys / one multi-key call, {args.rtt_ms} ms round trip each)")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems += compare(json.load(f)['results'], results, args.threshold)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args), 'results': results},
+                      f, indent=2)
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Overload Test of the Scoring API
+Stripe Data Architecture - ML Module
+
+Purpose: Show what admission control (deployment/api/admission_control.py)
+         does to /api/v1/fraud/score beyond capacity:
+             - the API runs in its own process (threaded WSGI server, as in
+               production), the load generator in this one: client work
+               does not compete with the server for its GIL
+             - capacity: throughput of /score over HTTP on a freshly
+               trained model, saturated by a few closed-loop clients,
+               admission control off
+             - open-loop Poisson arrivals at `--overload` x capacity, with
+               and without admission control: every request is sent at its
+               scheduled time on its own connection (asyncio, no client
+               worker pool to saturate); latency is measured from the
+               scheduled arrival, which is also sent as X-Request-Start so
+               that the server's deadline covers its listen queue
+             - P50/P99 per half of the run (a growing P99 = unbounded queue),
+               handler-side P99 (latency_ms), share of model, degraded
+               (rule-based) and shed (503) responses, and decisions per
+               second returned within `--client-timeout-ms` (without
+               admission control most of them complete, but seconds late)
+
+Usage:
+    python load_shedding.py --overload 2 --seconds 20
+    python load_shedding.py --trees 300 --depth 8 --save results/load_shedding.json
+    python load_shedding.py --explain never --overload 1.5
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'deployment', 'api'))
+
+from run_benchmarks import build_model_artifact, percentile, synthetic_feature_payload  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('load_shedding')
+
+SCORE_PATH = '/api/v1/fraud/score'
+# Client-side limit of one request (the off run queues for seconds)
+REQUEST_TIMEOUT_SECONDS = 120
+# Capacity measurement: requests and closed-loop clients (enough to keep the
+# server busy while each one is between requests)
+CAPACITY_REQUESTS = 600
+CAPACITY_CONCURRENCY = 8
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {'p50': round(percentile(latencies, 50), 2), 'p99': round(percentile(latencies, 99), 2)}
+
+
+# ============================================================================
+# SERVER PROCESS
+# ============================================================================
+
+def serve(port: int, model_path: str) -> None:
+    """Server side (--serve): load, warm up, then serve the app until killed."""
+    import app as fraud_api
+    from werkzeug.serving import make_server
+
+    for name in ('app', 'werkzeug', 'model_monitoring'):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    fraud_api.MODEL_PATH = model_path
+    fraud_api.MODEL_BUNDLE_PATH = model_path + '.npz'
+    fraud_api.LABEL_STORE = 'off'
+    fraud_api.start()
+    make_server('127.0.0.1', port, fraud_api.app, threaded=True).serve_forever()
+
+
+def start_server(model_path: str, admission: bool) -> Tuple[subprocess.Popen, int]:
+    """API process on a free port, once /health reports ready."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, FRAUD_API_ADMISSION='on' if admission else 'off')
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port),
+                                '--model', model_path], env=env)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API process exited with {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                if response.status == 200:
+                    return process, port
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('API process not ready after 120 s')
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# ============================================================================
+# OPEN-LOOP CLIENT
+# ============================================================================
+
+async def post(port: int, payload: Dict, scheduled_epoch: Optional[float] = None) -> Tuple[int, Dict]:
+    """One POST /score on a new connection; returns (status, JSON body)."""
+    body = json.dumps(payload).encode()
+    headers = [f"POST {SCORE_PATH} HTTP/1.1", f"Host: 127.0.0.1:{port}", 'Content-Type: application/json',
+               f"Content-Length: {len(body)}", 'Connection: close']
+    if scheduled_epoch is not None:
+        headers.append(f"X-Request-Start: t={scheduled_epoch * 1000:.0f}")
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write('\r\n'.join(headers).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, json.loads(content) if content else {}
+
+
+async def capacity_run(port: int, payloads: List[Dict], concurrency: int) -> float:
+    """Throughput (req/s) of `concurrency` closed-loop clients sharing `payloads`."""
+    queue = iter(payloads)
+
+    async def client():
+        for payload in queue:
+            await post(port, payload)
+
+    # Warm-up (connections, first trees touched) outside the measurement
+    for payload in payloads[:20]:
+        await post(port, payload)
+    payloads = payloads[20:]
+    queue = iter(payloads)
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return len(payloads) / (time.perf_counter() - started)
+
+
+async def open_loop(port: int, payloads: List[Dict], rate: float, seconds: float, seed: int,
+                    client_timeout_ms: float) -> Dict:
+    """
+    Poisson arrivals at `rate` req/s for `seconds`, each request sent at its
+    scheduled time whatever the previous ones are doing.
+
+    Returns latency percentiles (ms, from the scheduled arrival) per half of
+    the run and overall, handler latency percentiles, the count of each
+    outcome, and the rate of decisions (model or degraded) returned before
+    `client_timeout_ms`: a later one is useless to the payment flow.
+    """
+    rng = random.Random(seed)
+    records = []
+    # perf_counter -> epoch offset, for X-Request-Start
+    epoch_offset = time.time() - time.perf_counter()
+
+    async def send(payload: Dict, scheduled: float):
+        server_ms = None
+        try:
+            status, body = await asyncio.wait_for(post(port, payload, scheduled + epoch_offset),
+                                                  REQUEST_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, OSError, ValueError, IndexError):
+            status, body = None, {}
+        if status == 200:
+            outcome = 'degraded' if body['degraded'] else 'model'
+            server_ms = body['latency_ms']
+        else:
+            outcome = 'shed' if status == 503 else 'error'
+        records.append((scheduled, (time.perf_counter() - scheduled) * 1000, outcome, server_ms))
+
+    start = time.perf_counter()
+    client_cpu = time.process_time()
+    scheduled = start
+    tasks = []
+    while scheduled - start < seconds:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(payloads[len(tasks) % len(payloads)], scheduled)))
+        scheduled += rng.expovariate(rate)
+    send_lag = time.perf_counter() - scheduled
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - start
+    client_cpu = time.process_time() - client_cpu
+
+    middle = start + seconds / 2
+    outcomes = {name: sum(1 for r in records if r[2] == name) for name in ('model', 'degraded', 'shed', 'error')}
+    answered = [r[1] for r in records if r[2] != 'error']
+    in_time = [r for r in records if r[2] in ('model', 'degraded') and r[1] <= client_timeout_ms]
+    return {
+        'requests': len(records),
+        'offered_rps': round(len(records) / seconds, 1),
+        'wall_seconds': round(wall, 2),
+        # Positive when the generator fell behind its schedule (client-bound)
+        'client_lag_ms': round(max(0.0, send_lag) * 1000, 1),
+        # CPU of this process per request (shared with the server on a small host)
+        'client_cpu_ms': round(client_cpu * 1000 / len(records), 2),
+        'outcomes': outcomes,
+        'model_rps': round(outcomes['model'] / wall, 1),
+        'in_time_rps': round(len(in_time) / seconds, 1),
+        'in_time_model_rps': round(sum(1 for r in in_time if r[2] == 'model') / seconds, 1),
+        'latency_ms': latency_summary(answered),
+        'server_ms': latency_summary([r[3] for r in records if r[3] is not None]),
+        'first_half_ms': latency_summary([r[1] for r in records if r[0] < middle and r[2] != 'error']),
+        'second_half_ms': latency_summary([r[1] for r in records if r[0] >= middle and r[2] != 'error']),
+    }
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='/score latency under overload, with and without admission control')
+    parser.add_argument('--trees', type=int, default=300)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--overload', type=float, default=2.0, help='Offered load / measured capacity')
+    parser.add_argument('--seconds', type=float, default=20.0, help='Duration of each run')
+    parser.add_argument('--explain', default='always', choices=['always', 'never'],
+                        help='Explanations per request (always: service time of a few ms)')
+    parser.add_argument('--client-timeout-ms', type=float, default=1000.0,
+                        help='Decisions returned later than this are not counted as in time')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results JSON')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    parser.add_argument('--model', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.model)
+        return
+
+    from feature_registry import FEATURE_NAMES
+
+    model_path = os.path.join(tempfile.mkdtemp(prefix='fraud_overload_'), 'fraud_model.pkl')
+    build_model_artifact(model_path, FEATURE_NAMES, n_estimators=args.trees, max_depth=args.depth, seed=args.seed)
+
+    rng = random.Random(args.seed)
+
+    def make_payloads(count: int, prefix: str) -> List[Dict]:
+        payloads = []
+        for i in range(count):
+            payload = synthetic_feature_payload(rng, FEATURE_NAMES, f"pi_{prefix}_{i}")
+            payload['explain'] = args.explain
+            payloads.append(payload)
+        return payloads
+
+    # Capacity: saturated closed loop over HTTP, no admission control
+    process, port = start_server(model_path, admission=False)
+    try:
+        capacity = asyncio.run(capacity_run(port, make_payloads(CAPACITY_REQUESTS, 'capacity'),
+                                            CAPACITY_CONCURRENCY))
+    finally:
+        stop_server(process)
+    rate = capacity * args.overload
+
+    results = {'capacity_rps': round(capacity, 1), 'offered_rps': round(rate, 1)}
+    for mode in ('on', 'off'):
+        process, port = start_server(model_path, admission=mode == 'on')
+        try:
+            # Fresh payment_ids per run (no idempotent replays)
+            payloads = make_payloads(int(rate * args.seconds * 1.2), mode)
+            results[f"admission_{mode}"] = asyncio.run(open_loop(port, payloads, rate, args.seconds, args.seed,
+                                                                     args.client_timeout_ms))
+        finally:
+            stop_server(process)
+
+    print(f"capacity {capacity:.0f} req/s, offered {rate:.0f} req/s "
+          f"({args.overload}x)")
+    print(f"{'admission':<10} {'p50 ms':>9} {'p99 ms':>9} {'p99 1st':>9} {'p99 2nd':>9} {'p99 srv':>9} "
+          f"{'model':>7} {'degraded':>9} {'shed':>6} {'error':>6} {'model/s':>8} {'in time/s':>10} "
+          f"{'model in time/s':>16}")
+    for mode in ('off', 'on'):
+        r = results[f"admission_{mode}"]
+        print(f"{mode:<10} {r['latency_ms']['p50']:>9.1f} {r['latency_ms']['p99']:>9.1f} "
+              f"{r['first_half_ms']['p99']:>9.1f} {r['second_half_ms']['p99']:>9.1f} {r['server_ms']['p99']:>9.1f} "
+              f"{r['outcomes']['model']:>7} {r['outcomes']['degraded']:>9} {r['outcomes']['shed']:>6} "
+              f"{r['outcomes']['error']:>6} {r['model_rps']:>8.1f} {r['in_time_rps']:>10.1f} "
+              f"{r['in_time_model_rps']:>16.1f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args), 'results': results},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+"""
+Local Stand-ins for Azure SQL and Cosmos DB
+Stripe Data Architecture - ML Module
+
+Purpose: Run FeatureEngineer and the scoring API fully offline for
+         benchmarking. SQLite replaces Azure SQL (same OLTP schema, T-SQL
+         constructs translated on the fly) and an in-memory container replaces
+         Cosmos DB. Both inject configurable network latency per call.
+"""
+
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import string
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'features'))
+from data_sources import StdevAggregate, translate_oltp_ddl
+from oltp_access import OLTP_SCHEMA_PATH
+from customer_activity import apply_payment_event, new_activity_document
+
+
+# ============================================================================
+# LATENCY INJECTION
+# ============================================================================
+
+class InjectedLatency:
+    """
+    Log-normal latency model for a remote call.
+
+    Args:
+        median_ms: Median round-trip time (0 disables injection)
+        sigma: Log-normal shape; 0.5 gives P99 ~ 3.2x the median
+        seed: Random seed for reproducible runs
+    """
+
+    def __init__(self, median_ms: float = 0.0, sigma: float = 0.5, seed: int = 42):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_ms(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        with self._lock:
+            z = self._rng.gauss(0, 1)
+        return self.median_ms * math.exp(self.sigma * z)
+
+    def wait(self) -> None:
+        delay_ms = self.sample_ms()
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+
+# ============================================================================
+# SQL STAND-IN (pyodbc-compatible subset over SQLite)
+# ============================================================================
+
+_OPENJSON_KEYS = re.compile(r"OPENJSON\(\?\)\s*WITH\s*\(\s*(\w+)\s+\w+\s+'\$'\s*\)", re.IGNORECASE)
+_DATEADD_NOW = re.compile(r"DATEADD\(\s*DAY\s*,\s*(-?\d+|\?)\s*,\s*GETDATE\(\)\s*\)", re.IGNORECASE)
+_DATEDIFF_NOW = re.compile(r"DATEDIFF\(\s*DAY\s*,\s*(.+?)\s*,\s*GETDATE\(\)\s*\)", re.IGNORECASE)
+
+SQLITE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def translate_tsql(sql: str) -> str:
+    """Rewrite the T-SQL constructs used by the feature lookups (key sets, date functions) for SQLite."""
+    sql = _OPENJSON_KEYS.sub(lambda m: f"(SELECT value AS {m.group(1)} FROM json_each(?))", sql)
+    sql = _DATEADD_NOW.sub(
+        lambda m: "datetime('now', ? || ' days')" if m.group(1) == '?'
+        else f"datetime('now', '{int(m.group(1))} days')",
+        sql
+    )
+    sql = _DATEDIFF_NOW.sub(
+        lambda m: f"CAST(julianday('now') - julianday({m.group(1)}) AS INTEGER)", sql
+    )
+    return sql
+
+
+def _sqlite_param(value):
+    return value.strftime(SQLITE_TIME_FORMAT) if isinstance(value, datetime) else value
+
+
+class _Row:
+    """Attribute-access row, like pyodbc.Row."""
+
+    __slots__ = ('_values',)
+
+    def __init__(self, values: Dict):
+        self._values = values
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, index):
+        return list(self._values.values())[index]
+
+    def __iter__(self):
+        return iter(self._values.values())
+
+
+class LocalSQLCursor:
+    """Subset of the pyodbc cursor API used by FeatureEngineer."""
+
+    def __init__(self, connection: 'LocalSQLConnection'):
+        self._connection = connection
+        self._rows: List[_Row] = []
+        self.description = None
+
+    def execute(self, sql: str, *params):
+        self._rows = self._connection.run(sql, params)
+        self.description = [(c,) for c in self._rows[0]._values] if self._rows else []
+        return self
+
+    def fetchone(self) -> Optional[_Row]:
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self) -> List[_Row]:
+        rows, self._rows = self._rows, []
+        return rows
+
+
+class LocalSQLConnection:
+    """
+    pyodbc-compatible connection backed by an in-memory SQLite database
+    with the OLTP schema (models/oltp/schema.sql).
+
+    SQLite calls are serialized; injected latency is spent outside the
+    lock so concurrent callers overlap like they would against a server.
+    """
+
+    def __init__(self, latency: Optional[InjectedLatency] = None):
+        self.latency = latency or InjectedLatency()
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._db.create_aggregate('STDEV', 1, StdevAggregate)
+        with open(OLTP_SCHEMA_PATH, 'r', encoding='utf-8') as f:
+            for statement in translate_oltp_ddl(f.read()):
+                self._db.execute(statement)
+        self._lock = threading.Lock()
+        self._translated: Dict[str, str] = {}
+        self.query_count = 0
+
+    def cursor(self) -> LocalSQLCursor:
+        return LocalSQLCursor(self)
+
+    def run(self, sql: str, params: Iterable) -> List[_Row]:
+        translated = self._translated.get(sql)
+        if translated is None:
+            translated = self._translated.setdefault(sql, translate_tsql(sql))
+        self.latency.wait()
+        with self._lock:
+            self.query_count += 1
+            cursor = self._db.execute(translated, tuple(_sqlite_param(p) for p in params))
+            columns = [c[0] for c in cursor.description] if cursor.description else []
+            return [_Row(dict(zip(columns, values))) for values in cursor.fetchall()]
+
+    def insert_many(self, table: str, rows: List[Dict]) -> None:
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        placeholders = ', '.join('?' for _ in columns)
+        with self._lock:
+            self._db.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                [tuple(row[c] for c in columns) for row in rows]
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# ============================================================================
+# COSMOS STAND-IN
+# ============================================================================
+
+_CONDITION = re.compile(r"c\.(\w+)\s*(>=|<=|!=|=|>|<)\s*(@\w+)")
+_OPERATORS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>=': lambda a, b: a is not None and a >= b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '<': lambda a, b: a is not None and a < b,
+}
+
+
+class LocalCosmosError(Exception):
+    """Mirrors CosmosHttpResponseError.status_code (404, 409, 412)."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LocalCosmosContainer:
+    """
+    In-memory container supporting the query shapes FeatureEngineer uses:
+    AND-ed `c.field <op> @param` filters, optionally with SELECT COUNT(1).
+
+    Logical partitions (partition key values) are hashed onto a fixed number
+    of physical partitions; stats record how many physical partitions and
+    documents each query touched. Writes maintain an _etag so conditional
+    replace behaves like Cosmos DB (412 on mismatch, 409 on duplicate create).
+    """
+
+    def __init__(self, partition_key: str = '/payment_id',
+                 latency: Optional[InjectedLatency] = None,
+                 physical_partitions: int = 16):
+        self.partition_field = partition_key.lstrip('/')
+        self.latency = latency or InjectedLatency()
+        self.physical_partitions = physical_partitions
+        self._partitions: Dict[str, Dict[str, Dict]] = {}
+        self._lock = threading.Lock()
+        self._etag = 0
+        self.stats = {'queries': 0, 'cross_partition_queries': 0, 'partitions_scanned': 0,
+                      'documents_scanned': 0, 'point_reads': 0, 'writes': 0}
+
+    def _write(self, body: Dict, expect_etag: Optional[str] = None, create: bool = False) -> Dict:
+        item_id = body.get('id') or body.get(self.partition_field)
+        with self._lock:
+            partition = self._partitions.setdefault(body.get(self.partition_field), {})
+            current = partition.get(item_id)
+            if create and current is not None:
+                raise LocalCosmosError(409, f"Item {item_id} already exists")
+            if expect_etag is not None and (current is None or current['_etag'] != expect_etag):
+                raise LocalCosmosError(412, f"Precondition failed for item {item_id}")
+            self._etag += 1
+            self.stats['writes'] += 1
+            stored = dict(body, _etag=f'"{self._etag}"')
+            partition[item_id] = stored
+            return dict(stored)
+
+    def upsert_item(self, body: Dict) -> Dict:
+        self.latency.wait()
+        return self._write(body)
+
+    def create_item(self, body: Dict) -> Dict:
+        self.latency.wait()
+        return self._write(body, create=True)
+
+    def replace_item(self, item: str, body: Dict, etag: Optional[str] = None,
+                     match_condition=None) -> Dict:
+        self.latency.wait()
+        return self._write(dict(body, id=item), expect_etag=etag)
+
+    def read_item(self, item: str, partition_key: str) -> Dict:
+        self.latency.wait()
+        with self._lock:
+            self.stats['point_reads'] += 1
+            partition = self._partitions.get(partition_key, {})
+            if item not in partition:
+                raise LocalCosmosError(404, f"Item {item} not found in partition {partition_key}")
+            return json.loads(json.dumps(partition[item]))
+
+    def delete_item(self, item: str, partition_key: str) -> None:
+        self.latency.wait()
+        with self._lock:
+            partition = self._partitions.get(partition_key, {})
+            if item not in partition:
+                raise LocalCosmosError(404, f"Item {item} not found in partition {partition_key}")
+            self.stats['writes'] += 1
+            del partition[item]
+
+    def query_items(self, query: str, parameters: Optional[List[Dict]] = None,
+                    enable_cross_partition_query: bool = False,
+                    partition_key: Optional[str] = None,
+                    max_item_count: Optional[int] = None) -> List[Dict]:
+        self.latency.wait()
+        values = {p['name']: p['value'] for p in (parameters or [])}
+        conditions = [(field, _OPERATORS[op], values[param])
+                      for field, op, param in _CONDITION.findall(query)]
+
+        with self._lock:
+            self.stats['queries'] += 1
+            if partition_key is not None:
+                partitions = [self._partitions.get(partition_key, {})]
+                self.stats['partitions_scanned'] += 1
+            else:
+                if not enable_cross_partition_query:
+                    raise ValueError("Cross-partition query requires enable_cross_partition_query")
+                self.stats['cross_partition_queries'] += 1
+                partitions = list(self._partitions.values())
+                self.stats['partitions_scanned'] += min(self.physical_partitions, len(partitions))
+            self.stats['documents_scanned'] += sum(len(p) for p in partitions)
+
+            matches = [
+                item for partition in partitions for item in partition.values()
+                if all(op(item.get(field), value) for field, op, value in conditions)
+            ]
+
+        if re.search(r"SELECT\s+COUNT\(1\)", query, re.IGNORECASE):
+            return [{'count': len(matches)}]
+        return [dict(item) for item in matches]
+
+
+# ============================================================================
+# SYNTHETIC DATA (shaped like models/nosql/samples)
+# ============================================================================
+
+INDUSTRIES = ['electronics', 'clothing', 'food', 'travel', 'gambling',
+              'software', 'jewelry', 'cryptocurrency']
+COUNTRIES = ['US', 'FR', 'GB', 'DE', 'ES', 'BR', 'IN', 'NG']
+EMAIL_DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'example.com',
+                 'company.fr', 'tempmail.com']
+
+
+def _stripe_id(rng: random.Random, prefix: str, length: int = 24) -> str:
+    alphabet = string.ascii_letters + string.digits
+    return prefix + ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+class SyntheticDataset:
+    """
+    Seeded population of customers, merchants and payment history, plus a
+    generator for incoming transactions that reference it.
+    """
+
+    def __init__(self, n_customers: int = 2_000, n_merchants: int = 200,
+                 history_per_customer: int = 20, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.n_customers = n_customers
+        self.n_merchants = n_merchants
+        self.history_per_customer = history_per_customer
+        self.customers = [_stripe_id(self.rng, 'cus_', 12) for _ in range(n_customers)]
+        self.merchants = [_stripe_id(self.rng, 'acct_', 16) for _ in range(n_merchants)]
+        self.devices = {cid: [_stripe_id(self.rng, 'fp_', 12) for _ in range(self.rng.randint(1, 2))]
+                        for cid in self.customers}
+
+    def _random_ip(self) -> str:
+        return '.'.join(str(self.rng.randint(1, 254)) for _ in range(4))
+
+    def _payment_event(self, customer_id: str, payment_id: str, timestamp: datetime) -> Dict:
+        """Customer activity projection event for a historical payment."""
+        rng = self.rng
+        return {
+            'payment_id': payment_id,
+            'customer_id': customer_id,
+            'timestamp': timestamp.isoformat(),
+            'country': rng.choice(COUNTRIES),
+            'latitude': round(rng.uniform(-60, 70), 4),
+            'longitude': round(rng.uniform(-180, 180), 4),
+            'device_fingerprint': rng.choice(self.devices[customer_id])
+        }
+
+    def oltp_history(self) -> Tuple[Dict[str, List[Dict]], List[Dict]]:
+        """
+        Rows of the OLTP tables (customers, merchants, payment_methods,
+        transactions, chargebacks) and the customer activity events of the
+        same payments.
+        """
+        now = datetime.utcnow()
+        rng = self.rng
+
+        def ts(days_ago: float) -> str:
+            return (now - timedelta(days=days_ago)).strftime(SQLITE_TIME_FORMAT)
+
+        customers = []
+        for cid in self.customers:
+            created = ts(rng.uniform(1, 1500))
+            customers.append({
+                'customer_id': cid, 'email': f"{cid}@{rng.choice(EMAIL_DOMAINS)}",
+                'first_name': 'Test', 'last_name': cid[-6:],
+                'country_code': rng.choice(COUNTRIES),
+                'created_at': created, 'updated_at': created
+            })
+
+        merchants = []
+        for i, mid in enumerate(self.merchants):
+            created = ts(rng.uniform(30, 3000))
+            merchants.append({
+                'merchant_id': mid, 'business_name': f"Merchant {i}",
+                'legal_name': f"Merchant {i} Ltd", 'email': f"{mid}@merchant.example",
+                'phone': '+10000000000', 'country_code': rng.choice(COUNTRIES),
+                'industry': rng.choice(INDUSTRIES), 'mcc_code': '5999',
+                'kyc_status': 'VERIFIED', 'created_at': created, 'updated_at': created
+            })
+
+        methods, transactions, chargebacks, events = [], [], [], []
+        for cid in self.customers:
+            cards = []
+            for _ in range(rng.randint(1, 3)):
+                methods.append({
+                    'payment_method_id': len(methods) + 1, 'customer_id': cid,
+                    'type': 'CARD', 'token': _stripe_id(rng, 'tok_'),
+                    'created_at': ts(1500), 'updated_at': ts(1500)
+                })
+                cards.append(len(methods))
+            for _ in range(self.history_per_customer):
+                days_ago = rng.expovariate(1 / 20)
+                created = ts(days_ago)
+                transaction_id = len(transactions) + 1
+                amount = int(rng.lognormvariate(8, 1)) + 1
+                transactions.append({
+                    'transaction_id': transaction_id,
+                    'merchant_id': rng.choice(self.merchants), 'customer_id': cid,
+                    'payment_method_id': rng.choice(cards), 'amount': amount,
+                    'currency': 'USD',
+                    'status': 'SUCCEEDED' if rng.random() < 0.95 else 'FAILED',
+                    'payment_intent_id': _stripe_id(rng, 'pi_'),
+                    'created_at': created, 'updated_at': created
+                })
+                events.append(self._payment_event(
+                    cid, transactions[-1]['payment_intent_id'], now - timedelta(days=days_ago)
+                ))
+                if rng.random() < 0.01:
+                    chargebacks.append({
+                        'transaction_id': transaction_id, 'amount': amount,
+                        'currency': 'USD', 'reason_code': '10.4',
+                        'reason_description': 'Fraudulent transaction',
+                        'status': 'OPEN', 'created_at': created
+                    })
+        tables = {'customers': customers, 'merchants': merchants, 'payment_methods': methods,
+                  'transactions': transactions, 'chargebacks': chargebacks}
+        return tables, events
+
+    def load(self, sql: LocalSQLConnection, cosmos: LocalCosmosContainer,
+             activity: Optional[LocalCosmosContainer] = None) -> None:
+        """
+        Populate the stand-ins with history for every customer and merchant.
+        fraud_features documents go to `cosmos`; the customer activity
+        projection of the same payments goes to `activity` when given.
+        """
+        tables, events = self.oltp_history()
+        for table, rows in tables.items():
+            sql.insert_many(table, rows)
+        docs: Dict[str, Dict] = {}
+        for event in events:
+            cosmos.upsert_item({
+                'id': event['payment_id'],
+                'payment_id': event['payment_id'],
+                'customer_id': event['customer_id'],
+                'timestamp': event['timestamp']
+            })
+            doc = docs.setdefault(event['customer_id'], new_activity_document(event['customer_id']))
+            apply_payment_event(doc, event)
+        if activity is not None:
+            for doc in docs.values():
+                activity.upsert_item(doc)
+
+    def load_local(self, source) -> None:
+        """Populate a SQLiteDataSource with the same history as load()."""
+        tables, events = self.oltp_history()
+        for table, rows in tables.items():
+            source.load_rows(table, rows)
+        source.record_payment_events(events)
+
+    def transactions(self, n: int) -> List[Dict]:
+        """Incoming transactions in the shape FeatureEngineer.compute_features expects."""
+        rng = self.rng
+        txns = []
+        for _ in range(n):
+            cid = rng.choice(self.customers)
+            txns.append({
+                'payment_id': _stripe_id(rng, 'pi_'),
+                'customer_id': cid,
+                'merchant_id': rng.choice(self.merchants),
+                'amount': rng.choice([int(rng.lognormvariate(8, 1.2)), 5000, 10000]),
+                'currency': 'USD',
+                'card_country': rng.choice(COUNTRIES),
+                'billing_country': rng.choice(COUNTRIES),
+                'ip_address': self._random_ip(),
+                # Mostly known devices, sometimes a new one
+                'device_fingerprint': rng.choice(self.devices[cid]) if rng.random() < 0.9
+                else _stripe_id(rng, 'fp_', 12),
+                'email': f"{cid}@{rng.choice(EMAIL_DOMAINS)}"
+            })
+        return txns
@@ -0,0 +1,141 @@
+"""
+Cosmos DB Fan-out Measurement for Per-Customer Feature Lookups
+Stripe Data Architecture - ML Module
+
+Purpose: Compare the per-score Cosmos DB cost of the per-customer lookups
+         before and after the customer activity projection:
+         - before: velocity counts queried on fraud_features (partitioned by
+           /payment_id) filtered by customer_id -> cross-partition fan-out
+         - after: one point read of customer_activity (partitioned by
+           /customer_id)
+         Runs on the in-memory Cosmos stand-in at several data sizes so the
+         growth of the cross-partition cost with data volume is visible.
+
+Usage:
+    python measure_fanout.py --customers 500 2000 8000 --physical-partitions 16
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'features'))
+
+from local_stores import LocalCosmosContainer, LocalSQLConnection, SyntheticDataset  # noqa: E402
+from data_sources import AzureDataSource  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('measure_fanout')
+
+# Query issued twice per score (1h and 24h windows) before the projection
+LEGACY_VELOCITY_QUERY = """
+SELECT COUNT(1) as count
+FROM c
+WHERE c.customer_id = @customer_id
+  AND c.timestamp >= @since
+"""
+
+# Rough request-unit model: a 1KB point read costs 1 RU; a query costs a
+# fixed amount per physical partition contacted plus a per-document scan
+# cost (no composite index on customer_id + timestamp in fraud_features)
+POINT_READ_RU = 1.0
+QUERY_RU_PER_PARTITION = 2.5
+QUERY_RU_PER_DOCUMENT = 0.05
+
+
+def estimate_ru(stats: Dict) -> float:
+    return (stats['point_reads'] * POINT_READ_RU
+            + stats['partitions_scanned'] * QUERY_RU_PER_PARTITION
+            + stats['documents_scanned'] * QUERY_RU_PER_DOCUMENT)
+
+
+def _per_score(stats: Dict, elapsed: float, scores: int) -> Dict:
+    return {
+        'queries': stats['queries'] / scores,
+        'cross_partition_queries': stats['cross_partition_queries'] / scores,
+        'partitions_touched': (stats['partitions_scanned'] + stats['point_reads']) / scores,
+        'documents_scanned': stats['documents_scanned'] / scores,
+        'point_reads': stats['point_reads'] / scores,
+        'estimated_ru': round(estimate_ru(stats) / scores, 2),
+        'us_per_score': round(elapsed / scores * 1e6, 1)
+    }
+
+
+def measure(n_customers: int, history: int, physical_partitions: int,
+            scores: int, seed: int) -> Dict:
+    """Per-score Cosmos cost of both access paths on one dataset size."""
+    dataset = SyntheticDataset(n_customers, max(10, n_customers // 20), history, seed=seed)
+    features = LocalCosmosContainer('/payment_id', physical_partitions=physical_partitions)
+    activity = LocalCosmosContainer('/customer_id', physical_partitions=physical_partitions)
+    dataset.load(LocalSQLConnection(), features, activity)
+    txns = dataset.transactions(scores)
+    now = datetime.utcnow()
+
+    # Before: legacy cross-partition velocity queries on fraud_features
+    features.stats = dict.fromkeys(features.stats, 0)
+    start = time.perf_counter()
+    for txn in txns:
+        for window in (timedelta(hours=1), timedelta(hours=24)):
+            list(features.query_items(
+                query=LEGACY_VELOCITY_QUERY,
+                parameters=[
+                    {"name": "@customer_id", "value": txn['customer_id']},
+                    {"name": "@since", "value": (now - window).isoformat()}
+                ],
+                enable_cross_partition_query=True
+            ))
+    before = _per_score(features.stats, time.perf_counter() - start, scores)
+
+    # After: one point read of the customer activity projection
+    source = AzureDataSource.from_clients(None, features, activity)
+    activity.stats = dict.fromkeys(activity.stats, 0)
+    start = time.perf_counter()
+    for txn in txns:
+        source.get_customer_activity(txn['customer_id'])
+    after = _per_score(activity.stats, time.perf_counter() - start, scores)
+
+    return {
+        'customers': n_customers,
+        'fraud_features_documents': n_customers * history,
+        'before': before,
+        'after': after
+    }
+
+
+def print_report(results: List[Dict]) -> None:
+    columns = ['partitions_touched', 'documents_scanned', 'estimated_ru', 'us_per_score']
+    print(f"{'documents':>10} {'path':<7}" + ''.join(f"{c:>20}" for c in columns))
+    for result in results:
+        for path in ('before', 'after'):
+            row = result[path]
+            print(f"{result['fraud_features_documents']:>10} {path:<7}"
+                  + ''.join(f"{row[c]:>20}" for c in columns))
+    print("(per score; RU is a rough model, see QUERY_RU_* constants)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cosmos DB fan-out before/after the customer projection')
+    parser.add_argument('--customers', type=int, nargs='+', default=[500, 2_000, 8_000])
+    parser.add_argument('--history', type=int, default=20)
+    parser.add_argument('--physical-partitions', type=int, default=16)
+    parser.add_argument('--scores', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='Print raw results as JSON')
+    args = parser.parse_args()
+
+    results = [measure(n, args.history, args.physical_partitions, args.scores, args.seed)
+               for n in args.customers]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+"""
+Latency & Throughput Benchmarks for Fraud Scoring
+Stripe Data Architecture - ML Module
+
+Purpose: Measure the "< 50ms P99" and "10,000 req/s" targets locally.
+         Drives /api/v1/fraud/score, /api/v1/fraud/batch and
+         FeatureEngineer.compute_features at configurable concurrency against
+         a small trained model and SQLite/in-memory stand-ins for Azure SQL and
+         Cosmos DB, then saves P50/P95/P99/throughput as JSON.
+
+Usage:
+    python run_benchmarks.py run --concurrency 8 --requests 2000 --sql-latency-ms 1.5
+    python run_benchmarks.py compare results/old.json results/new.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ML_ROOT = os.path.join(HERE, '..')
+sys.path.insert(0, os.path.join(ML_ROOT, 'features'))
+sys.path.insert(0, os.path.join(ML_ROOT, 'deployment', 'api'))
+
+from local_stores import (  # noqa: E402
+    InjectedLatency, LocalCosmosContainer, LocalSQLConnection, SyntheticDataset
+)
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('benchmarks')
+
+RESULTS_DIR = os.path.join(HERE, 'results')
+
+
+# ============================================================================
+# FIXTURES
+# ============================================================================
+
+def build_model_artifact(path: str, feature_names: List[str],
+                         n_samples: int = 20_000, n_estimators: int = 100,
+                         max_depth: int = 6, seed: int = 42) -> str:
+    """Train a small XGBoost model on synthetic features and save it with joblib."""
+    import joblib
+    import numpy as np
+    import pandas as pd
+    import xgboost as xgb
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((n_samples, len(feature_names))), columns=feature_names)
+    logit = -4 + 3 * X['card_country_mismatch'] + 2 * X['device_fingerprint_new'] \
+        + 2 * X['transaction_count_1h'] + rng.normal(0, 0.5, n_samples)
+    y = (rng.random(n_samples) < 1 / (1 + np.exp(-logit))).astype(int)
+
+    model = xgb.XGBClassifier(
+        n_estimators=n_estimators, max_depth=max_depth, learning_rate=0.1,
+        eval_metric='auc', random_state=seed
+    )
+    model.fit(X, y)
+    joblib.dump(model, path)
+    return path
+
+
+def synthetic_feature_payload(rng: random.Random, feature_names: List[str],
+                              payment_id: str) -> Dict:
+    """API request body with all model features populated."""
+    return {
+        'payment_id': payment_id,
+        'customer_id': f"cus_{rng.randrange(10**9)}",
+        'merchant_id': f"acct_{rng.randrange(500)}",
+        'amount': rng.randint(100, 500_000),
+        'currency': 'USD',
+        'features': {name: round(rng.random(), 4) for name in feature_names}
+    }
+
+
+# ============================================================================
+# LOAD DRIVER
+# ============================================================================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_load(call: Callable[[Dict], None], payloads: List[Dict],
+             concurrency: int, warmup: int = 50, degraded: bool = False) -> Dict:
+    """
+    Closed-loop load: `concurrency` workers issue the payloads back to back.
+
+    With degraded=True, `call` returns the number of degraded decisions in
+    its response (API under admission control), reported as `degraded`.
+
+    Returns latency percentiles (ms), throughput and error count.
+    """
+    for payload in payloads[:warmup]:
+        call(payload)
+
+    latencies: List[float] = []
+    errors = 0
+    degraded_count = 0
+    lock = threading.Lock()
+    cursor = iter(payloads[warmup:])
+
+    def worker():
+        nonlocal errors, degraded_count
+        local_latencies = []
+        local_errors = 0
+        local_degraded = 0
+        while True:
+            with lock:
+                payload = next(cursor, None)
+            if payload is None:
+                break
+            start = time.perf_counter()
+            try:
+                outcome = call(payload)
+                if degraded:
+                    local_degraded += outcome
+            except Exception:
+                local_errors += 1
+            local_latencies.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+            degraded_count += local_degraded
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    wall_seconds = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 1) if wall_seconds else 0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0,
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0
+        }
+    }
+    if degraded:
+        result['degraded'] = degraded_count
+    return result
+
+
+# ============================================================================
+# BENCHMARKS
+# ============================================================================
+
+def bench_feature_engine(args) -> Dict:
+    """
+    FeatureEngineer.compute_features against a local backend:
+    'standin' runs the Azure T-SQL/Cosmos queries on the SQLite/in-memory
+    stand-ins, 'local' runs SQLiteDataSource on the real OLTP schema.
+
+    The engine is built for a model as the scoring path builds it
+    (FeatureEngineer.for_model). The model is trained without the features
+    reading --unused-sources, and the run fails if any of them is queried.
+    """
+    import joblib
+    import feature_registry
+    from data_sources import AzureDataSource, SQLiteDataSource
+    from feature_engineering import FeatureEngineer
+
+    dataset = SyntheticDataset(args.customers, args.merchants, args.history, seed=args.seed)
+    if args.backend == 'local':
+        source = SQLiteDataSource()
+        dataset.load_local(source)
+    else:
+        sql = LocalSQLConnection(InjectedLatency(args.sql_latency_ms, seed=args.seed))
+        cosmos = LocalCosmosContainer('/payment_id', InjectedLatency(args.cosmos_latency_ms, seed=args.seed + 1))
+        activity = LocalCosmosContainer('/customer_id', InjectedLatency(args.cosmos_latency_ms, seed=args.seed + 2))
+        dataset.load(sql, cosmos, activity)
+        source = AzureDataSource.from_clients(sql, cosmos, activity)
+
+    unused = set(args.unused_sources)
+    trained_on = [name for name in feature_registry.FEATURE_NAMES
+                  if not unused & set(feature_registry.plan_features([name]).sources)]
+    model_path = os.path.join(tempfile.mkdtemp(prefix='fraud_bench_'), 'fraud_model.pkl')
+    build_model_artifact(model_path, trained_on, n_estimators=args.model_trees, seed=args.seed)
+    engineer = FeatureEngineer.for_model(joblib.load(model_path), data_source=source)
+
+    # Count source loads (the registry's loaders are looked up per call)
+    loads = {name: 0 for name in feature_registry.SOURCES}
+    originals = dict(feature_registry.SOURCES)
+
+    def counted(spec):
+        def load(engineer, txn):
+            loads[spec.name] += 1
+            return spec.load(engineer, txn)
+        return spec._replace(load=load)
+
+    feature_registry.SOURCES.update({name: counted(spec) for name, spec in originals.items()})
+    logging.getLogger('feature_engineering').setLevel(logging.WARNING)
+    txns = dataset.transactions(args.requests + args.warmup)
+    try:
+        result = run_load(engineer.compute_features, txns, args.concurrency, args.warmup)
+    finally:
+        feature_registry.SOURCES.update(originals)
+    queried = sorted(name for name in unused if loads.get(name))
+    if queried:
+        raise RuntimeError(f"Sources no required feature reads were queried: {', '.join(queried)}")
+    result['backend'] = args.backend
+    result['features_planned'] = len(engineer.plan.features)
+    result['round_trips'] = engineer.plan.round_trips()
+    result['source_loads'] = {name: count for name, count in loads.items() if count}
+    if args.backend == 'standin':
+        result['sql_queries'] = sql.query_count
+        result['cosmos'] = dict(cosmos.stats)
+        result['cosmos_activity'] = dict(activity.stats)
+    source.close()
+    return result
+
+
+def _degraded(body: Dict) -> int:
+    """Degraded (rules-based) decisions in a /score or /batch response."""
+    return sum(1 for r in body.get('results', [body]) if r.get('degraded'))
+
+
+def _api_caller(args, path: str) -> Callable[[Dict], int]:
+    """
+    Return a function that POSTs a payload to the API, in-process or over HTTP,
+    and returns the number of degraded decisions in the response.
+    """
+    import app as fraud_api
+
+    if args.transport == 'inprocess':
+        client = fraud_api.app.test_client()
+
+        def call(payload):
+            response = client.post(path, json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            return _degraded(response.get_json())
+        return call
+
+    import http.client
+    host, port = args.host, args.port
+    local = threading.local()
+
+    def call(payload):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection(host, port, timeout=30)
+        body = json.dumps(payload)
+        try:
+            conn.request('POST', path, body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            local.conn = None
+            raise
+        if response.will_close:
+            local.conn = None
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        return _degraded(json.loads(content))
+    return call
+
+
+def _start_local_server(args):
+    """Serve the Flask app on a background thread (threaded, like production)."""
+    import app as fraud_api
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, fraud_api.app, threaded=True)
+    args.host, args.port = '127.0.0.1', server.server_port
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def bench_api(args) -> Dict:
+    """
+    /api/v1/fraud/score and /api/v1/fraud/batch with a freshly trained, warmed-up model.
+
+    The in-process app runs without admission control, so every decision is a
+    model score; responses degraded by a remote server (--port) are counted.
+    """
+    import app as fraud_api
+
+    model_path = os.path.join(tempfile.mkdtemp(prefix='fraud_bench_'), 'fraud_model.pkl')
+    build_model_artifact(model_path, fraud_api.FEATURE_NAMES, seed=args.seed,
+                         n_estimators=args.model_trees)
+    fraud_api.MODEL_PATH = model_path
+    fraud_api.MODEL_BUNDLE_PATH = model_path + '.npz'
+    fraud_api.admission = None
+    fraud_api.load_model()
+    fraud_api.warm_up()
+    logging.getLogger('app').setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    server = None
+    if args.transport == 'http' and args.port is None:
+        server = _start_local_server(args)
+
+    rng = random.Random(args.seed)
+    n = args.requests + args.warmup
+    single = [synthetic_feature_payload(rng, fraud_api.FEATURE_NAMES, f"pi_bench_{i}")
+              for i in range(n)]
+    batches = [{'transactions': [synthetic_feature_payload(rng, fraud_api.FEATURE_NAMES, f"pi_batch_{i}_{j}")
+                                 for j in range(args.batch_size)]}
+               for i in range(max(1, n // args.batch_size))]
+
+    try:
+        results = {
+            'score': run_load(_api_caller(args, '/api/v1/fraud/score'), single,
+                              args.concurrency, args.warmup, degraded=True),
+            'batch': run_load(_api_caller(args, '/api/v1/fraud/batch'), batches,
+                              args.concurrency, min(args.warmup, len(batches) // 10), degraded=True)
+        }
+        results['batch']['batch_size'] = args.batch_size
+        results['batch']['transactions_per_second'] = round(
+            results['batch']['throughput_rps'] * args.batch_size, 1
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+# ============================================================================
+# RESULTS
+# ============================================================================
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save_results(results: Dict, args) -> str:
+    commit = _git_commit()
+    document = {
+        'commit': commit,
+        'timestamp': datetime.utcnow().isoformat(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('func', 'host', 'port')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"bench_{commit}_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+    return path
+
+
+def compare_results(baseline_path: str, candidate_path: str, threshold: float) -> bool:
+    """Print per-benchmark deltas; return False if any metric regressed beyond threshold."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    ok = True
+    print(f"Baseline {baseline['commit']} vs candidate {candidate['commit']}")
+    for name, new in candidate['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        checks = [(f"latency {p}", old['latency_ms'][p], new['latency_ms'][p], True)
+                  for p in ('p50', 'p95', 'p99')]
+        checks.append(('throughput', old['throughput_rps'], new['throughput_rps'], False))
+        for label, before, after, lower_is_better in checks:
+            change = (after - before) / before if before else 0.0
+            regressed = change > threshold if lower_is_better else change < -threshold
+            ok = ok and not regressed
+            print(f"  {name:<10} {label:<12} {before:>10.2f} -> {after:>10.2f} "
+                  f"({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def print_summary(results: Dict) -> None:
+    print(f"{'benchmark':<10} {'req':>7} {'err':>5} {'degr':>5} {'rps':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, r in results.items():
+        lat = r['latency_ms']
+        print(f"{name:<10} {r['requests']:>7} {r['errors']:>5} {r.get('degraded', '-'):>5} "
+              f"{r['throughput_rps']:>9.1f} {lat['p50']:>8.2f} {lat['p95']:>8.2f} {lat['p99']:>8.2f}")
+    print("(latencies in ms; P99 target < 50ms)")
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Fraud scoring benchmarks")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Run benchmarks and save results')
+    run.add_argument('--suite', choices=['all', 'api', 'features'], default='all')
+    run.add_argument('--concurrency', type=int, default=8)
+    run.add_argument('--requests', type=int, default=2_000)
+    run.add_argument('--warmup', type=int, default=100)
+    run.add_argument('--batch-size', type=int, default=50)
+    run.add_argument('--transport', choices=['http', 'inprocess'], default='http')
+    run.add_argument('--host', default='127.0.0.1')
+    run.add_argument('--port', type=int, default=None,
+                     help='Target an already running API instead of a local server')
+    run.add_argument('--model-trees', type=int, default=100)
+    run.add_argument('--backend', choices=['standin', 'local'], default='standin',
+                     help='Feature data source: Azure queries on stand-ins, or SQLite OLTP schema')
+    run.add_argument('--sql-latency-ms', type=float, default=1.0)
+    run.add_argument('--cosmos-latency-ms', type=float, default=2.0)
+    run.add_argument('--customers', type=int, default=2_000)
+    run.add_argument('--merchants', type=int, default=200)
+    run.add_argument('--history', type=int, default=20)
+    run.add_argument('--unused-sources', nargs='*', default=['merchant_stats'],
+                     help='Sources the feature benchmark model is trained without (must not be queried)')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--output', default=None)
+
+    compare = sub.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=0.10)
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(0 if compare_results(args.baseline, args.candidate, args.threshold) else 1)
+
+    results = {}
+    if args.suite in ('all', 'features'):
+        results['features'] = bench_feature_engine(args)
+    if args.suite in ('all', 'api'):
+        results.update(bench_api(args))
+
+    print_summary(results)
+    print(f"Results saved to {save_results(results, args)}")
+
+
+if __name__ == "__main__":
+    main()
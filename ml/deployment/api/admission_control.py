@@ -0,0 +1,210 @@
+"""
+Admission Control for the Scoring API
+Stripe Data Architecture - ML Module
+
+Purpose: Keep the P99 of /api/v1/fraud/score bounded when traffic exceeds
+         capacity, instead of letting every Flask thread queue behind the
+         model:
+             - adaptive concurrency limit: requests in flight, sized from
+               observed service latency (gradient: a recent latency rising
+               above the no-load latency shrinks the limit)
+             - bounded queue with deadlines: a request waits for a slot only
+               while its budget still covers the expected service time,
+               otherwise it is degraded (cheap fallback scorer, flagged in
+               the response)
+             - shedding: a request arriving on a full queue, or whose
+               deadline has already passed (it waited in the listen queue or
+               the load balancer), is rejected (503 + Retry-After) before any
+               scoring, model or fallback
+
+Usage:
+    controller = AdmissionController()
+    with controller.admit(deadline) as admitted:
+        if admitted:
+            ... model scoring ...
+        else:
+            ... fallback scoring (no slot held) ...
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+DEFAULT_MAX_QUEUE = 64
+# Default per-request budget: the P99 latency target
+DEFAULT_BUDGET_MS = 50.0
+# Seconds suggested to shed clients
+RETRY_AFTER_SECONDS = 1
+
+# Recent latency EWMA (admitted requests), limit smoothing
+SHORT_WINDOW = 10
+SMOOTHING = 0.2
+# No-load latency: minimum over this many admitted requests
+BASELINE_WINDOW = 1000
+# Recent latency tolerated above the no-load latency before the limit shrinks
+TOLERANCE = 1.5
+# Slots added on top of the latency-derived limit (requests allowed to queue in the server)
+QUEUE_ALLOWANCE = 1.0
+
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+
+ADMITTED = Counter('fraud_api_admitted_total', 'Requests granted a scoring slot', ['path'])
+DEGRADED = Counter('fraud_api_degraded_total', 'Requests answered by the fallback scorer', ['reason'])
+SHED = Counter('fraud_api_shed_total', 'Requests rejected by admission control', ['reason'])
+CONCURRENCY_LIMIT = Gauge('fraud_api_concurrency_limit', 'Adaptive limit of requests in flight')
+IN_FLIGHT = Gauge('fraud_api_in_flight', 'Requests holding a scoring slot')
+QUEUE_LENGTH = Gauge('fraud_api_admission_queue', 'Requests waiting for a scoring slot')
+
+
+class Overloaded(Exception):
+    """Request shed by admission control."""
+
+    def __init__(self, reason: str, retry_after: int = RETRY_AFTER_SECONDS):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Adaptive concurrency limit with a bounded, deadline-aware queue."""
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_LIMIT, min_limit: int = DEFAULT_MIN_LIMIT,
+                 max_limit: int = DEFAULT_MAX_LIMIT, max_queue: int = DEFAULT_MAX_QUEUE,
+                 clock: Callable[[], float] = time.perf_counter):
+        """
+        Args:
+            initial_limit: Concurrency limit before any latency is observed
+            min_limit: Lower bound of the limit
+            max_limit: Upper bound of the limit
+            max_queue: Requests allowed to wait for a slot
+            clock: Time source of the deadlines (seconds)
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.limit = float(initial_limit)
+        self._clock = clock
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        # Service latency (seconds) of admitted requests
+        self.short_latency = 0.0
+        self.min_latency = 0.0
+        self._window_min = float('inf')
+        self._window_count = 0
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def expected_service(self) -> float:
+        """Expected service time of an admitted request (short-term EWMA, seconds)."""
+        return self.short_latency
+
+    @contextmanager
+    def admit(self, deadline: float) -> Iterator[bool]:
+        """
+        Acquire a model scoring slot before `deadline`.
+
+        Yields:
+            True when admitted (the slot is released on exit), False when the
+            request must be degraded to the fallback scorer
+
+        Raises:
+            Overloaded: the deadline has passed or the queue is full
+        """
+        admitted = self._acquire(deadline)
+        if not admitted:
+            yield False
+            return
+        start = self._clock()
+        try:
+            yield True
+        finally:
+            self._release(self._clock() - start)
+
+    def _acquire(self, deadline: float) -> bool:
+        with self._cond:
+            if deadline <= self._clock():
+                # The client has given up: no answer is useful, not even the fallback
+                SHED.labels(reason='deadline').inc()
+                raise Overloaded('deadline')
+            if self._has_slot() and not self.waiting:
+                self.in_flight += 1
+                IN_FLIGHT.set(self.in_flight)
+                ADMITTED.labels(path='immediate').inc()
+                return True
+            if self.waiting >= self.max_queue:
+                SHED.labels(reason='queue_full').inc()
+                raise Overloaded('queue_full')
+            # Latest moment a slot is still useful for this request
+            give_up = deadline - self.expected_service()
+            if give_up <= self._clock():
+                DEGRADED.labels(reason='deadline').inc()
+                return False
+
+            self.waiting += 1
+            QUEUE_LENGTH.set(self.waiting)
+            try:
+                while not self._has_slot():
+                    remaining = give_up - self._clock()
+                    if remaining <= 0:
+                        DEGRADED.labels(reason='queue_timeout').inc()
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+                QUEUE_LENGTH.set(self.waiting)
+            self.in_flight += 1
+            IN_FLIGHT.set(self.in_flight)
+            ADMITTED.labels(path='queued').inc()
+            return True
+
+    def _release(self, latency: float) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            IN_FLIGHT.set(self.in_flight)
+            self._update_limit(latency)
+            self._cond.notify(max(1, int(self.limit) - self.in_flight))
+
+    def _update_limit(self, latency: float) -> None:
+        """
+        Gradient update from one admitted request (lock held).
+
+        The limit follows limit * TOLERANCE * min / recent latency (clamped to
+        [0.5, 1]) plus QUEUE_ALLOWANCE: while latency stays near its no-load
+        value the limit grows, and it shrinks as soon as added concurrency
+        only adds latency (one CPU-bound core settles around 2). The no-load
+        latency is the minimum of at most the previous BASELINE_WINDOW
+        requests, so it follows a slower model instead of drifting up with
+        the load itself.
+        """
+        self._window_min = min(self._window_min, latency)
+        self._window_count += 1
+        if not self.min_latency:
+            self.short_latency = self.min_latency = latency
+            return
+        self.min_latency = min(self.min_latency, latency)
+        if self._window_count >= BASELINE_WINDOW:
+            self.min_latency = self._window_min
+            self._window_min, self._window_count = float('inf'), 0
+        self.short_latency += (latency - self.short_latency) * 2 / (SHORT_WINDOW + 1)
+
+        gradient = max(0.5, min(1.0, TOLERANCE * self.min_latency / self.short_latency))
+        target = self.limit * gradient + QUEUE_ALLOWANCE
+        limit = self.limit * (1 - SMOOTHING) + target * SMOOTHING
+        self.limit = max(float(self.min_limit), min(float(self.max_limit), limit))
+        CONCURRENCY_LIMIT.set(self.limit)
@@ -7,16 +7,36 @@ Latency Target: < 50ms P99
 Throughput: 10,000 req/s
 """
 
-from flask import Flask, request, jsonify
-import joblib
+import time
+# Startup clock: time-to-ready counts from the import of this module
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, g, request, jsonify
+import os
+import sys
+import threading
 import numpy as np
-import pandas as pd
 from datetime import datetime
 import logging
-import time
-from prometheus_client import Counter, Histogram, generate_latest
+from prometheus_client import Counter, Gauge, Histogram, generate_latest
 from functools import wraps
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'monitoring'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'features'))
+from model_monitoring import ModelMonitor
+from label_store import DEFAULT_SAMPLE_RATE, CosmosLabelStore, SQLiteLabelStore
+from latency_tracing import SPAN_BUCKETS, format_trace, span
+# Model input columns, in training order (shared with the feature engine)
+from feature_registry import FEATURE_NAMES, RULE_FEATURES, model_features, plan_features
+from tree_explainer import TreeExplainer, format_reasons
+from compiled_model import CompiledModel, compile_model, load_bundle
+from admission_control import DEFAULT_BUDGET_MS, AdmissionController, Overloaded
+from scoring_cache import (
+    DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS, IdempotencyCache, IdempotencyConflict, payload_digest
+)
+
+IMPORT_SECONDS = time.perf_counter() - STARTED_AT
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -26,39 +46,224 @@ app = Flask(__name__)
 
 # Load model
 MODEL_PATH = 'fraud_model.pkl'
+# Precompiled serving bundle (compiled_model.py), preferred over the pickle
+MODEL_BUNDLE_PATH = os.environ.get('FRAUD_MODEL_BUNDLE', 'fraud_model.npz')
+MODEL_VERSION = '2.3.1'
 model = None
+explainer = None
+
+# Synthetic rows scored before /health reports ready (0: no warm-up)
+WARMUP_ROWS = int(os.environ.get('FRAUD_API_WARMUP_ROWS', 64))
+ready = threading.Event()
+startup_error = None
+time_to_ready = None
+
+# Per-request `explain`: "auto" explains review / decline decisions only
+EXPLAIN_MODES = ('auto', 'always', 'never')
+EXPLAIN_DEFAULT = os.environ.get('FRAUD_API_EXPLAIN', 'auto')
+EXPLAIN_TOP_K = 5
+
+# First decision per payment_id, replayed to client retries
+scoring_cache = IdempotencyCache(
+    max_entries=int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+    ttl_seconds=float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+)
+
+# Adaptive concurrency limit on /score; overflow is degraded to RISK_RULES or shed
+admission = AdmissionController() if os.environ.get('FRAUD_API_ADMISSION', 'on') != 'off' else None
+# Latency budget of a /score request, overridable per request with X-Request-Timeout-Ms
+ADMISSION_BUDGET_MS = float(os.environ.get('FRAUD_API_BUDGET_MS', DEFAULT_BUDGET_MS))
 
 # Prometheus metrics
 REQUEST_COUNT = Counter('fraud_api_requests_total', 'Total API requests')
-REQUEST_LATENCY = Histogram('fraud_api_latency_seconds', 'Request latency')
+REQUEST_LATENCY = Histogram('fraud_api_latency_seconds', 'Request latency', buckets=SPAN_BUCKETS)
 FRAUD_DETECTED = Counter('fraud_api_fraud_detected_total', 'Total fraud detected')
 ERRORS = Counter('fraud_api_errors_total', 'Total API errors', ['error_type'])
+TIME_TO_READY = Gauge('fraud_api_time_to_ready_seconds', 'From the import of the API module to /health ready')
+STARTUP_PHASE = Gauge('fraud_api_startup_phase_seconds', 'Duration of each startup phase', ['phase'])
+
+# Score distribution, decision rates and delayed-label metrics (aggregated off-thread).
+# Chargebacks are joined in a store shared by every worker: "cosmos" (model_labels
+# container, all replicas), a SQLite path (workers of one host) or "off"
+LABEL_STORE = os.environ.get('FRAUD_MONITOR_LABEL_STORE', 'model_labels.db')
+monitor = ModelMonitor(
+    label_sample_rate=float(os.environ.get('FRAUD_MONITOR_LABEL_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))
+)
 
 
 def load_model():
-    """Load trained model on startup."""
-    global model
+    """
+    Load the model for serving.
+    
+    The precompiled bundle (compiled_model.py) loads in milliseconds without
+    importing xgboost; without one (or when the pickle is newer), the pickle
+    is compiled in place and its TreeSHAP paths are built.
+    """
+    global model, explainer
+    if os.path.exists(MODEL_BUNDLE_PATH):
+        if os.path.exists(MODEL_PATH) and os.path.getmtime(MODEL_PATH) > os.path.getmtime(MODEL_BUNDLE_PATH):
+            logger.warning(f"{MODEL_PATH} is newer than {MODEL_BUNDLE_PATH}, recompile the bundle")
+        else:
+            try:
+                model, explainer = load_bundle(MODEL_BUNDLE_PATH)
+                logger.info(f"Model bundle loaded from {MODEL_BUNDLE_PATH}")
+                return
+            except Exception as e:
+                logger.warning(f"Model bundle {MODEL_BUNDLE_PATH} unusable, loading {MODEL_PATH}: {e}")
+    
     try:
-        model = joblib.load(MODEL_PATH)
+        import joblib
+        fitted = joblib.load(MODEL_PATH)
         logger.info(f"Model loaded successfully from {MODEL_PATH}")
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
         raise
+    try:
+        model, _ = compile_model(fitted, FEATURE_NAMES, explain=False)
+    except Exception as e:
+        model = fitted
+        logger.warning(f"Model not compiled, serving the XGBoost classifier: {e}")
+    try:
+        explainer = TreeExplainer(fitted, FEATURE_NAMES)
+    except Exception as e:
+        explainer = None
+        logger.warning(f"TreeSHAP explainer unavailable, using rule-based reasons: {e}")
+
+
+def warm_up(rows: int = WARMUP_ROWS):
+    """Score and explain synthetic vectors, so that first requests skip lazy initialization."""
+    if not rows:
+        return
+    X = np.random.default_rng(0).random((rows, len(FEATURE_NAMES)))
+    for n in (1, rows):
+        model.predict_proba(X[:n])
+        if explainer is not None:
+            explainer.explain(X[:n], EXPLAIN_TOP_K)
+
+
+def start_monitor():
+    """Open the label store, then start the monitor thread."""
+    if LABEL_STORE == 'cosmos':
+        monitor.label_store = CosmosLabelStore.connect(os.environ['COSMOS_ENDPOINT'])
+    elif LABEL_STORE != 'off':
+        monitor.label_store = SQLiteLabelStore(LABEL_STORE)
+    monitor.start()
+
+
+def start():
+    """
+    Startup pipeline: load the model, warm it up and start the monitor,
+    then report ready on /health. Phase durations and time-to-ready are
+    exported as metrics.
+    """
+    global startup_error, time_to_ready
+    STARTUP_PHASE.labels(phase='imports').set(IMPORT_SECONDS)
+    try:
+        for phase, step in (('model_load', load_model), ('warmup', warm_up), ('monitor', start_monitor)):
+            phase_start = time.perf_counter()
+            step()
+            STARTUP_PHASE.labels(phase=phase).set(time.perf_counter() - phase_start)
+    except Exception as e:
+        startup_error = str(e)
+        logger.error(f"Startup failed: {e}", exc_info=True)
+        return
+    time_to_ready = time.perf_counter() - STARTED_AT
+    TIME_TO_READY.set(time_to_ready)
+    ready.set()
+    logger.info(f"Ready in {time_to_ready:.3f}s")
+
+
+_startup_thread = None
+_startup_lock = threading.Lock()
+
+
+def create_app():
+    """
+    WSGI entry point: start the startup pipeline in the background (once
+    per process) and return the app; /health answers 503 until ready.
+    
+    gunicorn calls it in each worker (`gunicorn 'app:create_app()'`, without
+    --preload: the startup thread would run in the master and not survive
+    the fork).
+    """
+    global _startup_thread
+    with _startup_lock:
+        if _startup_thread is None:
+            _startup_thread = threading.Thread(target=start, name='startup', daemon=True)
+            _startup_thread.start()
+    return app
 
 
 def measure_latency(f):
     """Decorator to measure endpoint latency."""
     @wraps(f)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = f(*args, **kwargs)
-        latency = time.time() - start_time
+        start_time = time.perf_counter()
+        with span(f.__name__):
+            result = f(*args, **kwargs)
+        latency = time.perf_counter() - start_time
         REQUEST_LATENCY.observe(latency)
         logger.info(f"Request completed in {latency*1000:.2f}ms")
+        if latency > 0.05:
+            logger.warning(f"Slow request (> 50ms SLO):\n{format_trace()}")
         return result
     return wrapper
 
 
+def request_deadline() -> float:
+    """
+    Deadline of the current request on the perf_counter clock.
+    
+    The budget (X-Request-Timeout-Ms, default ADMISSION_BUDGET_MS) runs from
+    the arrival at the edge when the load balancer sets X-Request-Start
+    (seconds or milliseconds since the epoch, optionally "t=" prefixed),
+    so time spent in its queue and in the listen backlog counts; otherwise
+    from the arrival in the handler.
+    
+    Raises:
+        ValueError: Malformed header
+    """
+    now = time.perf_counter()
+    budget = float(request.headers.get('X-Request-Timeout-Ms', ADMISSION_BUDGET_MS)) / 1000
+    arrived = request.headers.get('X-Request-Start')
+    if arrived:
+        arrived = float(arrived.split('=', 1)[-1])
+        # Milliseconds since the epoch are above 1e11, seconds below
+        waited = time.time() - (arrived / 1000 if arrived > 1e11 else arrived)
+        budget -= max(0.0, waited)
+    return now + budget
+
+
+def admission_controlled(f):
+    """
+    Decorator to run an endpoint under admission control.
+    
+    The request waits for a slot of `admission` until its deadline
+    (request_deadline); without a slot g.degraded is set and the endpoint
+    answers from its fallback. A request arriving on a full queue or past
+    its deadline is shed with 503.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        g.degraded = False
+        if admission is None:
+            return f(*args, **kwargs)
+        
+        try:
+            deadline = request_deadline()
+        except ValueError:
+            ERRORS.labels(error_type='invalid_request').inc()
+            return jsonify({'error': 'X-Request-Timeout-Ms and X-Request-Start must be numbers'}), 400
+        
+        try:
+            with admission.admit(deadline) as admitted:
+                g.degraded = not admitted
+                return f(*args, **kwargs)
+        except Overloaded as e:
+            return jsonify({'error': 'Service overloaded, retry later'}), 503, {'Retry-After': str(e.retry_after)}
+    return wrapper
+
+
 @app.before_request
 def before_request():
     """Log request details."""
@@ -74,12 +279,15 @@ def health_check():
     Returns:
         200 if healthy, 503 if unhealthy
     """
-    if model is None:
-        return jsonify({'status': 'unhealthy', 'reason': 'model not loaded'}), 503
+    if startup_error is not None:
+        return jsonify({'status': 'unhealthy', 'reason': f"startup failed: {startup_error}"}), 503
+    if not ready.is_set():
+        return jsonify({'status': 'starting', 'reason': 'model loading / warming up'}), 503
     
     return jsonify({
         'status': 'healthy',
         'model_loaded': True,
+        'time_to_ready_s': round(time_to_ready, 3),
         'timestamp': datetime.utcnow().isoformat()
     }), 200
 
@@ -92,6 +300,7 @@ def metrics():
 
 @app.route('/api/v1/fraud/score', methods=['POST'])
 @measure_latency
+@admission_controlled
 def score_transaction():
     """
     Score a transaction for fraud.
@@ -107,7 +316,8 @@ def score_transaction():
             "transaction_count_1h": 2,
             "transaction_count_24h": 10,
             ... (43 more features)
-        }
+        },
+        "explain": "auto"   (optional: "auto" = review / decline only, "always", "never")
     }
     
     Response:
@@ -117,15 +327,28 @@ def score_transaction():
         "risk_level": "high",
         "decision": "review",
         "reasons": ["High velocity", "New device"],
+        "contributions": [{"feature": "transaction_count_1h", "value": 14, "contribution": 1.92}, ...],
         "timestamp": "2025-10-20T14:30:00Z",
-        "latency_ms": 28
+        "latency_ms": 28,
+        "model_version": "2.3.1",
+        "degraded": false
     }
+    
+    A retry with the same payment_id and features returns the first decision
+    (header Idempotent-Replayed: true); the same payment_id with different
+    features is rejected with 409. `explain` is not part of the key: a retry
+    asking for reasons the first request skipped gets them computed for the
+    replayed score (not under overload).
+    
+    Under overload (admission control), the decision comes from RISK_RULES
+    with "degraded": true, or the request is shed with 503 + Retry-After.
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
         # Validate request
-        data = request.get_json()
+        with span('parse_request'):
+            data = request.get_json()
         if not data:
             ERRORS.labels(error_type='invalid_request').inc()
             return jsonify({'error': 'Invalid JSON'}), 400
@@ -135,78 +358,56 @@ def score_transaction():
         if not features:
             ERRORS.labels(error_type='missing_features').inc()
             return jsonify({'error': 'Missing features'}), 400
+        explain_mode = parse_explain_mode(data.get('explain'))
+        if explain_mode is None:
+            ERRORS.labels(error_type='invalid_request').inc()
+            return jsonify({'error': f"explain must be one of {', '.join(EXPLAIN_MODES)} or a boolean"}), 400
         
-        # Convert to DataFrame (expected by model)
-        feature_names = [
-            'transaction_count_1h', 'transaction_count_24h', 'transaction_count_7d',
-            'transaction_count_30d', 'unique_cards_30d', 'unique_merchants_30d',
-            'avg_amount_7d', 'stddev_amount_7d', 'max_amount_30d',
-            'amount_ratio_to_avg', 'amount_zscore', 'round_amount',
-            'high_value_flag', 'amount_percentile', 'card_country_mismatch',
-            'ip_country_mismatch', 'distance_km', 'velocity_km_per_hour',
-            'high_risk_country', 'country_change_24h', 'timezone_anomaly',
-            'device_fingerprint_age_days', 'device_fingerprint_new',
-            'email_domain_age_days', 'email_domain_free', 'email_domain_disposable',
-            'browser_version_outdated', 'customer_age_days', 'first_transaction_customer',
-            'customer_dispute_history', 'customer_success_rate',
-            'days_since_last_transaction', 'customer_lifetime_value',
-            'avg_transaction_per_month', 'chargeback_rate_30d',
-            'merchant_age_days', 'merchant_dispute_rate_30d',
-            'merchant_chargeback_rate', 'merchant_avg_ticket',
-            'merchant_industry_risk', 'time_of_day', 'day_of_week',
-            'is_weekend', 'is_holiday', 'shipping_address_mismatch'
-        ]
-        
-        # Build feature vector
-        feature_vector = []
-        for feature_name in feature_names:
-            value = features.get(feature_name, 0)
-            feature_vector.append(value)
-        
-        X = pd.DataFrame([feature_vector], columns=feature_names)
-        
-        # Predict
-        fraud_score = float(model.predict_proba(X)[0, 1])
-        
-        # Determine risk level and decision
-        if fraud_score >= 0.95:
-            risk_level = "critical"
-            decision = "decline"
-        elif fraud_score >= 0.70:
-            risk_level = "high"
-            decision = "review"
-        elif fraud_score >= 0.40:
-            risk_level = "medium"
-            decision = "monitor"
+        # A retried payment_id gets its first decision back (computed once for concurrent duplicates);
+        # without a scoring slot (overload), a new decision comes from the fallback rules
+        payment_id = data.get('payment_id')
+        replayed = False
+        if payment_id:
+            key = (str(payment_id), payload_digest(features))
+            if g.degraded:
+                record = scoring_cache.get(*key)
+                replayed = record is not None
+                if record is None:
+                    record = scoring_cache.put(*key, fallback_payload(features))
+            else:
+                record, outcome = scoring_cache.get_or_compute(
+                    *key, lambda: score_payload(features, explain_mode, data)
+                )
+                replayed = outcome != 'miss'
         else:
-            risk_level = "low"
-            decision = "approve"
-        
-        # Explain prediction (top risk factors)
-        reasons = explain_prediction(features, fraud_score)
-        
-        # Update metrics
-        if decision in ['decline', 'review']:
-            FRAUD_DETECTED.inc()
+            record = fallback_payload(features) if g.degraded else score_payload(features, explain_mode, data)
+        if replayed and not g.degraded:
+            record = complete_explanation(record, features, explain_mode)
         
         # Calculate latency
-        latency_ms = (time.time() - start_time) * 1000
+        latency_ms = (time.perf_counter() - start_time) * 1000
         
         # Build response
         response = {
-            'payment_id': data.get('payment_id'),
-            'fraud_score': round(fraud_score, 4),
-            'risk_level': risk_level,
-            'decision': decision,
-            'reasons': reasons,
-            'timestamp': datetime.utcnow().isoformat(),
+            'payment_id': payment_id,
+            'fraud_score': record['fraud_score'],
+            'risk_level': record['risk_level'],
+            'decision': record['decision'],
+            'reasons': record['reasons'],
+            'contributions': record['contributions'],
+            'timestamp': record['timestamp'],
             'latency_ms': round(latency_ms, 2),
-            'model_version': '2.3.1'
+            'model_version': record['model_version'],
+            'degraded': record['degraded']
         }
         
-        logger.info(f"Scored payment {data.get('payment_id')}: score={fraud_score:.4f}, decision={decision}")
-        
-        return jsonify(response), 200
+        with span('serialize'):
+            headers = {'Idempotent-Replayed': 'true'} if replayed else {}
+            return jsonify(response), 200, headers
+    
+    except IdempotencyConflict:
+        ERRORS.labels(error_type='idempotency_conflict').inc()
+        return jsonify({'error': f"payment_id {data.get('payment_id')} was already scored with different features"}), 409
     
     except Exception as e:
         ERRORS.labels(error_type='internal_error').inc()
@@ -214,57 +415,187 @@ def score_transaction():
         return jsonify({'error': 'Internal server error'}), 500
 
 
-def explain_prediction(features: dict, fraud_score: float) -> list:
+def score_payload(features: dict, explain_mode: str, data: dict) -> dict:
     """
-    Explain why transaction was flagged as fraudulent.
+    Score one feature payload (the computation behind /score).
     
     Args:
-        features: Feature dictionary
-        fraud_score: Fraud score
+        features: Request features by name
+        explain_mode: Parsed `explain` of the request
+        data: Request body (payment_id / merchant_id for monitoring)
     
     Returns:
-        List of reasons
+        Decision record (fraud_score, risk_level, decision, reasons, contributions,
+        timestamp, model_version), as stored for retries
     """
-    reasons = []
+    # Build feature vector (model input order)
+    with span('build_vector'):
+        X = np.array([[features.get(name, 0) for name in FEATURE_NAMES]], dtype=np.float64)
     
-    # High velocity
-    if features.get('transaction_count_1h', 0) > 10:
-        reasons.append("High transaction velocity (>10 in 1 hour)")
+    # Predict
+    with span('predict'):
+        fraud_score = float(model.predict_proba(X)[0, 1])
     
-    # Geographic anomalies
-    if features.get('card_country_mismatch', 0) == 1:
-        reasons.append("Card country doesn't match IP country")
+    # Determine risk level and decision
+    risk_level, decision = classify_score(fraud_score)
     
-    if features.get('ip_country_mismatch', 0) == 1:
-        reasons.append("IP country doesn't match billing country")
+    # Explain prediction (top risk factors)
+    with span('explain'):
+        reasons, contributions = [], []
+        if should_explain(explain_mode, decision):
+            reasons, contributions = explain_rows(X, [features], [fraud_score])[0]
     
-    if features.get('velocity_km_per_hour', 0) > 500:
-        reasons.append("Impossible travel velocity detected")
+    # Update metrics (replayed decisions are not counted again)
+    if decision in ['decline', 'review']:
+        FRAUD_DETECTED.inc()
+    monitor.record_prediction(
+        data.get('payment_id'), data.get('merchant_id'),
+        fraud_score, risk_level, decision
+    )
     
-    # Device/Email
-    if features.get('device_fingerprint_new', 0) == 1:
-        reasons.append("New device fingerprint")
+    logger.info(f"Scored payment {data.get('payment_id')}: score={fraud_score:.4f}, decision={decision}")
     
-    if features.get('email_domain_disposable', 0) == 1:
-        reasons.append("Disposable email domain")
+    return {
+        'fraud_score': round(fraud_score, 4),
+        'risk_level': risk_level,
+        'decision': decision,
+        'reasons': reasons,
+        'contributions': contributions,
+        'explained': should_explain(explain_mode, decision),
+        'timestamp': datetime.utcnow().isoformat(),
+        'model_version': MODEL_VERSION,
+        'degraded': False
+    }
+
+
+def complete_explanation(record: dict, features: dict, explain_mode: str) -> dict:
+    """
+    Replayed decision with the explanation this request asks for.
     
-    # Customer history
-    if features.get('first_transaction_customer', 0) == 1:
-        reasons.append("First transaction for customer")
+    The stored record keeps the explanation of the first request only: a
+    retry asking for one the first request skipped (explain=never, or auto
+    on an approve) gets it computed now for the stored score. The stored
+    record itself is not changed.
+    """
+    if record.get('explained', True) or not should_explain(explain_mode, record['decision']):
+        return record
+    with span('explain'):
+        X = np.array([[features.get(name, 0) for name in FEATURE_NAMES]], dtype=np.float64)
+        reasons, contributions = explain_rows(X, [features], [record['fraud_score']])[0]
+    return dict(record, reasons=reasons, contributions=contributions, explained=True)
+
+
+def response_record(record: dict) -> dict:
+    """Decision record fields returned to clients (bookkeeping dropped)."""
+    return {key: value for key, value in record.items() if key != 'explained'}
+
+
+def fallback_payload(features: dict) -> dict:
+    """
+    Decision record from the fixed RISK_RULES (no model, a few microseconds).
     
-    if features.get('customer_dispute_history', 0) > 0:
-        reasons.append("Customer has dispute history")
+    Used for requests degraded by admission control; flagged `degraded` and
+    kept out of the model monitoring (not a model score).
+    """
+    hits = [(reason, weight) for reason, rule, weight in RISK_RULES if rule(features)]
+    fraud_score = 1 / (1 + np.exp(-(FALLBACK_BIAS + sum(weight for _, weight in hits))))
+    risk_level, decision = classify_score(fraud_score)
+    if decision in ['decline', 'review']:
+        FRAUD_DETECTED.inc()
     
-    # Amount
-    if features.get('high_value_flag', 0) == 1:
-        reasons.append("High transaction amount (>$10,000)")
+    return {
+        'fraud_score': round(float(fraud_score), 4),
+        'risk_level': risk_level,
+        'decision': decision,
+        'reasons': [reason for reason, _ in hits][:5],
+        'contributions': [],
+        'explained': True,
+        'timestamp': datetime.utcnow().isoformat(),
+        'model_version': 'rules',
+        'degraded': True
+    }
+
+
+def classify_score(fraud_score: float) -> tuple:
+    """Map a fraud score to (risk_level, decision) using the business thresholds."""
+    if fraud_score >= 0.95:
+        return "critical", "decline"
+    elif fraud_score >= 0.70:
+        return "high", "review"
+    elif fraud_score >= 0.40:
+        return "medium", "monitor"
+    return "low", "approve"
+
+
+def parse_explain_mode(value) -> str:
+    """Request `explain` value -> mode (None when invalid)."""
+    if value is None:
+        return EXPLAIN_DEFAULT
+    if isinstance(value, bool):
+        return 'always' if value else 'never'
+    return value if value in EXPLAIN_MODES else None
+
+
+def should_explain(mode: str, decision: str) -> bool:
+    return mode == 'always' or (mode == 'auto' and decision in ('review', 'decline'))
+
+
+def explain_rows(X: np.ndarray, features: list, fraud_scores: list) -> list:
+    """
+    Reasons and contributions for a batch of feature rows.
+
+    Uses exact TreeSHAP contributions of the loaded model (top positive
+    log-odds contributions); falls back to explain_prediction when the
+    model could not be loaded into the explainer.
+
+    Args:
+        X: Rows x FEATURE_NAMES
+        features: Request feature dictionaries, same order
+        fraud_scores: Model scores, same order
+
+    Returns:
+        List of (reasons, contributions) per row
+    """
+    if explainer is None:
+        return [(explain_prediction(f, s), []) for f, s in zip(features, fraud_scores)]
+    return [
+        (format_reasons(row), [{'feature': e.feature, 'value': e.value, 'contribution': round(e.contribution, 4)}
+                               for e in row])
+        for row in explainer.explain(X, EXPLAIN_TOP_K)
+    ]
+
+
+# Fixed risk rules: reason, test, log-odds weight.
+# Reasons when TreeSHAP is unavailable, and the degraded scorer under overload
+# (hand-set weights: about four hits reach review, six reach decline).
+RISK_RULES = [
+    ("High transaction velocity (>10 in 1 hour)", lambda f: f.get('transaction_count_1h', 0) > 10, 1.5),
+    ("Card country doesn't match IP country", lambda f: f.get('card_country_mismatch', 0) == 1, 1.5),
+    ("IP country doesn't match billing country", lambda f: f.get('ip_country_mismatch', 0) == 1, 1.0),
+    ("Impossible travel velocity detected", lambda f: f.get('velocity_km_per_hour', 0) > 500, 2.5),
+    ("New device fingerprint", lambda f: f.get('device_fingerprint_new', 0) == 1, 1.0),
+    ("Disposable email domain", lambda f: f.get('email_domain_disposable', 0) == 1, 1.5),
+    ("First transaction for customer", lambda f: f.get('first_transaction_customer', 0) == 1, 0.5),
+    ("Customer has dispute history", lambda f: f.get('customer_dispute_history', 0) > 0, 1.5),
+    ("High transaction amount (>$10,000)", lambda f: f.get('high_value_flag', 0) == 1, 1.0),
+    ("Transaction amount significantly above customer average", lambda f: f.get('amount_zscore', 0) > 3, 1.0),
+    ("Transaction from high-risk country", lambda f: f.get('high_risk_country', 0) == 1, 1.5),
+]
+FALLBACK_BIAS = -4.0
+
+
+def explain_prediction(features: dict, fraud_score: float) -> list:
+    """
+    Explain why transaction was flagged as fraudulent (fixed rules).
     
-    if features.get('amount_zscore', 0) > 3:
-        reasons.append("Transaction amount significantly above customer average")
+    Args:
+        features: Feature dictionary
+        fraud_score: Fraud score
     
-    # High risk indicators
-    if features.get('high_risk_country', 0) == 1:
-        reasons.append("Transaction from high-risk country")
+    Returns:
+        List of reasons
+    """
+    reasons = [reason for reason, rule, _ in RISK_RULES if rule(features)]
     
     # Limit to top 5 reasons
     return reasons[:5] if reasons else ["Pattern analysis indicates elevated risk"]
@@ -280,8 +611,9 @@ def batch_score():
     {
         "transactions": [
             {"payment_id": "pi_1", "features": {...}},
-            {"payment_id": "pi_2", "features": {...}}
-        ]
+            {"payment_id": "pi_2", "features": {...}, "explain": "always"}
+        ],
+        "explain": "auto"   (optional, default for the transactions)
     }
     
     Response:
@@ -294,7 +626,7 @@ def batch_score():
         "latency_ms": 45
     }
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
         data = request.get_json()
@@ -303,44 +635,137 @@ def batch_score():
         if not transactions:
             return jsonify({'error': 'No transactions provided'}), 400
         
-        results = []
-        for txn in transactions:
-            # Score each transaction (reuse single scoring logic)
-            score_response = score_transaction_internal(txn)
-            results.append(score_response)
+        modes = [parse_explain_mode(txn.get('explain', data.get('explain'))) for txn in transactions]
+        if None in modes:
+            ERRORS.labels(error_type='invalid_request').inc()
+            return jsonify({'error': f"explain must be one of {', '.join(EXPLAIN_MODES)} or a boolean"}), 400
+        
+        # One prediction and one explanation pass for the whole batch
+        results = score_batch_internal(transactions, modes)
         
-        latency_ms = (time.time() - start_time) * 1000
+        latency_ms = (time.perf_counter() - start_time) * 1000
         
-        return jsonify({
-            'results': results,
-            'total_processed': len(results),
-            'latency_ms': round(latency_ms, 2)
-        }), 200
+        with span('serialize'):
+            return jsonify({
+                'results': results,
+                'total_processed': len(results),
+                'latency_ms': round(latency_ms, 2)
+            }), 200
     
     except Exception as e:
         logger.error(f"Batch scoring error: {e}", exc_info=True)
         return jsonify({'error': 'Internal server error'}), 500
 
 
-def score_transaction_internal(txn: dict) -> dict:
-    """Internal scoring function (without HTTP overhead)."""
-    # Simplified version of score_transaction logic
-    features = txn.get('features', {})
+def score_batch_internal(transactions: list, explain_modes: list) -> list:
+    """
+    Internal batch scoring (without HTTP overhead), vectorized across transactions.
+    
+    Transactions whose payment_id was already scored get the stored decision;
+    the others are scored together and stored for later retries.
+    """
+    features = [txn.get('features', {}) for txn in transactions]
+    keys = [(str(txn['payment_id']), payload_digest(f)) if txn.get('payment_id') else None
+            for txn, f in zip(transactions, features)]
     
-    # Build feature vector
-    feature_vector = [features.get(f, 0) for f in [
-        'transaction_count_1h', 'transaction_count_24h', # ... (all 45 features)
-    ]]
+    results = [None] * len(transactions)
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        try:
+            record = scoring_cache.get(*key)
+        except IdempotencyConflict:
+            ERRORS.labels(error_type='idempotency_conflict').inc()
+            results[i] = {'payment_id': transactions[i]['payment_id'],
+                          'error': 'payment_id was already scored with different features'}
+            continue
+        if record is not None:
+            record = complete_explanation(record, features[i], explain_modes[i])
+            results[i] = {'payment_id': transactions[i]['payment_id'], **response_record(record)}
     
-    # Predict (simplified)
-    fraud_score = 0.5  # Placeholder
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
     
-    return {
-        'payment_id': txn.get('payment_id'),
-        'fraud_score': fraud_score,
-        'risk_level': 'medium',
-        'decision': 'monitor'
+    # Build feature matrix
+    with span('build_vector'):
+        X = np.array([[features[i].get(name, 0) for name in FEATURE_NAMES] for i in pending], dtype=np.float64)
+    
+    with span('predict'):
+        fraud_scores = model.predict_proba(X)[:, 1]
+    
+    timestamp = datetime.utcnow().isoformat()
+    records = []
+    for fraud_score in fraud_scores:
+        risk_level, decision = classify_score(float(fraud_score))
+        records.append({
+            'fraud_score': round(float(fraud_score), 4),
+            'risk_level': risk_level,
+            'decision': decision,
+            'reasons': [],
+            'contributions': [],
+            'explained': False,
+            'timestamp': timestamp,
+            'model_version': MODEL_VERSION,
+            'degraded': False
+        })
+    
+    # Explain the selected rows together
+    with span('explain'):
+        rows = [j for j, i in enumerate(pending) if should_explain(explain_modes[i], records[j]['decision'])]
+        if rows:
+            explained = explain_rows(X[rows], [features[pending[j]] for j in rows],
+                                     [float(fraud_scores[j]) for j in rows])
+            for j, (reasons, contributions) in zip(rows, explained):
+                records[j]['reasons'] = reasons
+                records[j]['contributions'] = contributions
+                records[j]['explained'] = True
+    
+    # Store, keeping a decision stored meanwhile (or earlier in this batch) for the same payment_id
+    for i, record in zip(pending, records):
+        scored = record
+        if keys[i] is not None:
+            try:
+                record = scoring_cache.put(*keys[i], record)
+            except IdempotencyConflict:
+                ERRORS.labels(error_type='idempotency_conflict').inc()
+                results[i] = {'payment_id': transactions[i]['payment_id'],
+                              'error': 'payment_id was already scored with different features'}
+                continue
+        if record is not scored:
+            record = complete_explanation(record, features[i], explain_modes[i])
+        results[i] = {'payment_id': transactions[i].get('payment_id'), **response_record(record)}
+        
+        # Update metrics for new decisions only (not the ones replayed from the cache)
+        if record is scored:
+            if record['decision'] in ['decline', 'review']:
+                FRAUD_DETECTED.inc()
+            monitor.record_prediction(
+                transactions[i].get('payment_id'), transactions[i].get('merchant_id'),
+                record['fraud_score'], record['risk_level'], record['decision']
+            )
+    
+    return results
+
+
+@app.route('/api/v1/fraud/chargeback', methods=['POST'])
+def record_chargeback():
+    """
+    Delayed fraud label feedback (chargeback or confirmed fraud).
+    
+    Request Body:
+    {
+        "payment_id": "pi_123"
     }
+    """
+    data = request.get_json(silent=True) or {}
+    payment_id = data.get('payment_id')
+    if not payment_id:
+        ERRORS.labels(error_type='invalid_request').inc()
+        return jsonify({'error': 'Missing payment_id'}), 400
+    
+    monitor.record_chargeback(payment_id)
+    return jsonify({'status': 'accepted'}), 202
 
 
 @app.route('/api/v1/model/info', methods=['GET'])
@@ -353,14 +778,24 @@ def model_info():
         "model_version": "2.3.1",
         "trained_at": "2025-10-01T00:00:00Z",
         "features_count": 45,
-        "model_type": "xgboost"
+        "model_type": "xgboost",
+        "required_features": ["amount_zscore", ...]
     }
+
+    required_features: features the loaded model splits on, the rule-based
+    reasons' inputs and their dependencies; the feature producer builds its
+    engine with FeatureEngineer(required_features=...) (or
+    FeatureEngineer.for_model) and may omit the others (scored as 0).
     """
+    required = plan_features(model_features(model) | RULE_FEATURES).features if model is not None else None
     return jsonify({
-        'model_version': '2.3.1',
+        'model_version': MODEL_VERSION,
         'trained_at': '2025-10-01T00:00:00Z',
         'features_count': 45,
         'model_type': 'xgboost',
+        'model_format': 'compiled' if isinstance(model, CompiledModel) else 'xgboost',
+        'explanations': 'treeshap' if explainer is not None else 'rules',
+        'required_features': [name for name in required if name in FEATURE_NAMES] if required else None,
         'thresholds': {
             'decline': 0.95,
             'review': 0.70,
@@ -384,13 +819,10 @@ def internal_error(error):
 # APPLICATION STARTUP
 
 if __name__ == '__main__':
-    # Load model
-    load_model()
-    
-    # Start Flask app
-    app.run(
+    # Development server; in production: gunicorn 'app:create_app()'
+    create_app().run(
         host='0.0.0.0',
         port=5000,
         debug=False,
         threaded=True
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,241 @@
+"""
+Idempotent Scoring Cache
+Stripe Data Architecture - ML Module
+
+Purpose: Decisions of the fraud API keyed by payment_id, so client retries
+         of the same payment are answered without recomputing features
+         and inference:
+             - the first decision for a payment_id is final: a retry with
+               the same feature payload gets it back, a request reusing the
+               payment_id with different features is a conflict
+             - concurrent duplicates wait for the first computation instead
+               of running their own
+             - bounded: LRU above max_entries, entries expire after
+               ttl_seconds
+
+Guarantee: among the responses for one payment_id while its entry lives,
+every decision is the one stored first (put keeps the existing entry, so
+two computations racing from different endpoints resolve to one). The cache
+lives in one worker process: it holds only for the retries that reach the
+same process. Retries routed to another worker or replica (gunicorn
+workers, several API instances) are scored again and may get a different
+decision, e.g. after a model reload or when one of them is degraded.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_TTL_SECONDS = 600
+# A waiting duplicate computes on its own after this (leader stuck)
+COALESCE_TIMEOUT_SECONDS = 5.0
+# Per-entry bookkeeping added to the serialized size (key, digest, links)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+
+IDEMPOTENCY_REQUESTS = Counter(
+    'fraud_api_idempotency_requests_total', 'Scoring requests by idempotency cache outcome', ['outcome']
+)
+IDEMPOTENCY_HIT_RATIO = Gauge(
+    'fraud_api_idempotency_hit_ratio', 'Share of keyed requests answered from the cache (hit or coalesced)'
+)
+IDEMPOTENCY_ENTRIES = Gauge('fraud_api_idempotency_entries', 'Decisions held by the idempotency cache')
+IDEMPOTENCY_BYTES = Gauge('fraud_api_idempotency_bytes', 'Approximate memory of the cached decisions')
+IDEMPOTENCY_EVICTIONS = Counter(
+    'fraud_api_idempotency_evictions_total', 'Cached decisions dropped', ['reason']
+)
+
+
+class IdempotencyConflict(Exception):
+    """payment_id already scored with a different feature payload."""
+
+
+def payload_digest(features: Dict) -> str:
+    """Stable hash of a feature payload (key order and spacing ignored)."""
+    canonical = json.dumps(features, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class _Entry(NamedTuple):
+    digest: str
+    value: Any
+    size: int
+    expires_at: float
+
+
+class _InFlight:
+    def __init__(self, digest: str):
+        self.digest = digest
+        self.done = threading.Event()
+        self.value: Optional[Any] = None
+
+
+class IdempotencyCache:
+    """Thread-safe payment_id -> first decision, with request coalescing."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_entries: Decisions kept (least recently used dropped beyond)
+            ttl_seconds: Lifetime of a decision after it is stored
+            clock: Monotonic time source (seconds)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: 'OrderedDict[str, _Entry]' = OrderedDict()
+        self._in_flight: Dict[str, _InFlight] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.stats = {'hit': 0, 'coalesced': 0, 'miss': 0, 'conflict': 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _record(self, outcome: str) -> None:
+        self.stats[outcome] += 1
+        IDEMPOTENCY_REQUESTS.labels(outcome=outcome).inc()
+        keyed = sum(self.stats.values())
+        IDEMPOTENCY_HIT_RATIO.set((self.stats['hit'] + self.stats['coalesced']) / keyed)
+
+    def _drop(self, payment_id: str, reason: str) -> None:
+        entry = self._entries.pop(payment_id)
+        self.bytes -= entry.size
+        IDEMPOTENCY_EVICTIONS.labels(reason=reason).inc()
+
+    def _publish(self) -> None:
+        IDEMPOTENCY_ENTRIES.set(len(self._entries))
+        IDEMPOTENCY_BYTES.set(self.bytes)
+
+    def _lookup(self, payment_id: str, digest: str) -> Optional[_Entry]:
+        """Live entry for payment_id (lock held); raises on a payload mismatch."""
+        entry = self._entries.get(payment_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= self._clock():
+            self._drop(payment_id, 'ttl')
+            self._publish()
+            return None
+        if entry.digest != digest:
+            raise IdempotencyConflict(payment_id)
+        self._entries.move_to_end(payment_id)
+        return entry
+
+    def get(self, payment_id: str, digest: str) -> Optional[Any]:
+        """
+        Stored decision for a retry.
+
+        Raises:
+            IdempotencyConflict: payment_id stored with another payload
+        """
+        with self._lock:
+            try:
+                entry = self._lookup(payment_id, digest)
+            except IdempotencyConflict:
+                self._record('conflict')
+                raise
+            self._record('hit' if entry else 'miss')
+            return entry.value if entry else None
+
+    def put(self, payment_id: str, digest: str, value: Any) -> Any:
+        """
+        Store a decision unless one is already live for payment_id.
+
+        Returns:
+            The decision to answer with: the existing one if present
+
+        Raises:
+            IdempotencyConflict: payment_id stored with another payload
+        """
+        size = len(json.dumps(value, default=str)) + len(payment_id) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            entry = self._lookup(payment_id, digest)
+            if entry is not None:
+                return entry.value
+            self._entries[payment_id] = _Entry(digest, value, size, self._clock() + self.ttl_seconds)
+            self.bytes += size
+            self._expire()
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)), 'capacity')
+            self._publish()
+            return value
+
+    def _expire(self) -> None:
+        """Drop expired entries from the LRU end (lock held; stops at the first live one)."""
+        now = self._clock()
+        for payment_id in list(self._entries):
+            if self._entries[payment_id].expires_at > now:
+                break
+            self._drop(payment_id, 'ttl')
+
+    def get_or_compute(self, payment_id: str, digest: str, compute: Callable[[], Any],
+                       cacheable: Callable[[Any], bool] = lambda value: True) -> Tuple[Any, str]:
+        """
+        Stored decision, or the result of compute() run once for all concurrent duplicates.
+
+        Args:
+            payment_id: Idempotency key
+            digest: payload_digest of the request features
+            compute: Scoring function (exceptions are not cached)
+            cacheable: Whether a computed value may be stored (e.g. not an error)
+
+        Returns:
+            (value, outcome) with outcome 'hit', 'coalesced' or 'miss'
+
+        Raises:
+            IdempotencyConflict: payment_id stored or in flight with another payload
+        """
+        while True:
+            with self._lock:
+                try:
+                    entry = self._lookup(payment_id, digest)
+                    flight = self._in_flight.get(payment_id)
+                    if flight is not None and flight.digest != digest:
+                        raise IdempotencyConflict(payment_id)
+                except IdempotencyConflict:
+                    self._record('conflict')
+                    raise
+                if entry is not None:
+                    self._record('hit')
+                    return entry.value, 'hit'
+                leader = flight is None
+                if leader:
+                    flight = self._in_flight[payment_id] = _InFlight(digest)
+
+            if not leader:
+                if not flight.done.wait(COALESCE_TIMEOUT_SECONDS):
+                    logger.warning(f"Scoring of {payment_id} still in flight after "
+                                   f"{COALESCE_TIMEOUT_SECONDS}s, computing the duplicate")
+                    value = compute()
+                    return (self.put(payment_id, digest, value) if cacheable(value) else value), 'miss'
+                if flight.value is not None:
+                    with self._lock:
+                        self._record('coalesced')
+                    return flight.value, 'coalesced'
+                continue  # leader failed: the next caller computes
+
+            try:
+                value = compute()
+                if cacheable(value):
+                    value = flight.value = self.put(payment_id, digest, value)
+            finally:
+                with self._lock:
+                    self._in_flight.pop(payment_id, None)
+                    self._record('miss')
+                flight.done.set()
+            return value, 'miss'
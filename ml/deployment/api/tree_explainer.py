@@ -0,0 +1,455 @@
+"""
+TreeSHAP Explanation Engine
+Stripe Data Architecture - ML Module
+
+Purpose: Exact SHAP contributions of the loaded XGBoost booster, used for
+         the `reasons` of the fraud API instead of fixed feature rules:
+             - load: every root-to-leaf path of every tree is flattened once
+               (unique features, cover fractions, split conditions, leaf value)
+             - explain: path-parallel TreeSHAP (Lundberg et al. 2020,
+               Algorithm 2: EXTEND / UNWIND on the path weights), vectorized
+               with NumPy over a batch of rows x all paths
+             - table: a row only decides, per path feature, whether it
+               follows the path (one fraction 0 or 1), so for shallow
+               models the contributions of every path are computed at load
+               for all 2^depth patterns and explain is a lookup
+             - reasons: top positive contributions (log-odds toward fraud)
+               mapped to human-readable messages
+             - state: to_arrays / from_arrays, so a precompiled model bundle
+               (compiled_model.py) restores the explainer without rebuilding
+               the paths and tables
+
+The contributions are in margin (log-odds) space and sum, with
+expected_value, to the raw model output; they match
+Booster.predict(..., pred_contribs=True).
+"""
+
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# Rows x paths x path-slots handled per chunk (memory bound of explain)
+CHUNK_ELEMENTS = 1_000_000
+
+# Size limit of the per-pattern contribution table (float32); deeper
+# models run EXTEND / UNWIND per request instead
+TABLE_MAX_BYTES = 256 * 1024 * 1024
+
+# Reason text per feature, for contributions pushing toward fraud
+FEATURE_REASONS = {
+    'transaction_count_1h': "High transaction velocity in the last hour",
+    'transaction_count_24h': "High transaction count in the last 24 hours",
+    'transaction_count_7d': "Unusual transaction count in the last 7 days",
+    'transaction_count_30d': "Unusual transaction count in the last 30 days",
+    'unique_cards_30d': "Many different cards used recently",
+    'unique_merchants_30d': "Many different merchants used recently",
+    'avg_amount_7d': "Unusual average amount over 7 days",
+    'stddev_amount_7d': "Irregular amounts over 7 days",
+    'max_amount_30d': "Unusual maximum amount over 30 days",
+    'amount_ratio_to_avg': "Amount far from customer average",
+    'amount_zscore': "Transaction amount significantly above customer average",
+    'round_amount': "Round transaction amount",
+    'high_value_flag': "High transaction amount (>$10,000)",
+    'amount_percentile': "Amount in an unusual percentile for the customer",
+    'card_country_mismatch': "Card country doesn't match IP country",
+    'ip_country_mismatch': "IP country doesn't match billing country",
+    'distance_km': "Unusual distance from previous transaction",
+    'velocity_km_per_hour': "Impossible travel velocity detected",
+    'high_risk_country': "Transaction from high-risk country",
+    'country_change_24h': "Country changed in the last 24 hours",
+    'timezone_anomaly': "Device timezone doesn't match location",
+    'device_fingerprint_age_days': "Recently seen device fingerprint",
+    'device_fingerprint_new': "New device fingerprint",
+    'email_domain_age_days': "Recently registered email domain",
+    'email_domain_free': "Free email provider",
+    'email_domain_disposable': "Disposable email domain",
+    'browser_version_outdated': "Outdated browser version",
+    'customer_age_days': "Recently created customer account",
+    'first_transaction_customer': "First transaction for customer",
+    'customer_dispute_history': "Customer has dispute history",
+    'customer_success_rate': "Low customer payment success rate",
+    'days_since_last_transaction': "Unusual time since last transaction",
+    'customer_lifetime_value': "Unusual customer lifetime value",
+    'avg_transaction_per_month': "Unusual monthly transaction frequency",
+    'chargeback_rate_30d': "Recent chargebacks for customer",
+    'merchant_age_days': "Recently onboarded merchant",
+    'merchant_dispute_rate_30d': "Merchant has a high dispute rate",
+    'merchant_chargeback_rate': "Merchant has a high chargeback rate",
+    'merchant_avg_ticket': "Amount unusual for this merchant",
+    'merchant_industry_risk': "High-risk merchant industry",
+    'time_of_day': "Unusual time of day",
+    'day_of_week': "Unusual day of week",
+    'is_weekend': "Weekend transaction",
+    'is_holiday': "Holiday transaction",
+    'shipping_address_mismatch': "Shipping address doesn't match billing address",
+}
+
+
+class Explanation(NamedTuple):
+    """Per-row contribution of one feature."""
+    feature: str
+    value: float
+    contribution: float
+
+
+# ============================================================================
+# PATH EXTRACTION
+# ============================================================================
+
+def _trees(booster, n_trees: Optional[int]) -> Dict[int, Dict[int, Dict]]:
+    """tree -> node id -> node record, from Booster.trees_to_dataframe()."""
+    frame = booster.trees_to_dataframe()
+    if 'Category' in frame.columns and frame['Category'].notna().any():
+        raise ValueError("Categorical splits are not supported by the explainer")
+    if n_trees is not None:
+        frame = frame[frame['Tree'] < n_trees]
+
+    def child(ref: str) -> int:
+        return int(ref.split('-')[1])
+
+    trees: Dict[int, Dict[int, Dict]] = {}
+    for row in frame.itertuples(index=False):
+        node = {'cover': float(row.Cover)}
+        if row.Feature == 'Leaf':
+            node['value'] = float(row.Gain)
+        else:
+            node.update(feature=row.Feature, split=float(row.Split), yes=child(row.Yes),
+                        no=child(row.No), missing=child(row.Missing))
+        trees.setdefault(int(row.Tree), {})[int(row.Node)] = node
+    return trees
+
+
+def _feature_index(name: str, feature_names: List[str], booster_names: Optional[List[str]]) -> int:
+    if booster_names:
+        return feature_names.index(name)
+    return int(name[1:])  # f<index> when trained without names
+
+
+def _n_trees(model) -> Optional[int]:
+    """Trees used by predict_proba (early stopping keeps best_iteration + 1 rounds)."""
+    try:
+        best = model.best_iteration
+    except AttributeError:
+        return None
+    if best is None:
+        return None
+    parallel = (model.get_params().get('num_parallel_tree') or 1)
+    return (best + 1) * parallel
+
+
+# ============================================================================
+# EXPLAINER
+# ============================================================================
+
+class _PathGroup(NamedTuple):
+    """Paths with the same number of distinct features (slots 1..depth; slot 0 is the null root)."""
+    depth: int
+    slot_start: int
+    leaf_value: np.ndarray
+    zero_fraction: np.ndarray
+    # Slots 1..depth of every path ordered by feature, with the start of each
+    # feature's run: contributions are summed per feature with add.reduceat
+    slot_order: np.ndarray
+    slot_bounds: np.ndarray
+    slot_features: np.ndarray
+    table: Optional[np.ndarray]
+
+
+def _path_contributions(one: np.ndarray, zero_fraction: np.ndarray, leaf_value: np.ndarray) -> np.ndarray:
+    """
+    TreeSHAP leaf contributions of paths of equal length.
+
+    Args:
+        one: Rows x paths x slots one fractions (0/1)
+        zero_fraction: Paths x slots cover fractions
+        leaf_value: Paths
+
+    Returns:
+        Rows x paths x slots: leaf value x (o - z) x unwound path weight sum
+    """
+    z = zero_fraction
+    o = one.astype(np.float64)
+    n_slots = z.shape[1]
+    depth = n_slots - 1
+
+    # EXTEND with every slot (slot 0: pweight = 1)
+    weights = np.zeros(o.shape)
+    weights[..., 0] = 1.0
+    for d in range(1, n_slots):
+        previous = weights[..., :d + 1].copy()
+        scale = np.arange(d + 1)
+        weights[..., :d + 1] = z[:, d, None] * previous * (d - scale) / (d + 1)
+        weights[..., 1:d + 1] += o[..., d, None] * previous[..., :d] * scale[1:] / (d + 1)
+
+    # UNWIND each slot: the zero-one-fraction branch does not depend on the slot
+    zero_sum = np.sum(weights[..., :depth] / (depth - np.arange(depth)), axis=-1)
+    phi = np.zeros(o.shape)
+    for k in range(1, n_slots):
+        zk = z[:, k]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unwound_zero = np.where(zk > 0, zero_sum / zk, 0.0)
+        next_portion = weights[..., depth]
+        unwound_one = np.zeros(o.shape[:2])
+        for i in range(depth - 1, -1, -1):
+            tmp = next_portion / (i + 1)
+            unwound_one += tmp
+            next_portion = weights[..., i] - tmp * zk * (depth - i)
+        unwound = np.where(one[..., k], unwound_one, unwound_zero) * (depth + 1)
+        phi[..., k] = unwound * (o[..., k] - zk) * leaf_value
+    return phi
+
+
+def _pattern_table(zero_fraction: np.ndarray, leaf_value: np.ndarray) -> np.ndarray:
+    """(Paths x patterns) x slots 1.. contributions; bit k-1 of a pattern = one fraction of slot k."""
+    n_paths, n_slots = zero_fraction.shape
+    n_patterns = 2 ** (n_slots - 1)
+    bits = ((np.arange(n_patterns)[:, None] >> np.arange(n_slots - 1)) & 1).astype(bool)
+    table = np.empty((n_paths, n_patterns, n_slots - 1), dtype=np.float32)
+    chunk = max(1, CHUNK_ELEMENTS // (n_paths * n_slots))
+    for start in range(0, n_patterns, chunk):
+        one = np.ones((len(bits[start:start + chunk]), n_paths, n_slots), dtype=bool)
+        one[..., 1:] = bits[start:start + chunk, None, :]
+        table[:, start:start + chunk] = _path_contributions(one, zero_fraction, leaf_value)[..., 1:].transpose(1, 0, 2)
+    return table.reshape(-1, n_slots - 1)
+
+
+class TreeExplainer:
+    """
+    Exact TreeSHAP for a binary XGBoost classifier (margin space).
+
+    Paths are grouped by number of distinct features; slot 0 of every
+    path is a null feature (zero and one fractions of 1), as in the
+    reference algorithm.
+    """
+
+    def __init__(self, model, feature_names: List[str], table_max_bytes: int = TABLE_MAX_BYTES):
+        """
+        Args:
+            model: Fitted xgboost XGBClassifier (or Booster)
+            feature_names: Model input columns, in training order
+            table_max_bytes: Memory for the per-pattern tables; path groups
+                             beyond it run EXTEND / UNWIND per request
+        """
+        booster = model.get_booster() if hasattr(model, 'get_booster') else model
+        self.feature_names = list(feature_names)
+        n_features = len(self.feature_names)
+        n_trees = _n_trees(model) if booster is not model else None
+        trees = _trees(booster, n_trees)
+        # Boosting rounds of predict_proba (0: all)
+        self._rounds = n_trees // (model.get_params().get('num_parallel_tree') or 1) if n_trees else 0
+        booster_names = booster.feature_names
+
+        # Internal nodes, numbered across trees
+        node_ids: Dict[tuple, int] = {}
+        node_feature, node_split, node_missing_yes = [], [], []
+        for t, nodes in trees.items():
+            for n, node in nodes.items():
+                if 'value' not in node:
+                    node_ids[(t, n)] = len(node_feature)
+                    node_feature.append(_feature_index(node['feature'], self.feature_names, booster_names))
+                    node_split.append(node['split'])
+                    node_missing_yes.append(node['missing'] == node['yes'])
+
+        # Root-to-leaf paths: split conditions with the cover fraction of the branch taken
+        paths = []
+        for t, nodes in trees.items():
+            stack = [(0, [])]
+            while stack:
+                n, conditions = stack.pop()
+                node = nodes[n]
+                if 'value' in node:
+                    depth = len({node_feature[c[0]] for c in conditions})
+                    paths.append((depth, node['value'], conditions))
+                    continue
+                for branch, go_yes in ((node['yes'], True), (node['no'], False)):
+                    fraction = nodes[branch]['cover'] / node['cover'] if node['cover'] > 0 else 0.0
+                    stack.append((branch, conditions + [(node_ids[(t, n)], go_yes, fraction)]))
+        paths.sort(key=lambda path: path[0])
+        self.n_paths = len(paths)
+
+        # Flattened slot layout: group by group, path by path, slot 0..depth
+        self.groups: List[_PathGroup] = []
+        cond_node, cond_yes, cond_slot = [], [], []
+        slot_start, table_bytes, tree_expectation = 0, 0, 0.0
+        for depth in sorted({path[0] for path in paths}):
+            group = [path for path in paths if path[0] == depth]
+            leaf_value = np.array([path[1] for path in group])
+            zero_fraction = np.ones((len(group), depth + 1))
+            slot_feature = np.zeros((len(group), depth), dtype=np.int64)
+            for p, (_, _, conditions) in enumerate(group):
+                slots: Dict[int, int] = {}
+                for node, go_yes, fraction in conditions:
+                    feature = node_feature[node]
+                    slot = slots.setdefault(feature, len(slots) + 1)
+                    slot_feature[p, slot - 1] = feature
+                    zero_fraction[p, slot] *= fraction
+                    cond_node.append(node)
+                    cond_yes.append(go_yes)
+                    cond_slot.append(slot_start + p * (depth + 1) + slot)
+            tree_expectation += float(leaf_value @ np.prod(zero_fraction, axis=1))
+
+            slot_order = np.argsort(slot_feature.ravel(), kind='stable')
+            slot_features, slot_bounds = np.unique(slot_feature.ravel()[slot_order], return_index=True)
+            table = None
+            size = len(group) * 2 ** depth * depth * 4
+            if depth and table_bytes + size <= table_max_bytes:
+                table = _pattern_table(zero_fraction, leaf_value)
+                table_bytes += size
+            self.groups.append(_PathGroup(depth, slot_start, leaf_value, zero_fraction,
+                                          slot_order, slot_bounds, slot_features, table))
+            slot_start += len(group) * (depth + 1)
+        self.n_slots = slot_start
+        self.table_bytes = table_bytes
+
+        order = np.argsort(cond_slot, kind='stable')
+        cond_slot = np.asarray(cond_slot, dtype=np.int64)[order]
+        self._cond_node = np.asarray(cond_node, dtype=np.int64)[order]
+        self._cond_yes = np.asarray(cond_yes, dtype=bool)[order]
+        self._slots, self._slot_starts = np.unique(cond_slot, return_index=True)
+
+        self._node_feature = np.asarray(node_feature, dtype=np.int64)
+        self._node_split = np.asarray(node_split, dtype=np.float32)
+        self._node_missing_yes = np.asarray(node_missing_yes, dtype=bool)
+
+        # E[f(x)]: cover-weighted leaves, plus the base margin (model margin minus leaf sum of a probe row)
+        probe = np.zeros((1, n_features), dtype=np.float32)
+        one = self._one_fraction(probe)
+        leaves = sum(float(group.leaf_value @ self._group_view(one, group).all(axis=2)[0])
+                     for group in self.groups)
+        self.base_margin = float(self._margin(booster, probe, booster_names)[0]) - leaves
+        self.expected_value = tree_expectation + self.base_margin
+        logger.info(f"TreeExplainer: {len(trees)} trees, {self.n_paths} paths, "
+                    f"{max(group.depth for group in self.groups)} features per path max, "
+                    f"tables {table_bytes / 2**20:.1f} MB for "
+                    f"{sum(len(g.leaf_value) for g in self.groups if g.table is not None)} paths")
+
+    # Array attributes saved by to_arrays, besides the path groups
+    _STATE = ('_cond_node', '_cond_yes', '_slots', '_slot_starts',
+              '_node_feature', '_node_split', '_node_missing_yes')
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Precomputed state as named arrays (for np.savez); see from_arrays."""
+        arrays = {name.lstrip('_'): getattr(self, name) for name in self._STATE}
+        arrays['scalars'] = np.array([self.base_margin, self.expected_value, self.n_paths,
+                                      self.n_slots, self.table_bytes], dtype=np.float64)
+        for i, group in enumerate(self.groups):
+            arrays[f"group{i}.layout"] = np.array([group.depth, group.slot_start], dtype=np.int64)
+            for field in ('leaf_value', 'zero_fraction', 'slot_order', 'slot_bounds', 'slot_features', 'table'):
+                if getattr(group, field) is not None:
+                    arrays[f"group{i}.{field}"] = getattr(group, field)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], feature_names: List[str]) -> 'TreeExplainer':
+        """
+        Explainer restored from to_arrays() output, without the booster.
+
+        Args:
+            arrays: Name -> array, as returned by to_arrays (e.g. an np.load view)
+            feature_names: Model input columns, in training order
+        """
+        explainer = cls.__new__(cls)
+        explainer.feature_names = list(feature_names)
+        for name in cls._STATE:
+            setattr(explainer, name, np.asarray(arrays[name.lstrip('_')]))
+        base_margin, expected_value, n_paths, n_slots, table_bytes = arrays['scalars']
+        explainer.base_margin, explainer.expected_value = float(base_margin), float(expected_value)
+        explainer.n_paths, explainer.n_slots, explainer.table_bytes = int(n_paths), int(n_slots), int(table_bytes)
+        explainer._rounds = 0
+        explainer.groups = []
+        i = 0
+        while f"group{i}.layout" in arrays:
+            depth, slot_start = (int(v) for v in arrays[f"group{i}.layout"])
+            explainer.groups.append(_PathGroup(
+                depth, slot_start,
+                *(np.asarray(arrays[f"group{i}.{field}"])
+                  for field in ('leaf_value', 'zero_fraction', 'slot_order', 'slot_bounds', 'slot_features')),
+                np.asarray(arrays[f"group{i}.table"]) if f"group{i}.table" in arrays else None
+            ))
+            i += 1
+        return explainer
+
+    def _margin(self, booster, X: np.ndarray, booster_names) -> np.ndarray:
+        import xgboost as xgb
+        matrix = xgb.DMatrix(X, feature_names=booster_names or None)
+        return booster.predict(matrix, output_margin=True, iteration_range=(0, self._rounds))
+
+    def _one_fraction(self, X: np.ndarray) -> np.ndarray:
+        """Rows x slots: True where the row follows every split of the slot's feature."""
+        values = X[:, self._node_feature]
+        go_yes = np.where(np.isnan(values), self._node_missing_yes, values < self._node_split)
+        followed = (go_yes[:, self._cond_node] == self._cond_yes).astype(np.uint8)
+        one = np.ones((X.shape[0], self.n_slots), dtype=np.uint8)
+        one[:, self._slots] = np.minimum.reduceat(followed, self._slot_starts, axis=1)
+        return one.astype(bool)
+
+    @staticmethod
+    def _group_view(one: np.ndarray, group: _PathGroup) -> np.ndarray:
+        n_paths = len(group.leaf_value)
+        end = group.slot_start + n_paths * (group.depth + 1)
+        return one[:, group.slot_start:end].reshape(one.shape[0], n_paths, group.depth + 1)
+
+    def shap_values(self, X: np.ndarray) -> np.ndarray:
+        """
+        Exact SHAP values.
+
+        Args:
+            X: Rows x features (NaN = missing)
+
+        Returns:
+            Rows x features contributions (log-odds); each row sums with
+            expected_value to the model margin
+        """
+        X = np.asarray(X, dtype=np.float32)
+        result = np.zeros((X.shape[0], len(self.feature_names)))
+        chunk = max(1, CHUNK_ELEMENTS // max(1, self.n_slots))
+        for start in range(0, X.shape[0], chunk):
+            rows = X[start:start + chunk]
+            one = self._one_fraction(rows)
+            for group in self.groups:
+                if group.depth == 0:
+                    continue
+                view = self._group_view(one, group)
+                if group.table is not None:
+                    pattern = view[..., 1:].astype(np.int64) @ (1 << np.arange(group.depth))
+                    offset = np.arange(len(group.leaf_value)) * 2 ** group.depth
+                    phi = group.table[offset + pattern]
+                else:
+                    phi = _path_contributions(view, group.zero_fraction, group.leaf_value)[..., 1:]
+                flat = phi.reshape(rows.shape[0], -1)[:, group.slot_order]
+                result[start:start + chunk, group.slot_features] += np.add.reduceat(
+                    flat, group.slot_bounds, axis=1, dtype=np.float64
+                )
+        return result
+
+    def explain(self, X: np.ndarray, top_k: int = 5) -> List[List[Explanation]]:
+        """
+        Top contributions toward fraud per row.
+
+        Args:
+            X: Rows x features
+            top_k: Contributions kept per row
+
+        Returns:
+            Per row, up to top_k positive contributions, largest first
+        """
+        X = np.asarray(X, dtype=np.float64)
+        values = self.shap_values(X)
+        explanations = []
+        for row, contributions in zip(X, values):
+            order = np.argsort(-contributions)[:top_k]
+            explanations.append([
+                Explanation(self.feature_names[j], float(row[j]), float(contributions[j]))
+                for j in order if contributions[j] > 0
+            ])
+        return explanations
+
+
+def format_reasons(explanations: List[Explanation]) -> List[str]:
+    """Human-readable reasons of one row's top contributions."""
+    return [FEATURE_REASONS.get(e.feature, f"Unusual {e.feature.replace('_', ' ')}") for e in explanations] \
+        or ["Pattern analysis indicates elevated risk"]
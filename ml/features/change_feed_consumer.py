@@ -0,0 +1,483 @@
+"""
+Change-Feed Consumer for Online Feature State
+Stripe Data Architecture - ML Module
+
+Purpose: Read Payment, Dispute, Customer and Merchant changes (the tables
+         captured by architecture/pipelines/scripts/setup_cdc.sql) and keep
+         the per-customer / per-merchant aggregates of online_state.py up to
+         date, so FeatureEngineer no longer recomputes them from raw tables
+         at request time.
+
+Delivery: at-least-once reads, exactly-once effect. Changes are applied in
+batches in change-log order; each batch is committed atomically with the
+per-table checkpoints, and replays after a crash are skipped by position.
+
+Bootstrap: CDC only keeps a few days of changes, so the state is first
+seeded from a consistent snapshot of the tables taken at a known position
+(--bootstrap); consumption then starts after that position. Without it,
+lifetime aggregates are served by the fallback source (online_state.py).
+
+Sources:
+    AzureSQLChangeLog  - SQL Server CDC (cdc.fn_cdc_get_all_changes_dbo_<Table>)
+    SQLiteChangeLog    - local file-backed change log (tests, benchmarks, replays)
+
+Usage:
+    python change_feed_consumer.py --changelog changes.db --state online_state.db
+    python change_feed_consumer.py --sql-connection "<conn>" --state online_state.db --bootstrap
+    python change_feed_consumer.py --sql-connection "<conn>" --state online_state.db --metrics-port 9101
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from online_state import OnlineFeatureState, to_iso
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Tables consumed, with the columns captured by setup_cdc.sql
+CAPTURED_COLUMNS = {
+    'Payment': ['PaymentID', 'CustomerID', 'MerchantID', 'Amount', 'Currency',
+                'Status', 'PaymentMethod', 'CreatedAt', 'UpdatedAt'],
+    'Dispute': ['DisputeID', 'PaymentID', 'Reason', 'Status', 'Amount',
+                'CreatedAt', 'ResolvedAt'],
+    'Customer': ['CustomerID', 'Email', 'Country', 'IsActive', 'CreatedAt', 'UpdatedAt'],
+    'Merchant': ['MerchantID', 'BusinessName', 'Country', 'Industry', 'IsActive',
+                 'CreatedAt', 'UpdatedAt'],
+}
+DEFAULT_TABLES = list(CAPTURED_COLUMNS)
+# Snapshot order: a dispute's payment is seeded before the dispute
+SNAPSHOT_ORDER = ['Merchant', 'Customer', 'Payment', 'Dispute']
+
+# CDC __$operation codes ('all' row filter: no update before-images)
+CDC_OPERATIONS = {1: 'delete', 2: 'insert', 4: 'update'}
+
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+
+CHANGES_APPLIED = Counter(
+    'fraud_change_feed_changes_applied_total', 'Changes applied to online feature state', ['table']
+)
+CHANGES_SKIPPED = Counter(
+    'fraud_change_feed_changes_skipped_total', 'Changes skipped', ['reason']
+)
+DEFERRED_DISPUTES = Gauge(
+    'fraud_change_feed_deferred_disputes', 'Disputes waiting for their payment'
+)
+CHANGE_FEED_LAG = Gauge(
+    'fraud_change_feed_lag_seconds',
+    'Age of the latest applied change while a backlog remains (0 when caught up)', ['table']
+)
+BATCH_DURATION = Histogram(
+    'fraud_change_feed_batch_seconds', 'Time to read and apply one batch',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+BATCH_SIZE = Histogram(
+    'fraud_change_feed_batch_size', 'Changes per applied batch',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+
+
+class ChangeRecord(NamedTuple):
+    table: str
+    position: int          # Total order within the change log
+    operation: str         # insert, update, delete
+    committed_at: Optional[datetime]
+    row: Dict
+
+
+class Snapshot(NamedTuple):
+    position: int                       # Every change up to here is in rows
+    rows: Iterable[Tuple[str, Dict]]    # (table, row), in SNAPSHOT_ORDER
+
+
+# ============================================================================
+# CHANGE LOGS
+# ============================================================================
+
+class ChangeLog(ABC):
+    """Ordered, replayable source of row changes."""
+
+    @abstractmethod
+    def read(self, table: str, after: Optional[int], limit: int) -> List[ChangeRecord]:
+        """Up to `limit` changes of `table` with position > after, in order."""
+
+    def snapshot(self, tables: Sequence[str]) -> Snapshot:
+        """Current rows of `tables`, consistent with a change-log position."""
+        raise NotImplementedError(f"{type(self).__name__} cannot take snapshots")
+
+    def close(self) -> None:
+        """Release connections."""
+
+
+class SQLiteChangeLog(ChangeLog):
+    """
+    File-backed change log: one row per change, position = rowid.
+    Producers (tests, replays, the synthetic benchmark) call append().
+    """
+
+    def __init__(self, database: str = ':memory:'):
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS change_log (
+                position INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_table TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                committed_at TEXT NOT NULL,
+                row_data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS IX_change_log_table ON change_log(source_table, position);
+        """)
+        self._db.commit()
+
+    def append(self, table: str, operation: str, row: Dict,
+               committed_at: Optional[datetime] = None) -> int:
+        return self.append_many([(table, operation, row)], committed_at)
+
+    def append_many(self, changes: Sequence, committed_at: Optional[datetime] = None) -> int:
+        """Append (table, operation, row) tuples as one commit; returns the last position."""
+        committed = to_iso(committed_at or datetime.utcnow())
+        with self._lock, self._db:
+            cursor = None
+            for table, operation, row in changes:
+                cursor = self._db.execute(
+                    "INSERT INTO change_log (source_table, operation, committed_at, row_data) "
+                    "VALUES (?, ?, ?, ?)",
+                    (table, operation, committed, json.dumps(row, default=str))
+                )
+            return cursor.lastrowid if cursor else 0
+
+    def read(self, table: str, after: Optional[int], limit: int) -> List[ChangeRecord]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT position, operation, committed_at, row_data FROM change_log "
+                "WHERE source_table = ? AND position > ? ORDER BY position LIMIT ?",
+                (table, after if after is not None else 0, limit)
+            ).fetchall()
+        return [ChangeRecord(table, position, operation, datetime.fromisoformat(committed),
+                             json.loads(data))
+                for position, operation, committed, data in rows]
+
+    def snapshot(self, tables: Sequence[str]) -> Snapshot:
+        """Latest image per primary key (first captured column) up to the last position."""
+        with self._lock:
+            position = self._db.execute("SELECT COALESCE(MAX(position), 0) FROM change_log").fetchone()[0]
+            rows = self._db.execute(
+                "SELECT source_table, operation, row_data FROM change_log WHERE position <= ? ORDER BY position",
+                (position,)
+            ).fetchall()
+        images = {table: {} for table in tables}
+        for table, operation, data in rows:
+            if table not in images:
+                continue
+            row = json.loads(data)
+            key = row[CAPTURED_COLUMNS[table][0]]
+            if operation == 'delete':
+                images[table].pop(key, None)
+            else:
+                images[table][key] = row
+        ordered = [table for table in SNAPSHOT_ORDER if table in images]
+        return Snapshot(position, [(table, row) for table in ordered for row in images[table].values()])
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class AzureSQLChangeLog(ChangeLog):
+    """
+    SQL Server CDC reader. Position = (__$start_lsn << 80) | __$seqval, so
+    several changes committed in one transaction stay individually addressable.
+    """
+
+    def __init__(self, sql_connection_string: str):
+        import pyodbc
+
+        self.sql_conn = pyodbc.connect(sql_connection_string)
+
+    def read(self, table: str, after: Optional[int], limit: int) -> List[ChangeRecord]:
+        capture_instance = f"dbo_{table}"
+        columns = ', '.join(CAPTURED_COLUMNS[table])
+        cursor = self.sql_conn.cursor()
+        if after is None:
+            from_lsn = cursor.execute(
+                "SELECT sys.fn_cdc_get_min_lsn(?)", capture_instance
+            ).fetchone()[0]
+            after_lsn, after_seq = None, b''
+        else:
+            after_lsn = (after >> 80).to_bytes(10, 'big')
+            after_seq = (after & ((1 << 80) - 1)).to_bytes(10, 'big')
+            from_lsn = after_lsn
+
+        # Capture-instance name is interpolated: it comes from CAPTURED_COLUMNS only
+        cursor.execute(f"""
+            DECLARE @from BINARY(10) = ?, @to BINARY(10) = sys.fn_cdc_get_max_lsn();
+            IF @from IS NULL OR @from > @to
+                SELECT TOP (0) NULL AS start_lsn;
+            ELSE
+                SELECT TOP (?)
+                    __$start_lsn AS start_lsn, __$seqval AS seqval, __$operation AS operation,
+                    sys.fn_cdc_map_lsn_to_time(__$start_lsn) AS committed_at, {columns}
+                FROM cdc.fn_cdc_get_all_changes_{capture_instance}(@from, @to, N'all')
+                WHERE ? IS NULL OR __$start_lsn > ? OR (__$start_lsn = ? AND __$seqval > ?)
+                ORDER BY __$start_lsn, __$seqval;
+        """, from_lsn, limit, after_lsn, after_lsn, after_lsn, after_seq)
+
+        if cursor.description is None or len(cursor.description) == 1:
+            return []
+        names = [c[0] for c in cursor.description]
+        records = []
+        for values in cursor.fetchall():
+            row = dict(zip(names, values))
+            position = (int.from_bytes(row.pop('start_lsn'), 'big') << 80) \
+                | int.from_bytes(row.pop('seqval'), 'big')
+            operation = CDC_OPERATIONS.get(row.pop('operation'))
+            committed_at = row.pop('committed_at')
+            if operation is not None:
+                records.append(ChangeRecord(table, position, operation, committed_at, row))
+        return records
+
+    def snapshot(self, tables: Sequence[str], fetch_size: int = 10_000) -> Snapshot:
+        """
+        Tables read in one SNAPSHOT-isolation transaction (on by default in Azure SQL
+        Database) whose first read is sys.fn_cdc_get_max_lsn(): every change captured
+        up to that LSN is in the rows. Changes committed but not yet captured are in
+        the rows too and replayed later, which the image-based handlers absorb.
+        """
+        cursor = self.sql_conn.cursor()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL SNAPSHOT")
+        max_lsn = cursor.execute("SELECT sys.fn_cdc_get_max_lsn()").fetchone()[0]
+        position = (int.from_bytes(max_lsn, 'big') << 80) | ((1 << 80) - 1)
+
+        def rows():
+            try:
+                for table in [t for t in SNAPSHOT_ORDER if t in tables]:
+                    columns = CAPTURED_COLUMNS[table]
+                    # Table name is interpolated: it comes from CAPTURED_COLUMNS only
+                    cursor.execute(f"SELECT {', '.join(columns)} FROM dbo.{table}")
+                    while True:
+                        batch = cursor.fetchmany(fetch_size)
+                        if not batch:
+                            break
+                        for values in batch:
+                            yield table, dict(zip(columns, values))
+            finally:
+                self.sql_conn.commit()
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+
+        return Snapshot(position, rows())
+
+    def close(self) -> None:
+        self.sql_conn.close()
+
+
+# ============================================================================
+# CONSUMER
+# ============================================================================
+
+class ChangeFeedConsumer:
+    """
+    Polls the change log and applies changes to the online feature state.
+
+    Changes of all tables are merged in position order before being applied,
+    so a dispute is never applied before the payment it references. When a
+    table returned a full page, the merged batch stops at that table's last
+    position; the rest is re-read on the next poll.
+    """
+
+    def __init__(self, change_log: ChangeLog, state: OnlineFeatureState,
+                 tables: Optional[List[str]] = None, batch_size: int = 500,
+                 poll_interval: float = 1.0):
+        """
+        Args:
+            change_log: Source of changes
+            state: Online feature state (also stores checkpoints)
+            tables: Source tables to consume (default: Payment, Dispute, Customer, Merchant)
+            batch_size: Maximum changes read per table per poll
+            poll_interval: Seconds to wait when caught up
+        """
+        self.change_log = change_log
+        self.state = state
+        self.tables = tables or DEFAULT_TABLES
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> int:
+        """Read and apply one batch. Returns the number of changes read."""
+        start = time.perf_counter()
+        checkpoints = self.state.get_checkpoints()
+
+        pages = {table: self.change_log.read(table, checkpoints.get(table), self.batch_size)
+                 for table in self.tables}
+        full_pages = [records[-1].position for records in pages.values()
+                      if len(records) >= self.batch_size]
+        limit = min(full_pages) if full_pages else None
+
+        changes = sorted(
+            (record for records in pages.values() for record in records
+             if limit is None or record.position <= limit),
+            key=lambda record: record.position
+        )
+        if not changes:
+            for table in self.tables:
+                CHANGE_FEED_LAG.labels(table=table).set(0)
+            return 0
+
+        meta = None
+        if not checkpoints:
+            # First changes consumed without a bootstrap: windows are complete from here on
+            first = [records[0].committed_at for records in pages.values()
+                     if records and records[0].committed_at is not None]
+            meta = {'complete_since': to_iso(max(first) if first else datetime.utcnow())}
+
+        batch = self.state.begin()
+        new_checkpoints = {}
+        for record in changes:
+            batch.apply(record.table, record.operation, record.row, record.position)
+            new_checkpoints[record.table] = record.position
+        self.state.commit(batch, new_checkpoints, meta)
+        DEFERRED_DISPUTES.set(self.state.deferred_count())
+
+        now = datetime.utcnow()
+        for table in self.tables:
+            applied = [r for r in changes if r.table == table]
+            CHANGES_APPLIED.labels(table=table).inc(len(applied))
+            backlog = len(applied) < len(pages[table]) or len(pages[table]) >= self.batch_size
+            if backlog and applied and applied[-1].committed_at is not None:
+                CHANGE_FEED_LAG.labels(table=table).set(
+                    max(0.0, (now - applied[-1].committed_at.replace(tzinfo=None)).total_seconds())
+                )
+            else:
+                CHANGE_FEED_LAG.labels(table=table).set(0)
+        for reason, count in batch.skipped.items():
+            if count:
+                CHANGES_SKIPPED.labels(reason=reason).inc(count)
+        BATCH_SIZE.observe(len(changes))
+        BATCH_DURATION.observe(time.perf_counter() - start)
+        return len(changes)
+
+    def bootstrap(self, chunk_size: int = 10_000) -> int:
+        """
+        Seed an empty state from a change-log snapshot, then set every table's
+        checkpoint to the snapshot position. Returns the rows applied.
+
+        Rows get increasing positions below the snapshot's, so later changes
+        always apply after them. A state left by an interrupted bootstrap
+        (no checkpoints yet) is emptied first.
+        """
+        if self.state.get_checkpoints():
+            raise ValueError("The state already consumes the change log: bootstrap needs a new state")
+        self.state.reset()
+        snapshot = self.change_log.snapshot(self.tables)
+        started = time.perf_counter()
+
+        applied = 0
+        batch = self.state.begin()
+        for applied, (table, row) in enumerate(snapshot.rows, start=1):
+            batch.apply(table, 'insert', row, applied)
+            if applied % chunk_size == 0:
+                self.state.commit(batch, {})
+                batch = self.state.begin()
+        self.state.commit(batch, {table: snapshot.position for table in self.tables},
+                          {'seeded_position': str(snapshot.position)})
+        DEFERRED_DISPUTES.set(self.state.deferred_count())
+        logger.info(f"Bootstrapped {applied:,} rows at position {snapshot.position} "
+                    f"in {time.perf_counter() - started:.1f}s")
+        return applied
+
+    def run_until_caught_up(self) -> int:
+        """Apply batches until the change log is drained. Returns changes read."""
+        total = 0
+        while True:
+            n = self.run_once()
+            total += n
+            if n == 0:
+                return total
+
+    # ------------------------------------------------------------------
+    # Background loop
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start polling on a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='change-feed-consumer', daemon=True)
+        self._thread.start()
+        logger.info(f"Change-feed consumer started ({', '.join(self.tables)})")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Finish the current batch and stop."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("Change-feed consumer stopped")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                applied = self.run_once()
+            except Exception:
+                # Nothing was committed: the batch is retried from the checkpoint
+                logger.exception("Change-feed batch failed")
+                applied = 0
+            if applied == 0:
+                self._stop.wait(self.poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep online feature state up to date from CDC')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--changelog', help='SQLite change log file')
+    source.add_argument('--sql-connection', help='Azure SQL connection string (CDC)')
+    parser.add_argument('--state', default='online_state.db', help='Online state SQLite file')
+    parser.add_argument('--tables', nargs='+', default=DEFAULT_TABLES, choices=DEFAULT_TABLES)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--metrics-port', type=int, default=None)
+    parser.add_argument('--bootstrap', action='store_true',
+                        help='Seed a new state from a snapshot of the tables before consuming')
+    parser.add_argument('--once', action='store_true', help='Drain the log and exit')
+    args = parser.parse_args()
+
+    change_log = SQLiteChangeLog(args.changelog) if args.changelog \
+        else AzureSQLChangeLog(args.sql_connection)
+    consumer = ChangeFeedConsumer(change_log, OnlineFeatureState(args.state), args.tables,
+                                  args.batch_size, args.poll_interval)
+    if args.bootstrap:
+        consumer.bootstrap()
+
+    if args.once:
+        logger.info(f"Applied {consumer.run_until_caught_up()} changes")
+        return
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    consumer.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        consumer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Customer Activity Projection
+Stripe Data Architecture - ML Module
+
+Purpose: One rolling document per customer (Cosmos DB container
+         customer_activity, partition key /customer_id), maintained from the
+         payment event stream. Every per-customer lookup of FeatureEngineer
+         (velocity, last location, device age, country change) becomes a
+         single-partition point read of this document instead of a
+         cross-partition query on fraud_features (partitioned by /payment_id).
+
+Document shape (bounded size, whatever the customer's history length):
+    {
+        "id": "cus_...", "customer_id": "cus_...",
+        "recent_events": [{"payment_id", "timestamp", "country", "latitude", "longitude"}],
+        "recent_complete_since": "...",     # recent_events is exact from here on
+        "daily_counts": {"2025-10-19": 3},  # last DAILY_WINDOW_DAYS days
+        "last_event": {...},
+        "devices": {"fp_...": "first seen timestamp"},
+        "seen_payment_ids": ["pi_..."],     # idempotency window
+        "updated_at": "...", "ttl": 7776000
+    }
+
+Timestamps are naive UTC ISO 8601 strings (datetime.utcnow().isoformat()),
+so they order lexicographically.
+"""
+
+import bisect
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+# Exact per-event history kept for sub-day velocity windows
+RECENT_WINDOW = timedelta(hours=24)
+MAX_RECENT_EVENTS = 256
+# Per-day counts for the 7d / 30d velocity features
+DAILY_WINDOW_DAYS = 31
+MAX_DEVICES = 64
+MAX_SEEN_PAYMENTS = 512
+# Inactive customers expire with the longest window
+ACTIVITY_TTL_SECONDS = 90 * 24 * 3600
+
+
+def new_activity_document(customer_id: str) -> Dict:
+    return {
+        'id': customer_id,
+        'customer_id': customer_id,
+        'recent_events': [],
+        'recent_complete_since': '',
+        'daily_counts': {},
+        'last_event': None,
+        'devices': {},
+        'seen_payment_ids': [],
+        'updated_at': None,
+        'ttl': ACTIVITY_TTL_SECONDS
+    }
+
+
+def payment_event_from_features(features: Dict) -> Dict:
+    """Projection event for a scored payment (metadata added by compute_features)."""
+    return {
+        'payment_id': features['payment_id'],
+        'customer_id': features['customer_id'],
+        'timestamp': features['computed_at'],
+        'country': features.get('ip_country'),
+        'latitude': features.get('ip_latitude'),
+        'longitude': features.get('ip_longitude'),
+        'device_fingerprint': features.get('device_fingerprint')
+    }
+
+
+def apply_payment_event(doc: Dict, event: Dict) -> bool:
+    """
+    Fold one payment event into the customer's document, in place.
+    Events may arrive out of order; replays are ignored.
+
+    Args:
+        doc: Activity document (see new_activity_document)
+        event: {'payment_id', 'timestamp', 'country', 'latitude', 'longitude',
+                'device_fingerprint'}; location/device fields are optional
+
+    Returns:
+        False if the payment was already applied
+    """
+    payment_id = event['payment_id']
+    if payment_id in doc['seen_payment_ids']:
+        return False
+    doc['seen_payment_ids'].append(payment_id)
+    del doc['seen_payment_ids'][:-MAX_SEEN_PAYMENTS]
+
+    timestamp = event['timestamp']
+    record = {
+        'payment_id': payment_id,
+        'timestamp': timestamp,
+        'country': event.get('country'),
+        'latitude': event.get('latitude'),
+        'longitude': event.get('longitude')
+    }
+
+    # Daily counts
+    day = timestamp[:10]
+    daily = doc['daily_counts']
+    daily[day] = daily.get(day, 0) + 1
+
+    last = doc['last_event']
+    if last is None or timestamp >= last['timestamp']:
+        doc['last_event'] = record
+        last_timestamp = timestamp
+    else:
+        last_timestamp = last['timestamp']
+
+    cutoff_day = (datetime.fromisoformat(last_timestamp) - timedelta(days=DAILY_WINDOW_DAYS)).date().isoformat()
+    for old_day in [d for d in daily if d < cutoff_day]:
+        del daily[old_day]
+
+    # Exact recent events, trimmed to the window ending at the latest event
+    recent = doc['recent_events']
+    window_start = (datetime.fromisoformat(last_timestamp) - RECENT_WINDOW).isoformat()
+    if timestamp >= window_start:
+        timestamps = [e['timestamp'] for e in recent]
+        recent.insert(bisect.bisect_right(timestamps, timestamp), record)
+    while recent and recent[0]['timestamp'] < window_start:
+        recent.pop(0)
+    complete_since = max(window_start, doc['recent_complete_since'] or '')
+    if len(recent) > MAX_RECENT_EVENTS:
+        dropped = recent[:len(recent) - MAX_RECENT_EVENTS]
+        del recent[:len(recent) - MAX_RECENT_EVENTS]
+        # Older history is only available at day granularity
+        complete_since = max(complete_since, dropped[-1]['timestamp'])
+    doc['recent_complete_since'] = complete_since
+
+    # Device first-seen
+    device = event.get('device_fingerprint')
+    if device:
+        devices = doc['devices']
+        if device not in devices or timestamp < devices[device]:
+            devices[device] = timestamp
+        if len(devices) > MAX_DEVICES:
+            # Forget the device not seen for the longest time
+            del devices[min(devices, key=devices.get)]
+
+    doc['updated_at'] = last_timestamp
+    return True
+
+
+# ============================================================================
+# READS
+# ============================================================================
+
+def count_events_since(doc: Optional[Dict], since: datetime) -> int:
+    """
+    Payments since `since`: exact within the recent window, day granularity
+    (whole days from since's date) beyond it.
+    """
+    if not doc:
+        return 0
+    since_iso = since.isoformat()
+    if doc['recent_complete_since'] and since_iso >= doc['recent_complete_since']:
+        timestamps = [e['timestamp'] for e in doc['recent_events']]
+        return len(timestamps) - bisect.bisect_left(timestamps, since_iso)
+    since_day = since_iso[:10]
+    return sum(n for day, n in doc['daily_counts'].items() if day >= since_day)
+
+
+def last_location(doc: Optional[Dict]) -> Optional[Tuple[float, float, datetime]]:
+    """(latitude, longitude, time) of the latest located payment, None if unknown."""
+    if not doc:
+        return None
+    for event in [doc['last_event']] + doc['recent_events'][::-1]:
+        if event and event.get('latitude') is not None and event.get('longitude') is not None:
+            return event['latitude'], event['longitude'], datetime.fromisoformat(event['timestamp'])
+    return None
+
+
+def countries_since(doc: Optional[Dict], since: datetime) -> Set[str]:
+    """IP countries seen on payments since `since` (within the recent window)."""
+    if not doc:
+        return set()
+    since_iso = since.isoformat()
+    return {e['country'] for e in doc['recent_events']
+            if e['timestamp'] >= since_iso and e.get('country')}
+
+
+def device_first_seen(doc: Optional[Dict], device_fingerprint: str) -> Optional[datetime]:
+    if not doc or not device_fingerprint:
+        return None
+    first_seen = doc['devices'].get(device_fingerprint)
+    return datetime.fromisoformat(first_seen) if first_seen else None
@@ -0,0 +1,514 @@
+"""
+Feature Data Sources
+Stripe Data Architecture - ML Module
+
+Purpose: Storage interface behind FeatureEngineer. Every customer,
+         merchant, payment, dispute and customer-activity lookup goes through a
+         FeatureDataSource, so the feature engine can run against Azure
+         (SQL + Cosmos DB) or a local SQLite database built from
+         models/oltp/schema.sql for profiling, offline batch runs and tests.
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'monitoring'))
+from latency_tracing import span
+from customer_activity import apply_payment_event, new_activity_document, payment_event_from_features
+from feature_encoding import encode_document
+from oltp_access import OLTP_SCHEMA_PATH, OLTPAccess
+
+logger = logging.getLogger(__name__)
+
+SQLITE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# ============================================================================
+# INTERFACE
+# ============================================================================
+
+class FeatureDataSource(ABC):
+    """
+    Lookups needed by FeatureEngineer.
+
+    Aggregate methods return dictionaries whose values may be None when the
+    entity has no history; FeatureEngineer applies the defaults.
+    """
+
+    @abstractmethod
+    def get_payment_diversity(self, customer_id: str, days: int = 30) -> Dict:
+        """Distinct payment methods and merchants: {'unique_cards', 'unique_merchants'}."""
+
+    @abstractmethod
+    def get_amount_stats(self, customer_id: str, days: int = 7) -> Dict:
+        """Successful payment amounts: {'avg_amount', 'stddev_amount', 'max_amount'}."""
+
+    @abstractmethod
+    def get_customer_age_days(self, customer_id: str) -> Optional[int]:
+        """Days since the customer was created, None if unknown."""
+
+    @abstractmethod
+    def get_customer_history(self, customer_id: str) -> Dict:
+        """{'total_txn', 'success_count', 'lifetime_value', 'days_since_last'}."""
+
+    @abstractmethod
+    def get_customer_dispute_count(self, customer_id: str) -> int:
+        """Number of disputes/chargebacks on the customer's payments."""
+
+    @abstractmethod
+    def get_merchant_stats(self, merchant_id: str, days: int = 30) -> Optional[Dict]:
+        """{'age_days', 'industry', 'dispute_rate', 'avg_ticket'}, None if unknown."""
+
+    @abstractmethod
+    def get_customer_activity(self, customer_id: str) -> Optional[Dict]:
+        """Customer activity projection document (point read), None if no activity."""
+
+    @abstractmethod
+    def record_payment_event(self, event: Dict) -> None:
+        """Fold a payment event into the customer activity projection (idempotent)."""
+
+    def record_payment_events(self, events: Iterable[Dict]) -> None:
+        for event in events:
+            self.record_payment_event(event)
+
+    @abstractmethod
+    def store_features(self, features: Dict) -> None:
+        """Persist a computed feature document and project it as a payment event."""
+
+    def store_features_batch(self, features_list: List[Dict]) -> None:
+        """
+        Persist several feature documents (write-behind flushes). Must be
+        safe to retry as a whole: documents are upserted by payment_id and
+        payment events are idempotent.
+        """
+        for features in features_list:
+            self.store_features(features)
+
+    def close(self) -> None:
+        """Release connections."""
+
+
+# ============================================================================
+# AZURE (Azure SQL + Cosmos DB)
+# ============================================================================
+
+# Optimistic-concurrency retries for customer_activity read-modify-write
+ACTIVITY_UPDATE_RETRIES = 5
+# In-flight upserts per write-behind flush
+BULK_UPSERT_CONCURRENCY = 16
+
+
+def _cosmos_status(error: Exception) -> Optional[int]:
+    return getattr(error, 'status_code', None)
+
+
+def _days_since(timestamp: Optional[datetime], now: datetime) -> Optional[int]:
+    return (now - timestamp).days if timestamp is not None else None
+
+
+def _history(row, now: datetime) -> Dict:
+    return {
+        'total_txn': row.total_txn,
+        'success_count': row.success_count or 0,
+        'lifetime_value': row.lifetime_value,
+        'days_since_last': _days_since(row.last_created_at, now)
+    }
+
+
+def _merchant_stats(merchant, activity, now: datetime) -> Dict:
+    return {
+        'age_days': _days_since(merchant.created_at, now),
+        'industry': merchant.industry,
+        'dispute_rate': activity.dispute_rate,
+        'avg_ticket': activity.avg_ticket
+    }
+
+
+class AzureDataSource(FeatureDataSource):
+    """
+    Production backend: Azure SQL via pyodbc, the Cosmos DB fraud_features
+    container and the customer_activity projection (partitioned by /customer_id).
+    Feature documents are written in the compact format of feature_encoding.py.
+    """
+
+    def __init__(self, sql_connection_string: str, cosmos_endpoint: str, compact_features: bool = True):
+        """
+        Args:
+            sql_connection_string: Azure SQL connection string
+            cosmos_endpoint: Cosmos DB endpoint URL
+            compact_features: Pack model inputs into fv (False: one JSON property per feature)
+        """
+        # Azure SDKs are only needed by this backend
+        import pyodbc
+        from azure.cosmos import CosmosClient
+        from azure.identity import DefaultAzureCredential
+
+        self.sql_conn = pyodbc.connect(sql_connection_string)
+        self.oltp = OLTPAccess(self.sql_conn, 'tsql')
+        self.cosmos_client = CosmosClient(
+            cosmos_endpoint,
+            credential=DefaultAzureCredential()
+        )
+        self.cosmos_db = self.cosmos_client.get_database_client("stripe_nosql_db")
+        self.features_container = self.cosmos_db.get_container_client("fraud_features")
+        self.activity_container = self.cosmos_db.get_container_client("customer_activity")
+        self.compact_features = compact_features
+        self._bulk_executor: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def from_clients(cls, sql_conn, features_container, activity_container,
+                     compact_features: bool = True) -> 'AzureDataSource':
+        """Build from already-open clients (or compatible stand-ins)."""
+        source = cls.__new__(cls)
+        source.sql_conn = sql_conn
+        source.oltp = OLTPAccess(sql_conn, 'tsql')
+        source.cosmos_client = None
+        source.cosmos_db = None
+        source.features_container = features_container
+        source.activity_container = activity_container
+        source.compact_features = compact_features
+        source._bulk_executor = None
+        return source
+
+    def _since(self, days: int) -> datetime:
+        return datetime.utcnow() - timedelta(days=days)
+
+    def get_payment_diversity(self, customer_id: str, days: int = 30) -> Dict:
+        with span('sql.unique_cards_merchants'):
+            row = self.oltp.payment_diversity([customer_id], self._since(days))[customer_id]
+        return row._asdict()
+
+    def get_amount_stats(self, customer_id: str, days: int = 7) -> Dict:
+        with span('sql.amount_stats_7d'):
+            row = self.oltp.amount_stats([customer_id], self._since(days))[customer_id]
+        return row._asdict()
+
+    def get_customer_age_days(self, customer_id: str) -> Optional[int]:
+        with span('sql.customer_age'):
+            row = self.oltp.customers([customer_id]).get(customer_id)
+        return _days_since(row.created_at, datetime.utcnow()) if row else None
+
+    def get_customer_history(self, customer_id: str) -> Dict:
+        with span('sql.customer_history'):
+            row = self.oltp.customer_history([customer_id])[customer_id]
+        return _history(row, datetime.utcnow())
+
+    def get_customer_dispute_count(self, customer_id: str) -> int:
+        with span('sql.customer_disputes'):
+            return self.oltp.customer_disputes([customer_id])[customer_id].dispute_count
+
+    def get_merchant_stats(self, merchant_id: str, days: int = 30) -> Optional[Dict]:
+        with span('sql.merchant_stats'):
+            merchant = self.oltp.merchants([merchant_id]).get(merchant_id)
+            if merchant is None:
+                return None
+            activity = self.oltp.merchant_activity([merchant_id], self._since(days))[merchant_id]
+        return _merchant_stats(merchant, activity, datetime.utcnow())
+
+    def get_customer_activity(self, customer_id: str) -> Optional[Dict]:
+        try:
+            return self.activity_container.read_item(item=customer_id, partition_key=customer_id)
+        except Exception as e:
+            if _cosmos_status(e) == 404:
+                return None
+            raise
+
+    def record_payment_event(self, event: Dict) -> None:
+        self._update_activity(event['customer_id'], [event])
+
+    def record_payment_events(self, events: Iterable[Dict]) -> None:
+        """One read-modify-write per customer instead of per event."""
+        by_customer: Dict[str, List[Dict]] = {}
+        for event in events:
+            by_customer.setdefault(event['customer_id'], []).append(event)
+        for customer_id, customer_events in by_customer.items():
+            self._update_activity(customer_id, customer_events)
+
+    def _update_activity(self, customer_id: str, events: List[Dict]) -> None:
+        """Read-modify-write guarded by the document ETag, retried on conflicts."""
+        try:
+            from azure.core import MatchConditions
+            if_not_modified = MatchConditions.IfNotModified
+        except ImportError:
+            if_not_modified = None
+
+        with span('cosmos.customer_activity_update'):
+            for attempt in range(ACTIVITY_UPDATE_RETRIES):
+                doc = self.get_customer_activity(customer_id)
+                etag = doc.get('_etag') if doc else None
+                doc = doc or new_activity_document(customer_id)
+                changed = False
+                for event in events:
+                    changed = apply_payment_event(doc, event) or changed
+                if not changed:
+                    return
+                try:
+                    if etag:
+                        self.activity_container.replace_item(
+                            item=customer_id, body=doc, etag=etag, match_condition=if_not_modified
+                        )
+                    else:
+                        self.activity_container.create_item(body=doc)
+                    return
+                except Exception as e:
+                    # 412: modified since read, 409: created concurrently
+                    if _cosmos_status(e) not in (409, 412):
+                        raise
+            logger.warning(f"customer_activity update for {customer_id} gave up after "
+                           f"{ACTIVITY_UPDATE_RETRIES} conflicts")
+
+    def _feature_document(self, features: Dict) -> Dict:
+        if not self.compact_features:
+            return features
+        try:
+            return encode_document(features)
+        except ValueError as e:
+            # Still readable by decode_matrix, as a legacy JSON document
+            logger.warning(f"Storing features of {features['payment_id']} as JSON: {e}")
+            return dict(features, id=features['payment_id'])
+
+    def store_features(self, features: Dict) -> None:
+        with span('cosmos.store_features'):
+            self.features_container.upsert_item(self._feature_document(features))
+        self.record_payment_event(payment_event_from_features(features))
+
+    def store_features_batch(self, features_list: List[Dict]) -> None:
+        """
+        Concurrent upserts (one logical partition per payment_id, so Cosmos
+        transactional batches do not apply), then one activity update per
+        customer. Raises the first upsert error after all upserts completed.
+        """
+        if self._bulk_executor is None:
+            self._bulk_executor = ThreadPoolExecutor(
+                max_workers=BULK_UPSERT_CONCURRENCY, thread_name_prefix='cosmos-bulk'
+            )
+        with span('cosmos.store_features_batch'):
+            futures = [self._bulk_executor.submit(self.features_container.upsert_item,
+                                                  self._feature_document(features))
+                       for features in features_list]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+        self.record_payment_events(payment_event_from_features(f) for f in features_list)
+
+    def close(self) -> None:
+        if self._bulk_executor is not None:
+            self._bulk_executor.shutdown(wait=True)
+        self.sql_conn.close()
+
+
+# ============================================================================
+# LOCAL (SQLite from the OLTP schema)
+# ============================================================================
+
+# T-SQL -> SQLite rewrites for the DDL in models/oltp/schema.sql
+_DDL_REWRITES = [
+    # Keep explicit BIGINT keys (not rowid aliases) so external IDs such as
+    # "cus_456" can be loaded as-is
+    (re.compile(r"BIGINT\s+IDENTITY\(\d+,\s*\d+\)\s+PRIMARY KEY", re.I), "BIGINT PRIMARY KEY"),
+    (re.compile(r"IDENTITY\(\d+,\s*\d+\)", re.I), ""),
+    (re.compile(r"NVARCHAR\((\d+|MAX)\)", re.I), "TEXT"),
+    (re.compile(r"\bDATETIME2\b", re.I), "TEXT"),
+    (re.compile(r"\bBIT\b", re.I), "INTEGER"),
+    (re.compile(r"\bGETUTCDATE\(\)", re.I), "CURRENT_TIMESTAMP"),
+    (re.compile(r"\bLEN\(", re.I), "length("),
+    # No INCLUDE in SQLite: included columns become trailing key columns (still covering)
+    (re.compile(r"\(([^()]*)\)\s*INCLUDE\s*\(([^()]*)\)", re.I), r"(\1, \2)"),
+]
+
+
+def translate_oltp_ddl(schema_sql: str) -> List[str]:
+    """
+    Extract CREATE TABLE / CREATE INDEX statements from the T-SQL schema and
+    rewrite them for SQLite. Filtered indexes (WHERE is_deleted = 0) are kept
+    as SQLite partial indexes. Triggers, views, procedures and sample INSERTs
+    are skipped.
+    """
+    # Drop comments, then split on statement terminators / GO batches
+    body = re.sub(r"--[^\n]*", "", schema_sql)
+    statements = re.split(r";|\n\s*GO\s*\n", body)
+    result = []
+    for statement in statements:
+        statement = statement.strip()
+        if not re.match(r"CREATE\s+(TABLE|INDEX)\b", statement, re.I):
+            continue
+        for pattern, replacement in _DDL_REWRITES:
+            statement = pattern.sub(replacement, statement)
+        result.append(statement)
+    return result
+
+
+class StdevAggregate:
+    """Sample standard deviation aggregate (T-SQL STDEV)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    def finalize(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+
+class SQLiteDataSource(FeatureDataSource):
+    """
+    Local backend over SQLite (in-memory by default) with the real OLTP
+    tables: customers, merchants, payment_methods, transactions, chargebacks.
+    The customer activity projection is a local table of JSON documents keyed
+    by customer_id, so its reads are primary-key lookups as in Cosmos DB.
+    """
+
+    def __init__(self, database: str = ':memory:', schema_path: str = OLTP_SCHEMA_PATH,
+                 now: Optional[datetime] = None):
+        """
+        Args:
+            database: SQLite path, ':memory:' for a private in-memory database
+            schema_path: T-SQL schema to translate and load
+            now: Fixed reference time for deterministic runs (default: wall clock)
+        """
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._db.create_aggregate('STDEV', 1, StdevAggregate)
+        self._lock = threading.Lock()
+        self._fixed_now = now
+        self.stored_features: Dict[str, Dict] = {}
+
+        with open(schema_path, 'r', encoding='utf-8') as f:
+            ddl = translate_oltp_ddl(f.read())
+        for statement in ddl:
+            # Idempotent so an existing database file can be reopened
+            self._db.execute(re.sub(
+                r"^CREATE\s+(TABLE|INDEX)\s+", r"CREATE \1 IF NOT EXISTS ", statement, flags=re.I
+            ))
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS customer_activity (
+                customer_id TEXT PRIMARY KEY,
+                document TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+        self.oltp = OLTPAccess(self._db, 'sqlite', schema_path)
+
+    # ------------------------------------------------------------------
+    # Loading
+    # ------------------------------------------------------------------
+
+    def _now(self) -> datetime:
+        return self._fixed_now or datetime.utcnow()
+
+    def _since(self, days: int) -> str:
+        return (self._now() - timedelta(days=days)).strftime(SQLITE_TIME_FORMAT)
+
+    def load_rows(self, table: str, rows: List[Dict]) -> None:
+        """Bulk insert rows (dicts keyed by OLTP column name)."""
+        if not rows:
+            return
+        columns = list(rows[0].keys())
+        placeholders = ', '.join('?' for _ in columns)
+        with self._lock:
+            self._db.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                [tuple(row[c] for c in columns) for row in rows]
+            )
+            self._db.commit()
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+
+    def get_payment_diversity(self, customer_id: str, days: int = 30) -> Dict:
+        with span('sql.unique_cards_merchants'), self._lock:
+            row = self.oltp.payment_diversity([customer_id], self._since(days))[customer_id]
+        return row._asdict()
+
+    def get_amount_stats(self, customer_id: str, days: int = 7) -> Dict:
+        with span('sql.amount_stats_7d'), self._lock:
+            row = self.oltp.amount_stats([customer_id], self._since(days))[customer_id]
+        return row._asdict()
+
+    def get_customer_age_days(self, customer_id: str) -> Optional[int]:
+        with span('sql.customer_age'), self._lock:
+            row = self.oltp.customers([customer_id]).get(customer_id)
+        return _days_since(row.created_at, self._now()) if row else None
+
+    def get_customer_history(self, customer_id: str) -> Dict:
+        with span('sql.customer_history'), self._lock:
+            row = self.oltp.customer_history([customer_id])[customer_id]
+        return _history(row, self._now())
+
+    def get_customer_dispute_count(self, customer_id: str) -> int:
+        with span('sql.customer_disputes'), self._lock:
+            return self.oltp.customer_disputes([customer_id])[customer_id].dispute_count
+
+    def get_merchant_stats(self, merchant_id: str, days: int = 30) -> Optional[Dict]:
+        with span('sql.merchant_stats'), self._lock:
+            merchant = self.oltp.merchants([merchant_id]).get(merchant_id)
+            if merchant is None:
+                return None
+            activity = self.oltp.merchant_activity([merchant_id], self._since(days))[merchant_id]
+        return _merchant_stats(merchant, activity, self._now())
+
+    def _read_activity(self, customer_id: str) -> Optional[Dict]:
+        row = self._db.execute(
+            "SELECT document FROM customer_activity WHERE customer_id = ?", (customer_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_customer_activity(self, customer_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._read_activity(customer_id)
+
+    def record_payment_event(self, event: Dict) -> None:
+        self.record_payment_events([event])
+
+    def record_payment_events(self, events: Iterable[Dict]) -> None:
+        """Apply events with one read and one write per customer."""
+        by_customer: Dict[str, List[Dict]] = {}
+        for event in events:
+            by_customer.setdefault(event['customer_id'], []).append(event)
+        with self._lock:
+            updates = []
+            for customer_id, customer_events in by_customer.items():
+                doc = self._read_activity(customer_id) or new_activity_document(customer_id)
+                changed = False
+                for event in customer_events:
+                    changed = apply_payment_event(doc, event) or changed
+                if changed:
+                    updates.append((customer_id, json.dumps(doc)))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO customer_activity (customer_id, document) VALUES (?, ?)",
+                updates
+            )
+            self._db.commit()
+
+    def store_features(self, features: Dict) -> None:
+        self.store_features_batch([features])
+
+    def store_features_batch(self, features_list: List[Dict]) -> None:
+        with self._lock:
+            for features in features_list:
+                self.stored_features[features['payment_id']] = dict(features)
+        self.record_payment_events(
+            payment_event_from_features(f) for f in features_list
+            if f.get('customer_id') and f.get('computed_at')
+        )
+
+    def close(self) -> None:
+        self._db.close()
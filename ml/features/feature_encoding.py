@@ -0,0 +1,272 @@
+"""
+Compact Feature-Vector Encoding
+Stripe Data Architecture - ML Module
+
+Purpose: Storage format of the fraud_features documents. The 45 model
+         inputs are no longer written as one JSON property each (full name,
+         float as text, every path indexed) but as one packed, versioned
+         vector:
+             - schema: fixed layout identified by fv_schema; float32 for
+               unbounded values, float16 for rates in [0, 1], int8 for flags
+               and small enumerations
+             - document: fv_schema + fv (base64 of the packed vector, excluded
+               from indexing) next to the plain queryable fields (payment_id,
+               customer_id, merchant_id, computed_at, fraud_score, ...)
+             - bulk decode: documents of any schema version (and legacy JSON
+               documents) into one float32 matrix in FEATURE_NAMES order, for
+               the training loader
+
+A published schema is never modified: changing the layout means adding a new
+schema id, and decode keeps reading every id still in SCHEMAS.
+
+Usage:
+    doc = encode_document(features)          # written to Cosmos DB
+    X = decode_matrix(documents)             # rows x FEATURE_NAMES, NaN = missing
+"""
+
+import base64
+import logging
+import math
+import struct
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from feature_registry import FEATURE_NAMES
+
+logger = logging.getLogger(__name__)
+
+
+# int8 value of a missing flag / enumeration (NaN for float columns)
+INT8_MISSING = -128
+# Properties holding the packed vector
+SCHEMA_FIELD = 'fv_schema'
+VECTOR_FIELD = 'fv'
+
+
+class FeatureVectorSchema:
+    """Fixed packed layout: float32 columns, then float16, then int8 (little-endian)."""
+
+    def __init__(self, schema_id: int, float32: Sequence[str], float16: Sequence[str], int8: Sequence[str]):
+        """
+        Args:
+            schema_id: Version written in fv_schema
+            float32: Unbounded values (counts, amounts, ages, distances)
+            float16: Rates in [0, 1] (absolute error <= 2.5e-4)
+            int8: Integer flags and enumerations in [-127, 127]
+        """
+        self.schema_id = schema_id
+        self.float32 = tuple(float32)
+        self.float16 = tuple(float16)
+        self.int8 = tuple(int8)
+        self.names = self.float32 + self.float16 + self.int8
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f"Schema {schema_id} lists a feature twice")
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self._struct = struct.Struct(f"<{len(self.float32)}f{len(self.float16)}e{len(self.int8)}b")
+        self.dtype = np.dtype([(name, '<f4') for name in self.float32] +
+                              [(name, '<f2') for name in self.float16] +
+                              [(name, 'i1') for name in self.int8])
+        self.size = self._struct.size
+
+    def pack(self, features: Dict) -> bytes:
+        """
+        Packed vector of one feature dict (absent or None values are missing).
+
+        Raises:
+            ValueError: a float16 value outside [0, 1] or an int8 value that is
+                        not an integer in [-127, 127]
+        """
+        values = []
+        for name in self.float32:
+            value = features.get(name)
+            values.append(math.nan if value is None else float(value))
+        for name in self.float16:
+            value = features.get(name)
+            if value is None or value != value:
+                values.append(math.nan)
+            elif 0.0 <= value <= 1.0:
+                values.append(float(value))
+            else:
+                raise ValueError(f"{name}={value!r} outside the float16 range [0, 1] of schema {self.schema_id}")
+        for name in self.int8:
+            value = features.get(name)
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                values.append(INT8_MISSING)
+            elif value == int(value) and -127 <= value <= 127:
+                values.append(int(value))
+            else:
+                raise ValueError(f"{name}={value!r} is not an int8 value of schema {self.schema_id}")
+        return self._struct.pack(*values)
+
+    def pack_many(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Packed vectors of many rows at once (bulk writers, synthetic data).
+
+        Args:
+            columns: One array per feature, NaN = missing (absent columns are
+                     missing for every row)
+
+        Returns:
+            rows x size uint8 matrix, row i equal to pack() of row i
+
+        Raises:
+            ValueError: same value rules as pack
+        """
+        n = len(next(iter(columns.values())))
+        records = np.empty(n, dtype=self.dtype)
+
+        def column(name: str) -> np.ndarray:
+            return np.asarray(columns[name], dtype=np.float64) if name in columns else np.full(n, np.nan)
+
+        for name in self.float32:
+            records[name] = column(name)
+        for name in self.float16:
+            values = column(name)
+            if ((values < 0.0) | (values > 1.0)).any():
+                raise ValueError(f"{name} has values outside the float16 range [0, 1] of schema {self.schema_id}")
+            records[name] = values
+        for name in self.int8:
+            values = column(name)
+            missing = np.isnan(values)
+            if (~missing & ((values != np.round(values)) | (np.abs(values) > 127))).any():
+                raise ValueError(f"{name} has values that are not int8 values of schema {self.schema_id}")
+            records[name] = np.where(missing, INT8_MISSING, values)
+        return records.view(np.uint8).reshape(n, self.size)
+
+    def unpack(self, data: bytes) -> Dict:
+        """Feature dict of one packed vector (ints for int8 columns, None when missing)."""
+        values = self._struct.unpack(data)
+        n_float = len(self.float32) + len(self.float16)
+        features = {name: (None if math.isnan(value) else value)
+                    for name, value in zip(self.names[:n_float], values[:n_float])}
+        features.update((name, None if value == INT8_MISSING else value)
+                        for name, value in zip(self.int8, values[n_float:]))
+        return features
+
+    def unpack_many(self, data: bytes) -> np.ndarray:
+        """Concatenated packed vectors -> rows x names float32 matrix (NaN = missing)."""
+        records = np.frombuffer(data, dtype=self.dtype)
+        matrix = np.empty((len(records), len(self.names)), dtype=np.float32)
+        for i, name in enumerate(self.names):
+            matrix[:, i] = records[name]
+        ints = matrix[:, len(self.float32) + len(self.float16):]
+        ints[ints == INT8_MISSING] = np.nan
+        return matrix
+
+
+# ============================================================================
+# SCHEMAS
+# ============================================================================
+
+SCHEMAS: Dict[int, FeatureVectorSchema] = {s.schema_id: s for s in [
+    FeatureVectorSchema(
+        1,
+        float32=(
+            'transaction_count_1h', 'transaction_count_24h', 'transaction_count_7d', 'transaction_count_30d',
+            'unique_cards_30d', 'unique_merchants_30d',
+            'avg_amount_7d', 'stddev_amount_7d', 'max_amount_30d', 'amount_ratio_to_avg', 'amount_zscore',
+            'distance_km', 'velocity_km_per_hour',
+            'device_fingerprint_age_days', 'email_domain_age_days',
+            'customer_age_days', 'customer_dispute_history', 'days_since_last_transaction',
+            'customer_lifetime_value', 'avg_transaction_per_month',
+            'merchant_age_days', 'merchant_avg_ticket',
+        ),
+        float16=(
+            'amount_percentile', 'customer_success_rate', 'chargeback_rate_30d',
+            'merchant_dispute_rate_30d', 'merchant_chargeback_rate',
+        ),
+        int8=(
+            'round_amount', 'high_value_flag',
+            'card_country_mismatch', 'ip_country_mismatch', 'high_risk_country', 'country_change_24h',
+            'timezone_anomaly',
+            'device_fingerprint_new', 'email_domain_free', 'email_domain_disposable', 'browser_version_outdated',
+            'first_transaction_customer',
+            'merchant_industry_risk',
+            'time_of_day', 'day_of_week', 'is_weekend', 'is_holiday', 'shipping_address_mismatch',
+        ),
+    ),
+]}
+CURRENT_SCHEMA_ID = max(SCHEMAS)
+
+
+# ============================================================================
+# DOCUMENTS
+# ============================================================================
+
+def encode_document(features: Dict, schema_id: int = CURRENT_SCHEMA_ID) -> Dict:
+    """
+    fraud_features document with the schema's features packed.
+
+    Fields outside the schema (metadata, scores, features added after it)
+    are kept as plain JSON properties.
+
+    Raises:
+        ValueError: a value cannot be represented by the schema (see pack)
+    """
+    schema = SCHEMAS[schema_id]
+    document = {key: value for key, value in features.items() if key not in schema.index}
+    document.setdefault('id', features['payment_id'])
+    document[SCHEMA_FIELD] = schema.schema_id
+    document[VECTOR_FIELD] = base64.b64encode(schema.pack(features)).decode('ascii')
+    return document
+
+
+def decode_document(document: Dict) -> Dict:
+    """Flat feature dict of a stored document (compact or legacy JSON)."""
+    if VECTOR_FIELD not in document:
+        return dict(document)
+    features = {key: value for key, value in document.items() if key not in (SCHEMA_FIELD, VECTOR_FIELD)}
+    features.update(_schema(document).unpack(base64.b64decode(document[VECTOR_FIELD])))
+    return features
+
+
+def _schema(document: Dict) -> FeatureVectorSchema:
+    schema_id = document[SCHEMA_FIELD]
+    if schema_id not in SCHEMAS:
+        raise ValueError(f"Unknown feature-vector schema {schema_id} (payment {document.get('payment_id')})")
+    return SCHEMAS[schema_id]
+
+
+def decode_matrix(documents: Iterable[Dict], feature_names: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Bulk decode for training.
+
+    Args:
+        documents: fraud_features documents, any mix of schema versions and
+                   legacy JSON documents
+        feature_names: Columns of the result (default: FEATURE_NAMES)
+
+    Returns:
+        len(documents) x len(feature_names) float32 matrix, NaN where a
+        feature is missing (absent from the document's schema and fields)
+
+    Raises:
+        ValueError: a document references an unknown schema
+    """
+    documents = documents if isinstance(documents, list) else list(documents)
+    feature_names = FEATURE_NAMES if feature_names is None else feature_names
+    matrix = np.full((len(documents), len(feature_names)), np.nan, dtype=np.float32)
+
+    # Rows per schema id (None: legacy JSON)
+    groups: Dict[Optional[int], List[int]] = {}
+    for row, document in enumerate(documents):
+        groups.setdefault(document.get(SCHEMA_FIELD) if VECTOR_FIELD in document else None, []).append(row)
+
+    for schema_id, rows in groups.items():
+        plain = feature_names
+        if schema_id is not None:
+            schema = _schema(documents[rows[0]])
+            packed = schema.unpack_many(b''.join(base64.b64decode(documents[row][VECTOR_FIELD]) for row in rows))
+            columns = [(i, schema.index[name]) for i, name in enumerate(feature_names) if name in schema.index]
+            target, source = zip(*columns) if columns else ((), ())
+            matrix[np.ix_(rows, target)] = packed[:, source]
+            plain = [name for name in feature_names if name not in schema.index]
+        # Features stored as JSON properties
+        for name in plain:
+            i = feature_names.index(name)
+            for row in rows:
+                value = documents[row].get(name)
+                if value is not None:
+                    matrix[row, i] = value
+    return matrix
@@ -0,0 +1,376 @@
+"""
+Feature Registry
+Stripe Data Architecture - ML Module
+
+Purpose: Single declarative definition of the 45 fraud features, shared by
+         the online engine (FeatureEngineer.compute_features), the batch
+         path (compute_features_batch) and the scoring API (FEATURE_NAMES):
+             - each feature declares its data sources, the features it is
+               derived from and its computation
+             - each source declares its kind and round trips (its cost)
+             - plan_features(required) resolves the dependency closure of the
+               features a model needs; sources outside the plan are never
+               queried, sources inside it are loaded lazily, once per
+               transaction
+
+Usage:
+    engineer = FeatureEngineer.for_model(model, data_source=source)
+    # i.e. required_features=model_features(model) | RULE_FEATURES
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from math import atan2, cos, isnan, radians, sin, sqrt
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'monitoring'))
+from latency_tracing import span
+from customer_activity import count_events_since, countries_since, device_first_seen, last_location
+
+
+# ============================================================================
+# SOURCES
+# ============================================================================
+
+class SourceSpec(NamedTuple):
+    """Data read once per transaction by the features that need it."""
+    name: str
+    kind: str              # 'sql' | 'cosmos' | 'external' | 'local'
+    round_trips: int       # remote calls per transaction (0 for local lookups)
+    load: Callable         # (engineer, transaction) -> value
+
+
+def _load_activity(engineer, txn: Dict):
+    # Customer activity projection: one single-partition point read
+    with span('cosmos.customer_activity'):
+        return engineer.data_source.get_customer_activity(txn['customer_id'])
+
+
+def _load_ip_country(engineer, txn: Dict) -> str:
+    return txn.get('ip_country') or engineer._get_country_from_ip(txn['ip_address'])
+
+
+def _load_ip_coordinates(engineer, txn: Dict) -> Tuple[float, float]:
+    latitude = txn.get('ip_latitude')
+    # Resolved upstream (batch GeoIP pass); NaN when the IP was not found
+    if latitude is not None and not (isinstance(latitude, float) and isnan(latitude)):
+        return txn['ip_latitude'], txn['ip_longitude']
+    return engineer._get_lat_lon_from_ip(txn['ip_address'])
+
+
+SOURCES: Dict[str, SourceSpec] = {s.name: s for s in [
+    SourceSpec('activity', 'cosmos', 1, _load_activity),
+    SourceSpec('payment_diversity', 'sql', 1,
+               lambda e, t: e.data_source.get_payment_diversity(t['customer_id'], days=30)),
+    SourceSpec('amount_stats', 'sql', 1,
+               lambda e, t: e.data_source.get_amount_stats(t['customer_id'], days=7)),
+    SourceSpec('amount_percentile', 'sql', 1,
+               lambda e, t: e._calculate_percentile(t['customer_id'], t['amount'])),
+    SourceSpec('ip_country', 'local', 0, _load_ip_country),
+    SourceSpec('ip_coordinates', 'local', 0, _load_ip_coordinates),
+    SourceSpec('timezone_profile', 'sql', 1,
+               lambda e, t: e._check_timezone_anomaly(t['customer_id'], datetime.utcnow())),
+    SourceSpec('email_domain_age', 'external', 1,
+               lambda e, t: e._get_email_domain_age(_email_domain(t))),
+    SourceSpec('customer', 'sql', 1, lambda e, t: e.data_source.get_customer_age_days(t['customer_id'])),
+    SourceSpec('customer_history', 'sql', 1, lambda e, t: e.data_source.get_customer_history(t['customer_id'])),
+    SourceSpec('customer_disputes', 'sql', 1,
+               lambda e, t: e.data_source.get_customer_dispute_count(t['customer_id'])),
+    SourceSpec('customer_chargebacks', 'sql', 1, lambda e, t: e._get_chargeback_rate(t['customer_id'])),
+    # merchants + merchant_activity lookups
+    SourceSpec('merchant_stats', 'sql', 2,
+               lambda e, t: e.data_source.get_merchant_stats(t['merchant_id'], days=30)),
+    SourceSpec('merchant_chargebacks', 'sql', 1,
+               lambda e, t: e._get_merchant_chargeback_rate(t['merchant_id'])),
+]}
+
+
+# ============================================================================
+# FEATURES
+# ============================================================================
+
+HIGH_RISK_COUNTRIES = ['XX', 'YY', 'ZZ']  # Placeholder
+FREE_EMAIL_DOMAINS = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com']
+DISPOSABLE_EMAIL_DOMAINS = ['tempmail.com', '10minutemail.com', 'guerrillamail.com']
+HIGH_RISK_INDUSTRIES = ['gambling', 'cryptocurrency', 'adult_content']
+MEDIUM_RISK_INDUSTRIES = ['travel', 'electronics', 'jewelry']
+HOLIDAYS = [
+    datetime(2025, 12, 25),  # Christmas
+    datetime(2025, 1, 1),    # New Year
+    datetime(2025, 7, 4),    # Independence Day
+]
+
+
+class FeatureSpec(NamedTuple):
+    name: str
+    category: str
+    sources: Tuple[str, ...]
+    requires: Tuple[str, ...]    # features it is derived from
+    compute: Callable            # (FeatureContext) -> value
+    model_input: bool = True     # False: metadata kept with the feature document
+
+
+class FeatureContext:
+    """Per-transaction evaluation state: sources loaded on first use, computed values."""
+
+    def __init__(self, engineer, transaction: Dict, sources: Set[str]):
+        self.engineer = engineer
+        self.txn = transaction
+        self.now = datetime.utcnow()
+        self.values: Dict[str, object] = {}
+        self._allowed = sources
+        self._loaded: Dict[str, object] = {}
+
+    def source(self, name: str):
+        if name not in self._loaded:
+            if name not in self._allowed:
+                raise KeyError(f"Source {name} is not declared by the planned features")
+            self._loaded[name] = SOURCES[name].load(self.engineer, self.txn)
+        return self._loaded[name]
+
+    def __getitem__(self, feature: str):
+        return self.values[feature]
+
+    def loaded_sources(self) -> List[str]:
+        return list(self._loaded)
+
+
+def _email_domain(txn: Dict) -> str:
+    email = txn.get('email', '')
+    return email.split('@')[1] if '@' in email else ''
+
+
+def _haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance in km between two points (Haversine formula)."""
+    R = 6371  # Earth radius in km
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return R * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+def _distance_km(c: FeatureContext) -> float:
+    previous = last_location(c.source('activity'))
+    if previous is None:
+        return 0.0
+    current_lat, current_lon = c.source('ip_coordinates')
+    return _haversine_distance(previous[0], previous[1], current_lat, current_lon)
+
+
+def _velocity(c: FeatureContext) -> float:
+    previous = last_location(c.source('activity'))
+    if previous is None:
+        return 0.0
+    time_diff_hours = (c.now - previous[2]).total_seconds() / 3600
+    return c['distance_km'] / time_diff_hours if time_diff_hours > 0 else 0
+
+
+def _device_age(c: FeatureContext) -> int:
+    first_seen = device_first_seen(c.source('activity'), c.txn.get('device_fingerprint', ''))
+    return (c.now - first_seen).days if first_seen else 0
+
+
+def _industry_risk(c: FeatureContext) -> int:
+    stats = c.source('merchant_stats')
+    industry = (stats['industry'] or 'unknown').lower() if stats else 'unknown'
+    if industry in HIGH_RISK_INDUSTRIES:
+        return 2
+    if industry in MEDIUM_RISK_INDUSTRIES:
+        return 1
+    return 0
+
+
+def _merchant_stat(key: str) -> Callable:
+    def compute(c: FeatureContext):
+        stats = c.source('merchant_stats')
+        return stats[key] if stats and stats[key] else 0
+    return compute
+
+
+def _count_since(delta: timedelta) -> Callable:
+    return lambda c: count_events_since(c.source('activity'), c.now - delta)
+
+
+def _total_txn(c: FeatureContext) -> int:
+    return c.source('customer_history')['total_txn'] or 0
+
+
+F = FeatureSpec
+REGISTRY: Dict[str, FeatureSpec] = {f.name: f for f in [
+    # Category 1: Transaction Velocity (6 features)
+    F('transaction_count_1h', 'velocity', ('activity',), (), _count_since(timedelta(hours=1))),
+    F('transaction_count_24h', 'velocity', ('activity',), (), _count_since(timedelta(hours=24))),
+    F('transaction_count_7d', 'velocity', ('activity',), (), _count_since(timedelta(days=7))),
+    F('transaction_count_30d', 'velocity', ('activity',), (), _count_since(timedelta(days=30))),
+    F('unique_cards_30d', 'velocity', ('payment_diversity',), (),
+      lambda c: c.source('payment_diversity')['unique_cards'] or 0),
+    F('unique_merchants_30d', 'velocity', ('payment_diversity',), (),
+      lambda c: c.source('payment_diversity')['unique_merchants'] or 0),
+
+    # Category 2: Amount Analysis (8 features)
+    F('avg_amount_7d', 'amount', ('amount_stats',), (),
+      lambda c: c.source('amount_stats')['avg_amount'] or c.txn['amount']),
+    F('stddev_amount_7d', 'amount', ('amount_stats',), (),
+      lambda c: c.source('amount_stats')['stddev_amount'] or 0),
+    F('max_amount_30d', 'amount', ('amount_stats',), (),
+      lambda c: c.source('amount_stats')['max_amount'] or c.txn['amount']),
+    F('amount_ratio_to_avg', 'amount', (), ('avg_amount_7d',),
+      lambda c: c.txn['amount'] / c['avg_amount_7d'] if c['avg_amount_7d'] > 0 else 1.0),
+    F('amount_zscore', 'amount', (), ('avg_amount_7d', 'stddev_amount_7d'),
+      lambda c: (c.txn['amount'] - c['avg_amount_7d']) / c['stddev_amount_7d']
+      if c['stddev_amount_7d'] > 0 else 0),
+    F('round_amount', 'amount', (), (), lambda c: 1 if c.txn['amount'] % 100 == 0 else 0),
+    F('high_value_flag', 'amount', (), (), lambda c: 1 if c.txn['amount'] > 1000000 else 0),  # > $10,000
+    F('amount_percentile', 'amount', ('amount_percentile',), (), lambda c: c.source('amount_percentile')),
+
+    # Category 3: Geography (7 features)
+    F('card_country_mismatch', 'geo', ('ip_country',), (),
+      lambda c: 1 if c.txn.get('card_country', 'US') != c.source('ip_country') else 0),
+    F('ip_country_mismatch', 'geo', ('ip_country',), (),
+      lambda c: 1 if c.source('ip_country') != c.txn.get('billing_country', 'US') else 0),
+    F('distance_km', 'geo', ('activity', 'ip_coordinates'), (), _distance_km),
+    F('velocity_km_per_hour', 'geo', ('activity',), ('distance_km',), _velocity),
+    F('high_risk_country', 'geo', ('ip_country',), (),
+      lambda c: 1 if c.source('ip_country') in HIGH_RISK_COUNTRIES else 0),
+    F('country_change_24h', 'geo', ('activity', 'ip_country'), (),
+      lambda c: 1 if countries_since(c.source('activity'), c.now - timedelta(hours=24))
+      - {c.source('ip_country')} else 0),
+    F('timezone_anomaly', 'geo', ('timezone_profile',), (), lambda c: c.source('timezone_profile')),
+
+    # Category 4: Device & Email (6 features)
+    F('device_fingerprint_age_days', 'device_email', ('activity',), (), _device_age),
+    F('device_fingerprint_new', 'device_email', (), ('device_fingerprint_age_days',),
+      lambda c: 1 if c['device_fingerprint_age_days'] < 1 else 0),
+    F('email_domain_age_days', 'device_email', ('email_domain_age',), (), lambda c: c.source('email_domain_age')),
+    F('email_domain_free', 'device_email', (), (),
+      lambda c: 1 if _email_domain(c.txn) in FREE_EMAIL_DOMAINS else 0),
+    F('email_domain_disposable', 'device_email', (), (),
+      lambda c: 1 if _email_domain(c.txn) in DISPOSABLE_EMAIL_DOMAINS else 0),
+    F('browser_version_outdated', 'device_email', (), (), lambda c: 0),  # Placeholder (requires browser detection)
+
+    # Category 5: Customer History (8 features)
+    F('customer_age_days', 'customer_history', ('customer',), (), lambda c: c.source('customer') or 0),
+    F('first_transaction_customer', 'customer_history', ('customer_history',), (),
+      lambda c: 1 if _total_txn(c) == 0 else 0),
+    F('customer_dispute_history', 'customer_history', ('customer_disputes',), (),
+      lambda c: c.source('customer_disputes')),
+    F('customer_success_rate', 'customer_history', ('customer_history',), (),
+      lambda c: (c.source('customer_history')['success_count'] or 0) / _total_txn(c) if _total_txn(c) > 0 else 0),
+    F('days_since_last_transaction', 'customer_history', ('customer_history',), (),
+      lambda c: c.source('customer_history')['days_since_last']
+      if c.source('customer_history')['days_since_last'] is not None else 9999),
+    F('customer_lifetime_value', 'customer_history', ('customer_history',), (),
+      lambda c: c.source('customer_history')['lifetime_value'] or 0),
+    F('avg_transaction_per_month', 'customer_history', ('customer_history',), ('customer_age_days',),
+      lambda c: _total_txn(c) / (c['customer_age_days'] / 30) if c['customer_age_days'] > 0 else 0),
+    F('chargeback_rate_30d', 'customer_history', ('customer_chargebacks',), (),
+      lambda c: c.source('customer_chargebacks')),
+
+    # Category 6: Merchant Risk (5 features)
+    F('merchant_age_days', 'merchant', ('merchant_stats',), (),
+      lambda c: c.source('merchant_stats')['age_days'] if c.source('merchant_stats') else 0),
+    F('merchant_dispute_rate_30d', 'merchant', ('merchant_stats',), (), _merchant_stat('dispute_rate')),
+    F('merchant_chargeback_rate', 'merchant', ('merchant_chargebacks',), (),
+      lambda c: c.source('merchant_chargebacks')),
+    F('merchant_avg_ticket', 'merchant', ('merchant_stats',), (), _merchant_stat('avg_ticket')),
+    F('merchant_industry_risk', 'merchant', ('merchant_stats',), (), _industry_risk),
+
+    # Category 7: Contextual (5 features)
+    F('time_of_day', 'contextual', (), (), lambda c: c.now.hour),
+    F('day_of_week', 'contextual', (), (), lambda c: c.now.weekday()),
+    F('is_weekend', 'contextual', (), (), lambda c: 1 if c.now.weekday() >= 5 else 0),
+    F('is_holiday', 'contextual', (), (),
+      lambda c: 1 if c.now.date() in [h.date() for h in HOLIDAYS] else 0),
+    F('shipping_address_mismatch', 'contextual', (), (),
+      lambda c: 0 if c.txn.get('shipping_address') == c.txn.get('billing_address') else 1),
+
+    # Metadata: location of this payment, projected into customer activity
+    F('ip_country', 'geo', ('ip_country',), (), lambda c: c.source('ip_country'), model_input=False),
+    F('ip_latitude', 'geo', ('ip_coordinates',), (), lambda c: c.source('ip_coordinates')[0], model_input=False),
+    F('ip_longitude', 'geo', ('ip_coordinates',), (), lambda c: c.source('ip_coordinates')[1], model_input=False),
+]}
+del F
+
+# Model input columns, in training order
+FEATURE_NAMES = [f.name for f in REGISTRY.values() if f.model_input]
+METADATA_FEATURES = [f.name for f in REGISTRY.values() if not f.model_input]
+CATEGORIES = list(dict.fromkeys(f.category for f in REGISTRY.values()))
+
+# Inputs of the rule-based reasons (API fallback when no TreeSHAP explainer)
+RULE_FEATURES = {
+    'transaction_count_1h', 'card_country_mismatch', 'ip_country_mismatch', 'velocity_km_per_hour',
+    'device_fingerprint_new', 'email_domain_disposable', 'first_transaction_customer',
+    'customer_dispute_history', 'high_value_flag', 'amount_zscore', 'high_risk_country',
+}
+
+
+# ============================================================================
+# PLANNING
+# ============================================================================
+
+class FeaturePlan(NamedTuple):
+    """Features to evaluate (dependency order) and the sources they may read."""
+    features: List[str]
+    sources: List[str]
+    skipped: List[str]           # model inputs left out
+
+    def round_trips(self) -> Dict[str, int]:
+        """Remote calls per transaction by source kind (upper bound: sources are lazy)."""
+        trips: Dict[str, int] = {}
+        for name in self.sources:
+            source = SOURCES[name]
+            if source.round_trips:
+                trips[source.kind] = trips.get(source.kind, 0) + source.round_trips
+        return trips
+
+
+def plan_features(required: Optional[Iterable[str]] = None) -> FeaturePlan:
+    """
+    Dependency closure of the required features (plus metadata).
+
+    Args:
+        required: Feature names (None: all model inputs)
+
+    Returns:
+        FeaturePlan in registry order, which lists dependencies first
+
+    Raises:
+        KeyError: Unknown feature name
+    """
+    wanted = list(FEATURE_NAMES if required is None else required) + METADATA_FEATURES
+    closure: Set[str] = set()
+    while wanted:
+        name = wanted.pop()
+        if name not in REGISTRY:
+            raise KeyError(f"Unknown feature: {name}")
+        if name not in closure:
+            closure.add(name)
+            wanted.extend(REGISTRY[name].requires)
+    features = [name for name in REGISTRY if name in closure]
+    sources = list(dict.fromkeys(s for name in features for s in REGISTRY[name].sources))
+    return FeaturePlan(features, sources, [name for name in FEATURE_NAMES if name not in closure])
+
+
+def feature_cost(name: str) -> int:
+    """Remote round trips needed by a feature alone (its sources and those of its dependencies)."""
+    return sum(SOURCES[s].round_trips for s in plan_features([name]).sources)
+
+
+def model_features(model) -> Set[str]:
+    """
+    Features the trained booster splits on.
+
+    Args:
+        model: Fitted xgboost XGBClassifier (or Booster, or CompiledModel) trained on FEATURE_NAMES
+
+    Returns:
+        Feature names with at least one split
+    """
+    if hasattr(model, 'used_features'):
+        return model.used_features()  # CompiledModel
+    booster = model.get_booster() if hasattr(model, 'get_booster') else model
+    used = booster.get_score(importance_type='weight')
+    names = booster.feature_names or FEATURE_NAMES
+    # Boosters trained without names report f<index>
+    return {name if name in REGISTRY else names[int(name[1:])] for name in used}
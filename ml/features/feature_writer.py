@@ -0,0 +1,231 @@
+"""
+Write-Behind Feature Writer
+Stripe Data Architecture - ML Module
+
+Purpose: Take Cosmos DB feature writes off the scoring path. submit()
+         enqueues the feature document and returns immediately; a
+         background thread flushes documents in bulk batches bounded by
+         size and by delay, with bounded retries.
+
+Guarantees:
+    - Per payment_id ordering: a single flush thread writes batches in
+      submission order; several versions of one payment in a batch collapse
+      to the latest (documents are upserted by payment_id).
+    - Backpressure: the queue is bounded; submit() blocks up to
+      enqueue_timeout when it is full, then drops the document (counted).
+    - Clean shutdown: stop() stops accepting documents and flushes everything
+      already queued before returning.
+
+Usage:
+    writer = WriteBehindFeatureWriter(data_source)
+    writer.start()
+    engineer = FeatureEngineer(data_source=data_source, feature_writer=writer)
+    ...
+    writer.stop()
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from data_sources import FeatureDataSource
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Fields excluded from indexing in fraud_features (models/nosql/collections.json)
+# and not read by scoring: not worth the write RU on the hot path
+DROPPED_FIELDS = ('raw_features',)
+
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+
+WRITE_QUEUE_DEPTH = Gauge(
+    'fraud_feature_write_queue_depth', 'Feature documents waiting to be flushed'
+)
+FLUSH_LATENCY = Histogram(
+    'fraud_feature_write_flush_seconds', 'Duration of one bulk flush, retries included',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+FLUSH_BATCH_SIZE = Histogram(
+    'fraud_feature_write_batch_size', 'Feature documents per bulk flush',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500)
+)
+FEATURES_WRITTEN = Counter(
+    'fraud_feature_write_documents_total', 'Feature documents written by the write-behind queue'
+)
+FLUSH_RETRIES = Counter(
+    'fraud_feature_write_retries_total', 'Bulk flush retries'
+)
+FEATURES_DROPPED = Counter(
+    'fraud_feature_write_dropped_total', 'Feature documents dropped', ['reason']
+)
+
+
+class WriteBehindFeatureWriter:
+    """
+    Asynchronous, batched FeatureDataSource.store_features.
+
+    A flush happens when max_batch_size documents are pending or when the
+    oldest pending document has waited max_batch_delay seconds.
+    """
+
+    def __init__(self,
+                 data_source: FeatureDataSource,
+                 max_batch_size: int = 100,
+                 max_batch_delay: float = 0.05,
+                 queue_size: int = 10_000,
+                 enqueue_timeout: float = 0.005,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.1,
+                 dropped_fields: Sequence[str] = DROPPED_FIELDS):
+        """
+        Initialize writer.
+
+        Args:
+            data_source: Backend receiving store_features_batch calls
+            max_batch_size: Documents per bulk flush
+            max_batch_delay: Maximum seconds a document waits before its batch is flushed
+            queue_size: Capacity of the write queue
+            enqueue_timeout: Seconds submit() may block on a full queue before dropping
+            max_retries: Retries of a failed flush before its documents are dropped
+            retry_backoff: Initial retry delay in seconds (doubled per attempt)
+            dropped_fields: Top-level fields removed before writing
+        """
+        self.data_source = data_source
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dropped_fields = frozenset(dropped_fields)
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._accepting = False
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # Request-path API
+    # ------------------------------------------------------------------
+
+    def submit(self, features: Dict) -> bool:
+        """
+        Queue a feature document for writing.
+
+        Returns:
+            False if the document was dropped (queue full or writer stopped)
+        """
+        if not self._accepting:
+            FEATURES_DROPPED.labels(reason='stopped').inc()
+            logger.warning(f"Feature writer not running, features for {features['payment_id']} dropped")
+            return False
+        if self.dropped_fields.intersection(features):
+            features = {k: v for k, v in features.items() if k not in self.dropped_fields}
+        try:
+            self._queue.put(features, timeout=self.enqueue_timeout)
+        except queue.Full:
+            FEATURES_DROPPED.labels(reason='queue_full').inc()
+            return False
+        return True
+
+    def flush(self) -> None:
+        """Block until every document submitted so far has been flushed (or dropped)."""
+        self._queue.join()
+
+    def stats(self) -> Dict:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'running': self._thread is not None and self._thread.is_alive()
+        }
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the flush thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._accepting = True
+        self._thread = threading.Thread(
+            target=self._run, name='feature-writer', daemon=True
+        )
+        self._thread.start()
+        logger.info("Feature writer started")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop accepting documents and flush the ones already queued."""
+        self._accepting = False
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.error(f"Feature writer did not drain within {timeout}s "
+                             f"({self._queue.qsize()} documents pending)")
+            self._thread = None
+        logger.info("Feature writer stopped")
+
+    # ------------------------------------------------------------------
+    # Flush thread
+    # ------------------------------------------------------------------
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_batch_delay
+            while len(batch) < self.max_batch_size:
+                # On shutdown, take what is queued without waiting for the delay
+                remaining = 0 if self._stop.is_set() else deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                                 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+            WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def _flush(self, batch: List[Dict]) -> None:
+        # Latest version per payment_id, in order of first submission
+        latest: Dict[str, Dict] = {}
+        for features in batch:
+            latest[features['payment_id']] = features
+        documents = list(latest.values())
+
+        start = time.perf_counter()
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.data_source.store_features_batch(documents)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    FEATURES_DROPPED.labels(reason='write_failed').inc(len(documents))
+                    logger.error(f"Feature flush of {len(documents)} documents failed "
+                                 f"after {self.max_retries} retries: {e}")
+                    return
+                FLUSH_RETRIES.inc()
+                logger.warning(f"Feature flush failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                delay *= 2
+
+        FLUSH_LATENCY.observe(time.perf_counter() - start)
+        FLUSH_BATCH_SIZE.observe(len(documents))
+        FEATURES_WRITTEN.inc(len(documents))
@@ -0,0 +1,407 @@
+"""
+Local GeoIP Range Index
+Stripe Data Architecture - ML Module
+
+Purpose: Resolve ip_country and latitude/longitude in-process, without a
+         remote GeoIP call on the scoring path.
+
+The index is a flat binary file built once from a CSV range database
+(CIDR networks or start/end addresses, IPv4 and IPv6). Range starts/ends are
+stored as sorted integer arrays; a lookup is a binary search (searchsorted)
+on arrays memory-mapped read-only, so every API worker shares the same
+page-cache pages instead of holding its own copy.
+
+CSV columns:
+    network,country_code,latitude,longitude          (CIDR, e.g. 81.2.69.0/24)
+    start_ip,end_ip,country_code,latitude,longitude  (inclusive range)
+
+Usage:
+    python geoip_index.py build geoip_ranges.csv geoip.idx
+    python geoip_index.py lookup geoip.idx 81.2.69.160 2a02:8108::1
+    python geoip_index.py bench
+"""
+
+import argparse
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import socket
+import struct
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b'GEOIPIDX'
+VERSION = 1
+# magic, version, IPv4 ranges, IPv6 ranges, locations
+HEADER = struct.Struct('<8sIIII')
+_ALIGN = 8
+_MASK64 = (1 << 64) - 1
+_IPV4_MAPPED_PREFIX = b'\0' * 10 + b'\xff\xff'
+
+
+class GeoLocation(NamedTuple):
+    country: str
+    latitude: float
+    longitude: float
+
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def _parse_range(row: dict) -> Tuple[int, int, int]:
+    """(version, first, last) integer bounds of a CSV row."""
+    if row.get('network'):
+        network = ipaddress.ip_network(row['network'].strip(), strict=False)
+        return network.version, int(network.network_address), int(network.broadcast_address)
+    start = ipaddress.ip_address(row['start_ip'].strip())
+    end = ipaddress.ip_address(row['end_ip'].strip())
+    if start.version != end.version or int(end) < int(start):
+        raise ValueError(f"Invalid range {start} - {end}")
+    return start.version, int(start), int(end)
+
+
+def _layout(n4: int, n6: int, n_loc: int) -> List[Tuple[str, str, int]]:
+    """Sections of the index file as (name, dtype, count), widest dtypes first."""
+    return [
+        ('v6_start_hi', '<u8', n6), ('v6_start_lo', '<u8', n6),
+        ('v6_end_hi', '<u8', n6), ('v6_end_lo', '<u8', n6),
+        ('loc_lat', '<f8', n_loc), ('loc_lon', '<f8', n_loc),
+        ('v4_start', '<u4', n4), ('v4_end', '<u4', n4),
+        ('v4_loc', '<u4', n4), ('v6_loc', '<u4', n6),
+        ('loc_country', 'S2', n_loc),
+    ]
+
+
+def _offsets(n4: int, n6: int, n_loc: int) -> List[Tuple[str, np.dtype, int, int]]:
+    offset = -(-HEADER.size // _ALIGN) * _ALIGN
+    sections = []
+    for name, dtype, count in _layout(n4, n6, n_loc):
+        dtype = np.dtype(dtype)
+        sections.append((name, dtype, count, offset))
+        offset += -(-(dtype.itemsize * count) // _ALIGN) * _ALIGN
+    return sections
+
+
+def build_index(csv_path: str, output_path: str) -> Tuple[int, int]:
+    """
+    Compile a CSV range database into a binary index file.
+
+    Args:
+        csv_path: CSV with network or start_ip/end_ip, country_code, latitude, longitude
+        output_path: Index file to write
+
+    Returns:
+        (IPv4 range count, IPv6 range count)
+
+    Raises:
+        ValueError: On malformed or overlapping ranges
+    """
+    ranges = {4: [], 6: []}
+    locations = {}
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                version, first, last = _parse_range(row)
+                location = (
+                    row['country_code'].strip().upper()[:2],
+                    float(row['latitude'] or 0),
+                    float(row['longitude'] or 0),
+                )
+            except (KeyError, ValueError) as e:
+                raise ValueError(f"{csv_path}:{line_no}: {e}") from e
+            loc_id = locations.setdefault(location, len(locations))
+            ranges[version].append((first, last, loc_id))
+
+    for version, entries in ranges.items():
+        entries.sort()
+        for previous, current in zip(entries, entries[1:]):
+            if current[0] <= previous[1]:
+                raise ValueError(f"Overlapping IPv{version} ranges starting at "
+                                 f"{ipaddress.ip_address(previous[0])} and "
+                                 f"{ipaddress.ip_address(current[0])}")
+
+    v4, v6 = ranges[4], ranges[6]
+    by_id = sorted(locations, key=locations.get)
+    arrays = {
+        'v6_start_hi': [first >> 64 for first, _, _ in v6],
+        'v6_start_lo': [first & _MASK64 for first, _, _ in v6],
+        'v6_end_hi': [last >> 64 for _, last, _ in v6],
+        'v6_end_lo': [last & _MASK64 for _, last, _ in v6],
+        'v4_start': [first for first, _, _ in v4],
+        'v4_end': [last for _, last, _ in v4],
+        'v4_loc': [loc for _, _, loc in v4],
+        'v6_loc': [loc for _, _, loc in v6],
+        'loc_lat': [lat for _, lat, _ in by_id],
+        'loc_lon': [lon for _, _, lon in by_id],
+        'loc_country': [country.encode('ascii') for country, _, _ in by_id],
+    }
+
+    with open(output_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(v4), len(v6), len(by_id)))
+        for name, dtype, count, offset in _offsets(len(v4), len(v6), len(by_id)):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(np.asarray(arrays[name], dtype=dtype).tobytes())
+
+    logger.info(f"GeoIP index built: {len(v4)} IPv4 / {len(v6)} IPv6 ranges, "
+                f"{len(by_id)} locations -> {output_path}")
+    return len(v4), len(v6)
+
+
+# ============================================================================
+# LOOKUP
+# ============================================================================
+
+class GeoIPIndex:
+    """
+    Read-only IP range index over a memory-mapped file.
+
+    Lookups never allocate arrays: the range tables are numpy views over the
+    mmap. Hot IPs are served from a per-process LRU.
+    """
+
+    def __init__(self, path: str, cache_size: int = 65_536):
+        """
+        Args:
+            path: Index file produced by build_index()
+            cache_size: Entries of the hot-IP LRU (0 disables it)
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n4, n6, n_loc = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a GeoIP index (version {VERSION})")
+        self.ipv4_ranges = n4
+        self.ipv6_ranges = n6
+
+        for name, dtype, count, offset in _offsets(n4, n6, n_loc):
+            setattr(self, f"_{name}", np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset))
+        # Decoded once: at most a few hundred thousand short strings
+        self._countries = [c.decode('ascii') for c in self._loc_country]
+
+        self._cached = lru_cache(maxsize=cache_size)(self._lookup) if cache_size else self._lookup
+
+    # ------------------------------------------------------------------
+    # Single lookups
+    # ------------------------------------------------------------------
+
+    def lookup(self, ip_address: str) -> Optional[GeoLocation]:
+        """Location of an IPv4/IPv6 address, None if unknown or malformed."""
+        return self._cached(ip_address)
+
+    def country(self, ip_address: str, default: Optional[str] = None) -> Optional[str]:
+        location = self._cached(ip_address)
+        return location.country if location else default
+
+    def lat_lon(self, ip_address: str,
+                default: Optional[Tuple[float, float]] = None) -> Optional[Tuple[float, float]]:
+        location = self._cached(ip_address)
+        return (location.latitude, location.longitude) if location else default
+
+    def _location(self, loc_id: int) -> GeoLocation:
+        return GeoLocation(
+            self._countries[loc_id],
+            float(self._loc_lat[loc_id]),
+            float(self._loc_lon[loc_id])
+        )
+
+    def _lookup(self, ip_address: str) -> Optional[GeoLocation]:
+        loc_id = self._loc_id(ip_address)
+        return self._location(loc_id) if loc_id >= 0 else None
+
+    def _loc_id(self, ip_address: str) -> int:
+        """Location id of an address, -1 if unknown or malformed."""
+        ip_address = ip_address.strip() if isinstance(ip_address, str) else ''
+        try:
+            packed = socket.inet_aton(ip_address) if ':' not in ip_address \
+                else socket.inet_pton(socket.AF_INET6, ip_address)
+        except (OSError, ValueError):
+            return -1
+
+        if len(packed) == 16 and packed[:12] == _IPV4_MAPPED_PREFIX:
+            # IPv4-mapped IPv6 (::ffff:a.b.c.d)
+            packed = packed[12:]
+
+        if len(packed) == 4:
+            value = int.from_bytes(packed, 'big')
+            # Same dtype as the array, otherwise numpy upcasts (copies) the whole table
+            i = int(self._v4_start.searchsorted(np.uint32(value), side='right')) - 1
+            if i >= 0 and value <= self._v4_end[i]:
+                return int(self._v4_loc[i])
+            return -1
+
+        i = self._v6_index(int.from_bytes(packed[:8], 'big'), int.from_bytes(packed[8:], 'big'))
+        return int(self._v6_loc[i]) if i >= 0 else -1
+
+    def _v6_index(self, hi: int, lo: int) -> int:
+        """Index of the IPv6 range containing (hi, lo), -1 if none."""
+        hi_np = np.uint64(hi)
+        left = int(self._v6_start_hi.searchsorted(hi_np, side='left'))
+        right = int(self._v6_start_hi.searchsorted(hi_np, side='right'))
+        # Ranges starting in the same /64 are contiguous: refine on the low half
+        i = left + int(self._v6_start_lo[left:right].searchsorted(np.uint64(lo), side='right')) - 1
+        if i < 0:
+            return -1
+        if (hi, lo) <= (int(self._v6_end_hi[i]), int(self._v6_end_lo[i])):
+            return i
+        return -1
+
+    # ------------------------------------------------------------------
+    # Bulk lookups (batch feature path)
+    # ------------------------------------------------------------------
+
+    def lookup_many(self, ip_addresses: Sequence[str],
+                    default_country: str = '') -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Vectorized lookup.
+
+        Returns:
+            (countries, latitudes, longitudes) arrays aligned with the input;
+            unknown addresses get default_country and NaN coordinates
+        """
+        n = len(ip_addresses)
+        loc_ids = np.full(n, -1, dtype=np.int64)
+
+        v4_pos, v4_values, v6_pos = [], [], []
+        for pos, ip in enumerate(ip_addresses):
+            ip = ip.strip() if isinstance(ip, str) else ''
+            if ':' in ip:
+                v6_pos.append(pos)
+                continue
+            try:
+                v4_values.append(int.from_bytes(socket.inet_aton(ip), 'big'))
+                v4_pos.append(pos)
+            except (OSError, ValueError):
+                pass
+
+        if v4_pos and self.ipv4_ranges:
+            values = np.asarray(v4_values, dtype=np.uint32)
+            idx = self._v4_start.searchsorted(values, side='right') - 1
+            safe = np.maximum(idx, 0)
+            hit = (idx >= 0) & (values <= self._v4_end[safe])
+            loc_ids[np.asarray(v4_pos)[hit]] = self._v4_loc[safe[hit]]
+
+        # IPv6 is a small share of card traffic: per-address binary search
+        for pos in v6_pos:
+            loc_ids[pos] = self._loc_id(ip_addresses[pos])
+
+        found = loc_ids >= 0
+        countries = np.full(n, default_country, dtype=object)
+        latitudes = np.full(n, np.nan)
+        longitudes = np.full(n, np.nan)
+        countries[found] = np.asarray(self._countries, dtype=object)[loc_ids[found]]
+        latitudes[found] = self._loc_lat[loc_ids[found]]
+        longitudes[found] = self._loc_lon[loc_ids[found]]
+        return countries, latitudes, longitudes
+
+    def close(self) -> None:
+        # numpy views hold buffer exports on the mmap and must go first
+        for name, _, _ in _layout(0, 0, 0):
+            setattr(self, f"_{name}", None)
+        self._mmap.close()
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def _synthetic_csv(path: str, n_ranges: int, seed: int = 42) -> None:
+    """Random non-overlapping IPv4 and IPv6 ranges, for the benchmark."""
+    rng = np.random.default_rng(seed)
+    countries = ['US', 'FR', 'GB', 'DE', 'ES', 'BR', 'IN', 'NG', 'JP', 'CA']
+    starts = np.unique(rng.integers(1 << 24, 0xE0000000, n_ranges, dtype=np.uint64))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['start_ip', 'end_ip', 'country_code', 'latitude', 'longitude'])
+        for first, nxt in zip(starts, np.append(starts[1:], 0xE0000000)):
+            writer.writerow([
+                str(ipaddress.IPv4Address(int(first))), str(ipaddress.IPv4Address(int(nxt) - 1)),
+                countries[int(first) % len(countries)],
+                round(float(rng.uniform(-60, 70)), 4), round(float(rng.uniform(-180, 180)), 4)
+            ])
+        for i in range(n_ranges // 10):
+            network = ipaddress.IPv6Network(((0x2001 << 112) | (i << 80), 48))
+            writer.writerow([
+                str(network.network_address), str(network.broadcast_address),
+                countries[i % len(countries)], 0.0, 0.0
+            ])
+
+
+def _bench(n_ranges: int, n_lookups: int) -> None:
+    import tempfile
+    import time
+
+    workdir = tempfile.mkdtemp(prefix='geoip_')
+    csv_path = os.path.join(workdir, 'ranges.csv')
+    index_path = os.path.join(workdir, 'geoip.idx')
+    _synthetic_csv(csv_path, n_ranges)
+    build_index(csv_path, index_path)
+
+    rng = np.random.default_rng(7)
+    ips = [str(ipaddress.IPv4Address(int(v))) for v in rng.integers(1 << 24, 0xE0000000, n_lookups)]
+
+    index = GeoIPIndex(index_path, cache_size=0)
+    start = time.perf_counter()
+    for ip in ips:
+        index.lookup(ip)
+    uncached_us = (time.perf_counter() - start) / n_lookups * 1e6
+
+    index = GeoIPIndex(index_path)
+    hot = ips[:1000] * (n_lookups // 1000)
+    for ip in hot[:1000]:
+        index.lookup(ip)
+    start = time.perf_counter()
+    for ip in hot:
+        index.lookup(ip)
+    cached_us = (time.perf_counter() - start) / len(hot) * 1e6
+
+    start = time.perf_counter()
+    index.lookup_many(ips)
+    bulk_us = (time.perf_counter() - start) / n_lookups * 1e6
+
+    print(f"{index.ipv4_ranges} IPv4 / {index.ipv6_ranges} IPv6 ranges, "
+          f"index {os.path.getsize(index_path) / 1e6:.1f} MB")
+    print(f"lookup (uncached): {uncached_us:.2f}us")
+    print(f"lookup (LRU hit):  {cached_us:.2f}us")
+    print(f"lookup_many:       {bulk_us:.2f}us per address")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Local GeoIP range index')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help='Compile a CSV range database')
+    build.add_argument('csv_path')
+    build.add_argument('output_path')
+
+    lookup = sub.add_parser('lookup', help='Resolve addresses')
+    lookup.add_argument('index_path')
+    lookup.add_argument('ips', nargs='+')
+
+    bench = sub.add_parser('bench', help='Lookup latency on a synthetic database')
+    bench.add_argument('--ranges', type=int, default=500_000)
+    bench.add_argument('--lookups', type=int, default=200_000)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_index(args.csv_path, args.output_path)
+    elif args.command == 'lookup':
+        index = GeoIPIndex(args.index_path)
+        for ip in args.ips:
+            print(f"{ip}\t{index.lookup(ip)}")
+    else:
+        _bench(args.ranges, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
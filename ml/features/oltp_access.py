@@ -0,0 +1,406 @@
+"""
+OLTP Access Layer
+Stripe Data Architecture - ML Module
+
+Purpose: Typed, parameterized reads of the OLTP database for the feature
+         engine, derived from models/oltp/schema.sql:
+             - every lookup seeks a declared index (filtered indexes such as
+               IX_transactions_customer_date ... WHERE is_deleted = 0 need
+               the literal predicate in the query) and reads only columns the
+               index covers; check_lookups() verifies this against the schema
+             - multi-key: one statement for many customer / merchant ids,
+               keys passed as a single JSON parameter (OPENJSON on Azure SQL,
+               json_each on SQLite) and joined to the index seek
+             - row types: NamedTuples, entity rows generated from the table
+               definitions
+"""
+
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OLTP_SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'models', 'oltp', 'schema.sql'
+)
+
+# Keys per statement (JSON parameter size, plan stays a nested-loop seek)
+DEFAULT_BATCH_SIZE = 500
+
+DIALECTS = ('tsql', 'sqlite')
+
+_SQL_TYPES = [
+    (re.compile(r"^(BIGINT|INT|SMALLINT|TINYINT|BIT)\b", re.I), int),
+    (re.compile(r"^(DECIMAL|NUMERIC|FLOAT|REAL|MONEY)\b", re.I), float),
+    (re.compile(r"^(DATETIME2|DATETIME|DATE)\b", re.I), datetime),
+]
+
+
+# ============================================================================
+# SCHEMA
+# ============================================================================
+
+class IndexSchema(NamedTuple):
+    name: str
+    table: str
+    columns: List[str]
+    include: List[str]
+    where: Optional[str]
+
+
+class TableSchema(NamedTuple):
+    name: str
+    columns: Dict[str, str]      # column -> T-SQL type
+    primary_key: str
+    indexes: Dict[str, IndexSchema]
+
+
+def _column_list(text: str) -> List[str]:
+    return [c.strip().split()[0] for c in text.split(',') if c.strip()]
+
+
+def load_oltp_schema(path: str = OLTP_SCHEMA_PATH) -> Dict[str, TableSchema]:
+    """Tables, primary keys and indexes (key columns, INCLUDE, filter) of the OLTP schema."""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = re.sub(r"--[^\n]*", "", f.read())
+    tables: Dict[str, TableSchema] = {}
+    for match in re.finditer(r"CREATE TABLE (\w+)\s*\((.*?)\n\);", text, re.S):
+        columns, primary_key = {}, None
+        for line in match.group(2).split('\n'):
+            parts = line.strip().rstrip(',').split()
+            if len(parts) < 2 or parts[0].upper() == 'CONSTRAINT':
+                continue
+            columns[parts[0]] = parts[1]
+            if 'PRIMARY KEY' in line.upper():
+                primary_key = parts[0]
+        tables[match.group(1)] = TableSchema(match.group(1), columns, primary_key, {})
+    for match in re.finditer(
+            r"CREATE (?:UNIQUE )?(?:NONCLUSTERED )?INDEX (\w+)\s+ON (\w+)\s*\(([^)]*)\)"
+            r"(?:\s*INCLUDE\s*\(([^)]*)\))?(?:\s*WHERE\s+([^;]+))?;", text, re.I):
+        name, table = match.group(1), match.group(2)
+        if table in tables:
+            tables[table].indexes[name] = IndexSchema(
+                name, table, _column_list(match.group(3)), _column_list(match.group(4) or ''),
+                ' '.join(match.group(5).split()) if match.group(5) else None)
+    return tables
+
+
+def python_type(sql_type: str) -> type:
+    for pattern, kind in _SQL_TYPES:
+        if pattern.match(sql_type):
+            return kind
+    return str
+
+
+def record_type(table: TableSchema, columns: List[str], name: Optional[str] = None) -> type:
+    """NamedTuple of `columns` typed from the table definition (all fields Optional)."""
+    fields = [(c, Optional[python_type(table.columns[c])]) for c in columns]
+    record = NamedTuple(name or table.name.title().replace('_', '') + 'Record', fields)
+    record.__new__.__defaults__ = (None,) * len(fields)
+    return record
+
+
+# ============================================================================
+# ROW TYPES
+# ============================================================================
+
+class PaymentDiversity(NamedTuple):
+    unique_cards: int = 0
+    unique_merchants: int = 0
+
+
+class AmountStats(NamedTuple):
+    avg_amount: Optional[float] = None
+    stddev_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+
+
+class CustomerHistory(NamedTuple):
+    total_txn: int = 0
+    success_count: int = 0
+    lifetime_value: Optional[float] = None
+    last_created_at: Optional[datetime] = None
+
+
+class DisputeCount(NamedTuple):
+    dispute_count: int = 0
+
+
+class MerchantActivity(NamedTuple):
+    dispute_rate: Optional[float] = None
+    avg_ticket: Optional[float] = None
+
+
+# ============================================================================
+# LOOKUPS
+# ============================================================================
+
+class Seek(NamedTuple):
+    alias: str
+    table: str
+    column: str
+    index: Optional[str]     # None: primary key
+
+
+class Lookup(NamedTuple):
+    name: str
+    sql: str                 # {keys}: key set, one row per key with data (lookup_key first)
+    seeks: List[Seek]
+    row_type: Optional[type] = None     # None: entity record generated from the schema
+    record_columns: Tuple[str, ...] = ()
+    default: bool = True     # keys without rows get row_type() (aggregates) instead of no entry
+
+
+LOOKUPS = {lookup.name: lookup for lookup in [
+    Lookup('payment_diversity', """
+        SELECT k.id AS lookup_key,
+               COUNT(DISTINCT t.payment_method_id) AS unique_cards,
+               COUNT(DISTINCT t.merchant_id) AS unique_merchants
+        FROM {keys} AS k
+        INNER JOIN transactions AS t
+            ON t.customer_id = k.id AND t.created_at >= ? AND t.is_deleted = 0
+        GROUP BY k.id
+    """, [Seek('t', 'transactions', 'customer_id', 'IX_transactions_customer_date')], PaymentDiversity),
+
+    Lookup('amount_stats', """
+        SELECT k.id AS lookup_key,
+               AVG(CAST(t.amount AS FLOAT)) AS avg_amount,
+               STDEV(CAST(t.amount AS FLOAT)) AS stddev_amount,
+               MAX(t.amount) AS max_amount
+        FROM {keys} AS k
+        INNER JOIN transactions AS t
+            ON t.customer_id = k.id AND t.created_at >= ? AND t.is_deleted = 0
+        WHERE t.status = 'SUCCEEDED'
+        GROUP BY k.id
+    """, [Seek('t', 'transactions', 'customer_id', 'IX_transactions_customer_date')], AmountStats),
+
+    Lookup('customer_history', """
+        SELECT k.id AS lookup_key,
+               COUNT(*) AS total_txn,
+               SUM(CASE WHEN t.status = 'SUCCEEDED' THEN 1 ELSE 0 END) AS success_count,
+               SUM(t.amount) AS lifetime_value,
+               MAX(t.created_at) AS last_created_at
+        FROM {keys} AS k
+        INNER JOIN transactions AS t
+            ON t.customer_id = k.id AND t.is_deleted = 0
+        GROUP BY k.id
+    """, [Seek('t', 'transactions', 'customer_id', 'IX_transactions_customer_date')], CustomerHistory),
+
+    Lookup('customer_disputes', """
+        SELECT k.id AS lookup_key,
+               COUNT(*) AS dispute_count
+        FROM {keys} AS k
+        INNER JOIN transactions AS t
+            ON t.customer_id = k.id AND t.is_deleted = 0
+        INNER JOIN chargebacks AS cb
+            ON cb.transaction_id = t.transaction_id AND cb.is_deleted = 0
+        GROUP BY k.id
+    """, [Seek('t', 'transactions', 'customer_id', 'IX_transactions_customer_date'),
+          Seek('cb', 'chargebacks', 'transaction_id', 'IX_chargebacks_transaction_id')], DisputeCount),
+
+    Lookup('merchant_activity', """
+        SELECT k.id AS lookup_key,
+               COUNT(cb.transaction_id) * 1.0 / NULLIF(COUNT(*), 0) AS dispute_rate,
+               AVG(CAST(t.amount AS FLOAT)) AS avg_ticket
+        FROM {keys} AS k
+        INNER JOIN transactions AS t
+            ON t.merchant_id = k.id AND t.created_at >= ? AND t.is_deleted = 0
+        LEFT JOIN chargebacks AS cb
+            ON cb.transaction_id = t.transaction_id AND cb.is_deleted = 0
+        GROUP BY k.id
+    """, [Seek('t', 'transactions', 'merchant_id', 'IX_transactions_merchant_date_status'),
+          Seek('cb', 'chargebacks', 'transaction_id', 'IX_chargebacks_transaction_id')], MerchantActivity),
+
+    Lookup('customers', """
+        SELECT k.id AS lookup_key, c.created_at
+        FROM {keys} AS k
+        INNER JOIN customers AS c ON c.customer_id = k.id
+    """, [Seek('c', 'customers', 'customer_id', None)], record_columns=('created_at',), default=False),
+
+    Lookup('merchants', """
+        SELECT k.id AS lookup_key, m.created_at, m.industry
+        FROM {keys} AS k
+        INNER JOIN merchants AS m ON m.merchant_id = k.id
+    """, [Seek('m', 'merchants', 'merchant_id', None)], record_columns=('created_at', 'industry'),
+        default=False),
+]}
+
+
+def _normalize(sql: str) -> str:
+    return ' '.join(sql.split())
+
+
+def check_lookups(schema: Dict[str, TableSchema]) -> List[str]:
+    """
+    Problems preventing a lookup from being an index seek on the schema:
+    unknown table / column / index, seek column not leading the index,
+    missing filtered-index predicate, columns not covered by the index
+    (filter columns included: the optimizer may still check the predicate
+    on the row otherwise).
+    """
+    problems = []
+    for lookup in LOOKUPS.values():
+        sql = _normalize(lookup.sql)
+        for seek in lookup.seeks:
+            table = schema.get(seek.table)
+            if table is None:
+                problems.append(f"{lookup.name}: unknown table {seek.table}")
+                continue
+            used = set(re.findall(rf"\b{seek.alias}\.(\w+)", sql))
+            unknown = used - set(table.columns)
+            if unknown:
+                problems.append(f"{lookup.name}: {seek.table} has no column {', '.join(sorted(unknown))}")
+            if seek.index is None:
+                if seek.column != table.primary_key:
+                    problems.append(f"{lookup.name}: {seek.table}.{seek.column} is not the primary key")
+                continue
+            index = table.indexes.get(seek.index)
+            if index is None:
+                problems.append(f"{lookup.name}: {seek.table} has no index {seek.index}")
+                continue
+            if index.columns[0] != seek.column:
+                problems.append(f"{lookup.name}: {seek.index} does not lead with {seek.column}")
+            covered = set(index.columns) | set(index.include) | {table.primary_key}
+            if index.where:
+                predicate = re.sub(r"\b([a-z_]+)\b(?=\s*(=|<|>|IS\b))", rf"{seek.alias}.\1", index.where)
+                if predicate not in sql:
+                    problems.append(f"{lookup.name}: missing filtered-index predicate {predicate}")
+            uncovered = used - covered
+            if uncovered:
+                problems.append(f"{lookup.name}: {seek.index} does not cover {', '.join(sorted(uncovered))}")
+    return problems
+
+
+def _keys_source(dialect: str, key_type: str) -> str:
+    if dialect == 'tsql':
+        return f"OPENJSON(?) WITH (id {key_type} '$')"
+    return "(SELECT value AS id FROM json_each(?))"
+
+
+# ============================================================================
+# ACCESS
+# ============================================================================
+
+class OLTPAccess:
+    """
+    Bulk lookups over a DB-API connection.
+
+    'tsql': pyodbc-style connection (cursor().execute(sql, *params)),
+    'sqlite': sqlite3 connection. Callers serialize access when the
+    connection is shared (SQLiteDataSource holds its lock).
+    """
+
+    def __init__(self, connection, dialect: str = 'tsql', schema_path: str = OLTP_SCHEMA_PATH,
+                 batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Args:
+            connection: pyodbc (or compatible) or sqlite3 connection
+            dialect: 'tsql' or 'sqlite'
+            schema_path: OLTP schema the lookups are checked against
+            batch_size: Keys per statement
+        """
+        if dialect not in DIALECTS:
+            raise ValueError(f"Unknown dialect {dialect!r} (expected one of {DIALECTS})")
+        self.connection = connection
+        self.dialect = dialect
+        self.batch_size = batch_size
+        self.schema = load_oltp_schema(schema_path)
+        problems = check_lookups(self.schema)
+        if problems:
+            raise ValueError("OLTP lookups do not match the schema: " + '; '.join(problems))
+
+        self._row_types: Dict[str, type] = {}
+        self._sql: Dict[str, str] = {}
+        for lookup in LOOKUPS.values():
+            seek = lookup.seeks[0]
+            table = self.schema[seek.table]
+            self._row_types[lookup.name] = lookup.row_type or record_type(table, list(lookup.record_columns))
+            self._sql[lookup.name] = lookup.sql.format(
+                keys=_keys_source(dialect, table.columns[seek.column]))
+
+    def sql(self, name: str) -> str:
+        """Statement of a lookup in this dialect (first parameter: JSON array of keys)."""
+        return self._sql[name]
+
+    def _execute(self, sql: str, params: List) -> Tuple[List[str], List[tuple]]:
+        if self.dialect == 'sqlite':
+            cursor = self.connection.execute(sql, params)
+        else:
+            cursor = self.connection.cursor()
+            cursor.execute(sql, *params)
+        columns = [c[0] for c in cursor.description]
+        return columns, [tuple(row) for row in cursor.fetchall()]
+
+    def _coerce(self, row_type: type, values: Dict):
+        row = {}
+        for field, kind in row_type.__annotations__.items():
+            value = values.get(field)
+            if value is not None:
+                base = getattr(kind, '__args__', (kind,))[0]
+                if base is datetime and isinstance(value, str):
+                    value = datetime.fromisoformat(value[:19])
+                elif base is float and isinstance(value, (Decimal, int)):
+                    value = float(value)
+                elif base is int and isinstance(value, (Decimal, float)):
+                    value = int(value)
+            row[field] = value
+        return row_type(**row)
+
+    def fetch(self, name: str, keys: Iterable, *params) -> Dict:
+        """
+        Run a lookup for many keys.
+
+        Args:
+            name: Lookup name (LOOKUPS)
+            keys: Customer / merchant ids (duplicates ignored)
+            params: Remaining statement parameters (e.g. the `since` timestamp)
+
+        Returns:
+            key -> row (aggregates: every key; entities: keys found)
+        """
+        lookup = LOOKUPS[name]
+        row_type = self._row_types[name]
+        keys = list(dict.fromkeys(keys))
+        by_text = {str(k): k for k in keys}
+        result = {}
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            columns, rows = self._execute(self._sql[name], [json.dumps(chunk)] + list(params))
+            for values in rows:
+                record = dict(zip(columns, values))
+                key = by_text.get(str(record['lookup_key']), record['lookup_key'])
+                result[key] = self._coerce(row_type, record)
+        if lookup.default:
+            for key in keys:
+                result.setdefault(key, row_type())
+        return result
+
+    # ------------------------------------------------------------------
+    # Typed lookups
+    # ------------------------------------------------------------------
+
+    def payment_diversity(self, customer_ids: Iterable, since: datetime) -> Dict[object, PaymentDiversity]:
+        return self.fetch('payment_diversity', customer_ids, since)
+
+    def amount_stats(self, customer_ids: Iterable, since: datetime) -> Dict[object, AmountStats]:
+        return self.fetch('amount_stats', customer_ids, since)
+
+    def customer_history(self, customer_ids: Iterable) -> Dict[object, CustomerHistory]:
+        return self.fetch('customer_history', customer_ids)
+
+    def customer_disputes(self, customer_ids: Iterable) -> Dict[object, DisputeCount]:
+        return self.fetch('customer_disputes', customer_ids)
+
+    def merchant_activity(self, merchant_ids: Iterable, since: datetime) -> Dict[object, MerchantActivity]:
+        return self.fetch('merchant_activity', merchant_ids, since)
+
+    def customers(self, customer_ids: Iterable) -> Dict:
+        return self.fetch('customers', customer_ids)
+
+    def merchants(self, merchant_ids: Iterable) -> Dict:
+        return self.fetch('merchants', merchant_ids)
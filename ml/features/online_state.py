@@ -0,0 +1,559 @@
+"""
+Online Feature State
+Stripe Data Architecture - ML Module
+
+Purpose: Per-customer and per-merchant aggregates used by FeatureEngineer,
+         maintained incrementally from OLTP changes (see
+         change_feed_consumer.py) instead of being recomputed from raw tables
+         on every score.
+
+State (SQLite, one JSON document per entity):
+    customer: created_at, lifetime counters (payments, successes, amount,
+              last payment), disputes, and the payments of the last
+              WINDOW_DAYS days for the windowed aggregates
+    merchant: created_at, industry
+    merchant_window: one row per (merchant, payment) of the last
+              WINDOW_DAYS days with its amount and disputes, so that a batch
+              writes the rows it touches, not every payment of a large
+              merchant; rows that age out are deleted
+    payment_index: last applied image of every payment, used to retract a
+              payment's previous contribution on update/delete and to route
+              disputes to their customer and merchant
+    deferred_disputes: disputes whose payment is not in the index yet,
+              applied when the payment arrives
+
+Idempotence: every document and index row remembers the change-log position
+it last applied per source table; replayed changes are skipped. A batch is
+written in a single transaction together with the consumer checkpoints.
+
+Coverage: CDC keeps a few days of changes, so lifetime counters are only
+complete once the state was seeded from an OLTP snapshot (the consumer's
+bootstrap). Until then, OnlineAggregateDataSource serves lifetime fields,
+and windows longer than what the consumer has seen, from its fallback.
+"""
+
+import json
+import logging
+import math
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from data_sources import FeatureDataSource
+
+logger = logging.getLogger(__name__)
+
+
+# Longest feature window is 30 days; keep a margin for late updates
+WINDOW_DAYS = 35
+# Deferred disputes whose payment never showed up are dropped (counted) after this
+DEFERRED_RETENTION_DAYS = 90
+SUCCEEDED = 'succeeded'
+
+CUSTOMER, MERCHANT = 'customer', 'merchant'
+
+
+def to_iso(value) -> Optional[str]:
+    """Normalize a CDC timestamp (datetime or string) to 'YYYY-MM-DDTHH:MM:SS'."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(microsecond=0, tzinfo=None).isoformat()
+    return str(value).replace(' ', 'T')[:19]
+
+
+def _new_document(entity_type: str) -> Dict:
+    if entity_type == CUSTOMER:
+        return {'created_at': None, 'total_txn': 0, 'success_count': 0,
+                'lifetime_value': 0, 'last_created_at': None,
+                'payments': {}, 'disputes': {}, 'applied': {}}
+    return {'created_at': None, 'industry': None, 'applied': {}}
+
+
+# ============================================================================
+# CHANGE APPLICATION
+# ============================================================================
+
+class ChangeBatch:
+    """
+    Documents and index rows touched by one batch of changes, loaded once
+    and written back together by OnlineFeatureState.commit().
+    """
+
+    def __init__(self, state: 'OnlineFeatureState', now: datetime):
+        self.state = state
+        self.now = now
+        self.window_start = to_iso(now - timedelta(days=WINDOW_DAYS))
+        self.documents: Dict[Tuple[str, str], Dict] = {}
+        self.index: Dict[str, Optional[Dict]] = {}
+        # (merchant_id, payment_id) -> [created_at, amount, dispute ids], None to delete
+        self.window: Dict[Tuple[str, str], Optional[list]] = {}
+        # Disputes deferred by this batch, and payments whose deferred disputes were applied
+        self.deferred: Dict[str, List[tuple]] = {}
+        self.released: set = set()
+        self.applied = 0
+        self.skipped = {'duplicate': 0, 'deleted_payment': 0, 'deferred_expired': 0}
+
+    def document(self, entity_type: str, entity_id: str) -> Dict:
+        key = (entity_type, str(entity_id))
+        if key not in self.documents:
+            self.documents[key] = self.state._read_document(*key) or _new_document(entity_type)
+        return self.documents[key]
+
+    def window_entry(self, merchant_id: str, payment_id) -> Optional[list]:
+        key = (str(merchant_id), str(payment_id))
+        if key not in self.window:
+            self.window[key] = self.state._read_window(*key)
+        return self.window[key]
+
+    def payment(self, payment_id: str) -> Optional[Dict]:
+        if payment_id not in self.index:
+            self.index[payment_id] = self.state._read_payment(payment_id)
+        return self.index[payment_id]
+
+    @staticmethod
+    def _claim(doc: Dict, table: str, position: int) -> bool:
+        """Mark the change as applied to doc; False if it already was."""
+        if position <= doc['applied'].get(table, -1):
+            return False
+        doc['applied'][table] = position
+        return True
+
+    # ------------------------------------------------------------------
+    # Per-table handlers
+    # ------------------------------------------------------------------
+
+    def apply(self, table: str, operation: str, row: Dict, position: int) -> None:
+        handler = {
+            'Payment': self._apply_payment,
+            'Dispute': self._apply_dispute,
+            'Customer': self._apply_customer,
+            'Merchant': self._apply_merchant,
+        }.get(table)
+        if handler is None:
+            return
+        handler(table, operation, row, position)
+
+    def _apply_payment(self, table: str, operation: str, row: Dict, position: int) -> None:
+        payment_id = row['PaymentID']
+        old = self.payment(payment_id)
+        if old is not None and position <= old['position']:
+            self.skipped['duplicate'] += 1
+            return
+
+        new = None
+        if operation != 'delete':
+            new = {
+                'customer_id': str(row['CustomerID']),
+                'merchant_id': str(row['MerchantID']),
+                'amount': float(row['Amount'] or 0),
+                'status': (row.get('Status') or '').lower(),
+                'payment_method': row.get('PaymentMethod'),
+                'created_at': to_iso(row.get('CreatedAt')),
+                'position': position
+            }
+
+        # Retract the previous image (unless already deleted), then add the new one;
+        # the payment's disputes follow it in the merchant window
+        previous = None if old is None or old.get('deleted') else old
+        disputes = []
+        for image, sign in ((previous, -1), (new, 1)):
+            if image is None:
+                continue
+            customer = self.document(CUSTOMER, image['customer_id'])
+            merchant = self.document(MERCHANT, image['merchant_id'])
+            customer['applied'][table] = max(customer['applied'].get(table, -1), position)
+            merchant['applied'][table] = max(merchant['applied'].get(table, -1), position)
+
+            customer['total_txn'] += sign
+            customer['success_count'] += sign * (image['status'] == SUCCEEDED)
+            customer['lifetime_value'] += sign * image['amount']
+            if sign < 0:
+                customer['payments'].pop(payment_id, None)
+                entry = self.window_entry(image['merchant_id'], payment_id)
+                if entry is not None:
+                    disputes = entry[2]
+                    self.window[(image['merchant_id'], str(payment_id))] = None
+                continue
+            if image['created_at'] and (customer['last_created_at'] or '') < image['created_at']:
+                customer['last_created_at'] = image['created_at']
+            if image['created_at'] and image['created_at'] >= self.window_start:
+                customer['payments'][payment_id] = [
+                    image['created_at'], image['amount'], image['status'],
+                    image['merchant_id'], image['payment_method']
+                ]
+                self.window[(image['merchant_id'], str(payment_id))] = [image['created_at'], image['amount'],
+                                                                        disputes]
+
+        if new is None:
+            # Keep a tombstone so a replayed insert stays a duplicate
+            new = dict(old or {}, position=position, deleted=True)
+        self.index[payment_id] = new
+        self.applied += 1
+        self._release(payment_id)
+
+    def _release(self, payment_id) -> None:
+        """Apply the disputes deferred until this payment was known, in change-log order."""
+        key = str(payment_id)
+        waiting = self.deferred.pop(key, [])
+        if key not in self.released:
+            self.released.add(key)
+            waiting = self.state._read_deferred(key) + waiting
+        for position, operation, row in sorted(waiting, key=lambda change: change[0]):
+            # Never claimed when deferred: documents may have moved past its position since
+            self._apply_dispute('Dispute', operation, row, position, deferred=True)
+
+    def _apply_dispute(self, table: str, operation: str, row: Dict, position: int,
+                       deferred: bool = False) -> None:
+        payment = self.payment(row['PaymentID'])
+        if payment is None:
+            # Payment older than the change log (or not consumed yet): kept until it arrives
+            self.deferred.setdefault(str(row['PaymentID']), []).append((position, operation, row))
+            return
+        if payment.get('deleted'):
+            self.skipped['deleted_payment'] += 1
+            return
+        dispute_id = str(row['DisputeID'])
+        claimed = False
+        for entity_type, entity_id in ((CUSTOMER, payment['customer_id']),
+                                       (MERCHANT, payment['merchant_id'])):
+            doc = self.document(entity_type, entity_id)
+            if not deferred and not self._claim(doc, table, position):
+                continue
+            claimed = True
+            if entity_type == MERCHANT:
+                # Disputes of payments out of the window are not counted by the merchant
+                entry = self.window_entry(entity_id, row['PaymentID'])
+                if entry is not None:
+                    entry[2] = [d for d in entry[2] if d != dispute_id] + ([dispute_id] if operation != 'delete'
+                                                                           else [])
+            elif operation == 'delete':
+                doc['disputes'].pop(dispute_id, None)
+            else:
+                doc['disputes'][dispute_id] = row['PaymentID']
+        if claimed:
+            self.applied += 1
+        else:
+            self.skipped['duplicate'] += 1
+
+    def _apply_customer(self, table: str, operation: str, row: Dict, position: int) -> None:
+        doc = self.document(CUSTOMER, row['CustomerID'])
+        if not self._claim(doc, table, position):
+            self.skipped['duplicate'] += 1
+            return
+        if operation != 'delete':
+            doc['created_at'] = to_iso(row.get('CreatedAt'))
+        self.applied += 1
+
+    def _apply_merchant(self, table: str, operation: str, row: Dict, position: int) -> None:
+        doc = self.document(MERCHANT, row['MerchantID'])
+        if not self._claim(doc, table, position):
+            self.skipped['duplicate'] += 1
+            return
+        if operation != 'delete':
+            doc['created_at'] = to_iso(row.get('CreatedAt'))
+            doc['industry'] = row.get('Industry')
+        self.applied += 1
+
+    def prune(self) -> None:
+        """Drop customer window entries that aged out (merchant rows: see commit)."""
+        for (entity_type, _), doc in self.documents.items():
+            if entity_type == CUSTOMER:
+                doc['payments'] = {pid: entry for pid, entry in doc['payments'].items()
+                                   if entry[0] >= self.window_start}
+
+
+# ============================================================================
+# STORE
+# ============================================================================
+
+class OnlineFeatureState:
+    """SQLite-backed entity documents, payment index and change-log checkpoints."""
+
+    def __init__(self, database: str = ':memory:'):
+        """
+        Args:
+            database: SQLite path (':memory:' for tests and benchmarks)
+        """
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entity_state (
+                entity_type TEXT NOT NULL,
+                entity_id TEXT NOT NULL,
+                document TEXT NOT NULL,
+                PRIMARY KEY (entity_type, entity_id)
+            );
+            CREATE TABLE IF NOT EXISTS merchant_window (
+                merchant_id TEXT NOT NULL,
+                payment_id TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                amount REAL NOT NULL,
+                disputes INTEGER NOT NULL,
+                dispute_ids TEXT NOT NULL,
+                PRIMARY KEY (merchant_id, payment_id)
+            );
+            CREATE INDEX IF NOT EXISTS IX_merchant_window_created ON merchant_window(merchant_id, created_at);
+            CREATE INDEX IF NOT EXISTS IX_merchant_window_age ON merchant_window(created_at);
+            CREATE TABLE IF NOT EXISTS payment_index (
+                payment_id TEXT PRIMARY KEY,
+                image TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                source_table TEXT PRIMARY KEY,
+                position TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS deferred_disputes (
+                payment_id TEXT NOT NULL,
+                position TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                row_data TEXT NOT NULL,
+                deferred_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS IX_deferred_disputes_payment ON deferred_disputes(payment_id);
+            CREATE TABLE IF NOT EXISTS state_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._db.commit()
+
+    def _read_document(self, entity_type: str, entity_id: str) -> Optional[Dict]:
+        row = self._db.execute(
+            "SELECT document FROM entity_state WHERE entity_type = ? AND entity_id = ?",
+            (entity_type, entity_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _read_payment(self, payment_id: str) -> Optional[Dict]:
+        row = self._db.execute(
+            "SELECT image FROM payment_index WHERE payment_id = ?", (payment_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _read_window(self, merchant_id: str, payment_id: str) -> Optional[list]:
+        row = self._db.execute(
+            "SELECT created_at, amount, dispute_ids FROM merchant_window WHERE merchant_id = ? AND payment_id = ?",
+            (merchant_id, payment_id)
+        ).fetchone()
+        return [row[0], row[1], json.loads(row[2])] if row else None
+
+    def _read_deferred(self, payment_id: str) -> List[tuple]:
+        rows = self._db.execute(
+            "SELECT position, operation, row_data FROM deferred_disputes WHERE payment_id = ?", (payment_id,)
+        ).fetchall()
+        return [(int(position), operation, json.loads(data)) for position, operation, data in rows]
+
+    def get_document(self, entity_type: str, entity_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._read_document(entity_type, str(entity_id))
+
+    def merchant_window(self, merchant_id: str, since: str) -> Tuple[int, float, int]:
+        """(payments, total amount, disputes) of the merchant created at or after `since`."""
+        with self._lock:
+            count, amount, disputes = self._db.execute(
+                "SELECT COUNT(*), SUM(amount), SUM(disputes) FROM merchant_window "
+                "WHERE merchant_id = ? AND created_at >= ?", (str(merchant_id), since)
+            ).fetchone()
+        return count, amount or 0.0, disputes or 0
+
+    # ------------------------------------------------------------------
+    # Batches and checkpoints
+    # ------------------------------------------------------------------
+
+    def begin(self, now: Optional[datetime] = None) -> ChangeBatch:
+        return ChangeBatch(self, now or datetime.utcnow())
+
+    def commit(self, batch: ChangeBatch, checkpoints: Dict[str, int],
+               meta: Optional[Dict[str, str]] = None) -> None:
+        """
+        Write the batch's documents, merchant window rows, index rows, deferred
+        disputes and new checkpoints atomically; merchant window rows that
+        aged out are deleted.
+        """
+        batch.prune()
+        updated_at = to_iso(datetime.utcnow())
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM deferred_disputes WHERE payment_id = ?",
+                                 [(pid,) for pid in batch.released])
+            self._db.executemany(
+                "INSERT INTO deferred_disputes (payment_id, position, operation, row_data, deferred_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(pid, str(position), operation, json.dumps(row, default=str), to_iso(batch.now))
+                 for pid, changes in batch.deferred.items() for position, operation, row in changes]
+            )
+            batch.skipped['deferred_expired'] += self._db.execute(
+                "DELETE FROM deferred_disputes WHERE deferred_at < ?",
+                (to_iso(batch.now - timedelta(days=DEFERRED_RETENTION_DAYS)),)
+            ).rowcount
+            self._db.executemany("INSERT OR REPLACE INTO state_meta (key, value) VALUES (?, ?)",
+                                 list((meta or {}).items()))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entity_state (entity_type, entity_id, document) VALUES (?, ?, ?)",
+                [(t, i, json.dumps(doc)) for (t, i), doc in batch.documents.items()]
+            )
+            self._db.executemany(
+                "DELETE FROM merchant_window WHERE merchant_id = ? AND payment_id = ?",
+                [key for key, entry in batch.window.items() if entry is None]
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO merchant_window "
+                "(merchant_id, payment_id, created_at, amount, disputes, dispute_ids) VALUES (?, ?, ?, ?, ?, ?)",
+                [(merchant_id, payment_id, entry[0], entry[1], len(entry[2]), json.dumps(entry[2]))
+                 for (merchant_id, payment_id), entry in batch.window.items() if entry is not None]
+            )
+            self._db.execute("DELETE FROM merchant_window WHERE created_at < ?", (batch.window_start,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO payment_index (payment_id, image) VALUES (?, ?)",
+                [(pid, json.dumps(image)) for pid, image in batch.index.items() if image is not None]
+            )
+            # Positions can exceed 64 bits (CDC LSN + seqval): stored as text
+            self._db.executemany(
+                "INSERT OR REPLACE INTO checkpoints (source_table, position, updated_at) VALUES (?, ?, ?)",
+                [(table, str(position), updated_at) for table, position in checkpoints.items()]
+            )
+
+    def get_checkpoints(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT source_table, position FROM checkpoints").fetchall()
+        return {table: int(position) for table, position in rows}
+
+    def coverage(self) -> Dict:
+        """
+        seeded: lifetime counters include everything before the change log
+        (bootstrap from a snapshot); complete_since: earliest time from which
+        every change was consumed, when not seeded.
+        """
+        with self._lock:
+            meta = dict(self._db.execute("SELECT key, value FROM state_meta").fetchall())
+        return {'seeded': 'seeded_position' in meta, 'complete_since': meta.get('complete_since')}
+
+    def deferred_count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM deferred_disputes").fetchone()[0]
+
+    def reset(self) -> None:
+        """Empty the state (before a bootstrap)."""
+        with self._lock, self._db:
+            for table in ('entity_state', 'merchant_window', 'payment_index', 'checkpoints', 'deferred_disputes',
+                          'state_meta'):
+                self._db.execute(f"DELETE FROM {table}")
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# ============================================================================
+# READ SIDE
+# ============================================================================
+
+def _days_between(earlier: Optional[str], now: datetime) -> Optional[int]:
+    if not earlier:
+        return None
+    return (now - datetime.fromisoformat(earlier)).days
+
+
+class OnlineAggregateDataSource(FeatureDataSource):
+    """
+    FeatureDataSource serving customer/merchant aggregates from the online
+    state. Entities the consumer has not seen yet, aggregates the state does
+    not fully cover (lifetime counters before a bootstrap, windows reaching
+    before the first consumed change) and the customer activity projection
+    are served by the fallback source.
+    """
+
+    def __init__(self, state: OnlineFeatureState, fallback: FeatureDataSource):
+        self.state = state
+        self.fallback = fallback
+
+    def _covers(self, days: Optional[int] = None) -> bool:
+        """Whether the state holds every change of the last `days` days (None: lifetime)."""
+        coverage = self.state.coverage()
+        if coverage['seeded']:
+            return True
+        if days is None or coverage['complete_since'] is None:
+            return False
+        return coverage['complete_since'] <= to_iso(datetime.utcnow() - timedelta(days=days))
+
+    def _window(self, doc: Dict, days: int) -> List[list]:
+        since = to_iso(datetime.utcnow() - timedelta(days=days))
+        return [entry for entry in doc['payments'].values() if entry[0] >= since]
+
+    def get_payment_diversity(self, customer_id: str, days: int = 30) -> Dict:
+        doc = self.state.get_document(CUSTOMER, customer_id)
+        if doc is None or not self._covers(days):
+            return self.fallback.get_payment_diversity(customer_id, days)
+        entries = self._window(doc, days)
+        return {
+            'unique_cards': len({e[4] for e in entries if e[4] is not None}),
+            'unique_merchants': len({e[3] for e in entries})
+        }
+
+    def get_amount_stats(self, customer_id: str, days: int = 7) -> Dict:
+        doc = self.state.get_document(CUSTOMER, customer_id)
+        if doc is None or not self._covers(days):
+            return self.fallback.get_amount_stats(customer_id, days)
+        amounts = [e[1] for e in self._window(doc, days) if e[2] == SUCCEEDED]
+        if not amounts:
+            return {'avg_amount': None, 'stddev_amount': None, 'max_amount': None}
+        mean = sum(amounts) / len(amounts)
+        stddev = math.sqrt(sum((a - mean) ** 2 for a in amounts) / (len(amounts) - 1)) \
+            if len(amounts) > 1 else None
+        return {'avg_amount': mean, 'stddev_amount': stddev, 'max_amount': max(amounts)}
+
+    def get_customer_age_days(self, customer_id: str) -> Optional[int]:
+        doc = self.state.get_document(CUSTOMER, customer_id)
+        if doc is None or doc['created_at'] is None:
+            return self.fallback.get_customer_age_days(customer_id)
+        return _days_between(doc['created_at'], datetime.utcnow())
+
+    def get_customer_history(self, customer_id: str) -> Dict:
+        doc = self.state.get_document(CUSTOMER, customer_id)
+        if doc is None or not self._covers():
+            return self.fallback.get_customer_history(customer_id)
+        return {
+            'total_txn': doc['total_txn'],
+            'success_count': doc['success_count'],
+            'lifetime_value': doc['lifetime_value'],
+            'days_since_last': _days_between(doc['last_created_at'], datetime.utcnow())
+        }
+
+    def get_customer_dispute_count(self, customer_id: str) -> int:
+        doc = self.state.get_document(CUSTOMER, customer_id)
+        if doc is None or not self._covers():
+            return self.fallback.get_customer_dispute_count(customer_id)
+        return len(doc['disputes'])
+
+    def get_merchant_stats(self, merchant_id: str, days: int = 30) -> Optional[Dict]:
+        doc = self.state.get_document(MERCHANT, merchant_id)
+        if doc is None or doc['created_at'] is None or not self._covers(days):
+            return self.fallback.get_merchant_stats(merchant_id, days)
+        payments, amount, disputes = self.state.merchant_window(
+            merchant_id, to_iso(datetime.utcnow() - timedelta(days=days))
+        )
+        return {
+            'age_days': _days_between(doc['created_at'], datetime.utcnow()),
+            'industry': doc['industry'],
+            'dispute_rate': disputes / payments if payments else None,
+            'avg_ticket': amount / payments if payments else None
+        }
+
+    def get_customer_activity(self, customer_id: str) -> Optional[Dict]:
+        return self.fallback.get_customer_activity(customer_id)
+
+    def record_payment_event(self, event: Dict) -> None:
+        self.fallback.record_payment_event(event)
+
+    def record_payment_events(self, events: Iterable[Dict]) -> None:
+        self.fallback.record_payment_events(events)
+
+    def store_features(self, features: Dict) -> None:
+        self.fallback.store_features(features)
+
+    def store_features_batch(self, features_list: List[Dict]) -> None:
+        self.fallback.store_features_batch(features_list)
+
+    def close(self) -> None:
+        self.fallback.close()
@@ -0,0 +1,376 @@
+"""
+Distributed Fraud Model Training
+Stripe Data Architecture - ML Module
+
+Purpose: Data-parallel XGBoost training over the month-partitioned training
+         features (month=YYYYMM/*.parquet, as written by
+         pipelines/synthetic/generate.py):
+             - shards: the Parquet row groups of the date range are dealt to
+               the workers by rank; a worker reads only its own shard, no
+               process ever holds the full dataset
+             - training: XGBoost collective (Rabit tracker, allreduce): the
+               quantile sketches, split histograms, validation AUC and early
+               stopping are global, so every worker builds the same trees
+             - split: train / validation / test by a hash of transaction_id
+               (60 / 20 / 20, the proportions of prepare_data), the same on
+               every worker and for any number of workers
+             - evaluation: confusion counts and margin histograms of the
+               test shards are summed, so the test metrics need no gather of
+               predictions
+         Rank 0 returns the booster, loaded into an XGBClassifier: the
+         artifact of save_model_locally / log_to_mlflow is unchanged.
+         Workers are local processes (train), or processes on several
+         nodes joining one tracker (tracker / worker).
+
+Usage:
+    python distributed_train.py train --workers 4 --start-date 2025-04-01 --end-date 2025-10-01
+    python distributed_train.py tracker --host 10.0.0.4 --port 9091 --workers 8     # head node
+    python distributed_train.py worker --tracker 10.0.0.4:9091 --model-out fraud_model.pkl  # each node
+"""
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import time
+import traceback
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import xgboost as xgb
+from xgboost import collective
+from xgboost.tracker import RabitTracker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'features'))
+from feature_registry import FEATURE_NAMES  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+# Share of rows in train / validation (the rest is test), from a hash of transaction_id
+TRAIN_SHARE = 0.6
+VALIDATION_SHARE = 0.2
+DECISION_THRESHOLD = 0.7
+# Test AUC from margin histograms: bins over [-MARGIN_RANGE, MARGIN_RANGE]
+AUC_BINS = 20_000
+MARGIN_RANGE = 20.0
+WORKER_TIMEOUT_SECONDS = 24 * 3600
+
+
+class DistributedJob(NamedTuple):
+    root: str                   # month=YYYYMM/ training partitions
+    start_date: str             # computed_at >= start_date
+    end_date: str               # computed_at < end_date
+    params: Dict                # config.yaml model.params (XGBClassifier names)
+    threads: int = 1            # XGBoost threads per worker
+    threshold: float = DECISION_THRESHOLD
+
+
+# ============================================================================
+# SHARDS
+# ============================================================================
+
+def shard_units(root: str, start_date: str, end_date: str) -> List[Tuple[str, int]]:
+    """
+    (file, row group) of every partition overlapping the date range, in a
+    deterministic order; worker `rank` of `world` reads units[rank::world].
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    units = []
+    for month in pd.period_range(start, end - pd.Timedelta(seconds=1), freq='M'):
+        for path in sorted(glob.glob(os.path.join(root, f"month={month.strftime('%Y%m')}", '*.parquet'))):
+            units.extend((path, group) for group in range(pq.ParquetFile(path).num_row_groups))
+    return units
+
+
+def _split(transaction_id: np.ndarray) -> np.ndarray:
+    """0 train, 1 validation, 2 test: multiplicative hash of the id, independent of sharding."""
+    u = ((transaction_id.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)) / 2.0 ** 32
+    return np.where(u < TRAIN_SHARE, 0, np.where(u < TRAIN_SHARE + VALIDATION_SHARE, 1, 2))
+
+
+def read_shard(units: List[Tuple[str, int]], start_date: str,
+               end_date: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Features (float32, FEATURE_NAMES order), labels and split of this worker's row groups."""
+    start, end = np.datetime64(pd.Timestamp(start_date)), np.datetime64(pd.Timestamp(end_date))
+    blocks, labels, splits = [], [], []
+    for path, group in units:
+        table = pq.ParquetFile(path).read_row_group(
+            group, columns=['computed_at', 'transaction_id'] + FEATURE_NAMES + ['is_fraud'])
+        computed_at = table.column('computed_at').to_numpy()
+        keep = (computed_at >= start) & (computed_at < end)
+        blocks.append(np.column_stack([table.column(name).to_numpy()[keep].astype(np.float32)
+                                       for name in FEATURE_NAMES]))
+        labels.append(table.column('is_fraud').to_numpy()[keep].astype(np.int8))
+        splits.append(_split(table.column('transaction_id').to_numpy()[keep]))
+    if not blocks:
+        return np.empty((0, len(FEATURE_NAMES)), np.float32), np.empty(0, np.int8), np.empty(0, np.int64)
+    return np.concatenate(blocks), np.concatenate(labels), np.concatenate(splits)
+
+
+# ============================================================================
+# WORKER
+# ============================================================================
+
+def booster_params(params: Dict, scale_pos_weight: float, threads: int) -> Tuple[Dict, int, Optional[int]]:
+    """XGBClassifier parameters -> (xgb.train params, boosting rounds, early stopping rounds)."""
+    params = dict(params)
+    rounds = int(params.pop('n_estimators', 100))
+    early_stopping = params.pop('early_stopping_rounds', None)
+    params.pop('n_jobs', None)
+    if 'random_state' in params:
+        params['seed'] = params.pop('random_state')
+    params.update(scale_pos_weight=scale_pos_weight, nthread=threads)
+    return params, rounds, early_stopping
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_worker(job: DistributedJob) -> Optional[Dict]:
+    """
+    Body of one worker, inside a CommunicatorContext: read the shard of this
+    rank, train collectively, evaluate the test shard.
+
+    Returns:
+        On rank 0: model (UBJSON booster), scale_pos_weight, metrics, rows,
+        timings; None on the other ranks
+    """
+    rank, world = collective.get_rank(), collective.get_world_size()
+    started = time.perf_counter()
+    units = shard_units(job.root, job.start_date, job.end_date)
+    X, y, split = read_shard(units[rank::world], job.start_date, job.end_date)
+    loaded = time.perf_counter()
+
+    # Global label counts: class weight and the logged row counts
+    counts = collective.allreduce(np.array([
+        ((split == s) & (y == label)).sum() for s in range(3) for label in (0, 1)
+    ], dtype=np.float64), collective.Op.SUM)
+    train_negative, train_positive = counts[0], counts[1]
+    if train_positive == 0:
+        raise ValueError(f"No fraudulent transaction in the training split of {job.start_date}..{job.end_date}")
+    scale_pos_weight = float(train_negative / train_positive)
+    params, rounds, early_stopping = booster_params(job.params, scale_pos_weight, job.threads)
+
+    train, validation, test = (split == 0), (split == 1), (split == 2)
+    dtrain = xgb.QuantileDMatrix(X[train], y[train], feature_names=FEATURE_NAMES, nthread=job.threads)
+    dvalidation = xgb.QuantileDMatrix(X[validation], y[validation], ref=dtrain, feature_names=FEATURE_NAMES,
+                                      nthread=job.threads)
+    booster = xgb.train(params, dtrain, num_boost_round=rounds, evals=[(dvalidation, 'validation_0')],
+                        early_stopping_rounds=early_stopping, verbose_eval=100 if rank == 0 else False)
+    del dtrain, dvalidation
+    trained = time.perf_counter()
+
+    # Test shard: confusion counts at the threshold and margin histograms per class
+    best = booster.best_iteration if early_stopping else rounds - 1
+    margin = booster.predict(xgb.DMatrix(X[test], feature_names=FEATURE_NAMES, nthread=job.threads),
+                             output_margin=True, iteration_range=(0, best + 1))
+    predicted = 1 / (1 + np.exp(-margin)) >= job.threshold
+    actual = y[test] == 1
+    bins = np.clip(((margin + MARGIN_RANGE) / (2 * MARGIN_RANGE) * AUC_BINS).astype(np.int64), 0, AUC_BINS - 1)
+    evaluation = collective.allreduce(np.concatenate([
+        [(~actual & ~predicted).sum(), (~actual & predicted).sum(), (actual & ~predicted).sum(),
+         (actual & predicted).sum()],
+        np.bincount(bins[~actual], minlength=AUC_BINS), np.bincount(bins[actual], minlength=AUC_BINS),
+    ]).astype(np.float64), collective.Op.SUM)
+    evaluated = time.perf_counter()
+
+    timings = collective.allreduce(np.array([loaded - started, trained - loaded, evaluated - trained,
+                                             _peak_rss_mb()]), collective.Op.MAX)
+    if rank != 0:
+        return None
+    return {
+        'model': bytes(booster.save_raw('ubj')),
+        'scale_pos_weight': scale_pos_weight,
+        'metrics': metrics_from_counts(evaluation[:4], evaluation[4:4 + AUC_BINS], evaluation[4 + AUC_BINS:]),
+        'rows': {'train': int(counts[0] + counts[1]), 'validation': int(counts[2] + counts[3]),
+                 'test': int(counts[4] + counts[5]), 'train_fraud': int(train_positive)},
+        'workers': world,
+        'best_iteration': int(best),
+        'seconds': {'load': round(float(timings[0]), 3), 'train': round(float(timings[1]), 3),
+                    'evaluate': round(float(timings[2]), 3)},
+        'peak_rss_mb': round(float(timings[3]), 1),
+    }
+
+
+def metrics_from_counts(confusion: np.ndarray, negative_bins: np.ndarray, positive_bins: np.ndarray) -> Dict:
+    """evaluate_model's metrics from summed confusion counts and per-class margin histograms."""
+    tn, fp, fn, tp = (float(v) for v in confusion)
+    precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0.0
+    # AUC: P(score of a fraud > score of a legitimate payment), ties within a bin count half
+    negatives_below = np.concatenate([[0.0], np.cumsum(negative_bins)[:-1]])
+    pairs = negative_bins.sum() * positive_bins.sum()
+    auc = float((positive_bins * (negatives_below + 0.5 * negative_bins)).sum() / pairs) if pairs else 0.0
+    return {
+        'auc_roc': auc,
+        'precision': precision,
+        'recall': recall,
+        'f1_score': 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0,
+        'false_positive_rate': fp / (fp + tn) if fp + tn > 0 else 0.0,
+        'false_negative_rate': 1 - recall,
+        'true_negatives': int(tn),
+        'false_positives': int(fp),
+        'false_negatives': int(fn),
+        'true_positives': int(tp),
+    }
+
+
+def to_classifier(model: bytes, params: Dict, scale_pos_weight: float) -> xgb.XGBClassifier:
+    """
+    XGBClassifier around a collectively trained booster (same artifact as
+    in-process training: config params plus the class weight of the run).
+    """
+    classifier = xgb.XGBClassifier()
+    classifier.load_model(bytearray(model))
+    classifier.set_params(**{key: value for key, value in params.items() if key in classifier.get_params()})
+    classifier.set_params(scale_pos_weight=scale_pos_weight)
+    return classifier
+
+
+# ============================================================================
+# LOCAL CLUSTER
+# ============================================================================
+
+def _local_worker(tracker_args: Dict, job: DistributedJob, results) -> None:
+    logging.basicConfig(level=logging.INFO)
+    try:
+        with collective.CommunicatorContext(**tracker_args):
+            result = run_worker(job)
+        if result is not None:
+            results.put(('ok', result))
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+
+
+def train_distributed(job: DistributedJob, workers: int,
+                      host: str = '127.0.0.1') -> Tuple[xgb.XGBClassifier, Dict, Dict]:
+    """
+    Train with `workers` local processes.
+
+    Returns:
+        (classifier, test metrics, run info: rows, timings, peak RSS per worker)
+
+    Raises:
+        ValueError: fewer row groups than workers in the date range
+        RuntimeError: a worker failed
+    """
+    units = shard_units(job.root, job.start_date, job.end_date)
+    if len(units) < workers:
+        raise ValueError(f"{len(units)} row groups under {job.root} for {job.start_date}..{job.end_date}: "
+                         f"not enough to shard across {workers} workers")
+    started = time.perf_counter()
+    tracker = RabitTracker(host_ip=host, n_workers=workers)
+    tracker.start()
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_local_worker, args=(tracker.worker_args(), job, results), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    logger.info(f"Training on {workers} worker processes, {len(units)} row groups")
+
+    status, result = None, None
+    deadline = time.monotonic() + WORKER_TIMEOUT_SECONDS
+    while status is None and time.monotonic() < deadline:
+        try:
+            status, result = results.get(timeout=1.0)
+        except queue.Empty:
+            if any(p.exitcode not in (None, 0) for p in processes):
+                status, result = 'error', f"worker exit codes {[p.exitcode for p in processes]}"
+    if status != 'ok':
+        for process in processes:
+            process.terminate()
+        raise RuntimeError(f"Distributed training failed: {result or 'timeout'}")
+    for process in processes:
+        process.join()
+    tracker.wait_for()
+
+    classifier = to_classifier(result.pop('model'), job.params, result.pop('scale_pos_weight'))
+    result['seconds']['total'] = round(time.perf_counter() - started, 3)
+    logger.info(f"Trained {result['rows']['train']:,} rows on {workers} workers in "
+                f"{result['seconds']['total']:.1f} s (best iteration {result['best_iteration']}, "
+                f"peak RSS per worker {result['peak_rss_mb']:.0f} MB)")
+    return classifier, result.pop('metrics'), result
+
+
+# ============================================================================
+# MULTI-NODE
+# ============================================================================
+
+def _job_from_args(args) -> DistributedJob:
+    import yaml
+    with open(args.config) as f:
+        config = yaml.safe_load(f)
+    root = args.data or config['data']['training_features']
+    if not os.path.isabs(root):
+        root = os.path.join(os.path.dirname(os.path.abspath(args.config)), root)
+    return DistributedJob(root, args.start_date, args.end_date, config['model']['params'], args.threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data-parallel fraud model training (XGBoost collective)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def job_arguments(command):
+        command.add_argument('--config', default='config.yaml')
+        command.add_argument('--data', help='Training partitions (default: data.training_features)')
+        command.add_argument('--start-date', default='2025-04-01')
+        command.add_argument('--end-date', default='2025-10-01')
+        command.add_argument('--threads', type=int, default=1, help='XGBoost threads per worker')
+        command.add_argument('--model-out', default='fraud_model.pkl')
+        command.add_argument('--metrics-out', default='metrics.json')
+
+    train = commands.add_parser('train', help='Local cluster of worker processes')
+    job_arguments(train)
+    train.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    tracker = commands.add_parser('tracker', help='Start the tracker that workers of all nodes join')
+    tracker.add_argument('--host', required=True, help='Address reachable from every node')
+    tracker.add_argument('--port', type=int, default=9091)
+    tracker.add_argument('--workers', type=int, required=True, help='Total worker processes')
+
+    worker = commands.add_parser('worker', help='Join a tracker (rank 0 writes the model)')
+    job_arguments(worker)
+    worker.add_argument('--tracker', required=True, help='host:port of the tracker')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    import joblib
+
+    if args.command == 'tracker':
+        rabit = RabitTracker(host_ip=args.host, n_workers=args.workers, port=args.port)
+        rabit.start()
+        logger.info(f"Tracker listening: {rabit.worker_args()}; waiting for {args.workers} workers")
+        rabit.wait_for()
+        return
+
+    job = _job_from_args(args)
+    if args.command == 'train':
+        model, metrics, info = train_distributed(job, args.workers)
+    else:
+        host, port = args.tracker.rsplit(':', 1)
+        with collective.CommunicatorContext(dmlc_tracker_uri=host, dmlc_tracker_port=int(port)):
+            result = run_worker(job)
+        if result is None:
+            return
+        model = to_classifier(result.pop('model'), job.params, result.pop('scale_pos_weight'))
+        metrics, info = result.pop('metrics'), result
+    joblib.dump(model, args.model_out)
+    with open(args.metrics_out, 'w') as f:
+        json.dump({'metrics': metrics, **info}, f, indent=2)
+    logger.info(f"Model saved to {args.model_out}: AUC {metrics['auc_roc']:.4f}, "
+                f"recall {metrics['recall']:.4f}, precision {metrics['precision']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,11 +18,19 @@ import mlflow
 import mlflow.xgboost
 from mlflow.tracking import MlflowClient  # <-- CORRECT, pas azure.ai.mlflow
 from datetime import datetime
+import glob
 import logging
+import os
+import sys
 import yaml
 import joblib
+import pyarrow.parquet as pq
 from typing import Tuple, Dict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'pipelines', 'synthetic'))
+from synthetic_data import FEATURE_NAMES, GeneratorConfig, training_frame  # noqa: E402
+from distributed_train import DistributedJob, train_distributed  # noqa: E402
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -40,6 +48,8 @@ class FraudModelTrainer:
         """
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
+        self.config_path = config_path
+        self.config_dir = os.path.dirname(os.path.abspath(config_path))
         
         # MLflow setup
         mlflow.set_tracking_uri(self.config['mlflow']['tracking_uri'])
@@ -50,42 +60,65 @@ class FraudModelTrainer:
     
     def load_training_data(self, start_date: str, end_date: str) -> pd.DataFrame:
         """
-        Load training data from feature store.
+        Load training data: FEATURE_NAMES + is_fraud of the transactions
+        computed in [start_date, end_date).
+
+        Reads the month partitions written by pipelines/synthetic/generate.py
+        (data.training_features); when they are absent, generates the same
+        synthetic data in memory (data.synthetic_rows, data.seed).
         """
         logger.info(f"Loading training data from {start_date} to {end_date}")
-        
-        # Demo: Génère données synthétiques ; en prod : requête sur feature store réel
-        n_samples = 1_000_000
-        data = {
-            # ... (les mêmes 45 features que dans ton code initial)
-            'transaction_count_1h': np.random.poisson(2, n_samples),
-            'transaction_count_24h': np.random.poisson(10, n_samples),
-            'transaction_count_7d': np.random.poisson(50, n_samples),
-            'transaction_count_30d': np.random.poisson(200, n_samples),
-            'unique_cards_30d': np.random.randint(1, 5, n_samples),
-            'unique_merchants_30d': np.random.randint(1, 10, n_samples),
-            # ... (toutes les autres features inchangées)
-            'merchant_industry_risk': np.random.choice([0, 1, 2], n_samples, p=[0.7, 0.2, 0.1]),
-            'time_of_day': np.random.randint(0, 24, n_samples),
-            'day_of_week': np.random.randint(0, 7, n_samples),
-            'is_weekend': np.random.binomial(1, 2/7, n_samples),
-            'is_holiday': np.random.binomial(1, 0.03, n_samples),
-            'shipping_address_mismatch': np.random.binomial(1, 0.2, n_samples),
-        }
-        df = pd.DataFrame(data)
-        fraud_prob = (
-            0.01 + 0.15 * df['card_country_mismatch'] +
-            0.20 * df['ip_country_mismatch'] +
-            0.10 * df['device_fingerprint_new'] +
-            0.15 * df['email_domain_disposable'] +
-            0.10 * df['high_risk_country'] +
-            0.05 * (df['velocity_km_per_hour'] > 500)
-        )
-        fraud_prob = np.clip(fraud_prob, 0, 1)
-        df['is_fraud'] = np.random.binomial(1, fraud_prob)
+        start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        data_config = self.config.get('data', {})
+        root = self._training_features_root()
+
+        files = []
+        if root and os.path.isdir(root):
+            for month in pd.period_range(start, end - pd.Timedelta(seconds=1), freq='M'):
+                files.extend(sorted(glob.glob(os.path.join(root, f"month={month.strftime('%Y%m')}", '*.parquet'))))
+        if files:
+            table = pq.ParquetDataset(files, filters=[('computed_at', '>=', start), ('computed_at', '<', end)])
+            df = table.read(columns=FEATURE_NAMES + ['is_fraud']).to_pandas()
+            logger.info(f"Read {len(files)} files from {root}")
+        else:
+            logger.info(f"No training partitions under {root}: generating synthetic data in memory")
+            df = training_frame(GeneratorConfig(n_transactions=data_config.get('synthetic_rows', 1_000_000),
+                                                seed=data_config.get('seed', 42)), start, end)
         logger.info(f"Loaded {len(df)} samples, fraud rate: {df['is_fraud'].mean():.2%}")
         return df
 
+    def _training_features_root(self):
+        root = self.config.get('data', {}).get('training_features')
+        if root and not os.path.isabs(root):
+            root = os.path.join(self.config_dir, root)
+        return root
+
+    def train_distributed(self, start_date: str, end_date: str, workers: int) -> Tuple:
+        """
+        Data-parallel training on `workers` processes (distributed_train.py):
+        each worker reads a shard of the training partitions, the trees are
+        built collectively, test metrics are reduced across workers.
+
+        Returns:
+            (model, metrics) - same model artifact as train_model
+
+        Raises:
+            ValueError: no training partitions (the in-memory fallback is
+                        single-process only) or fewer row groups than workers
+        """
+        root = self._training_features_root()
+        if not root or not os.path.isdir(root):
+            raise ValueError(f"Distributed training reads the training partitions: {root} not found "
+                             f"(pipelines/synthetic/generate.py --outputs training)")
+        threads = self.config.get('distributed', {}).get('threads_per_worker') or \
+            max(1, (os.cpu_count() or 1) // workers)
+        job = DistributedJob(root, start_date, end_date, self.config['model']['params'], threads)
+        model, metrics, info = train_distributed(job, workers)
+        logger.info(f"Rows: {info['rows']}, timings: {info['seconds']}")
+        logger.info(f"  AUC-ROC: {metrics['auc_roc']:.4f}, Precision: {metrics['precision']:.4f}, "
+                    f"Recall: {metrics['recall']:.4f}")
+        return model, metrics
+
     def prepare_data(self, df: pd.DataFrame) -> Tuple:
         logger.info("Preparing data for training")
         X = df.drop('is_fraud', axis=1)
@@ -105,13 +138,13 @@ class FraudModelTrainer:
         logger.info("Training XGBoost model")
         scale_pos_weight = len(y_train[y_train == 0]) / len(y_train[y_train == 1])
         logger.info(f"Scale pos weight: {scale_pos_weight:.2f}")
-        params = self.config['model']['params']
+        # early_stopping_rounds is a constructor parameter (config.yaml) since XGBoost 2
+        params = dict(self.config['model']['params'])
         params['scale_pos_weight'] = scale_pos_weight
         model = xgb.XGBClassifier(**params)
         model.fit(
             X_train, y_train,
             eval_set=[(X_val, y_val)],
-            early_stopping_rounds=50,
             verbose=100
         )
         logger.info(f"Training completed. Best iteration: {model.best_iteration}")
@@ -176,7 +209,7 @@ class FraudModelTrainer:
             )
             feature_importance.to_csv('feature_importance.csv', index=False)
             mlflow.log_artifact('feature_importance.csv')
-            mlflow.log_artifact('config.yaml')
+            mlflow.log_artifact(self.config_path)
             mlflow.set_tags({
                 'model_type': 'xgboost',
                 'version': '2.3.1',
@@ -191,17 +224,23 @@ class FraudModelTrainer:
         joblib.dump(model, path)
         logger.info(f"Model saved to {path}")
 
-    def run_training_pipeline(self, start_date: str, end_date: str) -> Dict:
+    def run_training_pipeline(self, start_date: str, end_date: str, workers: int = None) -> Dict:
         logger.info("=" * 60)
         logger.info("FRAUD DETECTION MODEL TRAINING PIPELINE")
         logger.info("=" * 60)
-        df = self.load_training_data(start_date, end_date)
-        X_train, X_val, X_test, y_train, y_val, y_test = self.prepare_data(df)
-        model = self.train_model(X_train, y_train, X_val, y_val)
-        metrics = self.evaluate_model(model, X_test, y_test)
+        workers = workers or self.config.get('distributed', {}).get('workers', 1)
+        if workers > 1:
+            model, metrics = self.train_distributed(start_date, end_date, workers)
+            feature_names = FEATURE_NAMES
+        else:
+            df = self.load_training_data(start_date, end_date)
+            X_train, X_val, X_test, y_train, y_val, y_test = self.prepare_data(df)
+            model = self.train_model(X_train, y_train, X_val, y_val)
+            metrics = self.evaluate_model(model, X_test, y_test)
+            feature_names = X_train.columns.tolist()
         feature_importance = self.analyze_feature_importance(
             model, 
-            X_train.columns.tolist()
+            feature_names
         )
         run_id = self.log_to_mlflow(model, metrics, feature_importance)
         self.save_model_locally(model)
@@ -277,9 +316,10 @@ if __name__ == "__main__":
     parser.add_argument('--start-date', default='2025-04-01', help='Training data start date')
     parser.add_argument('--end-date', default='2025-10-01', help='Training data end date')
     parser.add_argument('--config', default='config.yaml', help='Config file path')
+    parser.add_argument('--workers', type=int, help='Data-parallel worker processes (default: distributed.workers)')
     args = parser.parse_args()
     trainer = FraudModelTrainer(config_path=args.config)
-    result = trainer.run_training_pipeline(args.start_date, args.end_date)
+    result = trainer.run_training_pipeline(args.start_date, args.end_date, args.workers)
     print("\n" + "=" * 60)
     print("TRAINING SUMMARY")
     print("=" * 60)
@@ -0,0 +1,243 @@
+"""
+Label Store for Delayed-Label Monitoring
+Stripe Data Architecture - ML Module
+
+Purpose: Persist the predictions that chargeback labels are joined
+         against, outside the scoring process. Labels mature over weeks
+         and a chargeback reaches whichever API worker the load balancer
+         picks, so the join cannot live in a worker's memory:
+             - sampling: a prediction is kept when the CRC32 of its
+               payment_id falls under label_sample_rate, with an explicit
+               weight 1 / rate; every worker and the chargeback endpoint
+               make the same decision for the same payment_id
+             - one shared store for all workers: SQLite (one host, WAL) or
+               the Cosmos DB model_labels container (partition key
+               /payment_id, TTL past the label window)
+             - precision / recall are computed per matured cohort (payments
+               scored between maturity + window and maturity ago): flagged
+               and labeled = TP, flagged and unlabeled = FP, and so on
+
+Sizing: rows held = sample rate x predictions/s x (maturity + window) in
+seconds; 0.1% of 10,000 req/s over 90 days is ~7.8M rows.
+"""
+
+import logging
+import sqlite3
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SAMPLE_RATE = 0.001
+
+# (payment_id, scored_at epoch seconds, flagged, weight)
+PredictionRow = Tuple[str, float, bool, float]
+# (payment_id, labeled_at epoch seconds)
+LabelRow = Tuple[str, float]
+
+
+def in_label_sample(payment_id: str, rate: float) -> bool:
+    """Deterministic sampling decision for payment_id (same in every process)."""
+    return zlib.crc32(str(payment_id).encode()) < rate * 2 ** 32
+
+
+# ============================================================================
+# INTERFACE
+# ============================================================================
+
+class LabelStore(ABC):
+    """Sampled predictions and their chargeback labels, shared by all API workers."""
+
+    @abstractmethod
+    def add_predictions(self, rows: List[PredictionRow]) -> None:
+        """Upsert predictions; a rescored payment keeps the latest decision and its label."""
+
+    @abstractmethod
+    def add_labels(self, rows: List[LabelRow]) -> int:
+        """Mark predictions as fraud; returns labels without a stored prediction."""
+
+    @abstractmethod
+    def confusion(self, scored_from: float, scored_to: float) -> Tuple[float, float, float, float]:
+        """Weighted (TP, FP, FN, TN) of the predictions scored in [scored_from, scored_to)."""
+
+    @abstractmethod
+    def prune(self, before: float) -> int:
+        """Drop predictions scored before `before`; returns rows removed."""
+
+    @abstractmethod
+    def size(self) -> int:
+        """Predictions held."""
+
+    def close(self) -> None:
+        pass
+
+
+def _confusion(groups: Iterable[Tuple[bool, bool, float]]) -> Tuple[float, float, float, float]:
+    tp = fp = fn = tn = 0.0
+    for flagged, labeled, weight in groups:
+        weight = weight or 0.0
+        if flagged and labeled:
+            tp += weight
+        elif flagged:
+            fp += weight
+        elif labeled:
+            fn += weight
+        else:
+            tn += weight
+    return tp, fp, fn, tn
+
+
+# ============================================================================
+# SQLITE (single host)
+# ============================================================================
+
+class SQLiteLabelStore(LabelStore):
+    """
+    Label store in a SQLite file, shared by the worker processes of one host
+    (WAL journal, writers serialized by SQLite's lock).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != ':memory:':
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            " payment_id TEXT PRIMARY KEY, scored_at REAL NOT NULL, flagged INTEGER NOT NULL,"
+            " weight REAL NOT NULL, labeled_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_predictions_scored_at ON predictions(scored_at)")
+
+    def add_predictions(self, rows: List[PredictionRow]) -> None:
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT INTO predictions (payment_id, scored_at, flagged, weight) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(payment_id) DO UPDATE SET scored_at = excluded.scored_at,"
+                    " flagged = excluded.flagged, weight = excluded.weight",
+                    [(payment_id, scored_at, int(flagged), weight)
+                     for payment_id, scored_at, flagged, weight in rows]
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def add_labels(self, rows: List[LabelRow]) -> int:
+        unmatched = 0
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for payment_id, labeled_at in rows:
+                    cursor = self.conn.execute(
+                        "UPDATE predictions SET labeled_at = COALESCE(labeled_at, ?) WHERE payment_id = ?",
+                        (labeled_at, payment_id)
+                    )
+                    unmatched += cursor.rowcount == 0
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return unmatched
+
+    def confusion(self, scored_from: float, scored_to: float) -> Tuple[float, float, float, float]:
+        with self._lock:
+            groups = self.conn.execute(
+                "SELECT flagged, labeled_at IS NOT NULL, SUM(weight) FROM predictions"
+                " WHERE scored_at >= ? AND scored_at < ? GROUP BY 1, 2",
+                (scored_from, scored_to)
+            ).fetchall()
+        return _confusion(groups)
+
+    def prune(self, before: float) -> int:
+        with self._lock:
+            return self.conn.execute("DELETE FROM predictions WHERE scored_at < ?", (before,)).rowcount
+
+    def size(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+# ============================================================================
+# COSMOS DB (all replicas)
+# ============================================================================
+
+def _not_found(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 404
+
+
+class CosmosLabelStore(LabelStore):
+    """
+    Label store in the Cosmos DB model_labels container (models/nosql/collections.json):
+    one document per sampled payment_id, point-patched by labels, expired by TTL.
+    """
+
+    def __init__(self, container):
+        """
+        Args:
+            container: model_labels ContainerProxy (or a compatible stand-in)
+        """
+        self.container = container
+
+    @classmethod
+    def connect(cls, cosmos_endpoint: str, database: str = 'stripe_nosql_db') -> 'CosmosLabelStore':
+        from azure.cosmos import CosmosClient
+        from azure.identity import DefaultAzureCredential
+
+        client = CosmosClient(cosmos_endpoint, credential=DefaultAzureCredential())
+        return cls(client.get_database_client(database).get_container_client('model_labels'))
+
+    def add_predictions(self, rows: List[PredictionRow]) -> None:
+        for payment_id, scored_at, flagged, weight in rows:
+            fields = {'scored_at': scored_at, 'flagged': bool(flagged), 'weight': weight}
+            try:
+                # Patch, not upsert: a rescored payment keeps its labeled_at
+                self.container.patch_item(item=payment_id, partition_key=payment_id,
+                                          patch_operations=[{'op': 'set', 'path': f"/{name}", 'value': value}
+                                                            for name, value in fields.items()])
+            except Exception as e:
+                if not _not_found(e):
+                    raise
+                self.container.upsert_item({'id': payment_id, 'payment_id': payment_id, **fields})
+
+    def add_labels(self, rows: List[LabelRow]) -> int:
+        unmatched = 0
+        for payment_id, labeled_at in rows:
+            try:
+                self.container.patch_item(item=payment_id, partition_key=payment_id,
+                                          patch_operations=[{'op': 'set', 'path': '/labeled_at',
+                                                             'value': labeled_at}])
+            except Exception as e:
+                if not _not_found(e):
+                    raise
+                unmatched += 1
+        return unmatched
+
+    def confusion(self, scored_from: float, scored_to: float) -> Tuple[float, float, float, float]:
+        groups = self.container.query_items(
+            "SELECT c.flagged, IS_DEFINED(c.labeled_at) AS labeled, SUM(c.weight) AS weight FROM c"
+            " WHERE c.scored_at >= @from AND c.scored_at < @to GROUP BY c.flagged, IS_DEFINED(c.labeled_at)",
+            parameters=[{'name': '@from', 'value': scored_from}, {'name': '@to', 'value': scored_to}],
+            enable_cross_partition_query=True
+        )
+        return _confusion((g['flagged'], g['labeled'], g['weight']) for g in groups)
+
+    def prune(self, before: float) -> int:
+        # Expired by the container's defaultTtl
+        return 0
+
+    def size(self) -> int:
+        counts = list(self.container.query_items("SELECT VALUE COUNT(1) FROM c",
+                                                 enable_cross_partition_query=True))
+        return int(sum(counts))
+
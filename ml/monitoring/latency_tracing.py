@@ -0,0 +1,166 @@
+"""
+Latency Tracing for the Fraud Scoring Path
+Stripe Data Architecture - ML Module
+
+Purpose: Lightweight nested timing spans exported as Prometheus histograms,
+         so the P99 can be attributed to a feature category, a single
+         DB/Cosmos call or an inference stage.
+
+Usage:
+    with span('velocity'):
+        with span('cosmos.velocity_1h'):
+            ...
+
+Spans nest per thread; the exported label is the slash-separated path of the
+enclosing spans (e.g. "compute_features/velocity/cosmos.velocity_1h").
+Span names are static strings from the code, so label cardinality is bounded.
+
+Tracing is toggled with FRAUD_TRACING_ENABLED (default "1") or set_enabled().
+When disabled, span() returns a shared no-op context manager (~0.2 us).
+"""
+
+import logging
+import os
+import threading
+from functools import wraps
+from time import perf_counter_ns
+from typing import Callable, List, Optional, Tuple
+
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+# Buckets concentrated around the 50ms P99 SLO, with sub-millisecond
+# resolution for individual lookups
+SPAN_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.0075, 0.01,
+    0.015, 0.02, 0.03, 0.04, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0
+)
+
+SPAN_LATENCY = Histogram(
+    'fraud_span_latency_seconds', 'Latency of traced pipeline stages',
+    ['span'], buckets=SPAN_BUCKETS
+)
+
+_enabled = os.environ.get('FRAUD_TRACING_ENABLED', '1').lower() not in ('0', 'false', 'no')
+_local = threading.local()
+# span path -> histogram child; labels() is too slow to call per span
+_histograms = {}
+
+
+def set_enabled(enabled: bool) -> None:
+    """Enable or disable tracing process-wide."""
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+class _NoopSpan:
+    """Shared span returned while tracing is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """Active span: records its duration on exit."""
+
+    __slots__ = ('path', 'start_ns', 'parent_path')
+
+    def __init__(self, name: str):
+        self.parent_path = getattr(_local, 'path', None)
+        self.path = f"{self.parent_path}/{name}" if self.parent_path else name
+        self.start_ns = 0
+
+    def __enter__(self):
+        _local.path = self.path
+        if self.parent_path is None:
+            _local.completed = []
+        self.start_ns = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed_ns = perf_counter_ns() - self.start_ns
+        _local.path = self.parent_path
+        histogram = _histograms.get(self.path)
+        if histogram is None:
+            histogram = _histograms.setdefault(self.path, SPAN_LATENCY.labels(span=self.path))
+        histogram.observe(elapsed_ns / 1e9)
+        completed = getattr(_local, 'completed', None)
+        if completed is not None:
+            completed.append((self.path, elapsed_ns / 1e6))
+        return False
+
+
+def span(name: str):
+    """
+    Context manager timing a pipeline stage.
+
+    Args:
+        name: Static stage name (never include IDs or other unbounded values)
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def traced(name: str) -> Callable:
+    """Decorator form of span()."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            with _Span(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def last_trace() -> List[Tuple[str, float]]:
+    """
+    Spans completed on this thread since the last root span started,
+    as (path, elapsed_ms) in completion order. Useful for slow-request logs.
+    """
+    return list(getattr(_local, 'completed', None) or [])
+
+
+def format_trace(trace: Optional[List[Tuple[str, float]]] = None) -> str:
+    """Render a trace as an indented tree, slowest paths easy to spot."""
+    trace = last_trace() if trace is None else trace
+    lines = []
+    for path, elapsed_ms in sorted(trace, key=lambda item: item[0]):
+        depth = path.count('/')
+        lines.append(f"{'  ' * depth}{path.rsplit('/', 1)[-1]}: {elapsed_ms:.3f}ms")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    # Measure per-span overhead in both modes
+    import timeit
+
+    n = 1_000_000
+
+    def run():
+        with span('bench'):
+            pass
+
+    set_enabled(False)
+    disabled_ns = timeit.timeit(run, number=n) / n * 1e9
+    set_enabled(True)
+    enabled_ns = timeit.timeit(run, number=n // 10) / (n // 10) * 1e9
+
+    print(f"Span overhead disabled: {disabled_ns:.0f}ns")
+    print(f"Span overhead enabled:  {enabled_ns:.0f}ns")
@@ -0,0 +1,485 @@
+"""
+Model Monitoring for Fraud Detection
+Stripe Data Architecture - ML Module
+
+Purpose: Track score distribution, decision rates per risk level,
+         per-merchant decline-rate anomalies and delayed-label
+         precision/recall once chargebacks arrive.
+
+All aggregation happens on a background thread: the scoring path only
+enqueues a small tuple and never waits on the monitor. Delayed labels are
+joined in a LabelStore shared by every worker (label_store.py), on a
+hash sample of payment_ids.
+"""
+
+import logging
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from label_store import DEFAULT_SAMPLE_RATE, LabelStore, in_label_sample
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# CONSTANTS
+# ============================================================================
+
+RISK_LEVELS = ['low', 'medium', 'high', 'critical']
+DECISIONS = ['approve', 'monitor', 'review', 'decline']
+FLAGGED_DECISIONS = ('review', 'decline')
+
+# Score buckets are finer above the review threshold (0.70)
+SCORE_BUCKETS = (
+    0.05, 0.10, 0.20, 0.30, 0.40, 0.50, 0.60, 0.70,
+    0.80, 0.90, 0.95, 0.98, 0.99, 1.0
+)
+
+
+# ============================================================================
+# PROMETHEUS METRICS
+# ============================================================================
+
+# Label values are restricted to the fixed risk level / decision sets;
+# merchant_id is deliberately never used as a label.
+SCORE_DISTRIBUTION = Histogram(
+    'fraud_model_score', 'Distribution of fraud scores', buckets=SCORE_BUCKETS
+)
+DECISION_COUNT = Counter(
+    'fraud_model_decisions_total', 'Scoring decisions', ['risk_level', 'decision']
+)
+DECISION_RATE = Gauge(
+    'fraud_model_decision_rate', 'Rolling share of predictions per risk level', ['risk_level']
+)
+MERCHANT_ANOMALIES = Gauge(
+    'fraud_model_merchant_decline_anomalies', 'Merchants with an anomalous rolling decline rate'
+)
+TRACKED_MERCHANTS = Gauge(
+    'fraud_model_tracked_merchants', 'Merchants currently held in the rolling window'
+)
+LABELED_PRECISION = Gauge(
+    'fraud_model_labeled_precision', 'Precision of the matured cohort on chargeback labels'
+)
+LABELED_RECALL = Gauge(
+    'fraud_model_labeled_recall', 'Recall of the matured cohort on chargeback labels'
+)
+LABEL_STORE_PREDICTIONS = Gauge(
+    'fraud_model_label_store_predictions', 'Sampled predictions held in the label store'
+)
+MONITOR_EVENTS_DROPPED = Counter(
+    'fraud_model_monitor_events_dropped_total', 'Monitoring events dropped', ['reason']
+)
+
+
+# ============================================================================
+# ROLLING AGGREGATES
+# ============================================================================
+
+class RollingCounter:
+    """
+    Fixed ring of time slots, each holding a small vector of counts.
+    Slots older than the window are recycled, so memory never grows.
+    """
+
+    def __init__(self, n_slots: int, slot_seconds: float, width: int):
+        """
+        Args:
+            n_slots: Number of slots in the window
+            slot_seconds: Duration covered by each slot
+            width: Number of counters per slot
+        """
+        self.n_slots = n_slots
+        self.slot_seconds = slot_seconds
+        self.width = width
+        self.slots = [[0] * width for _ in range(n_slots)]
+        self.slot_ids = [-1] * n_slots
+
+    def add(self, index: int, now: float, amount: int = 1) -> None:
+        """Add `amount` to counter `index` in the slot covering `now`."""
+        slot_id = int(now // self.slot_seconds)
+        pos = slot_id % self.n_slots
+        if self.slot_ids[pos] != slot_id:
+            self.slots[pos] = [0] * self.width
+            self.slot_ids[pos] = slot_id
+        self.slots[pos][index] += amount
+
+    def totals(self, now: float) -> List[int]:
+        """Sum of each counter over the slots still inside the window."""
+        oldest = int(now // self.slot_seconds) - self.n_slots + 1
+        result = [0] * self.width
+        for slot_id, counts in zip(self.slot_ids, self.slots):
+            if slot_id >= oldest:
+                for i, value in enumerate(counts):
+                    result[i] += value
+        return result
+
+
+class MerchantDeclineTracker:
+    """
+    Rolling (total, declined) counts per merchant with LRU eviction.
+    At most `max_merchants` windows are held at any time.
+    """
+
+    def __init__(self, max_merchants: int, n_slots: int, slot_seconds: float):
+        self.max_merchants = max_merchants
+        self.n_slots = n_slots
+        self.slot_seconds = slot_seconds
+        self.windows: 'OrderedDict[str, RollingCounter]' = OrderedDict()
+        self.evicted = 0
+
+    def add(self, merchant_id: str, declined: bool, now: float) -> None:
+        window = self.windows.get(merchant_id)
+        if window is None:
+            if len(self.windows) >= self.max_merchants:
+                self.windows.popitem(last=False)
+                self.evicted += 1
+            window = RollingCounter(self.n_slots, self.slot_seconds, 2)
+            self.windows[merchant_id] = window
+        else:
+            self.windows.move_to_end(merchant_id)
+        window.add(0, now)
+        if declined:
+            window.add(1, now)
+
+    def find_anomalies(self, now: float, min_volume: int,
+                       z_threshold: float) -> List[Dict]:
+        """
+        Flag merchants whose decline rate is significantly above the
+        platform-wide rate (one-sided binomial z-test).
+        """
+        per_merchant = []
+        global_total = 0
+        global_declined = 0
+        for merchant_id, window in self.windows.items():
+            total, declined = window.totals(now)
+            if total == 0:
+                continue
+            per_merchant.append((merchant_id, total, declined))
+            global_total += total
+            global_declined += declined
+
+        if global_total == 0:
+            return []
+
+        base_rate = global_declined / global_total
+        anomalies = []
+        for merchant_id, total, declined in per_merchant:
+            if total < min_volume:
+                continue
+            rate = declined / total
+            stddev = math.sqrt(max(base_rate * (1 - base_rate), 1e-9) / total)
+            z_score = (rate - base_rate) / stddev
+            if z_score >= z_threshold:
+                anomalies.append({
+                    'merchant_id': merchant_id,
+                    'transactions': total,
+                    'decline_rate': rate,
+                    'baseline_rate': base_rate,
+                    'z_score': z_score
+                })
+
+        anomalies.sort(key=lambda a: a['z_score'], reverse=True)
+        return anomalies
+
+
+# ============================================================================
+# MODEL MONITOR
+# ============================================================================
+
+class ModelMonitor:
+    """
+    Asynchronous model monitor.
+
+    `record_prediction` and `record_chargeback` only enqueue; a daemon
+    thread applies events to bounded rolling aggregates, writes sampled
+    predictions and labels to the label store and refreshes the
+    Prometheus gauges.
+    """
+
+    def __init__(self,
+                 window_seconds: int = 3600,
+                 slot_seconds: int = 300,
+                 max_merchants: int = 10_000,
+                 min_merchant_volume: int = 50,
+                 anomaly_z_threshold: float = 4.0,
+                 label_store: Optional[LabelStore] = None,
+                 label_sample_rate: float = DEFAULT_SAMPLE_RATE,
+                 label_maturity_days: int = 60,
+                 label_window_days: int = 30,
+                 label_refresh_interval: float = 600.0,
+                 queue_size: int = 100_000,
+                 refresh_interval: float = 10.0):
+        """
+        Initialize monitor.
+
+        Args:
+            window_seconds: Rolling window for decision rates and merchant stats
+            slot_seconds: Granularity of the rolling window
+            max_merchants: Upper bound on merchants tracked at once
+            min_merchant_volume: Minimum transactions before a merchant is tested
+            anomaly_z_threshold: z-score above which a decline rate is anomalous
+            label_store: Shared store joining predictions and chargebacks
+                         (None: no delayed-label metrics)
+            label_sample_rate: Share of payment_ids kept in the label store
+            label_maturity_days: Age after which an unlabeled prediction counts as legitimate
+            label_window_days: Scoring-time span of the matured cohort
+            label_refresh_interval: Seconds between precision/recall queries on the store
+            queue_size: Capacity of the event queue (events are dropped when full)
+            refresh_interval: Seconds between gauge refreshes
+        """
+        n_slots = max(1, window_seconds // slot_seconds)
+        self.min_merchant_volume = min_merchant_volume
+        self.anomaly_z_threshold = anomaly_z_threshold
+        self.label_store = label_store
+        self.label_sample_rate = label_sample_rate
+        self.label_maturity_seconds = label_maturity_days * 86400
+        self.label_window_seconds = label_window_days * 86400
+        self.label_refresh_interval = label_refresh_interval
+        self.refresh_interval = refresh_interval
+
+        self._risk_levels = RollingCounter(n_slots, slot_seconds, len(RISK_LEVELS))
+        self._merchants = MerchantDeclineTracker(max_merchants, n_slots, slot_seconds)
+        # Sampled rows waiting for the next label store write (monitor thread only)
+        self._new_predictions: List[tuple] = []
+        self._new_labels: List[tuple] = []
+        self._labeled = {'confusion': (0.0, 0.0, 0.0, 0.0), 'stored': 0, 'refreshed_at': None}
+        self._next_label_refresh = 0.0
+        self._anomalies: List[Dict] = []
+
+        self._events: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------
+    # Request-path API (non-blocking)
+    # ------------------------------------------------------------------
+
+    def record_prediction(self, payment_id: str, merchant_id: str,
+                          fraud_score: float, risk_level: str,
+                          decision: str) -> None:
+        """Enqueue a scored prediction. Never blocks the caller."""
+        self._enqueue(('prediction', time.time(), payment_id, merchant_id,
+                       fraud_score, risk_level, decision))
+
+    def record_chargeback(self, payment_id: str) -> None:
+        """Enqueue a fraud label (chargeback or confirmed fraud) for a payment."""
+        self._enqueue(('chargeback', time.time(), payment_id))
+
+    def _enqueue(self, event: tuple) -> None:
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            MONITOR_EVENTS_DROPPED.labels(reason='queue_full').inc()
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Start the aggregation thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='model-monitor', daemon=True
+        )
+        self._thread.start()
+        logger.info("Model monitor started")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Drain pending events and stop the aggregation thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info("Model monitor stopped")
+
+    def _run(self) -> None:
+        next_refresh = time.time() + self.refresh_interval
+        while not (self._stop.is_set() and self._events.empty()):
+            try:
+                event = self._events.get(timeout=min(self.refresh_interval, 1.0))
+            except queue.Empty:
+                event = None
+
+            if event is not None:
+                batch = [event]
+                # Apply whatever else is already queued under one lock acquisition
+                while len(batch) < 10_000:
+                    try:
+                        batch.append(self._events.get_nowait())
+                    except queue.Empty:
+                        break
+                with self._lock:
+                    for item in batch:
+                        self._apply(item)
+                self._write_labels()
+
+            now = time.time()
+            if now >= next_refresh:
+                self.refresh(now)
+                next_refresh = now + self.refresh_interval
+
+        self.refresh(time.time())
+
+    # ------------------------------------------------------------------
+    # Aggregation (monitor thread only)
+    # ------------------------------------------------------------------
+
+    def _apply(self, event: tuple) -> None:
+        try:
+            if event[0] == 'prediction':
+                self._apply_prediction(*event[1:])
+            elif event[0] == 'chargeback':
+                self._apply_chargeback(*event[1:])
+        except Exception as e:
+            MONITOR_EVENTS_DROPPED.labels(reason='invalid_event').inc()
+            logger.warning(f"Dropped monitoring event: {e}")
+
+    def _apply_prediction(self, now: float, payment_id: str, merchant_id: str,
+                          fraud_score: float, risk_level: str,
+                          decision: str) -> None:
+        if risk_level not in RISK_LEVELS or decision not in DECISIONS:
+            raise ValueError(f"unknown risk_level/decision: {risk_level}/{decision}")
+
+        SCORE_DISTRIBUTION.observe(fraud_score)
+        DECISION_COUNT.labels(risk_level=risk_level, decision=decision).inc()
+        self._risk_levels.add(RISK_LEVELS.index(risk_level), now)
+
+        flagged = decision in FLAGGED_DECISIONS
+        if merchant_id:
+            self._merchants.add(merchant_id, decision == 'decline', now)
+
+        if payment_id and self._sampled(payment_id):
+            self._new_predictions.append((str(payment_id), now, flagged, 1.0 / self.label_sample_rate))
+
+    def _apply_chargeback(self, now: float, payment_id: str) -> None:
+        # Labels of unsampled payments are not needed: their predictions were not kept
+        if self._sampled(payment_id):
+            self._new_labels.append((str(payment_id), now))
+
+    def _sampled(self, payment_id: str) -> bool:
+        return self.label_store is not None and in_label_sample(payment_id, self.label_sample_rate)
+
+    def _write_labels(self) -> None:
+        """Write the sampled predictions and labels applied since the last call (monitor thread)."""
+        predictions, self._new_predictions = self._new_predictions, []
+        labels, self._new_labels = self._new_labels, []
+        try:
+            if predictions:
+                self.label_store.add_predictions(predictions)
+            if labels:
+                # Predictions first: a label and its prediction may arrive in one batch
+                unmatched = self.label_store.add_labels(labels)
+                if unmatched:
+                    # Payment scored before the store existed, degraded (rules), or unknown
+                    MONITOR_EVENTS_DROPPED.labels(reason='label_unmatched').inc(unmatched)
+        except Exception as e:
+            MONITOR_EVENTS_DROPPED.labels(reason='label_store_error').inc(len(predictions) + len(labels))
+            logger.warning(f"Label store write failed: {e}")
+
+    def _refresh_labels(self, now: float) -> None:
+        """
+        Precision / recall of the matured cohort: predictions scored between
+        maturity + window and maturity ago, unlabeled ones counting as legitimate.
+        """
+        matured = now - self.label_maturity_seconds
+        try:
+            confusion = self.label_store.confusion(matured - self.label_window_seconds, matured)
+            self.label_store.prune(matured - self.label_window_seconds)
+            stored = self.label_store.size()
+        except Exception as e:
+            logger.warning(f"Label store query failed: {e}")
+            return
+        self._labeled = {'confusion': confusion, 'stored': stored, 'refreshed_at': now}
+        tp, fp, fn, _ = confusion
+        LABELED_PRECISION.set(tp / (tp + fp) if (tp + fp) else 0)
+        LABELED_RECALL.set(tp / (tp + fn) if (tp + fn) else 0)
+        LABEL_STORE_PREDICTIONS.set(stored)
+
+    def refresh(self, now: Optional[float] = None) -> None:
+        """Recompute rolling gauges and merchant anomalies."""
+        now = now if now is not None else time.time()
+        if self.label_store is not None and now >= self._next_label_refresh:
+            self._refresh_labels(now)
+            self._next_label_refresh = now + self.label_refresh_interval
+
+        with self._lock:
+            risk_totals = self._risk_levels.totals(now)
+            total = sum(risk_totals)
+            for level, count in zip(RISK_LEVELS, risk_totals):
+                DECISION_RATE.labels(risk_level=level).set(count / total if total else 0)
+
+            self._anomalies = self._merchants.find_anomalies(
+                now, self.min_merchant_volume, self.anomaly_z_threshold
+            )
+            MERCHANT_ANOMALIES.set(len(self._anomalies))
+            TRACKED_MERCHANTS.set(len(self._merchants.windows))
+
+        for anomaly in self._anomalies[:10]:
+            logger.warning(
+                f"Merchant {anomaly['merchant_id']} decline rate "
+                f"{anomaly['decline_rate']:.2%} vs baseline {anomaly['baseline_rate']:.2%} "
+                f"(z={anomaly['z_score']:.1f}, n={anomaly['transactions']})"
+            )
+
+    def snapshot(self) -> Dict:
+        """Point-in-time view of the rolling aggregates."""
+        now = time.time()
+        with self._lock:
+            risk_totals = self._risk_levels.totals(now)
+            tp, fp, fn, tn = self._labeled['confusion']
+            return {
+                'risk_level_counts': dict(zip(RISK_LEVELS, risk_totals)),
+                'merchant_anomalies': list(self._anomalies),
+                'tracked_merchants': len(self._merchants.windows),
+                'labeled': {
+                    # Weighted estimates over the label sample (matured cohort)
+                    'sample_rate': self.label_sample_rate if self.label_store is not None else None,
+                    'stored_predictions': self._labeled['stored'],
+                    'refreshed_at': self._labeled['refreshed_at'],
+                    'true_positives': tp,
+                    'false_positives': fp,
+                    'false_negatives': fn,
+                    'true_negatives': tn,
+                    'precision': tp / (tp + fp) if (tp + fp) else None,
+                    'recall': tp / (tp + fn) if (tp + fn) else None
+                },
+                'queue_depth': self._events.qsize()
+            }
+
+
+if __name__ == "__main__":
+    # Example usage with synthetic predictions
+    import random
+    from label_store import SQLiteLabelStore
+
+    monitor = ModelMonitor(refresh_interval=1.0, label_store=SQLiteLabelStore(':memory:'),
+                           label_sample_rate=0.5, label_maturity_days=0, label_refresh_interval=1.0)
+    monitor.start()
+
+    for i in range(10_000):
+        score = random.random() ** 3
+        if score >= 0.95:
+            risk_level, decision = 'critical', 'decline'
+        elif score >= 0.70:
+            risk_level, decision = 'high', 'review'
+        elif score >= 0.40:
+            risk_level, decision = 'medium', 'monitor'
+        else:
+            risk_level, decision = 'low', 'approve'
+        monitor.record_prediction(f"pi_{i}", f"acct_{i % 200}", score, risk_level, decision)
+        if score > 0.9 and random.random() < 0.5:
+            monitor.record_chargeback(f"pi_{i}")
+
+    monitor.stop()
+    print(monitor.snapshot())
@@ -126,10 +126,12 @@ CREATE TABLE transactions (
 
 -- Critical indexes for performance
 
+-- INCLUDE columns cover the fraud feature lookups (ml/features/oltp_access.py)
 CREATE INDEX IX_transactions_merchant_date_status 
-    ON transactions(merchant_id, created_at, status) WHERE is_deleted = 0;
+    ON transactions(merchant_id, created_at, status) INCLUDE (amount, is_deleted) WHERE is_deleted = 0;
 CREATE INDEX IX_transactions_customer_date 
-    ON transactions(customer_id, created_at) WHERE is_deleted = 0;
+    ON transactions(customer_id, created_at)
+    INCLUDE (merchant_id, payment_method_id, amount, status, is_deleted) WHERE is_deleted = 0;
 CREATE INDEX IX_transactions_status_date 
     ON transactions(status, created_at) WHERE is_deleted = 0;
 
@@ -182,7 +184,7 @@ CREATE TABLE chargebacks (
     CONSTRAINT CHK_chargebacks_amount CHECK (amount > 0)
 );
 
-CREATE INDEX IX_chargebacks_transaction_id ON chargebacks(transaction_id);
+CREATE INDEX IX_chargebacks_transaction_id ON chargebacks(transaction_id) INCLUDE (is_deleted);
 CREATE INDEX IX_chargebacks_status ON chargebacks(status);
 
 -- 7. TABLE: FRAUD_CHECKS
@@ -0,0 +1,272 @@
+"""
+CDC Net-Change Sources for the Incremental ETL
+Stripe Data Architecture - Pipelines
+
+Purpose: Read net changes of a CDC-enabled OLTP table (see
+         architecture/pipelines/scripts/setup_cdc.sql) since the watermark
+         stored in dbo.ETL_CDC_Watermark, in bounded LSN chunks.
+
+Sources:
+    AzureSQLCDCSource  - SQL Server CDC (cdc.fn_cdc_get_net_changes_dbo_<Table>)
+    SQLiteCDCSource    - local stand-in with the same change-table layout
+                         (cdc_dbo_<Table>_CT) and watermark table
+
+LSNs are handled as Python ints (BINARY(10) big-endian on SQL Server).
+"""
+
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+# Columns captured by setup_cdc.sql, primary key first
+CAPTURED_COLUMNS = {
+    'Payment': ['PaymentID', 'CustomerID', 'MerchantID', 'Amount', 'Currency',
+                'Status', 'PaymentMethod', 'CreatedAt', 'UpdatedAt'],
+    'Customer': ['CustomerID', 'Email', 'Country', 'IsActive', 'CreatedAt', 'UpdatedAt'],
+    'Merchant': ['MerchantID', 'BusinessName', 'Country', 'Industry', 'IsActive',
+                 'CreatedAt', 'UpdatedAt'],
+    'Subscription': ['SubscriptionID', 'CustomerID', 'PlanID', 'Status', 'StartDate',
+                     'EndDate', 'CreatedAt', 'UpdatedAt'],
+    'Dispute': ['DisputeID', 'PaymentID', 'Reason', 'Status', 'Amount',
+                'CreatedAt', 'ResolvedAt'],
+    'Refund': ['RefundID', 'PaymentID', 'Amount', 'Reason', 'Status', 'CreatedAt'],
+}
+
+# __$operation codes returned by net changes with the 'all' row filter
+CDC_DELETE, CDC_INSERT, CDC_UPDATE_BEFORE, CDC_UPDATE = 1, 2, 3, 4
+
+
+def lsn_to_int(lsn) -> int:
+    return int.from_bytes(lsn, 'big') if isinstance(lsn, (bytes, bytearray)) else int(lsn)
+
+
+def int_to_lsn(value: int) -> bytes:
+    return value.to_bytes(10, 'big')
+
+
+class CDCSource(ABC):
+    """Net changes of CDC-enabled tables and their ETL watermarks."""
+
+    @abstractmethod
+    def max_lsn(self) -> int:
+        """Highest LSN available to readers."""
+
+    @abstractmethod
+    def next_chunk_end(self, table: str, after_lsn: int, to_lsn: int, max_rows: int) -> Optional[int]:
+        """
+        Upper LSN of the next chunk: the LSN of the max_rows-th change after
+        after_lsn (whole transactions are kept together), None if no change.
+        """
+
+    @abstractmethod
+    def net_changes(self, table: str, after_lsn: int, to_lsn: int) -> pd.DataFrame:
+        """
+        One row per key changed in (after_lsn, to_lsn]: column 'operation'
+        (CDC_DELETE / CDC_INSERT / CDC_UPDATE) plus the captured columns.
+        """
+
+    @abstractmethod
+    def get_watermark(self, table: str) -> int:
+        """Last LSN loaded for the table."""
+
+    @abstractmethod
+    def set_watermark(self, table: str, lsn: int, rows: int) -> None:
+        """Advance the watermark after a chunk was merged."""
+
+    def close(self) -> None:
+        """Release connections."""
+
+
+# ============================================================================
+# AZURE SQL (SQL Server CDC)
+# ============================================================================
+
+class AzureSQLCDCSource(CDCSource):
+    """Reads cdc.* functions of the OLTP database through pyodbc."""
+
+    def __init__(self, sql_connection_string: str):
+        import pyodbc
+
+        self.sql_conn = pyodbc.connect(sql_connection_string)
+
+    def max_lsn(self) -> int:
+        return lsn_to_int(self.sql_conn.cursor().execute(
+            "SELECT sys.fn_cdc_get_max_lsn()"
+        ).fetchone()[0])
+
+    def next_chunk_end(self, table: str, after_lsn: int, to_lsn: int, max_rows: int) -> Optional[int]:
+        # Table name comes from CAPTURED_COLUMNS, never from user input
+        row = self.sql_conn.cursor().execute(f"""
+            SELECT MAX(__$start_lsn) FROM (
+                SELECT TOP (?) __$start_lsn
+                FROM cdc.dbo_{table}_CT
+                WHERE __$start_lsn > ? AND __$start_lsn <= ?
+                ORDER BY __$start_lsn, __$seqval
+            ) chunk
+        """, max_rows, int_to_lsn(after_lsn), int_to_lsn(to_lsn)).fetchone()
+        return lsn_to_int(row[0]) if row and row[0] is not None else None
+
+    def net_changes(self, table: str, after_lsn: int, to_lsn: int) -> pd.DataFrame:
+        columns = CAPTURED_COLUMNS[table]
+        cursor = self.sql_conn.cursor().execute(f"""
+            SELECT __$operation AS operation, {', '.join(columns)}
+            FROM cdc.fn_cdc_get_net_changes_dbo_{table}(
+                sys.fn_cdc_increment_lsn(?), ?, N'all')
+        """, int_to_lsn(after_lsn), int_to_lsn(to_lsn))
+        return pd.DataFrame.from_records(
+            [tuple(row) for row in cursor.fetchall()], columns=['operation'] + columns
+        )
+
+    def get_watermark(self, table: str) -> int:
+        row = self.sql_conn.cursor().execute("""
+            SELECT COALESCE(LastProcessedLSN, sys.fn_cdc_get_min_lsn(?))
+            FROM dbo.ETL_CDC_Watermark WHERE TableName = ?
+        """, f"dbo_{table}", table).fetchone()
+        return lsn_to_int(row[0]) if row and row[0] is not None else 0
+
+    def set_watermark(self, table: str, lsn: int, rows: int) -> None:
+        self.sql_conn.cursor().execute("""
+            UPDATE dbo.ETL_CDC_Watermark
+            SET LastProcessedLSN = ?,
+                LastProcessedTime = sys.fn_cdc_map_lsn_to_time(?),
+                RowsProcessed = RowsProcessed + ?,
+                UpdatedAt = SYSDATETIME()
+            WHERE TableName = ?
+        """, int_to_lsn(lsn), int_to_lsn(lsn), rows, table)
+        self.sql_conn.commit()
+
+    def close(self) -> None:
+        self.sql_conn.close()
+
+
+# ============================================================================
+# LOCAL (SQLite stand-in)
+# ============================================================================
+
+class SQLiteCDCSource(CDCSource):
+    """
+    Local CDC stand-in: change tables with the SQL Server layout
+    (__$start_lsn, __$seqval, __$operation, captured columns), a
+    lsn_time_mapping table and dbo.ETL_CDC_Watermark. Net changes follow
+    fn_cdc_get_net_changes(..., 'all') semantics.
+    """
+
+    def __init__(self, database: str = ':memory:', tables: Sequence[str] = tuple(CAPTURED_COLUMNS)):
+        self._db = sqlite3.connect(database, check_same_thread=False)
+        self._lock = threading.Lock()
+        statements = [
+            "CREATE TABLE IF NOT EXISTS cdc_lsn_time_mapping "
+            "(start_lsn INTEGER PRIMARY KEY, tran_end_time TEXT NOT NULL)",
+            "CREATE TABLE IF NOT EXISTS ETL_CDC_Watermark (TableName TEXT PRIMARY KEY, "
+            "LastProcessedLSN INTEGER, LastProcessedTime TEXT, RowsProcessed INTEGER DEFAULT 0)",
+        ]
+        for table in tables:
+            columns = ', '.join(f'"{c}"' for c in CAPTURED_COLUMNS[table])
+            statements.append(
+                f'CREATE TABLE IF NOT EXISTS "cdc_dbo_{table}_CT" ("__$start_lsn" INTEGER NOT NULL, '
+                f'"__$seqval" INTEGER NOT NULL, "__$operation" INTEGER NOT NULL, {columns}, '
+                f'PRIMARY KEY ("__$start_lsn", "__$seqval"))'
+            )
+            statements.append(
+                f"INSERT OR IGNORE INTO ETL_CDC_Watermark (TableName, LastProcessedLSN, RowsProcessed) "
+                f"VALUES ('{table}', 0, 0)"
+            )
+        with self._db:
+            for statement in statements:
+                self._db.execute(statement)
+
+    def capture(self, table: str, changes: List[tuple], committed_at: str) -> int:
+        """
+        Record one committed transaction: changes are (operation, row dict).
+        Updates are stored as a before-image (3) / after-image (4) pair when
+        the before row is given as row['__before__'].
+
+        Returns:
+            The transaction's LSN
+        """
+        columns = CAPTURED_COLUMNS[table]
+        placeholders = ', '.join('?' for _ in range(len(columns) + 3))
+        with self._lock, self._db:
+            lsn = (self._db.execute("SELECT MAX(start_lsn) FROM cdc_lsn_time_mapping").fetchone()[0] or 0) + 1
+            self._db.execute("INSERT INTO cdc_lsn_time_mapping VALUES (?, ?)", (lsn, committed_at))
+            records = []
+            for operation, row in changes:
+                if operation == CDC_UPDATE and '__before__' in row:
+                    before = row['__before__']
+                    records.append((lsn, len(records), CDC_UPDATE_BEFORE) + tuple(before.get(c) for c in columns))
+                records.append((lsn, len(records), operation) + tuple(row.get(c) for c in columns))
+            self._db.executemany(f'INSERT INTO "cdc_dbo_{table}_CT" VALUES ({placeholders})', records)
+        return lsn
+
+    def max_lsn(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT MAX(start_lsn) FROM cdc_lsn_time_mapping").fetchone()[0] or 0
+
+    def next_chunk_end(self, table: str, after_lsn: int, to_lsn: int, max_rows: int) -> Optional[int]:
+        with self._lock:
+            return self._db.execute(f"""
+                SELECT MAX(lsn) FROM (
+                    SELECT "__$start_lsn" AS lsn FROM "cdc_dbo_{table}_CT"
+                    WHERE "__$start_lsn" > ? AND "__$start_lsn" <= ?
+                    ORDER BY "__$start_lsn", "__$seqval" LIMIT ?
+                )
+            """, (after_lsn, to_lsn, max_rows)).fetchone()[0]
+
+    def net_changes(self, table: str, after_lsn: int, to_lsn: int) -> pd.DataFrame:
+        columns = CAPTURED_COLUMNS[table]
+        key = columns[0]
+        quoted = ', '.join(f'"{c}"' for c in columns)
+        # Last image per key; insert+delete inside the range cancels out,
+        # insert+update reports an insert of the final image
+        sql = f"""
+            SELECT CASE WHEN op = {CDC_DELETE} THEN {CDC_DELETE}
+                        WHEN first_op = {CDC_INSERT} THEN {CDC_INSERT}
+                        ELSE {CDC_UPDATE} END AS operation, {quoted}
+            FROM (
+                SELECT "__$operation" AS op, {quoted},
+                       ROW_NUMBER() OVER (PARTITION BY "{key}"
+                           ORDER BY "__$start_lsn" DESC, "__$seqval" DESC) AS rn,
+                       FIRST_VALUE("__$operation") OVER (PARTITION BY "{key}"
+                           ORDER BY "__$start_lsn", "__$seqval") AS first_op
+                FROM "cdc_dbo_{table}_CT"
+                WHERE "__$start_lsn" > ? AND "__$start_lsn" <= ? AND "__$operation" != {CDC_UPDATE_BEFORE}
+            )
+            WHERE rn = 1 AND NOT (op = {CDC_DELETE} AND first_op = {CDC_INSERT})
+        """
+        with self._lock:
+            rows = self._db.execute(sql, (after_lsn, to_lsn)).fetchall()
+        return pd.DataFrame.from_records(rows, columns=['operation'] + columns)
+
+    def get_watermark(self, table: str) -> int:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT LastProcessedLSN FROM ETL_CDC_Watermark WHERE TableName = ?", (table,)
+            ).fetchone()
+        return row[0] if row and row[0] is not None else 0
+
+    def set_watermark(self, table: str, lsn: int, rows: int) -> None:
+        with self._lock, self._db:
+            self._db.execute("""
+                UPDATE ETL_CDC_Watermark
+                SET LastProcessedLSN = ?,
+                    LastProcessedTime = (SELECT tran_end_time FROM cdc_lsn_time_mapping WHERE start_lsn = ?),
+                    RowsProcessed = RowsProcessed + ?
+                WHERE TableName = ?
+            """, (lsn, lsn, rows, table))
+
+    def watermarks(self) -> Dict[str, Dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT TableName, LastProcessedLSN, LastProcessedTime, RowsProcessed FROM ETL_CDC_Watermark"
+            ).fetchall()
+        return {r[0]: {'lsn': r[1], 'time': r[2], 'rows': r[3]} for r in rows}
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,133 @@
+"""
+Distinct-Count Sketch for Incremental Aggregates
+Stripe Data Architecture - Pipelines
+
+Purpose: Mergeable distinct count of customer keys per aggregate cell.
+         Small cells keep exact multiplicities (customer_key -> rows), so
+         additions and retractions are exact; past SPARSE_LIMIT distinct
+         keys the sketch switches to HyperLogLog registers (2^HLL_PRECISION
+         bytes, ~1.6% standard error), which merge by register-wise max.
+
+HyperLogLog cannot forget a key: a retraction in HLL mode marks the sketch
+stale, and its owner rebuilds it from the fact rows.
+"""
+
+import math
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+SPARSE_LIMIT = 1024
+HLL_PRECISION = 12
+HLL_REGISTERS = 1 << HLL_PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_MASK64 = (1 << 64) - 1
+
+
+def _hash64(key: int) -> int:
+    """splitmix64 finalizer: well-mixed 64-bit hash of an integer key."""
+    z = (key + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+def _register_update(registers: np.ndarray, key: int) -> None:
+    h = _hash64(int(key))
+    index = h >> (64 - HLL_PRECISION)
+    remainder = (h << HLL_PRECISION) & _MASK64
+    rank = (64 - HLL_PRECISION + 1) if remainder == 0 else (65 - remainder.bit_length())
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+class DistinctSketch:
+    """Exact multiset of keys, promoted to HyperLogLog past SPARSE_LIMIT."""
+
+    __slots__ = ('counts', 'registers', 'stale')
+
+    def __init__(self):
+        self.counts: Optional[Dict[int, int]] = {}
+        self.registers: Optional[np.ndarray] = None
+        self.stale = False
+
+    @property
+    def exact(self) -> bool:
+        return self.registers is None
+
+    def add(self, key: int, sign: int = 1) -> None:
+        """Count one row of `key` (sign=+1) or retract one (sign=-1)."""
+        key = int(key)
+        if self.registers is None:
+            count = self.counts.get(key, 0) + sign
+            if count > 0:
+                self.counts[key] = count
+            else:
+                self.counts.pop(key, None)
+            if len(self.counts) > SPARSE_LIMIT:
+                self._promote()
+        elif sign > 0:
+            _register_update(self.registers, key)
+        else:
+            self.stale = True
+
+    def _promote(self) -> None:
+        self.registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+        for key in self.counts:
+            _register_update(self.registers, key)
+        self.counts = None
+
+    def merge(self, other: 'DistinctSketch') -> 'DistinctSketch':
+        """Union of two sketches (new object)."""
+        merged = DistinctSketch()
+        merged.stale = self.stale or other.stale
+        if self.exact and other.exact:
+            merged.counts = dict(self.counts)
+            for key, count in other.counts.items():
+                merged.counts[key] = merged.counts.get(key, 0) + count
+            if len(merged.counts) > SPARSE_LIMIT:
+                merged._promote()
+            return merged
+        merged._promote()
+        for sketch in (self, other):
+            if sketch.exact:
+                for key in sketch.counts:
+                    _register_update(merged.registers, key)
+            else:
+                np.maximum(merged.registers, sketch.registers, out=merged.registers)
+        return merged
+
+    def estimate(self) -> int:
+        if self.registers is None:
+            return len(self.counts)
+        registers = self.registers.astype(np.float64)
+        raw = _ALPHA * HLL_REGISTERS ** 2 / np.sum(np.exp2(-registers))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * HLL_REGISTERS and zeros:
+            # Small-range correction (linear counting)
+            return int(round(HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)))
+        return int(round(raw))
+
+    def keys(self) -> Iterable[int]:
+        """Exact keys (exact mode only)."""
+        return self.counts.keys()
+
+    # ------------------------------------------------------------------
+    # Serialization (JSON-friendly)
+    # ------------------------------------------------------------------
+
+    def to_state(self) -> Dict:
+        if self.registers is None:
+            return {'counts': [[k, c] for k, c in self.counts.items()]}
+        return {'hll': self.registers.tobytes().hex(), 'stale': self.stale}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'DistinctSketch':
+        sketch = cls()
+        if 'hll' in state:
+            sketch.counts = None
+            sketch.registers = np.frombuffer(bytes.fromhex(state['hll']), dtype=np.uint8).copy()
+            sketch.stale = state.get('stale', False)
+        else:
+            sketch.counts = {int(k): int(c) for k, c in state['counts']}
+        return sketch
@@ -0,0 +1,334 @@
+"""
+Fact Parquet Writer and Merge Batches
+Stripe Data Architecture - Pipelines
+
+Purpose: Write transformed fact rows as date-partitioned Parquet
+         (time_key=YYYYMMDD/), sorted so row-group min/max statistics prune
+         well, and apply each chunk to the warehouse as an idempotent merge
+         batch.
+
+Idempotence: a batch is identified by (table, from_lsn, to_lsn). Its files
+have deterministic names (a rerun overwrites them), and the merge deletes
+then inserts the batch's keys and records the batch id in etl_merge_log in
+one transaction; an already-recorded batch is skipped.
+"""
+
+import json
+import logging
+from decimal import Decimal
+import os
+import re
+import sqlite3
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+OLAP_SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'models', 'olap', 'schema.sql'
+)
+
+FACT_SCHEMA = pa.schema([
+    ('transaction_key', pa.int64()),
+    ('transaction_id', pa.int64()),
+    ('time_key', pa.int32()),
+    ('customer_key', pa.int32()),
+    ('merchant_key', pa.int32()),
+    ('payment_method_key', pa.int32()),
+    ('geography_key', pa.int32()),
+    ('product_key', pa.int32()),
+    ('amount', pa.decimal128(18, 2)),
+    ('processing_fee', pa.decimal128(18, 2)),
+    ('net_amount', pa.decimal128(18, 2)),
+    ('refund_amount', pa.decimal128(18, 2)),
+    ('chargeback_amount', pa.decimal128(18, 2)),
+    ('is_successful', pa.bool_()),
+    ('is_refunded', pa.bool_()),
+    ('is_disputed', pa.bool_()),
+    ('is_fraudulent', pa.bool_()),
+    ('transaction_count', pa.int32()),
+    ('transaction_datetime', pa.timestamp('us')),
+])
+FACT_COLUMNS = FACT_SCHEMA.names
+DECIMAL_COLUMNS = [f.name for f in FACT_SCHEMA if pa.types.is_decimal(f.type)]
+
+# Within a day partition, rows are clustered by merchant so per-merchant
+# queries skip row groups on merchant_key statistics
+SORT_KEYS = [('merchant_key', 'ascending'), ('transaction_datetime', 'ascending')]
+DEFAULT_ROW_GROUP_SIZE = 128 * 1024
+
+
+class MergeBatch(NamedTuple):
+    batch_id: str
+    table: str
+    from_lsn: int
+    to_lsn: int
+    files: List[str]
+    upserts: int
+    deleted_ids: List[int]
+
+
+def batch_id_for(table: str, from_lsn: int, to_lsn: int) -> str:
+    return f"{table.lower()}_{from_lsn:020x}_{to_lsn:020x}"
+
+
+# ============================================================================
+# PARQUET
+# ============================================================================
+
+def to_arrow(facts: pd.DataFrame) -> pa.Table:
+    """Fact rows (float amounts) -> Arrow table with exact DECIMAL(18,2) amounts."""
+    columns = []
+    for field in FACT_SCHEMA:
+        values = facts[field.name].to_numpy()
+        if field.name in DECIMAL_COLUMNS:
+            # Exact cents, then scale: float -> decimal casts can truncate
+            cents = pa.array(np.round(values.astype(np.float64) * 100).astype(np.int64))
+            columns.append(pc.multiply(cents.cast(pa.decimal128(19, 0)), pa.scalar(Decimal('0.01')))
+                           .cast(field.type))
+        else:
+            columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=FACT_SCHEMA)
+
+
+def write_partitioned_parquet(facts: pd.DataFrame, root: str, batch_id: str,
+                              row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> List[str]:
+    """
+    Write one file per time_key partition: <root>/time_key=<k>/part-<batch_id>.parquet.
+    Files are written to a temporary name and renamed, so a partition never
+    exposes a partial file.
+
+    Returns:
+        Written file paths
+    """
+    if facts.empty:
+        return []
+    table = to_arrow(facts)
+    table = table.sort_by([('time_key', 'ascending')] + SORT_KEYS)
+    time_keys = table.column('time_key').to_numpy()
+    # Partition boundaries of the sorted time_key column
+    starts = np.flatnonzero(np.r_[True, time_keys[1:] != time_keys[:-1]])
+    ends = np.r_[starts[1:], len(time_keys)]
+    files = []
+    for start, end in zip(starts, ends):
+        directory = os.path.join(root, f"time_key={time_keys[start]}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{batch_id}.parquet")
+        pq.write_table(table.slice(start, end - start), path + '.tmp', row_group_size=row_group_size,
+                       compression='snappy', write_statistics=True)
+        os.replace(path + '.tmp', path)
+        files.append(path)
+    return files
+
+
+def write_manifest(root: str, batch: MergeBatch) -> str:
+    directory = os.path.join(root, '_merge')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{batch.batch_id}.json")
+    with open(path + '.tmp', 'w') as f:
+        json.dump(batch._asdict(), f, indent=2)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+# ============================================================================
+# MERGE SINKS
+# ============================================================================
+
+# Rows of an IN (...) list per statement
+READ_CHUNK = 500
+
+
+def read_facts(conn, transaction_ids: List[int]) -> pd.DataFrame:
+    """
+    Current fact_transactions rows of the given transaction ids, typed like
+    the transform output (DB-API connection with qmark parameters).
+    """
+    ids = sorted({int(i) for i in transaction_ids})
+    rows = []
+    cursor = conn.cursor()
+    for start in range(0, len(ids), READ_CHUNK):
+        chunk = ids[start:start + READ_CHUNK]
+        cursor.execute(f"SELECT {', '.join(FACT_COLUMNS)} FROM fact_transactions "
+                       f"WHERE transaction_id IN ({', '.join('?' for _ in chunk)})", chunk)
+        rows.extend(tuple(row) for row in cursor.fetchall())
+    facts = pd.DataFrame(rows, columns=FACT_COLUMNS)
+    for field in FACT_SCHEMA:
+        if field.name in DECIMAL_COLUMNS:
+            facts[field.name] = facts[field.name].astype(np.float64)
+        elif pa.types.is_boolean(field.type):
+            facts[field.name] = facts[field.name].astype(bool)
+        elif pa.types.is_timestamp(field.type):
+            facts[field.name] = pd.to_datetime(facts[field.name])
+        else:
+            facts[field.name] = facts[field.name].astype(np.int64)
+    return facts
+
+
+class SynapseMergeSink:
+    """
+    Emits (and optionally runs) the T-SQL of each batch against Synapse:
+    COPY the batch's Parquet into stg.Fact_Payment_Temp, then delete/insert
+    fact_transactions and log the batch, in one transaction.
+    """
+
+    def __init__(self, sql_dir: str, storage_url: Optional[str] = None, conn=None):
+        """
+        Args:
+            sql_dir: Directory receiving one <batch_id>.sql per batch
+            storage_url: ADLS URL of the Parquet root (COPY source)
+            conn: Optional pyodbc connection to execute the batches
+        """
+        self.sql_dir = sql_dir
+        self.storage_url = storage_url or '<adls-url>'
+        self.conn = conn
+        os.makedirs(sql_dir, exist_ok=True)
+
+    def read_facts(self, transaction_ids: List[int]) -> pd.DataFrame:
+        if self.conn is None:
+            # Scripts only: no current rows to adjust
+            return pd.DataFrame(columns=FACT_COLUMNS)
+        return read_facts(self.conn, transaction_ids)
+
+    def render(self, batch: MergeBatch, root: str) -> str:
+        sources = ',\n    '.join(
+            f"'{self.storage_url}/{os.path.relpath(f, root).replace(os.sep, '/')}'" for f in batch.files
+        )
+        deleted = ', '.join(str(i) for i in batch.deleted_ids) or 'NULL'
+        copy = f"""COPY INTO stg.Fact_Payment_Temp
+FROM {sources}
+WITH (FILE_TYPE = 'PARQUET', CREDENTIAL = (IDENTITY = 'Managed Identity'));
+""" if batch.files else ''
+        return f"""-- Merge batch {batch.batch_id} (LSN {batch.from_lsn:#x} -> {batch.to_lsn:#x})
+IF OBJECT_ID('dbo.etl_merge_log') IS NULL
+    CREATE TABLE dbo.etl_merge_log (
+        batch_id NVARCHAR(100) NOT NULL, table_name NVARCHAR(128) NOT NULL,
+        from_lsn DECIMAL(38,0) NOT NULL, to_lsn DECIMAL(38,0) NOT NULL,
+        rows_merged BIGINT NOT NULL, merged_at DATETIME2 NOT NULL
+    ) WITH (DISTRIBUTION = REPLICATE, HEAP);
+IF NOT EXISTS (SELECT 1 FROM dbo.etl_merge_log WHERE batch_id = '{batch.batch_id}')
+BEGIN
+TRUNCATE TABLE stg.Fact_Payment_Temp;
+{copy}BEGIN TRANSACTION;
+DELETE FROM fact_transactions
+WHERE transaction_id IN (SELECT transaction_id FROM stg.Fact_Payment_Temp)
+   OR transaction_id IN ({deleted});
+INSERT INTO fact_transactions ({', '.join(FACT_COLUMNS)})
+SELECT {', '.join(FACT_COLUMNS)} FROM stg.Fact_Payment_Temp;
+INSERT INTO dbo.etl_merge_log (batch_id, table_name, from_lsn, to_lsn, rows_merged, merged_at)
+VALUES ('{batch.batch_id}', '{batch.table}', {batch.from_lsn}, {batch.to_lsn}, {batch.upserts}, GETUTCDATE());
+COMMIT;
+END
+"""
+
+    def apply(self, batch: MergeBatch, facts: pd.DataFrame, root: str) -> bool:
+        sql = self.render(batch, root)
+        with open(os.path.join(self.sql_dir, f"{batch.batch_id}.sql"), 'w') as f:
+            f.write(sql)
+        if self.conn is not None:
+            self.conn.cursor().execute(sql)
+            self.conn.commit()
+        return True
+
+
+def translate_olap_ddl(schema_sql: str, tables: List[str]) -> List[str]:
+    """CREATE TABLE statements of models/olap/schema.sql rewritten for SQLite."""
+    statements = []
+    for table in tables:
+        match = re.search(rf"CREATE TABLE {table} \((.*?)\n\)\s*WITH", schema_sql, re.S)
+        if match is None:
+            raise ValueError(f"Table {table} not found in OLAP schema")
+        columns = []
+        for line in match.group(1).split('\n'):
+            line = line.strip().rstrip(',')
+            if not line or line.startswith('--') or line.upper().startswith('CONSTRAINT'):
+                continue
+            # Surrogate IDENTITY keys become SQLite rowid aliases
+            line = re.sub(r"BIGINT NOT NULL IDENTITY\(\d+,\s*\d+\)", 'INTEGER PRIMARY KEY', line)
+            line = re.sub(r"IDENTITY\(\d+,\s*\d+\)", '', line)
+            line = re.sub(r"N?VARCHAR\((\d+|MAX)\)|CHAR\(\d+\)", 'TEXT', line)
+            line = re.sub(r"DECIMAL\(\d+,\s*\d+\)", 'NUMERIC', line)
+            line = re.sub(r"\b(DATETIME2|DATE)\b", 'TEXT', line)
+            line = re.sub(r"\b(BIT|TINYINT|SMALLINT)\b", 'INTEGER', line)
+            line = line.replace('GETUTCDATE()', 'CURRENT_TIMESTAMP')
+            columns.append(line)
+        statements.append(f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ',\n    '.join(columns) + "\n)")
+    return statements
+
+
+class SQLiteMergeSink:
+    """Local warehouse stand-in: the OLAP schema's tables in SQLite."""
+
+    TABLES = ['dim_customer', 'dim_merchant', 'dim_payment_method', 'dim_geography',
+              'dim_product', 'fact_transactions', 'agg_daily_revenue', 'agg_monthly_metrics']
+
+    def __init__(self, database: str = ':memory:', schema_path: str = OLAP_SCHEMA_PATH,
+                 on_merge: Optional[Callable] = None):
+        """
+        Args:
+            database: SQLite database path
+            schema_path: OLAP schema (models/olap/schema.sql)
+            on_merge: Optional hook on_merge(conn, previous_facts, new_facts)
+                      called inside each merge transaction (e.g.
+                      IncrementalAggregator.on_merge)
+        """
+        self.on_merge = on_merge
+        self.conn = sqlite3.connect(database, check_same_thread=False)
+        with open(schema_path) as f:
+            ddl = translate_olap_ddl(f.read(), self.TABLES)
+        with self.conn:
+            for statement in ddl:
+                self.conn.execute(statement)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS IX_fact_transactions_id "
+                              "ON fact_transactions(transaction_id)")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS etl_merge_log (
+                    batch_id TEXT PRIMARY KEY, table_name TEXT, from_lsn INTEGER,
+                    to_lsn INTEGER, rows_merged INTEGER, merged_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+    def apply(self, batch: MergeBatch, facts: pd.DataFrame, root: str) -> bool:
+        """Merge the batch; False if it was already merged."""
+        with self.conn:
+            if self.conn.execute("SELECT 1 FROM etl_merge_log WHERE batch_id = ?",
+                                 (batch.batch_id,)).fetchone():
+                return False
+            keys = [(int(i),) for i in facts['transaction_id']] + [(i,) for i in batch.deleted_ids]
+            previous = read_facts(self.conn, [k for k, in keys]) if self.on_merge else None
+            self.conn.executemany("DELETE FROM fact_transactions WHERE transaction_id = ?", keys)
+            if not facts.empty:
+                rows = facts[FACT_COLUMNS].astype({
+                    'amount': float, 'processing_fee': float, 'net_amount': float,
+                    'refund_amount': float, 'chargeback_amount': float,
+                    'is_successful': int, 'is_refunded': int, 'is_disputed': int, 'is_fraudulent': int
+                })
+                rows['transaction_datetime'] = rows['transaction_datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+                self.conn.executemany(
+                    f"INSERT INTO fact_transactions ({', '.join(FACT_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in FACT_COLUMNS)})",
+                    rows.itertuples(index=False, name=None)
+                )
+            self.conn.execute(
+                "INSERT INTO etl_merge_log (batch_id, table_name, from_lsn, to_lsn, rows_merged) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (batch.batch_id, batch.table, batch.from_lsn, batch.to_lsn, batch.upserts)
+            )
+            if self.on_merge is not None:
+                self.on_merge(self.conn, previous, facts)
+        return True
+
+    def read_facts(self, transaction_ids: List[int]) -> pd.DataFrame:
+        return read_facts(self.conn, transaction_ids)
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            'fact_rows': self.conn.execute("SELECT COUNT(*) FROM fact_transactions").fetchone()[0],
+            'merged_batches': self.conn.execute("SELECT COUNT(*) FROM etl_merge_log").fetchone()[0]
+        }
@@ -0,0 +1,557 @@
+"""
+Incremental Maintenance of agg_daily_revenue and agg_monthly_metrics
+Stripe Data Architecture - Pipelines
+
+Purpose: Keep the aggregate tables of models/olap/schema.sql up to date
+         from the fact rows changed by each ETL merge batch, instead of
+         re-running sp_refresh_daily_aggregates / sp_calculate_monthly_metrics
+         over whole days and months.
+
+Each aggregate cell keeps a mergeable partial state (agg_cell_state):
+    - counts and sums (amounts in integer cents): exact under retraction
+    - min / max: exact for additions; retracting the current extreme marks
+      the cell stale
+    - unique customers: DistinctSketch (exact multiset, HyperLogLog when large)
+A changed fact row (late refund, chargeback, status change, delete) is
+applied as a retraction of its previous image plus an addition of the new
+one. Stale cells are rebuilt from their fact rows.
+
+new_customers / returning_customers depend on each customer's first
+transaction month (agg_customer_months); when it moves, every monthly cell
+of the affected months is reclassified.
+
+Usage:
+    python incremental_aggregates.py verify --olap olap.db
+    python incremental_aggregates.py rebuild --olap olap.db
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from distinct_sketch import DistinctSketch
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+DAILY, MONTHLY = 'daily', 'monthly'
+DAILY_KEYS = ['time_key', 'merchant_key', 'geography_key', 'payment_method_key']
+MONTHLY_KEYS = ['year_month', 'merchant_key']
+
+# Rows of an IN (...) list per statement
+IN_CHUNK = 500
+
+STATE_DDL = [
+    """CREATE TABLE IF NOT EXISTS agg_cell_state (
+        level TEXT NOT NULL, cell_key TEXT NOT NULL, state TEXT NOT NULL,
+        PRIMARY KEY (level, cell_key))""",
+    """CREATE TABLE IF NOT EXISTS agg_customer_months (
+        customer_key INTEGER PRIMARY KEY, months TEXT NOT NULL)""",
+    # Cell rewrites delete by cell key
+    "CREATE INDEX IF NOT EXISTS IX_agg_daily_revenue_cell ON agg_daily_revenue "
+    "(date_key, merchant_key, geography_key, payment_method_key)",
+    "CREATE INDEX IF NOT EXISTS IX_agg_monthly_metrics_cell ON agg_monthly_metrics (year_month, merchant_key)",
+]
+
+
+def _cents(values) -> np.ndarray:
+    return np.round(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def _chunks(items: List, size: int = IN_CHUNK) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _round2(value: Decimal) -> float:
+    """Rounded half away from zero, as the DECIMAL(18,2) / DECIMAL(5,2) columns."""
+    return float(value.quantize(Decimal('0.01'), ROUND_HALF_UP))
+
+
+def _avg(total_cents: int, count: int) -> float:
+    return _round2(Decimal(total_cents) / count / 100)
+
+
+def _rate(flagged: int, count: int) -> float:
+    return _round2(Decimal(flagged) * 100 / count)
+
+
+def _cell_key(values: Tuple) -> str:
+    return '|'.join(str(int(v)) for v in values)
+
+
+def _month_bounds(year_month: int) -> Tuple[int, int]:
+    year, month = divmod(year_month, 100)
+    start = year_month * 100 + 1
+    end = (year + 1) * 10000 + 101 if month == 12 else (year_month + 1) * 100 + 1
+    return start, end
+
+
+# ============================================================================
+# PARTIAL STATES
+# ============================================================================
+
+def _new_daily() -> Dict:
+    return {'transaction_count': 0, 'successful_count': 0, 'failed_count': 0, 'refunded_count': 0,
+            'amount': 0, 'fees': 0, 'net': 0, 'min': None, 'max': None,
+            'customers': DistinctSketch(), 'stale': False}
+
+
+def _new_monthly() -> Dict:
+    return {'transaction_count': 0, 'gross': 0, 'net': 0, 'refunded': 0, 'disputed': 0,
+            'fraudulent': 0, 'customers': DistinctSketch(), 'stale': False}
+
+
+def _dump(state: Dict) -> str:
+    return json.dumps(dict(state, customers=state['customers'].to_state()))
+
+
+def _load(raw: str) -> Dict:
+    state = json.loads(raw)
+    state['customers'] = DistinctSketch.from_state(state['customers'])
+    return state
+
+
+def _signed(facts: pd.DataFrame, sign: int) -> pd.DataFrame:
+    """Fact images -> integer delta rows."""
+    if facts is None or facts.empty:
+        return pd.DataFrame()
+    delta = pd.DataFrame({
+        'time_key': facts['time_key'].astype(np.int64).to_numpy(),
+        'merchant_key': facts['merchant_key'].astype(np.int64).to_numpy(),
+        'geography_key': facts['geography_key'].astype(np.int64).to_numpy(),
+        'payment_method_key': facts['payment_method_key'].astype(np.int64).to_numpy(),
+        'customer_key': facts['customer_key'].astype(np.int64).to_numpy(),
+        'amount': _cents(facts['amount']),
+        'fee': _cents(facts['processing_fee']),
+        'net': _cents(facts['net_amount']),
+        'is_successful': facts['is_successful'].astype(int).to_numpy(),
+        'is_refunded': facts['is_refunded'].astype(int).to_numpy(),
+        'is_disputed': facts['is_disputed'].astype(int).to_numpy(),
+        'is_fraudulent': facts['is_fraudulent'].astype(int).to_numpy(),
+    })
+    delta['year_month'] = delta['time_key'] // 100
+    delta['sign'] = sign
+    return delta
+
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+class IncrementalAggregator:
+    """
+    Merge hook of the ETL (SQLiteMergeSink / DB-API warehouse): called in the
+    merge transaction with the previous and new images of the batch's facts.
+    """
+
+    def __init__(self):
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def ensure_schema(conn) -> None:
+        for statement in STATE_DDL:
+            conn.execute(statement)
+
+    def on_merge(self, conn, retracted: pd.DataFrame, added: pd.DataFrame) -> None:
+        """
+        Args:
+            conn: Warehouse connection (inside the merge transaction)
+            retracted: Previous images of the facts replaced or deleted by the batch
+            added: New fact images
+        """
+        self.ensure_schema(conn)
+        frames = [f for f in (_signed(retracted, -1), _signed(added, 1)) if not f.empty]
+        if not frames:
+            return
+        delta = pd.concat(frames, ignore_index=True)
+        self.stats['rows_retracted'] += int((delta['sign'] < 0).sum())
+        self.stats['rows_added'] += int((delta['sign'] > 0).sum())
+
+        self._apply_daily(conn, delta)
+        reclassify = self._apply_customer_months(conn, delta)
+        self._apply_monthly(conn, delta[delta['is_successful'] == 1], reclassify)
+
+    # ------------------------------------------------------------------
+    # State storage
+    # ------------------------------------------------------------------
+
+    def _read_states(self, conn, level: str, keys: List[str]) -> Dict[str, Dict]:
+        states = {}
+        for chunk in _chunks(keys):
+            rows = conn.execute(
+                f"SELECT cell_key, state FROM agg_cell_state WHERE level = ? "
+                f"AND cell_key IN ({', '.join('?' for _ in chunk)})", [level] + chunk
+            ).fetchall()
+            states.update({key: _load(raw) for key, raw in rows})
+        return states
+
+    def _write_states(self, conn, level: str, states: Dict[str, Dict]) -> None:
+        empty = [k for k, s in states.items() if s['transaction_count'] == 0]
+        conn.executemany("DELETE FROM agg_cell_state WHERE level = ? AND cell_key = ?",
+                         [(level, k) for k in empty])
+        conn.executemany(
+            "INSERT OR REPLACE INTO agg_cell_state (level, cell_key, state) VALUES (?, ?, ?)",
+            [(level, k, _dump(s)) for k, s in states.items() if s['transaction_count'] != 0]
+        )
+
+    # ------------------------------------------------------------------
+    # Daily cells
+    # ------------------------------------------------------------------
+
+    def _apply_daily(self, conn, delta: pd.DataFrame) -> None:
+        cell_keys = [_cell_key(k) for k in delta[DAILY_KEYS].itertuples(index=False, name=None)]
+        states = self._read_states(conn, DAILY, sorted(set(cell_keys)))
+        for key, row in zip(cell_keys, delta.itertuples(index=False)):
+            state = states.get(key)
+            if state is None:
+                state = states[key] = _new_daily()
+            sign = row.sign
+            state['transaction_count'] += sign
+            state['successful_count'] += sign * row.is_successful
+            state['failed_count'] += sign * (1 - row.is_successful)
+            state['refunded_count'] += sign * row.is_refunded
+            state['amount'] += sign * row.amount
+            state['fees'] += sign * row.fee
+            state['net'] += sign * row.net
+            if sign > 0:
+                state['min'] = row.amount if state['min'] is None else min(state['min'], row.amount)
+                state['max'] = row.amount if state['max'] is None else max(state['max'], row.amount)
+            elif row.amount <= (state['min'] or 0) or row.amount >= (state['max'] or 0):
+                # The extreme may have been this row: rebuild from facts
+                state['stale'] = True
+            state['customers'].add(row.customer_key, sign)
+
+        # Retracted extremes: one MIN/MAX query for every stale cell of the batch
+        self._refresh_extremes(conn, [k for k, st in states.items()
+                                      if st['transaction_count'] and st['stale']], states)
+        for key, state in states.items():
+            if state['transaction_count'] and state['customers'].stale:
+                state['customers'] = self._rebuild_customers(conn, key)
+                self.stats['daily_sketch_rebuilds'] += 1
+        self._write_states(conn, DAILY, states)
+        self._write_daily_rows(conn, states)
+        self.stats['daily_cells_updated'] += len(states)
+
+    def _refresh_extremes(self, conn, keys: List[str], states: Dict[str, Dict]) -> None:
+        if not keys:
+            return
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS agg_stale_cells (time_key INTEGER, merchant_key INTEGER, "
+                     "geography_key INTEGER, payment_method_key INTEGER)")
+        conn.execute("DELETE FROM agg_stale_cells")
+        conn.executemany("INSERT INTO agg_stale_cells VALUES (?, ?, ?, ?)",
+                         [tuple(int(v) for v in k.split('|')) for k in keys])
+        for row in conn.execute(f"""
+            SELECT {', '.join('s.' + k for k in DAILY_KEYS)}, MIN(f.amount), MAX(f.amount)
+            FROM agg_stale_cells s
+            JOIN fact_transactions f ON {' AND '.join(f's.{k} = f.{k}' for k in DAILY_KEYS)}
+            GROUP BY {', '.join('s.' + k for k in DAILY_KEYS)}
+        """).fetchall():
+            state = states[_cell_key(row[:4])]
+            state['min'], state['max'] = (int(v) for v in _cents([row[4], row[5]]))
+            state['stale'] = False
+        self.stats['daily_extreme_refreshes'] += len(keys)
+
+    def _rebuild_customers(self, conn, key: str) -> DistinctSketch:
+        sketch = DistinctSketch()
+        for customer, rows in conn.execute(
+            "SELECT customer_key, COUNT(*) FROM fact_transactions WHERE time_key = ? AND merchant_key = ? "
+            "AND geography_key = ? AND payment_method_key = ? GROUP BY customer_key",
+            [int(v) for v in key.split('|')]
+        ):
+            for _ in range(rows):
+                sketch.add(customer)
+        return sketch
+
+    def _write_daily_rows(self, conn, states: Dict[str, Dict]) -> None:
+        keys = [tuple(int(v) for v in k.split('|')) for k in states]
+        conn.executemany(
+            "DELETE FROM agg_daily_revenue WHERE date_key = ? AND merchant_key = ? "
+            "AND geography_key = ? AND payment_method_key = ?", keys
+        )
+        rows = []
+        for key, state in zip(keys, states.values()):
+            count = state['transaction_count']
+            if count == 0:
+                continue
+            rows.append(key + (
+                count, state['successful_count'], state['failed_count'], state['refunded_count'],
+                state['amount'] / 100, state['fees'] / 100, state['net'] / 100,
+                _avg(state['amount'], count), state['max'] / 100, state['min'] / 100,
+                state['customers'].estimate()
+            ))
+        conn.executemany("""
+            INSERT INTO agg_daily_revenue (
+                date_key, merchant_key, geography_key, payment_method_key,
+                transaction_count, successful_count, failed_count, refunded_count,
+                total_amount, total_fees, total_net,
+                avg_transaction_amount, max_transaction_amount, min_transaction_amount,
+                unique_customers
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+    # ------------------------------------------------------------------
+    # Customer first month (all fact rows)
+    # ------------------------------------------------------------------
+
+    def _read_customer_months(self, conn, customers: List[int]) -> Dict[int, Dict[int, int]]:
+        months = {}
+        for chunk in _chunks(customers):
+            rows = conn.execute(
+                f"SELECT customer_key, months FROM agg_customer_months "
+                f"WHERE customer_key IN ({', '.join('?' for _ in chunk)})", chunk
+            ).fetchall()
+            months.update({c: {int(m): n for m, n in json.loads(raw).items()} for c, raw in rows})
+        return months
+
+    def _apply_customer_months(self, conn, delta: pd.DataFrame) -> Set[int]:
+        """Update per-customer month counts; returns months whose new/returning split changed."""
+        changes = delta.groupby(['customer_key', 'year_month'])['sign'].sum()
+        changes = changes[changes != 0]
+        customers = sorted({int(c) for c, _ in changes.index})
+        current = self._read_customer_months(conn, customers)
+        reclassify = set()
+        for (customer, year_month), count in changes.items():
+            months = current.setdefault(int(customer), {})
+            before = min(months) if months else None
+            months[int(year_month)] = months.get(int(year_month), 0) + int(count)
+            if months[int(year_month)] <= 0:
+                del months[int(year_month)]
+            after = min(months) if months else None
+            if before != after:
+                reclassify.update(m for m in (before, after) if m is not None)
+        conn.executemany("DELETE FROM agg_customer_months WHERE customer_key = ?",
+                         [(c,) for c, m in current.items() if not m])
+        conn.executemany(
+            "INSERT OR REPLACE INTO agg_customer_months (customer_key, months) VALUES (?, ?)",
+            [(c, json.dumps(m)) for c, m in current.items() if m]
+        )
+        return reclassify
+
+    def _first_months(self, conn, customers: Iterable[int]) -> Dict[int, int]:
+        return {c: min(m) for c, m in self._read_customer_months(conn, sorted(customers)).items() if m}
+
+    # ------------------------------------------------------------------
+    # Monthly cells (successful rows only, as sp_calculate_monthly_metrics)
+    # ------------------------------------------------------------------
+
+    def _apply_monthly(self, conn, delta: pd.DataFrame, reclassify: Set[int]) -> None:
+        cell_keys = [_cell_key(k) for k in delta[MONTHLY_KEYS].itertuples(index=False, name=None)]
+        states = self._read_states(conn, MONTHLY, sorted(set(cell_keys)))
+        for year_month in sorted(reclassify):
+            for key, raw in conn.execute(
+                "SELECT cell_key, state FROM agg_cell_state WHERE level = ? AND cell_key LIKE ?",
+                (MONTHLY, f"{year_month}|%")
+            ).fetchall():
+                states.setdefault(key, _load(raw))
+
+        for key, row in zip(cell_keys, delta.itertuples(index=False)):
+            state = states.get(key)
+            if state is None:
+                state = states[key] = _new_monthly()
+            sign = row.sign
+            state['transaction_count'] += sign
+            state['gross'] += sign * row.amount
+            state['net'] += sign * row.net
+            state['refunded'] += sign * row.is_refunded
+            state['disputed'] += sign * row.is_disputed
+            state['fraudulent'] += sign * row.is_fraudulent
+            state['customers'].add(row.customer_key, sign)
+
+        for key, state in states.items():
+            if state['transaction_count'] and state['customers'].stale:
+                states[key] = self._rebuild_monthly(conn, key)
+                self.stats['monthly_rebuilds'] += 1
+        self._write_states(conn, MONTHLY, states)
+        self._write_monthly_rows(conn, states)
+        self.stats['monthly_cells_updated'] += len(states)
+
+    def _monthly_facts(self, conn, key: str) -> pd.DataFrame:
+        year_month, merchant_key = (int(v) for v in key.split('|'))
+        start, end = _month_bounds(year_month)
+        return pd.read_sql_query(
+            "SELECT * FROM fact_transactions WHERE merchant_key = ? AND time_key >= ? "
+            "AND time_key < ? AND is_successful = 1", conn, params=[merchant_key, start, end]
+        )
+
+    def _rebuild_monthly(self, conn, key: str) -> Dict:
+        delta = _signed(self._monthly_facts(conn, key), 1)
+        state = _new_monthly()
+        if delta.empty:
+            return state
+        state.update({
+            'transaction_count': len(delta), 'gross': int(delta['amount'].sum()),
+            'net': int(delta['net'].sum()), 'refunded': int(delta['is_refunded'].sum()),
+            'disputed': int(delta['is_disputed'].sum()), 'fraudulent': int(delta['is_fraudulent'].sum()),
+        })
+        for customer in delta['customer_key']:
+            state['customers'].add(customer)
+        return state
+
+    def _new_returning(self, conn, key: str, state: Dict) -> Tuple[int, int]:
+        year_month = int(key.split('|')[0])
+        sketch = state['customers']
+        if sketch.exact:
+            customers = list(sketch.keys())
+        else:
+            # HyperLogLog cell: customers come from the fact rows
+            customers = self._monthly_facts(conn, key)['customer_key'].astype(int).unique().tolist()
+            self.stats['monthly_customer_scans'] += 1
+        first = self._first_months(conn, customers)
+        new = sum(1 for c in customers if first.get(c, year_month) >= year_month)
+        return new, len(customers) - new
+
+    def _write_monthly_rows(self, conn, states: Dict[str, Dict]) -> None:
+        keys = [tuple(int(v) for v in k.split('|')) for k in states]
+        conn.executemany("DELETE FROM agg_monthly_metrics WHERE year_month = ? AND merchant_key = ?", keys)
+        rows = []
+        for key, (cell, state) in zip(keys, states.items()):
+            count = state['transaction_count']
+            if count == 0:
+                continue
+            unique = state['customers'].estimate()
+            new, returning = self._new_returning(conn, cell, state)
+            rows.append(key + (
+                state['gross'] / 100, state['net'] / 100, count, unique, new, returning,
+                _avg(state['gross'], count),
+                _avg(state['gross'], unique) if unique else 0.0,
+                0.0,
+                _rate(state['refunded'], count),
+                _rate(state['disputed'], count),
+                _rate(state['fraudulent'], count),
+            ))
+        conn.executemany("""
+            INSERT INTO agg_monthly_metrics (
+                year_month, merchant_key, gross_revenue, net_revenue, transaction_count,
+                unique_customers, new_customers, returning_customers,
+                avg_order_value, customer_lifetime_value,
+                churn_rate, refund_rate, chargeback_rate, fraud_rate
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+
+# ============================================================================
+# FULL RECOMPUTE (verification)
+# ============================================================================
+
+# sp_refresh_daily_aggregates / sp_calculate_monthly_metrics over every day and month
+FULL_DAILY_SQL = """
+    SELECT f.time_key AS date_key, f.merchant_key, f.geography_key, f.payment_method_key,
+           COUNT(*) AS transaction_count,
+           SUM(CASE WHEN f.is_successful = 1 THEN 1 ELSE 0 END) AS successful_count,
+           SUM(CASE WHEN f.is_successful = 0 THEN 1 ELSE 0 END) AS failed_count,
+           SUM(CASE WHEN f.is_refunded = 1 THEN 1 ELSE 0 END) AS refunded_count,
+           SUM(f.amount) AS total_amount, SUM(f.processing_fee) AS total_fees,
+           SUM(f.net_amount) AS total_net,
+           ROUND(AVG(f.amount), 2) AS avg_transaction_amount,
+           MAX(f.amount) AS max_transaction_amount, MIN(f.amount) AS min_transaction_amount,
+           COUNT(DISTINCT f.customer_key) AS unique_customers
+    FROM fact_transactions f
+    GROUP BY f.time_key, f.merchant_key, f.geography_key, f.payment_method_key
+"""
+
+FULL_MONTHLY_SQL = """
+    SELECT f.time_key / 100 AS year_month, f.merchant_key,
+           SUM(f.amount) AS gross_revenue, SUM(f.net_amount) AS net_revenue,
+           COUNT(*) AS transaction_count,
+           COUNT(DISTINCT f.customer_key) AS unique_customers,
+           COUNT(DISTINCT CASE WHEN ft.first_month >= f.time_key / 100 THEN f.customer_key END) AS new_customers,
+           COUNT(DISTINCT CASE WHEN ft.first_month < f.time_key / 100 THEN f.customer_key END) AS returning_customers,
+           ROUND(AVG(f.amount), 2) AS avg_order_value,
+           ROUND(CAST(SUM(CASE WHEN f.is_refunded = 1 THEN 1 ELSE 0 END) AS REAL) * 100 / COUNT(*), 2) AS refund_rate,
+           ROUND(CAST(SUM(CASE WHEN f.is_disputed = 1 THEN 1 ELSE 0 END) AS REAL) * 100 / COUNT(*), 2) AS chargeback_rate,
+           ROUND(CAST(SUM(CASE WHEN f.is_fraudulent = 1 THEN 1 ELSE 0 END) AS REAL) * 100 / COUNT(*), 2) AS fraud_rate
+    FROM fact_transactions f
+    LEFT JOIN (SELECT customer_key, MIN(time_key) / 100 AS first_month
+               FROM fact_transactions GROUP BY customer_key) ft
+        ON f.customer_key = ft.customer_key
+    WHERE f.is_successful = 1
+    GROUP BY f.time_key / 100, f.merchant_key
+"""
+
+
+# Averages and rates: the SQL recompute rounds a float, the engine rounds exactly
+ROUNDED_TOLERANCE = 0.0101
+
+
+def _compare(expected: pd.DataFrame, actual: pd.DataFrame, keys: List[str],
+             approximate: List[str]) -> Dict:
+    merged = expected.merge(actual, on=keys, how='outer', suffixes=('_full', '_incr'), indicator=True)
+    report = {'cells': len(expected), 'missing': int((merged['_merge'] == 'left_only').sum()),
+              'extra': int((merged['_merge'] == 'right_only').sum()), 'mismatches': {},
+              'max_relative_error': {}}
+    both = merged[merged['_merge'] == 'both']
+    for column in expected.columns:
+        if column in keys:
+            continue
+        full = both[f"{column}_full"].astype(float)
+        incr = both[f"{column}_incr"].astype(float)
+        if column in approximate:
+            error = ((incr - full).abs() / full.clip(lower=1)).max() if len(both) else 0.0
+            report['max_relative_error'][column] = round(float(error), 4)
+            continue
+        tolerance = ROUNDED_TOLERANCE if column.startswith('avg_') or column.endswith('_rate') else 0.005
+        mismatched = int(((full - incr).abs() > tolerance).sum())
+        if mismatched:
+            report['mismatches'][column] = mismatched
+    return report
+
+
+def verify(conn) -> Dict:
+    """
+    Compare the maintained aggregate tables with a full recompute.
+    unique_customers is exact while a cell's sketch is exact, otherwise
+    within the HyperLogLog error (reported as max_relative_error).
+    """
+    daily_columns = ('date_key, merchant_key, geography_key, payment_method_key, transaction_count, '
+                     'successful_count, failed_count, refunded_count, total_amount, total_fees, total_net, '
+                     'avg_transaction_amount, max_transaction_amount, min_transaction_amount, unique_customers')
+    monthly_columns = ('year_month, merchant_key, gross_revenue, net_revenue, transaction_count, '
+                       'unique_customers, new_customers, returning_customers, avg_order_value, '
+                       'refund_rate, chargeback_rate, fraud_rate')
+    daily = _compare(
+        pd.read_sql_query(FULL_DAILY_SQL, conn),
+        pd.read_sql_query(f"SELECT {daily_columns} FROM agg_daily_revenue", conn),
+        ['date_key', 'merchant_key', 'geography_key', 'payment_method_key'], ['unique_customers']
+    )
+    monthly = _compare(
+        pd.read_sql_query(FULL_MONTHLY_SQL, conn),
+        pd.read_sql_query(f"SELECT {monthly_columns} FROM agg_monthly_metrics", conn),
+        ['year_month', 'merchant_key'], ['unique_customers']
+    )
+    return {'agg_daily_revenue': daily, 'agg_monthly_metrics': monthly}
+
+
+def rebuild(conn) -> Dict:
+    """Reset the states and aggregate every fact row (initial load or repair)."""
+    with conn:
+        IncrementalAggregator.ensure_schema(conn)
+        for table in ('agg_cell_state', 'agg_customer_months', 'agg_daily_revenue', 'agg_monthly_metrics'):
+            conn.execute(f"DELETE FROM {table}")
+        aggregator = IncrementalAggregator()
+        aggregator.on_merge(conn, None, pd.read_sql_query("SELECT * FROM fact_transactions", conn))
+    return dict(aggregator.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental aggregate tables')
+    parser.add_argument('command', choices=['verify', 'rebuild'])
+    parser.add_argument('--olap', required=True, help='SQLite warehouse stand-in')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.olap)
+    result = verify(conn) if args.command == 'verify' else rebuild(conn)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Incremental OLTP-to-OLAP Fact ETL
+Stripe Data Architecture - Pipelines
+
+Purpose: Python implementation of the etl_oltp_to_olap pipeline
+         (architecture/pipelines/adf/etl_oltp_to_olap.json), including the
+         transform step the Databricks notebook performed:
+             1. read Payment CDC net changes since the ETL watermark, in
+                bounded LSN chunks
+             2. resolve surrogate keys with in-memory dimension lookups
+             3. write date-partitioned Parquet (row-group statistics)
+             4. merge the chunk into fact_transactions (idempotent batch),
+                optionally maintaining the aggregate tables incrementally
+             5. advance the watermark
+         Refund and Dispute changes arrive after their payment and adjust
+         the merged fact row (refund / chargeback columns). All tables of a
+         run stop at the same max LSN, and adjustments never pass the
+         Payment watermark: a refund or dispute is only merged once its
+         payment is.
+         Each chunk is committed separately, so a failed run resumes from the
+         last merged chunk and can run as often as needed instead of daily.
+
+Usage:
+    # Local stand-ins (SQLite CDC + SQLite warehouse + local Parquet)
+    python incremental_etl.py bench --payments 200000 --chunk-rows 50000
+    python incremental_etl.py run --oltp oltp_cdc.db --olap olap.db --lake ./lake
+
+    # Azure SQL CDC -> Parquet + Synapse merge scripts
+    python incremental_etl.py run --sql-connection "<conn>" --synapse-connection "<conn>" \\
+        --lake /mnt/adls/processed/fact_transactions --merge-sql ./merge_batches
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cdc_source import CDC_DELETE, AzureSQLCDCSource, CDCSource, SQLiteCDCSource
+from dimension_lookup import INFERRED_MEMBER_SQL, PAYMENT_PRODUCT_CODE, DimensionLookups
+from fact_writer import (DEFAULT_ROW_GROUP_SIZE, FACT_COLUMNS, MergeBatch, SQLiteMergeSink,
+                         SynapseMergeSink, batch_id_for, write_manifest, write_partitioned_parquet)
+from incremental_aggregates import IncrementalAggregator, verify
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+SUCCEEDED = 'succeeded'
+REFUNDED = 'refunded'
+
+# Late-arriving adjustments: CDC table -> (flag column, amount column,
+# statuses that void the adjustment). One refund / dispute per payment.
+ADJUSTMENTS = {
+    'Refund': ('is_refunded', 'refund_amount', {'failed', 'canceled'}),
+    'Dispute': ('is_disputed', 'chargeback_amount', set()),
+}
+INFERRED_DIMENSIONS = tuple(INFERRED_MEMBER_SQL)
+
+# Payment first: adjustments need the merged payment row
+DEFAULT_TABLES = ['Payment', 'Refund', 'Dispute']
+
+
+# ============================================================================
+# TRANSFORM
+# ============================================================================
+
+def transform_payments(changes: pd.DataFrame, lookups: DimensionLookups) -> Tuple[pd.DataFrame, List[int]]:
+    """
+    Payment net changes -> fact_transactions rows (vectorized).
+
+    Args:
+        changes: Net changes ('operation' + Payment CDC columns)
+        lookups: Dimension lookup maps
+
+    Returns:
+        (fact rows for inserts/updates, PaymentIDs deleted in the source)
+    """
+    deletes = changes['operation'] == CDC_DELETE
+    deleted_ids = [int(i) for i in changes.loc[deletes, 'PaymentID']]
+    rows = changes.loc[~deletes]
+    if rows.empty:
+        return pd.DataFrame(columns=FACT_COLUMNS), deleted_ids
+
+    created = pd.to_datetime(rows['CreatedAt']).dt.tz_localize(None)
+    amount = pd.to_numeric(rows['Amount']).round(2).to_numpy()
+
+    customers = lookups['customer']
+    product = lookups['product']
+    product_code = pd.Series([PAYMENT_PRODUCT_CODE])
+    product_key = int(product.resolve(product_code)[0])
+    base_fee = float(product.attribute('base_fee', product_code, 0).iloc[0])
+    percentage_fee = float(product.attribute('percentage_fee', product_code, 0).iloc[0])
+
+    # SCD2 dimensions: the version in effect when the payment was created
+    customer_keys = customers.resolve(rows['CustomerID'], as_of=created)
+    customer_country = customers.attribute('country_code', rows['CustomerID'], as_of=created)
+    processing_fee = np.round(amount * percentage_fee + base_fee, 2)
+    transaction_id = rows['PaymentID'].astype(np.int64).to_numpy()
+    status = rows['Status'].str.lower()
+    refunded = (status == REFUNDED).to_numpy()
+
+    facts = pd.DataFrame({
+        # The source id is the fact key: re-merging a payment replaces its row
+        'transaction_key': transaction_id,
+        'transaction_id': transaction_id,
+        'time_key': (created.dt.year * 10000 + created.dt.month * 100 + created.dt.day).to_numpy(np.int32),
+        'customer_key': customer_keys,
+        'merchant_key': lookups['merchant'].resolve(rows['MerchantID'], as_of=created),
+        'payment_method_key': lookups['payment_method'].resolve(rows['PaymentMethod']),
+        'geography_key': lookups['geography'].resolve(customer_country),
+        'product_key': product_key,
+        'amount': amount,
+        'processing_fee': processing_fee,
+        'net_amount': np.round(amount - processing_fee, 2),
+        'refund_amount': np.where(refunded, amount, 0.0),
+        'chargeback_amount': 0.0,
+        # A refunded payment succeeded first (refund_rate is over successful payments)
+        'is_successful': (status == SUCCEEDED).to_numpy() | refunded,
+        'is_refunded': refunded,
+        'is_disputed': False,
+        'is_fraudulent': False,
+        'transaction_count': 1,
+        'transaction_datetime': created.to_numpy(),
+    })
+    return facts, deleted_ids
+
+
+def carry_adjustments(facts: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keep the refund / dispute / fraud columns of already-merged rows when a
+    payment update re-creates its fact row.
+    """
+    if facts.empty or current.empty:
+        return facts
+    current = current.set_index('transaction_id')
+    ids = facts['transaction_id']
+    known = ids.isin(current.index).to_numpy()
+    if not known.any():
+        return facts
+    facts = facts.copy()
+    for flag, amount, _ in ADJUSTMENTS.values():
+        carried_flag = ids.map(current[flag]).fillna(False).astype(bool).to_numpy()
+        carried_amount = ids.map(current[amount]).fillna(0.0).to_numpy(np.float64)
+        facts[flag] = facts[flag].to_numpy() | carried_flag
+        facts[amount] = np.where(carried_amount > 0, carried_amount, facts[amount].to_numpy())
+    facts['is_fraudulent'] = facts['is_fraudulent'].to_numpy() | \
+        ids.map(current['is_fraudulent']).fillna(False).astype(bool).to_numpy()
+    return facts
+
+
+def transform_adjustments(table: str, changes: pd.DataFrame,
+                          current: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """
+    Refund / Dispute net changes -> updated images of their payments' fact rows.
+
+    Args:
+        table: 'Refund' or 'Dispute'
+        changes: Net changes of the table
+        current: Current fact rows of the referenced payments
+
+    Returns:
+        (updated fact rows, changes whose payment is not in the warehouse)
+    """
+    flag, amount_column, void_statuses = ADJUSTMENTS[table]
+    if changes.empty:
+        return pd.DataFrame(columns=FACT_COLUMNS), 0
+    # Latest change per payment
+    changes = changes.drop_duplicates('PaymentID', keep='last')
+    payment_ids = changes['PaymentID'].astype(np.int64)
+    active = (changes['operation'] != CDC_DELETE).to_numpy() & \
+        ~changes['Status'].fillna('').str.lower().isin(void_statuses).to_numpy()
+    adjustment = pd.DataFrame({
+        'transaction_id': payment_ids.to_numpy(),
+        flag: active,
+        amount_column: np.where(active, pd.to_numeric(changes['Amount']).round(2).to_numpy(), 0.0),
+    })
+    facts = current.drop(columns=[flag, amount_column]).merge(adjustment, on='transaction_id')
+    return facts[FACT_COLUMNS], len(changes) - len(facts)
+
+
+# ============================================================================
+# ENGINE
+# ============================================================================
+
+class IncrementalFactETL:
+    """Chunked CDC -> fact_transactions loader."""
+
+    def __init__(self, source: CDCSource, lookups: DimensionLookups, lake_root: str, sink,
+                 chunk_rows: int = 50_000, row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 table: str = 'Payment'):
+        """
+        Args:
+            source: CDC source holding the watermark
+            lookups: Dimension lookup maps (loaded once per run)
+            lake_root: Parquet root of fact_transactions
+            sink: Merge sink (SQLiteMergeSink or SynapseMergeSink)
+            chunk_rows: Approximate CDC rows per chunk (whole transactions)
+            row_group_size: Parquet rows per row group
+            table: CDC source table ('Payment' or an ADJUSTMENTS table)
+        """
+        self.source = source
+        self.lookups = lookups
+        self.lake_root = lake_root
+        self.sink = sink
+        self.chunk_rows = chunk_rows
+        self.row_group_size = row_group_size
+        self.table = table
+
+    def run(self, max_chunks: Optional[int] = None, max_lsn: Optional[int] = None) -> Dict:
+        """
+        Load every change up to max_lsn (default: the current max LSN).
+
+        Adjustment tables stop at the Payment watermark if it is lower, so
+        the payment of every refund / dispute read is already merged.
+
+        Returns:
+            Run statistics (rows, chunks, per-stage seconds, rows/s)
+        """
+        timings = dict.fromkeys(['extract', 'transform', 'parquet', 'merge'], 0.0)
+        stats = {'chunks': 0, 'changes': 0, 'upserts': 0, 'deletes': 0, 'skipped_batches': 0,
+                 'orphan_adjustments': 0, 'inferred_members': 0}
+        start = time.perf_counter()
+
+        watermark = self.source.get_watermark(self.table)
+        if max_lsn is None:
+            max_lsn = self.source.max_lsn()
+        if self.table in ADJUSTMENTS:
+            max_lsn = min(max_lsn, self.source.get_watermark('Payment'))
+        logger.info(f"{self.table}: watermark {watermark:#x}, max LSN {max_lsn:#x}")
+
+        while watermark < max_lsn and (max_chunks is None or stats['chunks'] < max_chunks):
+            t = time.perf_counter()
+            chunk_end = self.source.next_chunk_end(self.table, watermark, max_lsn, self.chunk_rows)
+            if chunk_end is None:
+                # No change of this table up to max_lsn
+                self.source.set_watermark(self.table, max_lsn, 0)
+                break
+            changes = self.source.net_changes(self.table, watermark, chunk_end)
+            timings['extract'] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            facts, deleted_ids = self._transform(changes, stats)
+            timings['transform'] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            batch_id = batch_id_for(self.table, watermark, chunk_end)
+            files = write_partitioned_parquet(facts, self.lake_root, batch_id, self.row_group_size)
+            batch = MergeBatch(batch_id, self.table, watermark, chunk_end, files, len(facts), deleted_ids)
+            write_manifest(self.lake_root, batch)
+            timings['parquet'] += time.perf_counter() - t
+
+            t = time.perf_counter()
+            if self.sink.conn is not None:
+                # Placeholder rows of late-arriving members before the facts referencing them
+                stats['inferred_members'] += self.lookups.write_inferred(self.sink.conn)
+            if not self.sink.apply(batch, facts, self.lake_root):
+                stats['skipped_batches'] += 1
+            self.source.set_watermark(self.table, chunk_end, len(changes))
+            timings['merge'] += time.perf_counter() - t
+
+            stats['chunks'] += 1
+            stats['changes'] += len(changes)
+            stats['upserts'] += len(facts)
+            stats['deletes'] += len(deleted_ids)
+            watermark = chunk_end
+            logger.info(f"Chunk {batch_id}: {len(changes)} changes, {len(files)} partitions")
+
+        elapsed = time.perf_counter() - start
+        stats.update({
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(stats['changes'] / elapsed) if elapsed > 0 else 0,
+            'stage_seconds': {k: round(v, 3) for k, v in timings.items()},
+            'stage_rows_per_second': {k: round(stats['changes'] / v) if v > 0 else None
+                                      for k, v in timings.items()},
+            'unknown_keys': {k: v for k, v in self.lookups.misses().items() if v}
+        })
+        logger.info(f"{self.table}: {stats['changes']} changes in {elapsed:.2f}s "
+                     f"({stats['rows_per_second']} rows/s)")
+        return stats
+
+    def _transform(self, changes: pd.DataFrame, stats: Dict) -> Tuple[pd.DataFrame, List[int]]:
+        if self.table in ADJUSTMENTS:
+            current = self.sink.read_facts(changes['PaymentID'].tolist()) if not changes.empty \
+                else pd.DataFrame(columns=FACT_COLUMNS)
+            facts, orphans = transform_adjustments(self.table, changes, current)
+            if orphans:
+                logger.warning(f"{self.table}: {orphans} changes reference payments not in fact_transactions")
+            stats['orphan_adjustments'] += orphans
+            return facts, []
+        facts, deleted_ids = transform_payments(changes, self.lookups)
+        if not facts.empty:
+            facts = carry_adjustments(facts, self.sink.read_facts(facts['transaction_id'].tolist()))
+        return facts, deleted_ids
+
+
+def run_tables(source: CDCSource, lookups: DimensionLookups, lake_root: str, sink,
+               tables: List[str], **kwargs) -> Dict[str, Dict]:
+    """
+    Run the ETL for each table in order (payments before their adjustments),
+    every table up to the same max LSN read once for the run.
+    """
+    max_lsn = source.max_lsn()
+    return {table: IncrementalFactETL(source, lookups, lake_root, sink, table=table, **kwargs)
+            .run(max_lsn=max_lsn)
+            for table in tables}
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Incremental OLTP -> OLAP fact ETL')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='Load changes since the watermark')
+    source = run.add_mutually_exclusive_group(required=True)
+    source.add_argument('--oltp', help='SQLite CDC stand-in')
+    source.add_argument('--sql-connection', help='Azure SQL (OLTP, CDC) connection string')
+    run.add_argument('--olap', help='SQLite warehouse stand-in (with --oltp)')
+    run.add_argument('--synapse-connection', help='Synapse connection string (dimensions + merge)')
+    run.add_argument('--merge-sql', default='merge_batches', help='Directory of emitted Synapse merge scripts')
+    run.add_argument('--storage-url', help='ADLS URL of the lake root (COPY INTO source)')
+    run.add_argument('--lake', required=True, help='Parquet root of fact_transactions')
+    run.add_argument('--chunk-rows', type=int, default=50_000)
+    run.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    run.add_argument('--tables', nargs='+', default=DEFAULT_TABLES)
+    run.add_argument('--infer-members', action='store_true',
+                     help='Inferred dim_customer / dim_merchant rows for late-arriving ids')
+    run.add_argument('--aggregates', action='store_true',
+                     help='Maintain agg_daily_revenue / agg_monthly_metrics incrementally (--olap)')
+
+    bench = sub.add_parser('bench', help='Throughput on generated local stand-ins')
+    bench.add_argument('--payments', type=int, default=200_000)
+    bench.add_argument('--customers', type=int, default=20_000)
+    bench.add_argument('--merchants', type=int, default=500)
+    bench.add_argument('--chunk-rows', type=int, default=50_000)
+    bench.add_argument('--row-group-size', type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    bench.add_argument('--seed', type=int, default=42)
+    bench.add_argument('--no-aggregates', action='store_true', help='Fact loading only')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.oltp:
+            cdc = SQLiteCDCSource(args.oltp)
+            aggregator = IncrementalAggregator() if args.aggregates else None
+            sink = SQLiteMergeSink(args.olap or 'olap.db',
+                                   on_merge=aggregator.on_merge if aggregator else None)
+            olap_conn = sink.conn
+        else:
+            import pyodbc
+            cdc = AzureSQLCDCSource(args.sql_connection)
+            olap_conn = pyodbc.connect(args.synapse_connection)
+            sink = SynapseMergeSink(args.merge_sql, args.storage_url, olap_conn)
+        lookups = DimensionLookups.load(olap_conn, INFERRED_DIMENSIONS if args.infer_members else ())
+        stats = run_tables(cdc, lookups, args.lake, sink, args.tables,
+                           chunk_rows=args.chunk_rows, row_group_size=args.row_group_size)
+        print(json.dumps(stats, indent=2))
+        return
+
+    from local_standin import generate_standin
+
+    workdir = tempfile.mkdtemp(prefix='etl_bench_')
+    try:
+        cdc = SQLiteCDCSource(os.path.join(workdir, 'oltp_cdc.db'))
+        aggregator = None if args.no_aggregates else IncrementalAggregator()
+        sink = SQLiteMergeSink(os.path.join(workdir, 'olap.db'),
+                               on_merge=aggregator.on_merge if aggregator else None)
+        generated = generate_standin(cdc, sink.conn, args.payments, args.customers,
+                                     args.merchants, seed=args.seed)
+        lookups = DimensionLookups.load(sink.conn, INFERRED_DIMENSIONS)
+        lake = os.path.join(workdir, 'lake')
+        options = {'chunk_rows': args.chunk_rows, 'row_group_size': args.row_group_size}
+        stats = run_tables(cdc, lookups, lake, sink, DEFAULT_TABLES, **options)
+        stats['generated'] = generated
+        stats['warehouse'] = sink.counts()
+        # Second run: nothing new since the watermark
+        stats['rerun_changes'] = sum(s['changes'] for s in
+                                     run_tables(cdc, lookups, lake, sink, DEFAULT_TABLES, **options).values())
+        if aggregator is not None:
+            stats['aggregates'] = dict(aggregator.stats)
+            stats['aggregates_vs_full_recompute'] = verify(sink.conn)
+        print(json.dumps(stats, indent=2))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Local Stand-ins for the Incremental ETL
+Stripe Data Architecture - Pipelines
+
+Purpose: Generate a reproducible OLTP change stream (SQLite CDC stand-in)
+         and the matching current dimension rows (SQLite warehouse
+         stand-in) so the ETL can be run and timed without Azure.
+"""
+
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Dict
+
+from cdc_source import CDC_DELETE, CDC_INSERT, CDC_UPDATE, SQLiteCDCSource
+
+logger = logging.getLogger(__name__)
+
+
+COUNTRIES = [('FR', 'France', 'EUR'), ('US', 'United States', 'USD'), ('GB', 'United Kingdom', 'GBP'),
+             ('DE', 'Germany', 'EUR'), ('BR', 'Brazil', 'BRL')]
+PAYMENT_METHOD_TYPES = [('card', 0.0290), ('sepa_debit', 0.0080), ('wallet', 0.0250)]
+TRANSACTION_SIZE = 200
+
+
+def _insert(conn, table: str, rows) -> None:
+    rows = list(rows)
+    if rows:
+        conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' for _ in rows[0])})", rows)
+
+
+def load_dimensions(olap_conn, n_customers: int, n_merchants: int, rng: random.Random,
+                    effective_date: str, change_date: str, scd2_rate: float = 0.05) -> None:
+    """
+    Dimension rows; customer/merchant keys are offset from their ids. A share
+    of the customers moved country on change_date (SCD2: a second version
+    with key offset by n_customers).
+    """
+    moved = set(rng.sample(range(1, n_customers + 1), int(n_customers * scd2_rate)))
+
+    def customer_versions(c):
+        country, name, _ = rng.choice(COUNTRIES)
+        base = (c, f"c{c}@example.com", 'First', 'Last', 'First Last')
+        tail = (10.0, 'low', 1, 'standard', 0)
+        if c not in moved:
+            return [(100_000 + c,) + base + (country, name) + tail + (effective_date, None, 1, 1)]
+        new_country, new_name, _ = rng.choice([x for x in COUNTRIES if x[0] != country])
+        return [(100_000 + c,) + base + (country, name) + tail + (effective_date, change_date, 0, 1),
+                (100_000 + n_customers + c,) + base + (new_country, new_name) + tail + (change_date, None, 1, 2)]
+
+    with olap_conn:
+        _insert(olap_conn, 'dim_geography', (
+            (i + 1, code, name, 'region', 'sub_region', 'continent', currency, currency,
+             'UTC', None, None, None, int(code in ('FR', 'DE', 'GB')), 0)
+            for i, (code, name, currency) in enumerate(COUNTRIES)
+        ))
+        _insert(olap_conn, 'dim_product', [
+            (1, 'PAY-001', 'Standard Payment', 'Payment', 'Core', 'Percentage', 0.00, 0.0290, 1),
+            (2, 'SUB-001', 'Subscription Payment', 'Subscription', 'Premium', 'Percentage', 0.00, 0.0250, 1),
+        ])
+        _insert(olap_conn, 'dim_payment_method', (
+            (i + 1, i + 1, kind, kind, None, None, None, None, None, int(kind == 'wallet'), cost)
+            for i, (kind, cost) in enumerate(PAYMENT_METHOD_TYPES)
+        ))
+        _insert(olap_conn, 'dim_customer', (
+            row for c in range(1, n_customers + 1) for row in customer_versions(c)
+        ))
+        _insert(olap_conn, 'dim_merchant', (
+            (200_000 + m, m, f"Merchant {m}", f"Merchant {m} SAS", f"m{m}@example.com", 'FR', 'France',
+             'retail', 'commerce', '5411', 'Grocery', 1, 'verified', 'standard', effective_date, None, 1, 1)
+            for m in range(1, n_merchants + 1)
+        ))
+
+
+def generate_standin(cdc: SQLiteCDCSource, olap_conn, n_payments: int, n_customers: int,
+                     n_merchants: int, days: int = 30, update_rate: float = 0.10,
+                     delete_rate: float = 0.01, unknown_customer_rate: float = 0.001,
+                     refund_rate: float = 0.02, dispute_rate: float = 0.005,
+                     scd2_rate: float = 0.05, seed: int = 42) -> Dict:
+    """
+    Fill the CDC stand-in with payment inserts (committed in transactions of
+    TRANSACTION_SIZE rows), later status updates and deletes, late refunds
+    and disputes (some of them withdrawn), and load the dimensions (with SCD2
+    customer versions) into the warehouse stand-in.
+
+    Returns:
+        Counts of generated changes
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    load_dimensions(olap_conn, n_customers, n_merchants, rng,
+                    (now - timedelta(days=days + 1)).date().isoformat(),
+                    (now - timedelta(days=days // 2)).date().isoformat(), scd2_rate)
+
+    payments = []
+    for payment_id in range(1, n_payments + 1):
+        created = now - timedelta(seconds=rng.uniform(0, days * 86400))
+        # A few customers are not in the dimension yet (late-arriving)
+        customer = n_customers + payment_id if rng.random() < unknown_customer_rate \
+            else rng.randint(1, n_customers)
+        payments.append({
+            'PaymentID': payment_id, 'CustomerID': customer,
+            'MerchantID': rng.randint(1, n_merchants),
+            'Amount': round(rng.lognormvariate(3.5, 1.0), 2), 'Currency': 'EUR',
+            'Status': rng.choice(['succeeded'] * 9 + ['failed']),
+            'PaymentMethod': rng.choice(PAYMENT_METHOD_TYPES)[0],
+            'CreatedAt': created.isoformat(sep=' '), 'UpdatedAt': created.isoformat(sep=' ')
+        })
+    payments.sort(key=lambda p: p['CreatedAt'])
+
+    for start in range(0, len(payments), TRANSACTION_SIZE):
+        batch = payments[start:start + TRANSACTION_SIZE]
+        cdc.capture('Payment', [(CDC_INSERT, p) for p in batch], batch[-1]['CreatedAt'])
+
+    updated = rng.sample(payments, int(len(payments) * update_rate))
+    for start in range(0, len(updated), TRANSACTION_SIZE):
+        changes = []
+        for payment in updated[start:start + TRANSACTION_SIZE]:
+            after = dict(payment, Status='refunded' if payment['Status'] == 'succeeded' else 'succeeded',
+                         UpdatedAt=now.isoformat(sep=' '))
+            changes.append((CDC_UPDATE, dict(after, __before__=payment)))
+        cdc.capture('Payment', changes, now.isoformat(sep=' '))
+
+    deleted = rng.sample(payments, int(len(payments) * delete_rate))
+    for start in range(0, len(deleted), TRANSACTION_SIZE):
+        cdc.capture('Payment', [(CDC_DELETE, p) for p in deleted[start:start + TRANSACTION_SIZE]],
+                    now.isoformat(sep=' '))
+
+    # Late-arriving refunds and chargebacks on successful payments
+    deleted_ids = {p['PaymentID'] for p in deleted}
+    succeeded = [p for p in payments if p['Status'] == 'succeeded' and p['PaymentID'] not in deleted_ids]
+    adjustments = {}
+    for table, rate, columns in (
+        ('Refund', refund_rate, lambda i, p: {'RefundID': i, 'PaymentID': p['PaymentID'],
+                                              'Amount': p['Amount'], 'Reason': 'requested_by_customer',
+                                              'Status': 'succeeded', 'CreatedAt': now.isoformat(sep=' ')}),
+        ('Dispute', dispute_rate, lambda i, p: {'DisputeID': i, 'PaymentID': p['PaymentID'],
+                                                'Reason': 'fraudulent', 'Status': 'needs_response',
+                                                'Amount': p['Amount'], 'CreatedAt': now.isoformat(sep=' '),
+                                                'ResolvedAt': None}),
+    ):
+        rows = [columns(i + 1, p) for i, p in enumerate(rng.sample(succeeded, int(len(succeeded) * rate)))]
+        for start in range(0, len(rows), TRANSACTION_SIZE):
+            cdc.capture(table, [(CDC_INSERT, r) for r in rows[start:start + TRANSACTION_SIZE]],
+                        now.isoformat(sep=' '))
+        # A tenth are withdrawn later
+        withdrawn = rows[:len(rows) // 10]
+        if withdrawn:
+            cdc.capture(table, [(CDC_DELETE, r) for r in withdrawn], now.isoformat(sep=' '))
+        adjustments[table.lower() + 's'] = len(rows)
+
+    return dict({'payments': len(payments), 'updates': len(updated), 'deletes': len(deleted)},
+                **adjustments)
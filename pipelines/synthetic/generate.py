@@ -0,0 +1,382 @@
+"""
+Synthetic Dataset Generation
+Stripe Data Architecture - Pipelines
+
+Purpose: Generate the synthetic dataset of synthetic_data.py in parallel
+         worker processes, each chunk streamed to disk as soon as it is
+         generated (memory is bounded by one chunk per worker):
+             <out>/oltp/<table>/part-NNNNN.parquet
+                 customers, merchants, payment_methods, transactions,
+                 chargebacks (OLTP column names, models/oltp/schema.sql)
+             <out>/star/fact_transactions/time_key=YYYYMMDD/part-synthetic-NNNNN.parquet
+             <out>/star/dim_*.parquet, <out>/star/agg_*.parquet
+                 star schema in the StarSchemaLake layout, facts written by
+                 the ETL's partitioned writer (pipelines/etl/fact_writer.py),
+                 aggregate tables built from the facts once every chunk is
+                 written
+             <out>/ml/training/month=YYYYMM/part-NNNNN.parquet
+                 FEATURE_NAMES (float32) + is_fraud, partitioned by month of
+                 computed_at for date-range training loads
+             <out>/cosmos/<collection>/part-NNNNN.ndjson[.gz]
+                 fraud_features (compact encoding), api_logs, webhook_events
+         Entities are computed once and shared with the workers as
+         memory-mapped .npy files. Chunk files have deterministic names and
+         each finished chunk leaves a marker, so an interrupted run resumes
+         with --resume; the output does not depend on --workers.
+
+Usage:
+    python generate.py --out data/synthetic --transactions 100000000 --workers 8
+    python generate.py --out /tmp/synthetic --transactions 1000000 --outputs oltp training
+    python generate.py --out data/synthetic --transactions 100000000 --resume
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from synthetic_data import (
+    COUNTRIES, FEATURE_NAMES, INDUSTRIES, METHOD_KINDS, SEGMENTS, TIERS, Entities, GeneratorConfig,
+    api_log_documents, build_entities, customer_emails, customer_names, feature_documents, generate_chunk,
+    merchants_frame, webhook_documents,
+)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'queries', 'engine'))
+from star_schema_lake import FACT_TABLE, StarSchemaLake, build_dim_time  # noqa: E402
+from fact_writer import write_partitioned_parquet  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+OUTPUTS = ['oltp', 'star', 'training', 'fraud_features', 'api_logs', 'webhook_events']
+OLTP_TABLES = ['customers', 'payment_methods', 'transactions', 'chargebacks']
+STATE_DIR = '_entities'
+CHUNK_MARKERS = '_chunks'
+MANIFEST = '_manifest.json'
+# dim_customer is written in slices of this many customers
+DIMENSION_SLICE = 1_000_000
+
+
+# ============================================================================
+# SINKS
+# ============================================================================
+
+def _write_parquet(frame: pd.DataFrame, path: str) -> str:
+    """Parquet file written under a temporary name, then renamed."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path + '.tmp', compression='snappy')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _write_ndjson(documents: List[Dict], path: str, compress: bool) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    path = path + '.gz' if compress else path
+    opener = gzip.open if compress else open
+    with opener(path + '.tmp', 'wt', encoding='utf-8') as f:
+        for document in documents:
+            f.write(json.dumps(document, separators=(',', ':')))
+            f.write('\n')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _write_training(features: pd.DataFrame, root: str, part: str) -> List[str]:
+    """One file per month of computed_at: <root>/month=YYYYMM/<part>.parquet."""
+    computed_at = features['computed_at']
+    month = (computed_at.dt.year * 100 + computed_at.dt.month).to_numpy()
+    frame = features[['computed_at', 'transaction_id', 'customer_id'] + FEATURE_NAMES + ['is_fraud']]
+    files = []
+    for value in np.unique(month):
+        files.append(_write_parquet(frame[month == value], os.path.join(root, f"month={value}", f"{part}.parquet")))
+    return files
+
+
+def write_chunk(out: str, entities: Entities, config: GeneratorConfig, index: int,
+                outputs: Sequence[str], compress: bool = False) -> Dict:
+    """
+    Generate one chunk and write the requested outputs.
+
+    Returns:
+        Marker content: rows per table, fraud rows, seconds
+    """
+    start = time.perf_counter()
+    chunk = generate_chunk(entities, config, index)
+    part = f"part-{index:05d}"
+    rows = {table: len(chunk[table]) for table in OLTP_TABLES}
+    rows['fraud'] = int(chunk['features']['is_fraud'].sum())
+
+    if 'oltp' in outputs:
+        for table in OLTP_TABLES:
+            _write_parquet(chunk[table], os.path.join(out, 'oltp', table, f"{part}.parquet"))
+    if 'star' in outputs:
+        write_partitioned_parquet(chunk['facts'], os.path.join(out, 'star', FACT_TABLE), f"synthetic-{index:05d}")
+    if 'training' in outputs:
+        _write_training(chunk['features'], os.path.join(out, 'ml', 'training'), part)
+    cosmos = os.path.join(out, 'cosmos')
+    if 'fraud_features' in outputs:
+        _write_ndjson(feature_documents(chunk), os.path.join(cosmos, 'fraud_features', f"{part}.ndjson"), compress)
+    if 'api_logs' in outputs:
+        documents = api_log_documents(chunk, config, index)
+        rows['api_logs'] = len(documents)
+        _write_ndjson(documents, os.path.join(cosmos, 'api_logs', f"{part}.ndjson"), compress)
+    if 'webhook_events' in outputs:
+        documents = webhook_documents(chunk, config, index)
+        rows['webhook_events'] = len(documents)
+        _write_ndjson(documents, os.path.join(cosmos, 'webhook_events', f"{part}.ndjson"), compress)
+
+    marker = {'chunk': index, 'rows': rows, 'seconds': round(time.perf_counter() - start, 3)}
+    path = os.path.join(out, CHUNK_MARKERS, f"chunk-{index:05d}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(marker, f)
+    os.replace(path + '.tmp', path)
+    return marker
+
+
+# ============================================================================
+# DIMENSIONS
+# ============================================================================
+
+def _country_frame() -> pd.DataFrame:
+    geo = pd.DataFrame([c[:7] for c in COUNTRIES], columns=['country_code', 'country_name', 'region', 'sub_region',
+                                                            'continent', 'currency_code', 'is_gdpr_country'])
+    geo.insert(0, 'geography_key', np.arange(1, len(geo) + 1, dtype=np.int32))
+    geo['currency_name'] = geo['currency_code']
+    geo['timezone'] = 'UTC'
+    geo['is_high_risk'] = geo['region'] == 'Other'
+    return geo
+
+
+def write_dimensions(out: str, entities: Entities, config: GeneratorConfig) -> Dict[str, int]:
+    """Star-schema dimensions (StarSchemaLake columns) derived from the entities."""
+    lake = StarSchemaLake(os.path.join(out, 'star'))
+    geo = _country_frame()
+    industry = np.asarray(entities.merchant_industry, dtype=np.int64)
+    merchant_country = np.asarray(entities.merchant_country, dtype=np.int64)
+    n_merchants = len(industry)
+    tables = {
+        'dim_geography': geo,
+        'dim_merchant': pd.DataFrame({
+            'merchant_key': np.arange(1, n_merchants + 1, dtype=np.int32),
+            'merchant_id': np.arange(1, n_merchants + 1, dtype=np.int64),
+            'business_name': [f"Merchant {i}" for i in range(1, n_merchants + 1)],
+            'country_code': geo['country_code'].to_numpy()[merchant_country],
+            'country_name': geo['country_name'].to_numpy()[merchant_country],
+            'industry': [INDUSTRIES[i][0] for i in industry],
+            'industry_group': [INDUSTRIES[i][1] for i in industry],
+            'merchant_tier': np.array(TIERS)[np.asarray(entities.merchant_tier, dtype=np.int64)],
+            'is_active': True, 'effective_date': config.start, 'is_current': True, 'version': 1,
+        }),
+        'dim_payment_method': pd.DataFrame({
+            'payment_method_key': np.arange(1, len(METHOD_KINDS) + 1, dtype=np.int32),
+            'type': [k[2] for k in METHOD_KINDS], 'card_brand': [k[1] for k in METHOD_KINDS],
+            'is_digital_wallet': [bool(k[3]) for k in METHOD_KINDS],
+            'processing_cost_pct': [k[4] for k in METHOD_KINDS],
+        }),
+        'dim_product': pd.DataFrame({
+            'product_key': np.array([1, 2], dtype=np.int32), 'product_code': ['PAY-001', 'SUB-001'],
+            'product_name': ['Standard Payment', 'Subscription Payment'],
+            'base_fee': [0.00, 0.00], 'percentage_fee': [0.0290, 0.0250],
+        }),
+        'dim_time': build_dim_time(config.start.year - 1, config.end.year + 1),
+    }
+    for table, frame in tables.items():
+        lake.write_table(table, frame)
+    counts = {table: len(frame) for table, frame in tables.items()}
+
+    # dim_customer: millions of rows, written slice by slice
+    path = os.path.join(lake.root, 'dim_customer.parquet')
+    n_customers = len(entities.customer_country)
+    writer = None
+    for offset in range(0, n_customers, DIMENSION_SLICE):
+        ids = np.arange(offset + 1, min(n_customers, offset + DIMENSION_SLICE) + 1, dtype=np.int64)
+        country = np.asarray(entities.customer_country[offset:offset + len(ids)], dtype=np.int64)
+        first, last = customer_names(ids)
+        table = pa.Table.from_pandas(pd.DataFrame({
+            'customer_key': ids.astype(np.int32), 'customer_id': ids,
+            'email': customer_emails(entities, ids),
+            'full_name': np.char.add(np.char.add(first, ' '), last),
+            'country_code': geo['country_code'].to_numpy()[country],
+            'country_name': geo['country_name'].to_numpy()[country],
+            'customer_segment': np.array(SEGMENTS)[np.asarray(entities.customer_segment[offset:offset + len(ids)],
+                                                              dtype=np.int64)],
+            'effective_date': config.start, 'is_current': True, 'version': 1,
+        }), preserve_index=False)
+        writer = writer or pq.ParquetWriter(path + '.tmp', table.schema, compression='snappy')
+        writer.write_table(table)
+    writer.close()
+    os.replace(path + '.tmp', path)
+    counts['dim_customer'] = n_customers
+    return counts
+
+
+# ============================================================================
+# PARALLEL GENERATION
+# ============================================================================
+
+_worker: Dict = {}
+
+
+def _init_worker(out: str, config: GeneratorConfig, outputs: Sequence[str], compress: bool) -> None:
+    logging.getLogger('synthetic_data').setLevel(logging.WARNING)
+    _worker.update(out=out, config=config, outputs=outputs, compress=compress,
+                   entities=Entities.load(os.path.join(out, STATE_DIR)))
+
+
+def _run_chunk(index: int) -> Dict:
+    return write_chunk(_worker['out'], _worker['entities'], _worker['config'], index,
+                       _worker['outputs'], _worker['compress'])
+
+
+def _config_dict(config: GeneratorConfig) -> Dict:
+    return {key: value.isoformat() if isinstance(value, date) else value
+            for key, value in config._asdict().items()}
+
+
+def generate(out: str, config: GeneratorConfig, workers: int = 1, outputs: Sequence[str] = OUTPUTS,
+             compress: bool = False, resume: bool = False) -> Dict:
+    """
+    Generate the dataset under `out`.
+
+    Args:
+        workers: Worker processes (1: in this process)
+        outputs: Subset of OUTPUTS
+        compress: gzip the NDJSON files
+        resume: Skip chunks whose marker exists (same config and outputs)
+
+    Returns:
+        Manifest: config, rows per table, fraud rate, throughput
+
+    Raises:
+        ValueError: unknown output, or --resume over a different config
+    """
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f"Unknown outputs {sorted(unknown)} (expected a subset of {OUTPUTS})")
+    started = time.perf_counter()
+    manifest_path = os.path.join(out, MANIFEST)
+    settings = {'config': _config_dict(config), 'outputs': sorted(outputs)}
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if {key: previous.get(key) for key in settings} != settings:
+            raise ValueError(f"{out} was generated with another configuration; rerun without --resume")
+    os.makedirs(out, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump({**settings, 'complete': False}, f, indent=2)
+
+    entities = build_entities(config)
+    entities.save(os.path.join(out, STATE_DIR))
+    dimensions, aggregates = {}, {}
+    if 'oltp' in outputs:
+        _write_parquet(merchants_frame(entities, config), os.path.join(out, 'oltp', 'merchants', 'part-00000.parquet'))
+    if 'star' in outputs:
+        dimensions = write_dimensions(out, entities, config)
+
+    markers = os.path.join(out, CHUNK_MARKERS)
+    done = {}
+    if resume and os.path.isdir(markers):
+        for name in os.listdir(markers):
+            if name.endswith('.json'):
+                with open(os.path.join(markers, name)) as f:
+                    marker = json.load(f)
+                done[marker['chunk']] = marker
+    pending = [index for index in range(entities.n_chunks) if index not in done]
+    logger.info(f"{len(pending)} chunks to generate ({len(done)} already done) with {workers} worker(s)")
+
+    generated = 0
+    if workers <= 1:
+        _init_worker(out, config, outputs, compress)
+        for index in pending:
+            done[index] = _run_chunk(index)
+            generated += done[index]['rows']['transactions']
+            logger.info(f"chunk {index}: {done[index]['rows']['transactions']:,} transactions "
+                        f"in {done[index]['seconds']:.1f} s ({len(done)}/{entities.n_chunks})")
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(out, config, outputs, compress)) as pool:
+            futures = [pool.submit(_run_chunk, index) for index in pending]
+            for future in as_completed(futures):
+                marker = future.result()
+                done[marker['chunk']] = marker
+                generated += marker['rows']['transactions']
+                logger.info(f"chunk {marker['chunk']}: {marker['rows']['transactions']:,} transactions "
+                            f"in {marker['seconds']:.1f} s ({len(done)}/{entities.n_chunks})")
+
+    if 'star' in outputs:
+        # agg_daily_revenue / agg_monthly_metrics of the catalog's 7.x queries (DuckDB over the facts)
+        from olap_runner import OLAPRunner
+        aggregates = OLAPRunner(StarSchemaLake(os.path.join(out, 'star')), config.end).build_aggregates()
+
+    seconds = time.perf_counter() - started
+    rows: Dict[str, int] = {}
+    for marker in done.values():
+        for table, count in marker['rows'].items():
+            rows[table] = rows.get(table, 0) + count
+    rows['merchants'] = len(entities.merchant_cdf)
+    manifest = {
+        **settings, 'complete': True, 'generated_at': datetime.utcnow().isoformat(),
+        'chunks': entities.n_chunks, 'rows': rows, 'dimensions': dimensions,
+        'aggregates': aggregates,
+        'fraud_rate': round(rows['fraud'] / max(1, rows['transactions']), 5),
+        'seconds': round(seconds, 1), 'workers': workers,
+        'transactions_per_second': round(generated / seconds) if seconds > 0 else None,
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the synthetic payment dataset')
+    parser.add_argument('--out', required=True, help='Output directory')
+    parser.add_argument('--transactions', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, help='Default: transactions / 10')
+    parser.add_argument('--merchants', type=int, help='Default: transactions / 2000')
+    parser.add_argument('--start', type=date.fromisoformat, default=date(2024, 1, 1))
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000, help='Transactions per chunk')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--outputs', nargs='+', choices=OUTPUTS, default=OUTPUTS)
+    parser.add_argument('--gzip', action='store_true', help='Compress the NDJSON files')
+    parser.add_argument('--resume', action='store_true', help='Skip chunks already written')
+    # Fraud patterns and skew
+    parser.add_argument('--fraud-rate', type=float, default=0.02)
+    parser.add_argument('--pattern-mix', type=float, nargs=3, default=(0.3, 0.4, 0.3),
+                        metavar=('CARD_TESTING', 'STOLEN_CARD', 'ACCOUNT_TAKEOVER'))
+    parser.add_argument('--chargeback-rate', type=float, default=0.6)
+    parser.add_argument('--friendly-fraud-rate', type=float, default=0.002)
+    parser.add_argument('--activity-sigma', type=float, default=1.2, help='Customer activity skew (lognormal)')
+    parser.add_argument('--merchant-zipf', type=float, default=1.1, help='Merchant popularity skew')
+    parser.add_argument('--growth', type=float, default=1.0, help='Last-day / first-day volume - 1')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    config = GeneratorConfig(
+        n_transactions=args.transactions, n_customers=args.customers, n_merchants=args.merchants,
+        start=args.start, days=args.days, seed=args.seed, chunk_rows=args.chunk_rows,
+        fraud_rate=args.fraud_rate, pattern_mix=tuple(args.pattern_mix), chargeback_rate=args.chargeback_rate,
+        friendly_fraud_rate=args.friendly_fraud_rate, customer_activity_sigma=args.activity_sigma,
+        merchant_zipf=args.merchant_zipf, growth=args.growth,
+    )
+    manifest = generate(args.out, config, args.workers, args.outputs, args.gzip, args.resume)
+    logger.info(f"{manifest['rows']['transactions']:,} transactions ({manifest['fraud_rate']:.2%} fraud), "
+                f"{manifest['rows']['chargebacks']:,} chargebacks in {manifest['seconds']} s "
+                f"({manifest['transactions_per_second']:,} transactions/s, {args.workers} worker(s))")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,958 @@
+"""
+Synthetic Payment Data
+Stripe Data Architecture - Pipelines
+
+Purpose: Seedable generator of consistent data for every store of the
+         architecture, vectorized and chunked so it scales to 100M+
+         transactions:
+             - entities: customers, merchants and payment-method counts are
+               drawn once as NumPy arrays, together with each customer's
+               number of transactions (activity skew, fraud episode)
+             - chunks: all transactions of a contiguous range of customers,
+               so per-customer history features (velocity, amount
+               statistics, devices, dispute history) are exact within the
+               chunk; chargebacks, fraud_features, api_logs and
+               webhook_events are derived from the same rows
+             - fraud patterns (card testing, stolen card, account takeover,
+               friendly fraud) and skew (customer activity, merchant
+               popularity, growth over the period, time of day) are
+               parameters of GeneratorConfig
+         A chunk depends only on (config, entities, chunk index): chunks are
+         generated in any order by any number of processes, with identical
+         output for a given seed and chunk size.
+
+Usage:
+    entities = build_entities(config)
+    chunk = generate_chunk(entities, config, 0)    # Dict of DataFrames
+    frame = training_frame(config)                 # FEATURE_NAMES + is_fraud
+"""
+
+import base64
+import logging
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ml', 'features'))
+from feature_registry import (  # noqa: E402
+    DISPOSABLE_EMAIL_DOMAINS, FEATURE_NAMES, FREE_EMAIL_DOMAINS, HIGH_RISK_COUNTRIES, HOLIDAYS,
+)
+from feature_encoding import CURRENT_SCHEMA_ID, SCHEMA_FIELD, SCHEMAS, VECTOR_FIELD  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+class GeneratorConfig(NamedTuple):
+    n_transactions: int = 1_000_000
+    n_customers: Optional[int] = None      # default: n_transactions // 10
+    n_merchants: Optional[int] = None      # default: n_transactions // 2000 (at least 100)
+    start: date = date(2024, 1, 1)
+    days: int = 730
+    seed: int = 42
+    chunk_rows: int = 1_000_000            # transactions per chunk (approximate)
+    # Fraud patterns
+    fraud_rate: float = 0.02               # share of fraudulent transactions
+    pattern_mix: Tuple[float, float, float] = (0.3, 0.4, 0.3)  # card testing, stolen card, account takeover
+    chargeback_rate: float = 0.6           # successful fraud disputed by the cardholder
+    friendly_fraud_rate: float = 0.002     # legitimate successful payments disputed anyway
+    # Skew
+    customer_activity_sigma: float = 1.2   # lognormal spread of transactions per customer
+    merchant_zipf: float = 1.1             # merchant popularity exponent
+    growth: float = 1.0                    # volume on the last day / first day - 1
+
+    @property
+    def customers(self) -> int:
+        return self.n_customers or max(1, self.n_transactions // 10)
+
+    @property
+    def merchants(self) -> int:
+        return self.n_merchants or max(100, self.n_transactions // 2000)
+
+    @property
+    def end(self) -> date:
+        return self.start + timedelta(days=self.days)
+
+
+class FraudPattern(NamedTuple):
+    name: str
+    transactions: Tuple[int, int]          # episode size range
+    gap_seconds: float                     # mean time between episode transactions
+    amount_factor: Tuple[float, float]     # x merchant ticket (None: small test amounts)
+    failure_rate: float
+    high_risk_ip: float                    # share of episode IPs in high-risk countries
+    new_device: bool
+
+
+# Index 0 is "no fraud"; customer_pattern stores 1..3
+FRAUD_PATTERNS = [
+    FraudPattern('card_testing', (8, 30), 90.0, (0.0, 0.0), 0.7, 0.6, True),
+    FraudPattern('stolen_card', (2, 8), 1800.0, (2.0, 8.0), 0.25, 0.4, True),
+    FraudPattern('account_takeover', (1, 5), 3600.0, (1.5, 5.0), 0.15, 0.2, False),
+]
+
+
+# ============================================================================
+# REFERENCE DATA
+# ============================================================================
+
+COUNTRIES = [
+    # code, name, region, sub_region, continent, currency, gdpr, latitude, longitude, utc offset, weight
+    ('US', 'United States', 'Americas', 'Northern America', 'North America', 'USD', 0, 39.8, -98.6, -5, 0.30),
+    ('GB', 'United Kingdom', 'Europe', 'Northern Europe', 'Europe', 'GBP', 1, 54.0, -2.0, 0, 0.12),
+    ('FR', 'France', 'Europe', 'Western Europe', 'Europe', 'EUR', 1, 46.6, 2.4, 1, 0.12),
+    ('DE', 'Germany', 'Europe', 'Western Europe', 'Europe', 'EUR', 1, 51.2, 10.4, 1, 0.12),
+    ('ES', 'Spain', 'Europe', 'Southern Europe', 'Europe', 'EUR', 1, 40.4, -3.7, 1, 0.06),
+    ('NL', 'Netherlands', 'Europe', 'Western Europe', 'Europe', 'EUR', 1, 52.1, 5.3, 1, 0.05),
+    ('CA', 'Canada', 'Americas', 'Northern America', 'North America', 'CAD', 0, 56.1, -106.3, -5, 0.06),
+    ('BR', 'Brazil', 'Americas', 'South America', 'South America', 'BRL', 0, -14.2, -51.9, -3, 0.06),
+    ('JP', 'Japan', 'Asia', 'Eastern Asia', 'Asia', 'JPY', 0, 36.2, 138.3, 9, 0.06),
+    ('AU', 'Australia', 'Oceania', 'Australia and New Zealand', 'Oceania', 'AUD', 0, -25.3, 133.8, 10, 0.05),
+    # Synthetic high-risk regions (feature_registry.HIGH_RISK_COUNTRIES): fraud IPs only
+    (HIGH_RISK_COUNTRIES[0], 'High-risk region X', 'Other', 'Other', 'Other', 'USD', 0, 10.0, 20.0, 2, 0.0),
+    (HIGH_RISK_COUNTRIES[1], 'High-risk region Y', 'Other', 'Other', 'Other', 'USD', 0, -5.0, 100.0, 7, 0.0),
+]
+COUNTRY_CODES = np.array([c[0] for c in COUNTRIES])
+COUNTRY_LAT = np.array([c[7] for c in COUNTRIES])
+COUNTRY_LON = np.array([c[8] for c in COUNTRIES])
+COUNTRY_UTC_OFFSET = np.array([c[9] for c in COUNTRIES])
+COUNTRY_WEIGHTS = np.array([c[10] for c in COUNTRIES]) / sum(c[10] for c in COUNTRIES)
+HIGH_RISK = np.isin(COUNTRY_CODES, HIGH_RISK_COUNTRIES)
+HIGH_RISK_INDEX = np.flatnonzero(HIGH_RISK)
+COUNTRY_PHONE = {'US': '1', 'CA': '1', 'GB': '44', 'FR': '33', 'DE': '49', 'ES': '34', 'NL': '31',
+                 'BR': '55', 'JP': '81', 'AU': '61'}
+
+INDUSTRIES = [
+    # name, industry group, risk (feature_registry), mcc, typical ticket (USD), weight
+    ('retail', 'commerce', 0, '5999', 45.0, 0.30),
+    ('saas', 'software', 0, '5734', 30.0, 0.18),
+    ('food_delivery', 'services', 0, '5812', 25.0, 0.14),
+    ('travel', 'services', 1, '4722', 350.0, 0.08),
+    ('electronics', 'commerce', 1, '5732', 250.0, 0.10),
+    ('jewelry', 'commerce', 1, '5944', 400.0, 0.04),
+    ('gambling', 'digital', 2, '7995', 60.0, 0.06),
+    ('cryptocurrency', 'digital', 2, '6051', 500.0, 0.05),
+    ('adult_content', 'digital', 2, '5967', 30.0, 0.05),
+]
+INDUSTRY_NAMES = np.array([i[0] for i in INDUSTRIES])
+INDUSTRY_RISK = np.array([i[2] for i in INDUSTRIES], dtype=np.int8)
+INDUSTRY_TICKET = np.array([i[4] for i in INDUSTRIES])
+INDUSTRY_WEIGHTS = np.array([i[5] for i in INDUSTRIES])
+
+# Star-schema payment method kinds (queries/engine/star_schema_lake.PAYMENT_METHODS order)
+METHOD_KINDS = [
+    # OLTP type, card_brand, star-schema type, digital wallet, processing cost, weight
+    ('CARD', 'visa', 'card', 0, 0.0290, 0.40),
+    ('CARD', 'mastercard', 'card', 0, 0.0290, 0.25),
+    ('CARD', 'amex', 'card', 0, 0.0350, 0.07),
+    ('SEPA', None, 'sepa_debit', 0, 0.0080, 0.08),
+    ('WALLET', 'apple_pay', 'wallet', 1, 0.0250, 0.12),
+    ('WALLET', 'google_pay', 'wallet', 1, 0.0250, 0.08),
+]
+METHOD_TYPE = np.array([k[0] for k in METHOD_KINDS])
+METHOD_BRAND = np.array([k[1] for k in METHOD_KINDS], dtype=object)
+METHOD_FEE = np.array([k[4] for k in METHOD_KINDS])
+METHOD_WEIGHTS = np.array([k[5] for k in METHOD_KINDS])
+
+SEGMENTS = ['Regular', 'Premium', 'VIP']
+SEGMENT_WEIGHTS = [0.8, 0.15, 0.05]
+TIERS = ['standard', 'plus', 'enterprise']
+CORPORATE_DOMAINS = [f"corp{i}.example" for i in range(200)]
+# Email domain table: free, corporate, disposable (index stored per customer)
+EMAIL_DOMAINS = np.array(FREE_EMAIL_DOMAINS + CORPORATE_DOMAINS + DISPOSABLE_EMAIL_DOMAINS)
+EMAIL_KIND = np.array([0] * len(FREE_EMAIL_DOMAINS) + [1] * len(CORPORATE_DOMAINS)
+                      + [2] * len(DISPOSABLE_EMAIL_DOMAINS), dtype=np.int8)
+FIRST_NAMES = np.array(['Alice', 'Bruno', 'Chloe', 'David', 'Emma', 'Felix', 'Grace', 'Hugo', 'Ines', 'Jules',
+                        'Kenji', 'Lea', 'Marco', 'Nina', 'Oscar', 'Paula', 'Quentin', 'Rosa', 'Sam', 'Yuki'])
+LAST_NAMES = np.array(['Martin', 'Smith', 'Muller', 'Garcia', 'Silva', 'Tanaka', 'Dubois', 'Jones', 'Rossi',
+                       'Bernard', 'Brown', 'Schmidt', 'Lopez', 'Santos', 'Sato', 'Moreau', 'Wilson', 'Costa'])
+
+DEVICE_TYPES = np.array(['desktop', 'mobile', 'tablet'])
+USER_AGENTS = np.array([
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+    'Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+])
+# Share of transactions per UTC hour (customers mostly in Europe / Americas)
+HOUR_WEIGHTS = np.array([2, 1.5, 1, 1, 1, 1.5, 2.5, 3.5, 4.5, 5, 5.5, 5.5,
+                         6, 6, 6, 6, 6, 6, 6, 6, 5.5, 5, 4, 3])
+HOUR_WEIGHTS = HOUR_WEIGHTS / HOUR_WEIGHTS.sum()
+FAILURES = [('card_declined', 'Your card was declined.'), ('insufficient_funds', 'Your card has insufficient funds.'),
+            ('expired_card', 'Your card has expired.'), ('fraudulent', 'The payment was flagged as fraudulent.')]
+CHARGEBACK_REASONS = {
+    'fraud': ('10.4', 'Other Fraud - Card Absent Environment'),
+    'friendly': ('13.1', 'Merchandise/Services Not Received'),
+}
+
+# Keys of the per-customer sort: customer * SPAN + seconds since start
+# (chargebacks are created up to 120 days after the period)
+_SPAN_EXTRA_DAYS = 200
+_DAY = 86_400
+# RNG streams: np.random.default_rng([seed, stream, chunk])
+_ENTITY_STREAM, _CHUNK_STREAM, _DOCUMENT_STREAM = 1, 2, 3
+
+
+# ============================================================================
+# ENTITIES
+# ============================================================================
+
+class Entities(NamedTuple):
+    # Customers (index = customer_id - 1)
+    customer_country: np.ndarray        # int8 index in COUNTRIES
+    customer_created: np.ndarray        # int32 days since start (negative: before the period)
+    customer_segment: np.ndarray        # int8 index in SEGMENTS
+    customer_email_domain: np.ndarray   # int16 index in EMAIL_DOMAINS
+    customer_email_age: np.ndarray      # int32 email domain age in days
+    customer_methods: np.ndarray        # int8 payment methods (ids method_offset + 1 ..)
+    method_offset: np.ndarray           # int64 payment_method_id - 1 of the first method
+    customer_normal: np.ndarray         # int32 legitimate transactions
+    customer_pattern: np.ndarray        # int8 0 = none, else 1 + index in FRAUD_PATTERNS
+    customer_fraud: np.ndarray          # int16 fraudulent transactions (episode size)
+    transaction_offset: np.ndarray      # int64 transaction_id - 1 of the customer's first transaction
+    # Merchants (index = merchant_id - 1)
+    merchant_country: np.ndarray        # int8
+    merchant_industry: np.ndarray       # int8 index in INDUSTRIES
+    merchant_created: np.ndarray        # int32 days since start
+    merchant_tier: np.ndarray           # int8 index in TIERS
+    merchant_ticket: np.ndarray         # float32 average ticket (USD)
+    merchant_dispute_rate: np.ndarray   # float32
+    merchant_chargeback_rate: np.ndarray  # float32
+    merchant_cdf: np.ndarray            # float64 popularity CDF
+    # Chunks: customers [bounds[i], bounds[i + 1])
+    chunk_bounds: np.ndarray            # int64
+
+    @property
+    def n_chunks(self) -> int:
+        return len(self.chunk_bounds) - 1
+
+    @property
+    def n_transactions(self) -> int:
+        return int(self.transaction_offset[-1] + self.customer_normal[-1] + self.customer_fraud[-1])
+
+    def save(self, directory: str) -> None:
+        """One .npy per array, so workers can memory-map them."""
+        os.makedirs(directory, exist_ok=True)
+        for name, values in self._asdict().items():
+            np.save(os.path.join(directory, f"{name}.npy"), values)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'Entities':
+        return cls(**{name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+                      for name in cls._fields})
+
+
+def _growth_sample(u: np.ndarray, growth: float) -> np.ndarray:
+    """Inverse CDF of the density 1 + growth * x on [0, 1) (linear volume growth)."""
+    if growth <= 0:
+        return u
+    return (np.sqrt(1 + 2 * growth * (1 + growth / 2) * u) - 1) / growth
+
+
+def build_entities(config: GeneratorConfig) -> Entities:
+    """
+    Customers, merchants and transaction counts of the whole dataset
+    (a few bytes per customer; 10M customers fit in ~0.4 GB).
+    """
+    rng = np.random.default_rng([config.seed, _ENTITY_STREAM])
+    n_customers, n_merchants = config.customers, config.merchants
+
+    # Customers: created up to 3 years before the period and until 30 days before its end
+    country = rng.choice(len(COUNTRIES), n_customers, p=COUNTRY_WEIGHTS).astype(np.int8)
+    created = rng.integers(-3 * 365, max(1, config.days - 30), n_customers).astype(np.int32)
+    segment = rng.choice(len(SEGMENTS), n_customers, p=SEGMENT_WEIGHTS).astype(np.int8)
+    email_kind = rng.choice(3, n_customers, p=[0.6, 0.39, 0.01])
+    email_domain = np.where(
+        email_kind == 0, rng.integers(0, len(FREE_EMAIL_DOMAINS), n_customers),
+        np.where(email_kind == 1, len(FREE_EMAIL_DOMAINS) + rng.integers(0, len(CORPORATE_DOMAINS), n_customers),
+                 len(FREE_EMAIL_DOMAINS) + len(CORPORATE_DOMAINS)
+                 + rng.integers(0, len(DISPOSABLE_EMAIL_DOMAINS), n_customers))
+    ).astype(np.int16)
+    email_age = np.where(email_kind == 0, 9000 + rng.integers(0, 1500, n_customers),
+                         np.where(email_kind == 1, rng.lognormal(7.0, 0.8, n_customers),
+                                  rng.integers(1, 60, n_customers))).astype(np.int32)
+    methods = (1 + rng.binomial(2, 0.3, n_customers)).astype(np.int8)
+    method_offset = np.concatenate([[0], np.cumsum(methods[:-1], dtype=np.int64)])
+
+    # Activity skew: lognormal weights, scaled by the share of the period the customer exists
+    active = (config.days - np.maximum(created, 0)) / config.days
+    weight = rng.lognormal(0.0, config.customer_activity_sigma, n_customers) * active
+
+    # Fraud episodes sized so that fraud_rate of all transactions are fraudulent
+    mix = np.asarray(config.pattern_mix, dtype=np.float64)
+    mix = mix / mix.sum()
+    mean_episode = sum(p * (sum(f.transactions) / 2) for p, f in zip(mix, FRAUD_PATTERNS))
+    compromised_share = min(1.0, config.fraud_rate * config.n_transactions / (mean_episode * n_customers))
+    pattern = np.where(rng.random(n_customers) < compromised_share,
+                       1 + rng.choice(len(FRAUD_PATTERNS), n_customers, p=mix), 0).astype(np.int8)
+    low = np.array([0] + [f.transactions[0] for f in FRAUD_PATTERNS])
+    high = np.array([0] + [f.transactions[1] for f in FRAUD_PATTERNS])
+    fraud = np.where(pattern > 0, rng.integers(low[pattern], high[pattern] + 1), 0).astype(np.int16)
+
+    legitimate = max(0, config.n_transactions - int(fraud.sum()))
+    normal = rng.poisson(weight * (legitimate / weight.sum())).astype(np.int32)
+    total = normal.astype(np.int64) + fraud
+    transaction_offset = np.concatenate([[0], np.cumsum(total[:-1])])
+
+    # Chunks of ~chunk_rows transactions, cut at customer boundaries
+    cumulative = np.cumsum(total)
+    cuts = np.searchsorted(cumulative, np.arange(config.chunk_rows, cumulative[-1], config.chunk_rows))
+    chunk_bounds = np.unique(np.concatenate([[0], cuts + 1, [n_customers]])).astype(np.int64)
+
+    # Merchants: popularity follows a Zipf law over a random ranking
+    industry = rng.choice(len(INDUSTRIES), n_merchants, p=INDUSTRY_WEIGHTS / INDUSTRY_WEIGHTS.sum())
+    popularity = 1.0 / np.arange(1, n_merchants + 1) ** config.merchant_zipf
+    popularity = popularity[rng.permutation(n_merchants)]
+    risk = INDUSTRY_RISK[industry]
+    chargeback_rate = rng.beta(1.2, 300, n_merchants) * (1 + 2 * risk)
+
+    logger.info(f"Entities: {n_customers:,} customers ({(pattern > 0).sum():,} compromised), "
+                f"{n_merchants:,} merchants, {int(total.sum()):,} transactions in {len(chunk_bounds) - 1} chunks")
+    return Entities(
+        customer_country=country, customer_created=created, customer_segment=segment,
+        customer_email_domain=email_domain, customer_email_age=email_age,
+        customer_methods=methods, method_offset=method_offset,
+        customer_normal=normal, customer_pattern=pattern, customer_fraud=fraud,
+        transaction_offset=transaction_offset,
+        merchant_country=rng.choice(len(COUNTRIES), n_merchants, p=COUNTRY_WEIGHTS).astype(np.int8),
+        merchant_industry=industry.astype(np.int8),
+        merchant_created=rng.integers(-8 * 365, -30, n_merchants).astype(np.int32),
+        merchant_tier=rng.choice(len(TIERS), n_merchants, p=[0.7, 0.25, 0.05]).astype(np.int8),
+        merchant_ticket=(INDUSTRY_TICKET[industry] * rng.lognormal(0.0, 0.4, n_merchants)).astype(np.float32),
+        merchant_dispute_rate=np.minimum(1.0, chargeback_rate * 1.8).astype(np.float32),
+        merchant_chargeback_rate=np.minimum(1.0, chargeback_rate).astype(np.float32),
+        merchant_cdf=np.cumsum(popularity) / popularity.sum(),
+        chunk_bounds=chunk_bounds,
+    )
+
+
+def customer_emails(entities: Entities, customer_ids: np.ndarray) -> np.ndarray:
+    """Emails are derived from the id and stored domain (identical in OLTP and dim_customer)."""
+    domains = EMAIL_DOMAINS[entities.customer_email_domain[customer_ids - 1]]
+    return np.char.add(np.char.add('customer', customer_ids.astype(str)), np.char.add('@', domains))
+
+
+def customer_names(customer_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return FIRST_NAMES[customer_ids % len(FIRST_NAMES)], LAST_NAMES[(customer_ids * 7) % len(LAST_NAMES)]
+
+
+def _timestamps(start: date, seconds: np.ndarray) -> np.ndarray:
+    return np.datetime64(start, 's') + seconds.astype('timedelta64[s]')
+
+
+def _time_keys(timestamps: np.ndarray) -> np.ndarray:
+    """YYYYMMDD of datetime64 values."""
+    days = timestamps.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    years = months.astype('datetime64[Y]')
+    return ((years.astype(np.int64) + 1970) * 10000 + (months - years).astype(np.int64) * 100 + 100
+            + (days - months).astype(np.int64) + 1).astype(np.int32)
+
+
+def merchants_frame(entities: Entities, config: GeneratorConfig) -> pd.DataFrame:
+    """OLTP merchants rows (dim_merchant is derived from the same arrays)."""
+    rng = np.random.default_rng([config.seed, _ENTITY_STREAM, 1])
+    n = len(entities.merchant_cdf)
+    ids = np.arange(1, n + 1, dtype=np.int64)
+    industry = np.asarray(entities.merchant_industry, dtype=np.int64)
+    codes = COUNTRY_CODES[np.asarray(entities.merchant_country, dtype=np.int64)]
+    created_at = _timestamps(config.start, np.asarray(entities.merchant_created, dtype=np.int64) * _DAY
+                             + rng.integers(0, _DAY, n))
+    return pd.DataFrame({
+        'merchant_id': ids,
+        'business_name': np.char.add('Merchant ', ids.astype(str)),
+        'legal_name': np.char.add(np.char.add('Merchant ', ids.astype(str)), ' Ltd'),
+        'email': np.char.add(np.char.add('billing@merchant', ids.astype(str)), '.example'),
+        'phone': np.char.add(np.char.add('+', np.array([COUNTRY_PHONE.get(c, '1') for c in codes])),
+                             rng.integers(100_000_000, 999_999_999, n).astype(str)),
+        'country_code': codes,
+        'industry': INDUSTRY_NAMES[industry],
+        'mcc_code': np.array([i[3] for i in INDUSTRIES])[industry],
+        'is_active': True,
+        'kyc_status': np.where(rng.random(n) < 0.97, 'VERIFIED', 'PENDING'),
+        'created_at': created_at,
+        'updated_at': created_at,
+        'is_deleted': False,
+    })
+
+
+# ============================================================================
+# CHUNKS
+# ============================================================================
+
+def generate_chunk(entities: Entities, config: GeneratorConfig, index: int) -> Dict[str, pd.DataFrame]:
+    """
+    All rows of one chunk.
+
+    Returns:
+        customers, payment_methods, transactions, chargebacks (OLTP columns)
+        features (transaction metadata, FEATURE_NAMES, fraud_score,
+        is_fraud, fraud_pattern) and facts (fact_transactions rows), all
+        sorted by (customer, time)
+    """
+    rng = np.random.default_rng([config.seed, _CHUNK_STREAM, index])
+    c0, c1 = int(entities.chunk_bounds[index]), int(entities.chunk_bounds[index + 1])
+    n_local = c1 - c0
+    created = np.asarray(entities.customer_created[c0:c1], dtype=np.int64)
+    country = np.asarray(entities.customer_country[c0:c1], dtype=np.int64)
+    n_methods = np.asarray(entities.customer_methods[c0:c1], dtype=np.int64)
+    pattern = np.asarray(entities.customer_pattern[c0:c1], dtype=np.int64)
+    period = config.days * _DAY
+    first_second = np.maximum(created, 0) * _DAY
+
+    # --- Transactions: legitimate ones spread over the customer's lifetime, fraud in one episode
+    normal = np.asarray(entities.customer_normal[c0:c1], dtype=np.int64)
+    fraud = np.asarray(entities.customer_fraud[c0:c1], dtype=np.int64)
+    cust_n = np.repeat(np.arange(n_local), normal)
+    lo = first_second[cust_n] // _DAY
+    day = lo + np.floor((config.days - lo) * _growth_sample(rng.random(len(cust_n)), config.growth)).astype(np.int64)
+    t_n = day * _DAY + rng.choice(24, len(cust_n), p=HOUR_WEIGHTS) * 3600 + rng.integers(0, 3600, len(cust_n))
+
+    cust_f = np.repeat(np.arange(n_local), fraud)
+    episode_start = first_second + (rng.random(n_local) * (period - first_second)).astype(np.int64)
+    gap = np.array([0.0] + [f.gap_seconds for f in FRAUD_PATTERNS])[pattern[cust_f]]
+    step = rng.exponential(1.0, len(cust_f)) * gap
+    # Offsets within each episode: cumulative sum restarted per customer
+    cum = np.cumsum(step)
+    starts = np.concatenate([[0], np.cumsum(fraud)[:-1]])[fraud > 0]
+    restart = np.repeat(cum[starts] - step[starts], fraud[fraud > 0])
+    t_f = np.minimum(episode_start[cust_f] + (cum - restart).astype(np.int64), period - 1)
+
+    order = np.lexsort((np.concatenate([t_n, t_f]), np.concatenate([cust_n, cust_f])))
+    g = np.concatenate([cust_n, cust_f])[order]
+    t = np.concatenate([t_n, t_f])[order]
+    is_fraud = np.concatenate([np.zeros(len(cust_n), bool), np.ones(len(cust_f), bool)])[order]
+    kind = np.where(is_fraud, pattern[g], 0)
+    n = len(g)
+    customer_id = (c0 + g + 1).astype(np.int64)
+    transaction_id = np.int64(entities.transaction_offset[c0]) + 1 + np.arange(n, dtype=np.int64)
+
+    # Merchant: popularity-weighted
+    merchant = np.minimum(np.searchsorted(entities.merchant_cdf, rng.random(n)), len(entities.merchant_cdf) - 1)
+    ticket = np.asarray(entities.merchant_ticket, dtype=np.float64)[merchant]
+    amount = rng.lognormal(np.log(ticket) - 0.32, 0.8)
+    amount = np.where(rng.random(n) < 0.15, np.round(amount), amount)
+    factor_lo = np.array([1.0] + [f.amount_factor[0] for f in FRAUD_PATTERNS])[kind]
+    factor_hi = np.array([1.0] + [f.amount_factor[1] for f in FRAUD_PATTERNS])[kind]
+    amount = np.where(kind > 0, ticket * rng.uniform(factor_lo, factor_hi), amount)
+    amount = np.where(kind == 1, rng.uniform(0.5, 5.0, n), amount)        # card testing: tiny amounts
+    amount = np.maximum(0.5, np.round(amount, 2))
+    amount_cents = np.round(amount * 100)
+
+    # Payment method: any of the customer's; stolen card / card testing use the first card
+    method_slot = np.where(np.isin(kind, (1, 2)), 0, (rng.random(n) * n_methods[g]).astype(np.int64))
+    method_id = np.asarray(entities.method_offset[c0:c1], dtype=np.int64)[g] + 1 + method_slot
+    methods = _payment_methods(entities, rng, c0, c1, created, config.start)
+    method_row = method_id - methods['payment_method_id'].to_numpy()[0]
+    method_kind = methods['_kind'].to_numpy()[method_row]
+    card_country = methods['_card_country'].to_numpy()[method_row]
+
+    # Location: home country, travel for a few, foreign / high-risk during fraud episodes
+    foreign = rng.choice(len(COUNTRIES), n, p=COUNTRY_WEIGHTS)
+    ip_country = np.where(rng.random(n) < 0.04, foreign, country[g])
+    high_risk_share = np.array([0.0] + [f.high_risk_ip for f in FRAUD_PATTERNS])[kind]
+    fraud_ip = np.where(rng.random(n) < high_risk_share, rng.choice(HIGH_RISK_INDEX, n), foreign)
+    # One IP location per episode: reuse the location drawn for the first fraudulent transaction
+    first_fraud = np.flatnonzero(is_fraud & np.r_[True, (g[1:] != g[:-1]) | ~is_fraud[:-1]])
+    episode_ip = np.full(n_local, -1)
+    episode_ip[g[first_fraud]] = fraud_ip[first_fraud]
+    ip_country = np.where(is_fraud, episode_ip[g], ip_country)
+    lat = COUNTRY_LAT[ip_country] + rng.normal(0, 1.5, n)
+    lon = COUNTRY_LON[ip_country] + rng.normal(0, 1.5, n)
+
+    # Device: 0 main, 1 secondary, 2 fraudster device
+    new_device = np.array([False] + [f.new_device for f in FRAUD_PATTERNS])[kind]
+    device = np.where(new_device, 2, (rng.random(n) < 0.1).astype(np.int64))
+    device_type = np.where(device == 0, (customer_id % 2), np.where(device == 1, 2 - (customer_id % 2), 0))
+
+    # Status
+    failure_rate = np.array([0.04] + [f.failure_rate for f in FRAUD_PATTERNS])[kind]
+    u = rng.random(n)
+    status = np.where(u < failure_rate, 'FAILED', np.where(u > 0.995, 'PENDING', 'SUCCEEDED')).astype(object)
+    refunded = (status == 'SUCCEEDED') & (rng.random(n) < np.where(is_fraud, 0.05, 0.015))
+    status[refunded] = 'REFUNDED'
+    failed = status == 'FAILED'
+    failure = np.where(is_fraud & (rng.random(n) < 0.5), 3, rng.integers(0, 3, n))
+    charged = (status == 'SUCCEEDED') | (status == 'REFUNDED')
+    fee = np.where(charged, np.round(amount * METHOD_FEE[method_kind] + 0.30, 2), 0.0)
+
+    # Chargebacks: disputed fraud and friendly fraud, created 7-75 days after the payment
+    disputed = charged & (rng.random(n) < np.where(is_fraud, config.chargeback_rate, config.friendly_fraud_rate))
+    cb_rows = np.flatnonzero(disputed)
+    cb_created = t[cb_rows] + rng.integers(7 * _DAY, 75 * _DAY, len(cb_rows))
+    cb_resolved = cb_created + rng.integers(30 * _DAY, 60 * _DAY, len(cb_rows))
+    cb_closed = cb_resolved < period
+    cb_won = rng.random(len(cb_rows)) < np.where(is_fraud[cb_rows], 0.15, 0.6)
+
+    merchant_id = (merchant + 1).astype(np.int64)
+    mcountry = np.asarray(entities.merchant_country, dtype=np.int64)[merchant]
+    currency = np.array([c[5] for c in COUNTRIES])[mcountry]
+    created_at = _timestamps(config.start, t)
+    transactions = pd.DataFrame({
+        'transaction_id': transaction_id,
+        'merchant_id': merchant_id,
+        'customer_id': customer_id,
+        'payment_method_id': method_id,
+        'amount': amount,
+        'currency': currency,
+        'status': status,
+        'payment_intent_id': np.char.add('pi_', np.char.zfill(np.char.mod('%x', transaction_id), 14)),
+        'description': np.char.add('Order #', transaction_id.astype(str)),
+        'ip_address': _ip_addresses(rng, ip_country),
+        'user_agent': USER_AGENTS[device_type],
+        'device_type': DEVICE_TYPES[device_type],
+        'country_code': COUNTRY_CODES[ip_country],
+        'failure_code': np.where(failed, np.array([f[0] for f in FAILURES])[failure], None),
+        'failure_message': np.where(failed, np.array([f[1] for f in FAILURES])[failure], None),
+        'processing_fee': fee,
+        'net_amount': np.where(charged, np.round(amount - fee, 2), 0.0),
+        'created_at': created_at,
+        'updated_at': created_at + rng.integers(1, 5, n).astype('timedelta64[s]'),
+        'is_deleted': False,
+    })
+    cb_fraud = is_fraud[cb_rows]
+    chargebacks = pd.DataFrame({
+        # One chargeback per disputed transaction: ids follow the transaction ids
+        'chargeback_id': transaction_id[cb_rows],
+        'transaction_id': transaction_id[cb_rows],
+        'amount': amount[cb_rows],
+        'currency': currency[cb_rows],
+        'reason_code': np.where(cb_fraud, CHARGEBACK_REASONS['fraud'][0], CHARGEBACK_REASONS['friendly'][0]),
+        'reason_description': np.where(cb_fraud, CHARGEBACK_REASONS['fraud'][1], CHARGEBACK_REASONS['friendly'][1]),
+        'status': np.where(~cb_closed, 'OPEN', np.where(cb_won, 'WON', 'LOST')),
+        'evidence_due_date': _timestamps(config.start, cb_created + 21 * _DAY).astype('datetime64[D]'),
+        'resolved_at': pd.to_datetime(np.where(cb_closed, _timestamps(config.start, cb_resolved),
+                                               np.datetime64('NaT'))),
+        'created_at': _timestamps(config.start, cb_created),
+        'is_deleted': False,
+    })
+
+    features = _features(entities, config, rng, {
+        'g': g, 't': t, 'amount_cents': amount_cents, 'status': status, 'merchant': merchant,
+        'ip_country': ip_country, 'card_country': card_country, 'lat': lat, 'lon': lon, 'device': device,
+        'is_fraud': is_fraud, 'cb_rows': cb_rows, 'cb_created': cb_created, 'created': created,
+        'country': country, 'n_methods': n_methods, 'c0': c0,
+    })
+    features.insert(0, 'transaction_id', transaction_id)
+    features.insert(1, 'payment_id', transactions['payment_intent_id'].to_numpy())
+    features.insert(2, 'customer_id', customer_id)
+    features.insert(3, 'merchant_id', merchant_id)
+    features.insert(4, 'computed_at', created_at)
+    features.insert(5, 'ip_country', COUNTRY_CODES[ip_country])
+    features.insert(6, 'device_fingerprint', np.char.add(np.char.add('fp_', np.char.mod('%x', customer_id)),
+                                                          np.char.add('_', device.astype(str))))
+    features['is_fraud'] = is_fraud.astype(np.int8)
+    features['fraud_pattern'] = np.array(['none'] + [f.name for f in FRAUD_PATTERNS])[kind]
+
+    facts = pd.DataFrame({
+        'transaction_key': transaction_id,
+        'transaction_id': transaction_id,
+        'time_key': _time_keys(created_at),
+        'customer_key': customer_id.astype(np.int32),
+        'merchant_key': merchant_id.astype(np.int32),
+        'payment_method_key': (method_kind + 1).astype(np.int32),
+        'geography_key': (country[g] + 1).astype(np.int32),
+        # Subscription product for SaaS merchants
+        'product_key': np.where(INDUSTRY_NAMES[np.asarray(entities.merchant_industry)[merchant]] == 'saas',
+                                2, 1).astype(np.int32),
+        'amount': amount,
+        'processing_fee': fee,
+        'net_amount': transactions['net_amount'].to_numpy(),
+        'refund_amount': np.where(refunded, amount, 0.0),
+        'chargeback_amount': np.where(disputed, amount, 0.0),
+        'is_successful': charged,
+        'is_refunded': refunded,
+        'is_disputed': disputed,
+        'is_fraudulent': is_fraud,
+        'transaction_count': np.int32(1),
+        'transaction_datetime': created_at.astype('datetime64[us]'),
+    })
+
+    return {
+        'customers': _customers(entities, config, rng, c0, c1, created),
+        'payment_methods': methods.drop(columns=['_kind', '_card_country']),
+        'transactions': transactions,
+        'chargebacks': chargebacks,
+        'features': features,
+        'facts': facts,
+    }
+
+
+def _customers(entities: Entities, config: GeneratorConfig, rng: np.random.Generator,
+               c0: int, c1: int, created: np.ndarray) -> pd.DataFrame:
+    ids = np.arange(c0 + 1, c1 + 1, dtype=np.int64)
+    first, last = customer_names(ids)
+    codes = COUNTRY_CODES[np.asarray(entities.customer_country[c0:c1], dtype=np.int64)]
+    created_at = _timestamps(config.start, created * _DAY + rng.integers(0, _DAY, len(ids)))
+    pattern = np.asarray(entities.customer_pattern[c0:c1])
+    return pd.DataFrame({
+        'customer_id': ids,
+        'email': customer_emails(entities, ids),
+        'first_name': first,
+        'last_name': last,
+        'phone': np.char.add(np.char.add('+', np.array([COUNTRY_PHONE.get(c, '1') for c in codes])),
+                             rng.integers(100_000_000, 999_999_999, len(ids)).astype(str)),
+        'country_code': codes,
+        'is_verified': rng.random(len(ids)) < 0.85,
+        'risk_score': np.round(np.clip(rng.beta(2, 12, len(ids)) * 100 + 30 * (pattern > 0), 0, 100), 2),
+        'created_at': created_at,
+        'updated_at': created_at,
+        'is_deleted': False,
+    })
+
+
+def _payment_methods(entities: Entities, rng: np.random.Generator, c0: int, c1: int,
+                     created: np.ndarray, start: date) -> pd.DataFrame:
+    counts = np.asarray(entities.customer_methods[c0:c1], dtype=np.int64)
+    owner = np.repeat(np.arange(c0, c1), counts)
+    first_id = int(entities.method_offset[c0]) + 1
+    ids = np.arange(first_id, first_id + len(owner), dtype=np.int64)
+    kind = rng.choice(len(METHOD_KINDS), len(owner), p=METHOD_WEIGHTS / METHOD_WEIGHTS.sum())
+    # The first method is always a card (fraud patterns target it)
+    is_first = np.r_[True, owner[1:] != owner[:-1]]
+    kind = np.where(is_first & (METHOD_TYPE[kind] != 'CARD'), 0, kind)
+    home = np.asarray(entities.customer_country, dtype=np.int64)[owner]
+    card_country = np.where(rng.random(len(owner)) < 0.05, rng.choice(len(COUNTRIES), len(owner), p=COUNTRY_WEIGHTS),
+                            home)
+    created_at = _timestamps(start, created[owner - c0] * _DAY)
+    is_card = METHOD_TYPE[kind] == 'CARD'
+    return pd.DataFrame({
+        'payment_method_id': ids,
+        'customer_id': (owner + 1).astype(np.int64),
+        'type': METHOD_TYPE[kind],
+        'card_brand': METHOD_BRAND[kind],
+        'last4': np.char.zfill(rng.integers(0, 10_000, len(owner)).astype(str), 4),
+        'exp_month': np.where(is_card, rng.integers(1, 13, len(owner)), 0).astype(np.int16),
+        'exp_year': np.where(is_card, rng.integers(2026, 2032, len(owner)), 0).astype(np.int16),
+        'token': np.char.add('tok_', np.char.zfill(np.char.mod('%x', ids), 12)),
+        'is_default': is_first,
+        'is_active': rng.random(len(owner)) < 0.95,
+        'created_at': created_at,
+        'updated_at': created_at,
+        'is_deleted': False,
+        '_kind': kind,
+        '_card_country': card_country,
+    })
+
+
+def _ip_addresses(rng: np.random.Generator, country: np.ndarray) -> np.ndarray:
+    """IPv4 text, first octet per country so addresses geolocate consistently."""
+    octets = rng.integers(1, 255, (len(country), 3)).astype(str)
+    first = (11 + 7 * country).astype(str)
+    dot = np.full(len(country), '.')
+    parts = [first, dot, octets[:, 0], dot, octets[:, 1], dot, octets[:, 2]]
+    result = parts[0]
+    for part in parts[1:]:
+        result = np.char.add(result, part)
+    return result
+
+
+# ============================================================================
+# FEATURES
+# ============================================================================
+
+def _haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0 * 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _features(entities: Entities, config: GeneratorConfig, rng: np.random.Generator, rows: Dict) -> pd.DataFrame:
+    """
+    The 45 model inputs of each transaction, from the customer's history
+    inside the chunk (rows sorted by customer, then time).
+
+    Windowed counts and amount statistics are exact prior-window values, as
+    the feature engine computes them from the OLTP tables; two are bounds:
+    max_amount_30d is the customer's maximum to date, unique_cards_30d /
+    unique_merchants_30d are min(transactions in 30 days + 1, cards / merchants).
+    """
+    g, t, amount = rows['g'], rows['t'], rows['amount_cents']
+    n = len(g)
+    idx = np.arange(n)
+    span = (config.days + _SPAN_EXTRA_DAYS) * _DAY
+    key = g.astype(np.int64) * span + t
+    group_start = np.searchsorted(g, g, 'left')
+    has_prev = idx > group_start
+    prev = np.maximum(idx - 1, 0)
+
+    def window_start(seconds: int) -> np.ndarray:
+        return np.maximum(np.searchsorted(key, key - seconds, 'left'), group_start)
+
+    # Prefix sums over the sorted rows: value of rows [a, b) = cs[b] - cs[a]
+    def prefix(values: np.ndarray) -> np.ndarray:
+        return np.concatenate([[0.0], np.cumsum(values, dtype=np.float64)])
+
+    cs_amount, cs_square = prefix(amount), prefix(amount * amount)
+    succeeded = (rows['status'] == 'SUCCEEDED') | (rows['status'] == 'REFUNDED')
+    cs_success, cs_success_amount = prefix(succeeded), prefix(np.where(succeeded, amount, 0.0))
+
+    start_1h, start_24h, start_7d, start_30d = (window_start(s) for s in (3600, _DAY, 7 * _DAY, 30 * _DAY))
+    count_7d = idx - start_7d
+    count_30d = idx - start_30d
+    sum_7d = cs_amount[idx] - cs_amount[start_7d]
+    avg_7d = np.divide(sum_7d, count_7d, out=np.zeros(n), where=count_7d > 0)
+    var_7d = np.divide(cs_square[idx] - cs_square[start_7d], count_7d, out=np.zeros(n), where=count_7d > 0) - avg_7d ** 2
+    std_7d = np.sqrt(np.maximum(var_7d * np.divide(count_7d, count_7d - 1, out=np.zeros(n), where=count_7d > 1), 0))
+    prior = idx - group_start
+    # Max of previous rows of the same customer: running max shifted by one row
+    max_30d = np.where(has_prev, pd.Series(amount).groupby(g).cummax().to_numpy()[prev], amount)
+    zscore = np.divide(amount - avg_7d, std_7d, out=np.zeros(n), where=std_7d > 0)
+
+    # Customer
+    created = rows['created'][g]
+    age_days = (t // _DAY - created).astype(np.int64)
+    success_rate = np.divide(cs_success[idx] - cs_success[group_start], prior, out=np.zeros(n), where=prior > 0)
+    lifetime_value = cs_success_amount[idx] - cs_success_amount[group_start]
+    since_last = np.where(has_prev, (t - t[prev]) // _DAY, 9999)
+
+    # Disputes: chargebacks of the customer created before the transaction
+    cb_key = np.sort(g[rows['cb_rows']].astype(np.int64) * span + rows['cb_created'])
+    customer_floor = np.searchsorted(cb_key, g.astype(np.int64) * span, 'left')
+    disputes = np.searchsorted(cb_key, key, 'left') - customer_floor
+    disputes_30d = disputes - (np.maximum(np.searchsorted(cb_key, key - 30 * _DAY, 'left'), customer_floor)
+                               - customer_floor)
+
+    # Location
+    lat, lon, ip_country = rows['lat'], rows['lon'], rows['ip_country']
+    distance = np.where(has_prev, _haversine_km(lat[prev], lon[prev], lat, lon), 0.0)
+    hours = (t - t[prev]) / 3600.0
+    velocity = np.divide(distance, hours, out=np.zeros(n), where=has_prev & (hours > 0))
+    country_change = has_prev & (t - t[prev] < _DAY) & (ip_country[prev] != ip_country)
+    local_hour = ((t % _DAY) // 3600 + COUNTRY_UTC_OFFSET[rows['country'][g]]) % 24
+
+    # Device age: first use of (customer, device); the main device predates the period
+    device_key = g.astype(np.int64) * 4 + rows['device']
+    order = np.lexsort((t, device_key))
+    sorted_keys = device_key[order]
+    first = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    first_seen = np.empty(n, dtype=np.int64)
+    first_seen[order] = np.repeat(t[order][first], np.diff(np.r_[first, n]))
+    first_seen = np.where(rows['device'] == 0, np.minimum(first_seen, created * _DAY), first_seen)
+    device_age = (t - first_seen) // _DAY
+
+    # Merchant
+    merchant = rows['merchant']
+    industry = np.asarray(entities.merchant_industry, dtype=np.int64)[merchant]
+
+    # Calendar (UTC, as the feature engine)
+    day = t // _DAY
+    dates = np.datetime64(config.start, 'D') + day.astype('timedelta64[D]')
+    weekday = (dates.astype('datetime64[D]').view('int64') - 4) % 7      # 1970-01-01 was a Thursday
+    holidays = np.array([np.datetime64(h.date(), 'D') for h in HOLIDAYS])
+
+    is_fraud = rows['is_fraud']
+    customer = rows['c0'] + g
+    email_domain = np.asarray(entities.customer_email_domain, dtype=np.int64)[customer]
+    values = {
+        'transaction_count_1h': idx - start_1h,
+        'transaction_count_24h': idx - start_24h,
+        'transaction_count_7d': count_7d,
+        'transaction_count_30d': count_30d,
+        'unique_cards_30d': np.minimum(count_30d + 1, rows['n_methods'][g]),
+        'unique_merchants_30d': np.minimum(count_30d + 1, len(entities.merchant_cdf)),
+        'avg_amount_7d': avg_7d,
+        'stddev_amount_7d': std_7d,
+        'max_amount_30d': max_30d,
+        'amount_ratio_to_avg': np.divide(amount, avg_7d, out=np.ones(n), where=avg_7d > 0),
+        'amount_zscore': zscore,
+        'amount_percentile': np.where(std_7d > 0, 1 / (1 + np.exp(-1.702 * np.clip(zscore, -20, 20))), 0.5),
+        'round_amount': (amount % 100 == 0).astype(np.int8),
+        'high_value_flag': (amount > 1_000_000).astype(np.int8),
+        'card_country_mismatch': (rows['card_country'] != ip_country).astype(np.int8),
+        'ip_country_mismatch': (ip_country != rows['country'][g]).astype(np.int8),
+        'distance_km': distance,
+        'velocity_km_per_hour': velocity,
+        'high_risk_country': HIGH_RISK[ip_country].astype(np.int8),
+        'country_change_24h': country_change.astype(np.int8),
+        'timezone_anomaly': ((local_hour >= 1) & (local_hour <= 5)).astype(np.int8),
+        'device_fingerprint_new': (device_age < 1).astype(np.int8),
+        'device_fingerprint_age_days': device_age,
+        'email_domain_free': (EMAIL_KIND[email_domain] == 0).astype(np.int8),
+        'email_domain_disposable': (EMAIL_KIND[email_domain] == 2).astype(np.int8),
+        'email_domain_age_days': np.asarray(entities.customer_email_age, dtype=np.int64)[customer],
+        'browser_version_outdated': (rng.random(n) < np.where(is_fraud, 0.25, 0.05)).astype(np.int8),
+        'customer_age_days': age_days,
+        'customer_dispute_history': disputes,
+        'customer_success_rate': success_rate,
+        'days_since_last_transaction': since_last,
+        'first_transaction_customer': (~has_prev).astype(np.int8),
+        'customer_lifetime_value': lifetime_value,
+        'avg_transaction_per_month': np.divide(prior, age_days / 30.0, out=np.zeros(n), where=age_days > 0),
+        'chargeback_rate_30d': np.minimum(1.0, disputes_30d / np.maximum(1, count_30d)),
+        'merchant_age_days': day - np.asarray(entities.merchant_created, dtype=np.int64)[merchant],
+        'merchant_dispute_rate_30d': np.asarray(entities.merchant_dispute_rate)[merchant],
+        'merchant_chargeback_rate': np.asarray(entities.merchant_chargeback_rate)[merchant],
+        'merchant_avg_ticket': np.asarray(entities.merchant_ticket, dtype=np.float64)[merchant] * 100,
+        'merchant_industry_risk': INDUSTRY_RISK[industry],
+        'time_of_day': ((t % _DAY) // 3600).astype(np.int8),
+        'day_of_week': weekday.astype(np.int8),
+        'is_weekend': (weekday >= 5).astype(np.int8),
+        'is_holiday': np.isin(dates, holidays).astype(np.int8),
+        'shipping_address_mismatch': (rng.random(n) < np.where(is_fraud, 0.55, 0.08)).astype(np.int8),
+    }
+    frame = pd.DataFrame({name: np.asarray(values[name], dtype=np.float32) for name in FEATURE_NAMES})
+    # Score of a reasonable model: separates most episodes, a few false positives
+    frame['fraud_score'] = np.round(np.where(is_fraud, rng.beta(5, 1.5, n), rng.beta(1, 40, n)), 4)
+    return frame
+
+
+# ============================================================================
+# COSMOS DB DOCUMENTS
+# ============================================================================
+
+SDK_USER_AGENTS = np.array(['Stripe/v1 PythonBindings/5.5.0', 'Stripe/v1 NodeBindings/12.18.0',
+                            'Stripe/v1 RubyBindings/10.1.0', 'Stripe/v1 JavaBindings/24.3.0'])
+# defaultTtl of the collections (models/nosql/collections.json)
+API_LOGS_TTL = 7_776_000
+WEBHOOK_EVENTS_TTL = 5_184_000
+FRAUD_FEATURES_TTL = 15_552_000
+MODEL_VERSION = 'synthetic-1'
+
+
+def _iso(timestamps: np.ndarray) -> List[str]:
+    return np.char.add(np.datetime_as_string(timestamps.astype('datetime64[ms]')), 'Z').tolist()
+
+
+def feature_documents(chunk: Dict[str, pd.DataFrame]) -> List[Dict]:
+    """fraud_features documents in the compact encoding (features/feature_encoding.py)."""
+    features, transactions = chunk['features'], chunk['transactions']
+    schema = SCHEMAS[CURRENT_SCHEMA_ID]
+    packed = schema.pack_many({name: features[name].to_numpy() for name in schema.names})
+    vectors = [base64.b64encode(row.tobytes()).decode('ascii') for row in packed]
+    score = features['fraud_score'].to_numpy()
+    risk = np.where(score >= 0.7, 'high', np.where(score >= 0.3, 'medium', 'low')).tolist()
+    return [
+        {'id': payment_id, 'payment_id': payment_id, 'customer_id': customer_id, 'merchant_id': merchant_id,
+         'computed_at': computed_at, 'fraud_score': fraud_score, 'risk_level': risk_level,
+         'model_version': MODEL_VERSION, SCHEMA_FIELD: schema.schema_id, VECTOR_FIELD: vector,
+         'raw_features': {'ip_address': ip_address, 'device_fingerprint': fingerprint},
+         'ttl': FRAUD_FEATURES_TTL}
+        for payment_id, customer_id, merchant_id, computed_at, fraud_score, risk_level, vector, ip_address,
+        fingerprint in zip(
+            features['payment_id'].tolist(), features['customer_id'].tolist(), features['merchant_id'].tolist(),
+            _iso(features['computed_at'].to_numpy()), score.tolist(), risk, vectors,
+            transactions['ip_address'].tolist(), features['device_fingerprint'].tolist())
+    ]
+
+
+def api_log_documents(chunk: Dict[str, pd.DataFrame], config: GeneratorConfig, index: int) -> List[Dict]:
+    """api_logs: the POST /v1/payment_intents call of each transaction."""
+    rng = np.random.default_rng([config.seed, _DOCUMENT_STREAM, index, 0])
+    txns = chunk['transactions']
+    n = len(txns)
+    failed = (txns['status'] == 'FAILED').to_numpy()
+    latency = (np.round(rng.lognormal(4.3, 0.5, n)) + np.where(failed, 40, 0)).astype(np.int64)
+    merchant = txns['merchant_id'].to_numpy()
+    status = txns['status'].str.lower().replace('refunded', 'succeeded').tolist()
+    documents = []
+    for (transaction_id, merchant_id, payment_intent_id, method_id, cents, currency, state, is_failed,
+         failure_code, failure_message, timestamp, ms, agent, ip_address) in zip(
+            txns['transaction_id'].tolist(), merchant.tolist(), txns['payment_intent_id'].tolist(),
+            txns['payment_method_id'].tolist(), np.round(txns['amount'].to_numpy() * 100).astype(np.int64).tolist(),
+            txns['currency'].str.lower().tolist(), status, failed.tolist(), txns['failure_code'].tolist(),
+            txns['failure_message'].tolist(), _iso(txns['created_at'].to_numpy()), latency.tolist(),
+            SDK_USER_AGENTS[merchant % len(SDK_USER_AGENTS)].tolist(), txns['ip_address'].tolist()):
+        document = {
+            'id': f"log_{transaction_id:016x}", 'log_id': f"log_{transaction_id:016x}",
+            'merchant_id': merchant_id, 'timestamp': timestamp,
+            'endpoint': '/v1/payment_intents', 'method': 'POST',
+            'status_code': 402 if is_failed else 200, 'latency_ms': ms,
+            'request_body': {'amount': cents, 'currency': currency, 'payment_method': f"pm_{method_id}"},
+            'user_agent': agent, 'ip_address': ip_address, 'ttl': API_LOGS_TTL,
+        }
+        if is_failed:
+            document['response_body'] = {'error': {'type': 'card_error', 'code': failure_code,
+                                                   'message': failure_message}}
+            document['error_message'] = failure_message
+        else:
+            document['response_body'] = {'id': payment_intent_id, 'object': 'payment_intent', 'amount': cents,
+                                         'currency': currency, 'status': state}
+        documents.append(document)
+    return documents
+
+
+def webhook_documents(chunk: Dict[str, pd.DataFrame], config: GeneratorConfig, index: int) -> List[Dict]:
+    """
+    webhook_events: charge.succeeded / charge.failed per settled transaction,
+    charge.refunded and charge.dispute.created when they happen.
+    """
+    rng = np.random.default_rng([config.seed, _DOCUMENT_STREAM, index, 1])
+    txns = chunk['transactions']
+    status = txns['status'].to_numpy()
+    created = txns['created_at'].to_numpy()
+    settled = np.flatnonzero(status != 'PENDING')
+    refunded = np.flatnonzero(status == 'REFUNDED')
+    row_of = pd.Series(np.arange(len(txns)), index=txns['transaction_id'].to_numpy())
+    disputed = row_of.loc[chunk['chargebacks']['transaction_id'].to_numpy()].to_numpy()
+    rows = np.concatenate([settled, refunded, disputed])
+    event_type = np.concatenate([
+        np.where(status[settled] == 'FAILED', 'charge.failed', 'charge.succeeded'),
+        np.full(len(refunded), 'charge.refunded'), np.full(len(disputed), 'charge.dispute.created')])
+    sequence = np.concatenate([np.zeros(len(settled)), np.ones(len(refunded)), np.full(len(disputed), 2)])
+    at = np.concatenate([
+        created[settled] + np.timedelta64(1, 's'),
+        created[refunded] + rng.integers(1, 10 * _DAY, len(refunded)).astype('timedelta64[s]'),
+        chunk['chargebacks']['created_at'].to_numpy()])
+    n = len(rows)
+    sent = rng.random(n) < 0.97
+    response_ms = np.round(rng.lognormal(5.3, 0.5, n)).astype(np.int64)
+    delivered = at.astype('datetime64[ms]') + response_ms.astype('timedelta64[ms]')
+    merchant = txns['merchant_id'].to_numpy()[rows]
+    cents = np.round(txns['amount'].to_numpy()[rows] * 100).astype(np.int64)
+    transaction_ids = txns['transaction_id'].to_numpy()[rows]
+    documents = []
+    for (transaction_id, k, kind, merchant_id, amount, currency, timestamp, ok, ms, delivered_at) in zip(
+            transaction_ids.tolist(), sequence.astype(np.int64).tolist(), event_type.tolist(), merchant.tolist(),
+            cents.tolist(), txns['currency'].str.lower().to_numpy()[rows].tolist(), _iso(at), sent.tolist(),
+            response_ms.tolist(), _iso(delivered)):
+        event_id = f"evt_{transaction_id:016x}{k}"
+        document = {
+            'id': f"whk_{transaction_id:016x}{k}", 'webhook_id': f"whk_{transaction_id:016x}{k}",
+            'merchant_id': merchant_id, 'event_type': kind, 'event_id': event_id, 'created_at': timestamp,
+            'status': 'sent' if ok else 'failed',
+            'webhook_url': f"https://merchant{merchant_id}.example/webhooks/stripe",
+            'payload': {'id': event_id, 'object': 'event', 'type': kind, 'data': {'object': {
+                'id': f"ch_{transaction_id:016x}", 'amount': amount, 'currency': currency,
+                'status': 'failed' if kind == 'charge.failed' else 'succeeded'}}},
+            'retry_count': 0 if ok else 3,
+            'response_status_code': 200 if ok else 500,
+            'response_time_ms': ms,
+            'ttl': WEBHOOK_EVENTS_TTL,
+        }
+        if ok:
+            document['delivered_at'] = delivered_at
+        documents.append(document)
+    return documents
+
+
+# ============================================================================
+# IN-MEMORY TRAINING DATA
+# ============================================================================
+
+def training_frame(config: GeneratorConfig, start: Optional[datetime] = None,
+                   end: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    FEATURE_NAMES + is_fraud of every chunk, generated in this process,
+    optionally restricted to computed_at in [start, end).
+    """
+    entities = build_entities(config)
+    frames = []
+    for index in range(entities.n_chunks):
+        features = generate_chunk(entities, config, index)['features']
+        if start is not None or end is not None:
+            computed_at = features['computed_at']
+            keep = np.ones(len(features), dtype=bool)
+            if start is not None:
+                keep &= computed_at >= pd.Timestamp(start)
+            if end is not None:
+                keep &= computed_at < pd.Timestamp(end)
+            features = features[keep]
+        frames.append(features[FEATURE_NAMES + ['is_fraud']])
+    return pd.concat(frames, ignore_index=True)
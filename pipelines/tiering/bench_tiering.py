@@ -0,0 +1,181 @@
+"""
+Tiering Benchmark
+Stripe Data Architecture - Pipelines
+
+Purpose: Measure the tiering job and the hot + cold audit queries on
+         synthetic api_logs / webhook_events (pipelines/synthetic) loaded
+         into the in-memory Cosmos DB stand-in (ml/benchmarks/local_stores.py):
+             - hot store: documents and JSON bytes before / after tiering
+             - archive: Parquet bytes (zstd), files, compression ratio,
+               tiering throughput
+             - audit queries (queries.js) for the busiest merchants: results
+               over both tiers must equal the all-hot results, and every
+               archived row must sit in its own date / merchant_bucket
+               partition (exit status 1 otherwise); latency and hot
+               documents scanned (RU proxy) before / after
+             - a one-year lookback over both tiers
+
+Usage:
+    python bench_tiering.py --transactions 200000 --days 60 --age-days 7
+    python bench_tiering.py --transactions 500000 --merchants 5 --save results/tiering.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'synthetic'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'ml', 'benchmarks'))
+
+from cold_archive import ColdArchive  # noqa: E402
+from tiered_query import AUDIT_QUERIES, TieredStore  # noqa: E402
+from tiering_job import DEFAULT_POLICIES, TieringJob  # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger('tiering_benchmark')
+
+COLLECTIONS = ('api_logs', 'webhook_events')
+
+
+def load_hot(transactions: int, days: int, seed: int) -> Dict:
+    """In-memory api_logs / webhook_events containers filled with synthetic documents."""
+    from local_stores import LocalCosmosContainer
+    from synthetic_data import GeneratorConfig, api_log_documents, build_entities, generate_chunk, \
+        webhook_documents
+
+    config = GeneratorConfig(n_transactions=transactions, days=days, seed=seed, chunk_rows=100_000)
+    entities = build_entities(config)
+    containers = {name: LocalCosmosContainer(partition_key='/merchant_id') for name in COLLECTIONS}
+    for index in range(entities.n_chunks):
+        chunk = generate_chunk(entities, config, index)
+        for document in api_log_documents(chunk, config, index):
+            containers['api_logs'].upsert_item(document)
+        for document in webhook_documents(chunk, config, index):
+            containers['webhook_events'].upsert_item(document)
+    return containers, datetime.combine(config.end, datetime.min.time(), tzinfo=timezone.utc)
+
+
+def hot_size(container) -> Dict:
+    documents = container.query_items("SELECT * FROM c", enable_cross_partition_query=True)
+    return {'documents': len(documents),
+            'bytes': sum(len(json.dumps({k: v for k, v in d.items() if k != '_etag'}, separators=(',', ':')))
+                         for d in documents)}
+
+
+def busiest_merchants(container, n: int) -> List:
+    documents = container.query_items("SELECT * FROM c", enable_cross_partition_query=True)
+    return pd.Series([d['merchant_id'] for d in documents]).value_counts().index[:n].tolist()
+
+
+def run_queries(store: TieredStore, merchants: List, now: datetime, params: Dict) -> Dict:
+    """Each audit query over the last 90 days, per merchant: results and mean latency."""
+    results, latency = {}, {}
+    for name in AUDIT_QUERIES:
+        started = time.perf_counter()
+        for merchant in merchants:
+            results[(name, merchant)] = store.run(name, merchant, now - timedelta(days=90), None if name !=
+                                                  'query17_transaction_audit_trail' else now, now=now,
+                                                  paymentId=params[merchant])
+        latency[name] = (time.perf_counter() - started) * 1000 / len(merchants)
+    return {'results': results, 'latency_ms': latency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hot/cold tiering of api_logs and webhook_events')
+    parser.add_argument('--transactions', type=int, default=200_000)
+    parser.add_argument('--days', type=int, default=60, help='Period of the generated documents')
+    parser.add_argument('--age-days', type=float, default=7.0, help='Minimum age moved to the archive')
+    parser.add_argument('--merchants', type=int, default=3, help='Busiest merchants queried')
+    parser.add_argument('--buckets', type=int, default=4, help='merchant_id buckets (scale with daily volume)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write results JSON')
+    args = parser.parse_args()
+
+    containers, now = load_hot(args.transactions, args.days, args.seed)
+    merchants = busiest_merchants(containers['api_logs'], args.merchants)
+    # @paymentId of query17: a payment method of the merchant's latest logs
+    params = {}
+    for merchant in merchants:
+        logs = containers['api_logs'].query_items("SELECT * FROM c WHERE c.merchant_id = @m",
+                                                  [{'name': '@m', 'value': merchant}], partition_key=merchant)
+        params[merchant] = max(logs, key=lambda d: d['timestamp'])['request_body']['payment_method']
+
+    with tempfile.TemporaryDirectory(prefix='bench_tiering_') as tmp:
+        archive = ColdArchive(os.path.join(tmp, 'cold'), buckets=args.buckets)
+        store = TieredStore(containers, archive)
+        before_size = {name: hot_size(c) for name, c in containers.items()}
+        before_stats = {name: dict(c.stats) for name, c in containers.items()}
+        before = run_queries(store, merchants, now, params)
+        scanned_before = {name: c.stats['documents_scanned'] - before_stats[name]['documents_scanned']
+                          for name, c in containers.items()}
+
+        policies = [p._replace(min_age=timedelta(days=args.age_days)) for p in DEFAULT_POLICIES]
+        started = time.perf_counter()
+        summary = TieringJob(containers, archive, policies, delete_workers=1).run_once(now)
+        tiering_seconds = time.perf_counter() - started
+
+        after_size = {name: hot_size(c) for name, c in containers.items()}
+        after_stats = {name: dict(c.stats) for name, c in containers.items()}
+        store.stats = dict.fromkeys(store.stats, 0)
+        after = run_queries(store, merchants, now, params)
+        scanned_after = {name: c.stats['documents_scanned'] - after_stats[name]['documents_scanned']
+                         for name, c in containers.items()}
+        misplaced = {name: sum(archive.misplaced(name).values()) for name in COLLECTIONS}
+        lookback = {}
+        for name in ('query4_api_success_rate_hourly', 'query14_webhook_stats_by_event_type'):
+            started = time.perf_counter()
+            rows = sum(int(store.run(name, m, now - timedelta(days=365)).iloc[:, 1].sum()) for m in merchants)
+            lookback[name] = {'rows': rows, 'ms': (time.perf_counter() - started) * 1000 / len(merchants)}
+
+    identical = {}
+    for name in AUDIT_QUERIES:
+        identical[name] = all(before['results'][(name, m)].equals(after['results'][(name, m)]) for m in merchants)
+
+    print(f"{args.transactions:,} transactions, archive age >= {args.age_days:g} days, now = {now:%Y-%m-%d}")
+    print(f"{'collection':<15} {'hot docs':>10} {'-> after':>10} {'hot MB':>8} {'-> after':>9} "
+          f"{'parquet MB':>11} {'ratio':>6} {'files':>6}")
+    for name in COLLECTIONS:
+        s = summary[name]
+        print(f"{name:<15} {before_size[name]['documents']:>10,} {after_size[name]['documents']:>10,} "
+              f"{before_size[name]['bytes'] / 1e6:>8.1f} {after_size[name]['bytes'] / 1e6:>9.1f} "
+              f"{s['cold_bytes'] / 1e6:>11.1f} {s['hot_bytes'] / max(1, s['cold_bytes']):>5.1f}x {s['files']:>6}")
+    moved = sum(summary[name]['documents'] for name in COLLECTIONS)
+    print(f"tiering: {moved:,} documents in {tiering_seconds:.1f} s ({moved / tiering_seconds:,.0f} documents/s)")
+    print(f"hot documents scanned by the audit queries: "
+          f"{sum(scanned_before.values()):,} -> {sum(scanned_after.values()):,}")
+    print(f"{'query (last 90 days)':<38} {'all hot ms':>10} {'tiered ms':>10} {'identical':>10}")
+    for name in AUDIT_QUERIES:
+        print(f"{name:<38} {before['latency_ms'][name]:>10.1f} {after['latency_ms'][name]:>10.1f} "
+              f"{str(identical[name]):>10}")
+    for name, r in lookback.items():
+        print(f"1-year lookback {name}: {r['rows']:,} rows, {r['ms']:.1f} ms per merchant")
+    print(f"archived rows outside their date / merchant_bucket partition: {misplaced}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'timestamp': datetime.utcnow().isoformat(), 'config': vars(args),
+                       'results': {'hot_before': before_size, 'hot_after': after_size, 'tiering': summary,
+                                   'tiering_seconds': tiering_seconds,
+                                   'hot_documents_scanned': {'before': scanned_before, 'after': scanned_after},
+                                   'latency_ms': {'all_hot': before['latency_ms'], 'tiered': after['latency_ms']},
+                                   'identical': identical, 'misplaced': misplaced, 'lookback': lookback}},
+                      f, indent=2)
+
+    failed = [name for name in AUDIT_QUERIES if not identical[name]]
+    if failed or any(misplaced.values()):
+        logger.error(f"Tiered results differ from the all-hot results: {failed}, misplaced rows: {misplaced}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+Cold Archive of Cosmos DB Logs
+Stripe Data Architecture - Pipelines
+
+Purpose: Parquet tier of the api_logs and webhook_events collections.
+         Documents moved out of the hot store are written as
+         <root>/<collection>/date=YYYY-MM-DD/merchant_bucket=NN/part-<batch>.parquet:
+             - partitions: UTC date of the document's time field, and a hash
+               bucket of merchant_id (a directory per merchant would mean
+               millions of tiny files); a per-merchant lookup over a date
+               range opens one bucket directory per day
+             - files: sorted by merchant_id then time, zstd, row groups with
+               min/max statistics, so the other merchants of a bucket are
+               skipped without being read
+             - columns: the collection's fields, request / response bodies and
+               payloads as JSON text, unknown fields kept in _extra
+         A batch is staged under temporary names, committed by a journal
+         listing its files and document keys, then renamed; the journal is
+         removed once the hot copies are deleted (see tiering_job.py).
+         Readers deduplicate on the document id, so a document present in
+         both tiers, or in a compacted file and its inputs, is returned once.
+
+Usage:
+    archive = ColdArchive('/data/cold')
+    table = archive.read('api_logs', 'acct_1MxY2kLkdIwHu0C9', since, until, columns=['log_id', 'latency_ms'])
+"""
+
+import glob
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = 32
+DEFAULT_ROW_GROUP_SIZE = 64 * 1024
+DEFAULT_COMPRESSION_LEVEL = 6
+# Cosmos DB system properties and the TTL are not archived
+SYSTEM_FIELDS = ('_rid', '_self', '_etag', '_attachments', '_ts', 'ttl')
+EXTRA_FIELD = '_extra'
+STATE_DIR = '_tiering'
+
+_TIMESTAMP = pa.timestamp('ms', tz='UTC')
+
+
+class ArchivedCollection(NamedTuple):
+    name: str
+    id_field: str                   # document key, unique per collection
+    time_field: str                 # age for tiering, date partition
+    schema: pa.Schema               # archived columns (models/nosql/collections.json)
+    json_fields: Tuple[str, ...]    # objects stored as JSON text
+
+
+COLLECTIONS: Dict[str, ArchivedCollection] = {c.name: c for c in [
+    ArchivedCollection('api_logs', 'log_id', 'timestamp', pa.schema([
+        ('id', pa.string()), ('log_id', pa.string()), ('merchant_id', pa.string()),
+        ('timestamp', _TIMESTAMP), ('endpoint', pa.string()), ('method', pa.string()),
+        ('status_code', pa.int32()), ('latency_ms', pa.int32()),
+        ('request_body', pa.string()), ('response_body', pa.string()),
+        ('user_agent', pa.string()), ('ip_address', pa.string()), ('error_message', pa.string()),
+        (EXTRA_FIELD, pa.string()),
+    ]), ('request_body', 'response_body')),
+    ArchivedCollection('webhook_events', 'webhook_id', 'created_at', pa.schema([
+        ('id', pa.string()), ('webhook_id', pa.string()), ('merchant_id', pa.string()),
+        ('event_type', pa.string()), ('event_id', pa.string()), ('created_at', _TIMESTAMP),
+        ('status', pa.string()), ('webhook_url', pa.string()), ('payload', pa.string()),
+        ('retry_count', pa.int32()), ('last_retry_at', _TIMESTAMP), ('next_retry_at', _TIMESTAMP),
+        ('response_status_code', pa.int32()), ('response_time_ms', pa.int32()),
+        ('error_message', pa.string()), ('delivered_at', _TIMESTAMP),
+        (EXTRA_FIELD, pa.string()),
+    ]), ('payload',)),
+]}
+
+
+def merchant_bucket(merchant_id, buckets: int) -> int:
+    """Stable hash bucket of a merchant id (ints and strings hash by their text)."""
+    return zlib.crc32(str(merchant_id).encode()) % buckets
+
+
+def _runs(days: pa.ChunkedArray, buckets: pa.ChunkedArray) -> List[Tuple[str, int, int, int]]:
+    """(day, bucket, offset, length) of each run of equal keys in sorted columns."""
+    days, buckets = days.to_pylist(), buckets.to_pylist()
+    runs, start = [], 0
+    for i in range(1, len(days) + 1):
+        if i == len(days) or days[i] != days[start] or buckets[i] != buckets[start]:
+            runs.append((days[start], buckets[start], start, i - start))
+            start = i
+    return runs
+
+
+def to_iso(value: datetime) -> str:
+    """Cosmos DB / JavaScript toISOString() form: UTC, milliseconds, Z."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + f"{value.microsecond // 1000:03d}Z"
+
+
+def to_table(collection: ArchivedCollection, documents: Sequence[Dict],
+             columns: Optional[Sequence[str]] = None) -> pa.Table:
+    """Documents (hot-store JSON) -> Arrow table of the archived schema (or of `columns`)."""
+    known = set(collection.schema.names) | set(SYSTEM_FIELDS)
+    schema = collection.schema if columns is None else pa.schema([collection.schema.field(c) for c in columns])
+    columns = []
+    for field in schema:
+        if field.name == EXTRA_FIELD:
+            values = [json.dumps(extra, separators=(',', ':'), default=str) if extra else None
+                      for extra in ({k: v for k, v in d.items() if k not in known} for d in documents)]
+        elif field.name in collection.json_fields:
+            values = [None if d.get(field.name) is None else json.dumps(d[field.name], separators=(',', ':'))
+                      for d in documents]
+        elif field.type == _TIMESTAMP:
+            values = pd.to_datetime(pd.Series([d.get(field.name) for d in documents], dtype=object),
+                                    utc=True, format='ISO8601').dt.floor('ms')
+            columns.append(pa.array(values, type=_TIMESTAMP, from_pandas=True))
+            continue
+        elif field.name == 'merchant_id':
+            values = [None if d.get(field.name) is None else str(d[field.name]) for d in documents]
+        else:
+            values = [d.get(field.name) for d in documents]
+        columns.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def _expression(field: str, op: str, value) -> ds.Expression:
+    column = ds.field(field)
+    if op == 'contains':
+        return pc.match_substring(column, value)
+    if op == 'defined':
+        return column.is_valid() if value else column.is_null()
+    return {'=': column == value, '!=': column != value, '<': column < value, '<=': column <= value,
+            '>': column > value, '>=': column >= value}[op]
+
+
+class StagedBatch(NamedTuple):
+    batch_id: str
+    collection: str
+    files: List[str]                # final paths (written as <path>.tmp until committed)
+    keys: List[Tuple[str, object]]  # (id, partition key) of the archived documents
+    rows: int
+    bytes: int
+
+
+# ============================================================================
+# ARCHIVE
+# ============================================================================
+
+class ColdArchive:
+    """Date / merchant-bucket partitioned Parquet archive with a commit journal per batch."""
+
+    def __init__(self, root: str, buckets: Optional[int] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+        """
+        Args:
+            root: Archive directory (local path or mounted storage)
+            buckets: merchant_id hash buckets; fixed at the first write and
+                     read back from <root>/_tiering/archive.json afterwards
+            row_group_size: Rows per Parquet row group
+            compression_level: zstd level
+
+        Raises:
+            ValueError: buckets differs from the existing archive's
+        """
+        self.root = root
+        self.row_group_size = row_group_size
+        self.compression_level = compression_level
+        settings_path = os.path.join(root, STATE_DIR, 'archive.json')
+        if os.path.exists(settings_path):
+            with open(settings_path) as f:
+                existing = json.load(f)['buckets']
+            if buckets is not None and buckets != existing:
+                raise ValueError(f"Archive {root} uses {existing} merchant buckets, not {buckets}")
+            self.buckets = existing
+        else:
+            self.buckets = buckets or DEFAULT_BUCKETS
+            self._write_json(settings_path, {'buckets': self.buckets})
+
+    @staticmethod
+    def _write_json(path: str, content: Dict) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(content, f)
+        os.replace(path + '.tmp', path)
+
+    def _state_dir(self, collection: str) -> str:
+        return os.path.join(self.root, STATE_DIR, collection)
+
+    def _partition(self, collection: str, day: str, bucket: int) -> str:
+        return os.path.join(self.root, collection, f"date={day}", f"merchant_bucket={bucket:02d}")
+
+    def _write_file(self, table: pa.Table, path: str) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, path, row_group_size=self.row_group_size, compression='zstd',
+                       compression_level=self.compression_level, write_statistics=True)
+        return os.path.getsize(path)
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    def stage(self, collection: str, documents: Sequence[Dict], batch_id: str,
+              partition_field: str = 'merchant_id') -> StagedBatch:
+        """
+        Write the documents as temporary files, one per (date, bucket).
+
+        Returns:
+            The staged batch, to commit once all files are written
+        """
+        spec = COLLECTIONS[collection]
+        table = to_table(spec, documents)
+        days = pc.strftime(table.column(spec.time_field), format='%Y-%m-%d')
+        buckets = pa.array([merchant_bucket(m, self.buckets) for m in table.column('merchant_id').to_pylist()],
+                           type=pa.int32())
+        table = (table.append_column('_day', days).append_column('_bucket', buckets)
+                 .sort_by([('_day', 'ascending'), ('_bucket', 'ascending'),
+                           ('merchant_id', 'ascending'), (spec.time_field, 'ascending')]))
+        files, size = [], 0
+        for day, bucket, offset, count in _runs(table.column('_day'), table.column('_bucket')):
+            path = os.path.join(self._partition(collection, day, bucket), f"part-{batch_id}.parquet")
+            size += self._write_file(table.slice(offset, count).drop_columns(['_day', '_bucket']), path + '.tmp')
+            files.append(path)
+        keys = [(d['id'], d.get(partition_field)) for d in documents]
+        return StagedBatch(batch_id, collection, files, keys, len(documents), size)
+
+    def commit(self, batch: StagedBatch) -> None:
+        """Journal the batch (files + keys), then publish its files."""
+        self._write_json(os.path.join(self._state_dir(batch.collection), f"batch-{batch.batch_id}.json"),
+                         batch._asdict())
+        self._publish(batch)
+
+    @staticmethod
+    def _publish(batch: StagedBatch) -> None:
+        for path in batch.files:
+            if os.path.exists(path + '.tmp'):
+                os.replace(path + '.tmp', path)
+
+    def complete(self, batch: StagedBatch) -> None:
+        """Drop the journal once the hot copies are deleted."""
+        os.remove(os.path.join(self._state_dir(batch.collection), f"batch-{batch.batch_id}.json"))
+
+    def pending(self, collection: str) -> List[StagedBatch]:
+        """
+        Recovery after a crash: committed batches whose hot copies may remain
+        (files re-published), after removing staged files never committed.
+        """
+        batches = []
+        for path in sorted(glob.glob(os.path.join(self._state_dir(collection), 'batch-*.json'))):
+            with open(path) as f:
+                batch = StagedBatch(**json.load(f))
+            batches.append(batch._replace(keys=[tuple(key) for key in batch.keys]))
+            self._publish(batches[-1])
+        for path in glob.glob(os.path.join(self.root, collection, 'date=*', 'merchant_bucket=*', '*.tmp')):
+            os.remove(path)
+        return batches
+
+    def state(self, collection: str) -> Dict:
+        """Tiering state: watermark (every document older has left the hot store), totals."""
+        path = os.path.join(self._state_dir(collection), 'state.json')
+        if not os.path.exists(path):
+            return {'watermark': None, 'kept': 0, 'documents': 0, 'bytes': 0}
+        with open(path) as f:
+            return json.load(f)
+
+    def set_state(self, collection: str, state: Dict) -> None:
+        self._write_json(os.path.join(self._state_dir(collection), 'state.json'), state)
+
+    def compact(self, collection: str, day: str) -> int:
+        """
+        Rewrite every bucket of a closed date partition as a single file
+        (tiering runs leave one small file per run and bucket).
+
+        Returns:
+            Files removed
+        """
+        spec = COLLECTIONS[collection]
+        removed = 0
+        for directory in sorted(glob.glob(os.path.join(self.root, collection, f"date={day}", 'merchant_bucket=*'))):
+            parts = sorted(glob.glob(os.path.join(directory, '*.parquet')))
+            if len(parts) < 2:
+                continue
+            table = pa.concat_tables(pq.read_table(p, schema=spec.schema) for p in parts)
+            table = _unique(table, spec.id_field).sort_by([('merchant_id', 'ascending'),
+                                                            (spec.time_field, 'ascending')])
+            path = os.path.join(directory, f"part-compacted-{uuid.uuid4().hex[:12]}.parquet")
+            self._write_file(table, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            for part in parts:
+                os.remove(part)
+            removed += len(parts)
+        return removed
+
+    def misplaced(self, collection: str) -> Dict[str, int]:
+        """
+        Rows stored outside their own partition, per file: files() prunes on
+        the directory names, so such rows are never read again.
+        """
+        spec = COLLECTIONS[collection]
+        misplaced = {}
+        for path in sorted(glob.glob(os.path.join(self.root, collection, 'date=*', 'merchant_bucket=*',
+                                                  '*.parquet'))):
+            day = os.path.basename(os.path.dirname(os.path.dirname(path)))[len('date='):]
+            bucket = int(os.path.basename(os.path.dirname(path))[len('merchant_bucket='):])
+            table = pq.read_table(path, columns=['merchant_id', spec.time_field])
+            days = pc.strftime(table.column(spec.time_field), format='%Y-%m-%d').to_pylist()
+            count = sum(1 for d, m in zip(days, table.column('merchant_id').to_pylist())
+                        if d != day or merchant_bucket(m, self.buckets) != bucket)
+            if count:
+                misplaced[path] = count
+        return misplaced
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+
+    def files(self, collection: str, merchant_id, since: datetime, until: Optional[datetime] = None) -> List[str]:
+        """Files of the merchant's bucket for the archived days of [since, until] (partition pruning)."""
+        directory = os.path.join(self.root, collection)
+        if not os.path.isdir(directory):
+            return []
+        first = pd.Timestamp(since).strftime('%Y-%m-%d')
+        last = pd.Timestamp(until).strftime('%Y-%m-%d') if until is not None else '9999-12-31'
+        bucket = f"merchant_bucket={merchant_bucket(merchant_id, self.buckets):02d}"
+        files = []
+        for name in sorted(os.listdir(directory)):
+            if name.startswith('date=') and first <= name[5:] <= last:
+                partition = os.path.join(directory, name, bucket)
+                if os.path.isdir(partition):
+                    files.extend(os.path.join(partition, f) for f in sorted(os.listdir(partition))
+                                 if f.endswith('.parquet'))
+        return files
+
+    def read(self, collection: str, merchant_id, since: datetime, until: Optional[datetime] = None,
+             columns: Optional[Sequence[str]] = None,
+             conditions: Sequence[Tuple[str, str, object]] = (),
+             files: Optional[List[str]] = None) -> pa.Table:
+        """
+        Archived documents of one merchant with time in [since, until].
+
+        Args:
+            columns: Columns to read (default: all); the id field is always included
+            conditions: Extra AND-ed (field, op, value) filters; op is one of
+                        = != < <= > >=, 'contains' (substring) or 'defined'
+            files: Result of files() when the caller already listed them
+
+        Returns:
+            Arrow table, one row per document id
+        """
+        spec = COLLECTIONS[collection]
+        columns = list(dict.fromkeys([spec.id_field] + list(columns or spec.schema.names)))
+        files = self.files(collection, merchant_id, since, until) if files is None else files
+        if not files:
+            return spec.schema.empty_table().select(columns)
+        time = ds.field(spec.time_field)
+        expression = (ds.field('merchant_id') == str(merchant_id)) & (time >= pd.Timestamp(since))
+        if until is not None:
+            expression &= time <= pd.Timestamp(until)
+        for field, op, value in conditions:
+            expression &= _expression(field, op, value)
+        # Row groups of other merchants / times are skipped on their statistics
+        table = ds.dataset(files, schema=spec.schema, format='parquet').to_table(columns=columns, filter=expression)
+        return _unique(table, spec.id_field)
+
+
+def _unique(table: pa.Table, id_field: str) -> pa.Table:
+    """First row of each id (duplicates exist only while a batch or a compaction is in flight)."""
+    ids = table.column(id_field)
+    if pc.count_distinct(ids).as_py() == len(ids):
+        return table
+    first = table.append_column('_row', pa.array(range(len(ids)))).group_by(id_field, use_threads=False) \
+        .aggregate([('_row', 'min')]).column('_row_min')
+    return table.take(pc.sort_indices(first))
@@ -0,0 +1,268 @@
+"""
+Hot + Cold Audit Queries
+Stripe Data Architecture - Pipelines
+
+Purpose: Run the per-merchant audit queries of models/nosql/queries.js
+         (api_logs Q1-Q4, webhook_events Q13-Q16, Q17 step 2) over both
+         tiers, so callers do not know where a document lives:
+             - hot: the query's filters and projection as Cosmos SQL,
+               single-partition (merchant_id); skipped when the whole range
+               is older than the tiering watermark
+             - cold: the same filters on the archive (cold_archive.py),
+               pruned to the merchant's bucket for the days of the range,
+               then by row-group statistics
+             - union: one row per document id (the hot copy wins while a
+               batch is being moved), filters re-applied on the union, then
+               the query's ORDER BY / GROUP BY / TOP in pandas
+         Timestamps come back as UTC datetimes and bodies / payloads as
+         JSON text, whatever the tier.
+
+Usage:
+    store = TieredStore({'api_logs': container}, ColdArchive('/data/cold'))
+    errors = store.run('query2_api_errors_by_endpoint', 'acct_1MxY2kLkdIwHu0C9', since=datetime(2025, 1, 1))
+"""
+
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cold_archive import COLLECTIONS, ColdArchive, to_iso, to_table
+
+logger = logging.getLogger(__name__)
+
+
+class AuditQuery(NamedTuple):
+    name: str                       # export name in queries.js
+    collection: str
+    columns: Tuple[str, ...]        # projection (SELECT c.<column>, ...)
+    # AND-ed (field, op, value) filters besides merchant and time range; a
+    # value '@name' is a parameter of run(); ops: = != < <= > >= contains defined
+    conditions: Tuple[Tuple[str, str, object], ...] = ()
+    finish: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None
+
+
+def _top(column: str, n: Optional[int] = None) -> Callable[[pd.DataFrame], pd.DataFrame]:
+    def finish(frame: pd.DataFrame) -> pd.DataFrame:
+        frame = frame.sort_values(column, ascending=False, kind='stable')
+        return frame.head(n) if n else frame
+    return finish
+
+
+def _errors_by_endpoint(frame: pd.DataFrame) -> pd.DataFrame:
+    return (frame.groupby('endpoint', as_index=False)
+            .agg(error_count=('latency_ms', 'size'), avg_latency=('latency_ms', 'mean'),
+                 max_latency=('latency_ms', 'max'))
+            .sort_values('error_count', ascending=False, kind='stable'))
+
+
+def _success_rate_hourly(frame: pd.DataFrame) -> pd.DataFrame:
+    success = frame['status_code'].between(200, 299)
+    hourly = (frame.assign(hour=frame['timestamp'].dt.hour, success=success.astype(np.int64))
+              .groupby('hour', as_index=False)
+              .agg(total_requests=('success', 'size'), success_count=('success', 'sum')))
+    hourly['success_rate'] = hourly['success_count'] * 100.0 / hourly['total_requests']
+    return hourly.sort_values('hour', ascending=False)
+
+
+def _webhook_stats(frame: pd.DataFrame) -> pd.DataFrame:
+    stats = (frame.assign(sent=(frame['status'] == 'sent').astype(np.int64),
+                          failed=(frame['status'] == 'failed').astype(np.int64))
+             .groupby('event_type', as_index=False)
+             .agg(total_events=('sent', 'size'), sent_count=('sent', 'sum'), failed_count=('failed', 'sum'),
+                  avg_response_time=('response_time_ms', 'mean'), avg_retry_count=('retry_count', 'mean')))
+    stats.insert(4, 'success_rate', stats['sent_count'] * 100.0 / stats['total_events'])
+    return stats.sort_values('total_events', ascending=False, kind='stable')
+
+
+def _delivery_time(frame: pd.DataFrame) -> pd.DataFrame:
+    frame = frame.assign(delivery_time_seconds=(frame['delivered_at'] - frame['created_at']).dt.total_seconds()
+                         .astype(np.int64))
+    return frame[['webhook_id', 'event_type', 'created_at', 'delivered_at', 'delivery_time_seconds',
+                  'retry_count']].sort_values('delivery_time_seconds', ascending=False, kind='stable')
+
+
+AUDIT_QUERIES: Dict[str, AuditQuery] = {q.name: q for q in [
+    AuditQuery('query1_api_logs_24h', 'api_logs',
+               ('log_id', 'timestamp', 'endpoint', 'method', 'status_code', 'latency_ms', 'error_message'),
+               finish=_top('timestamp')),
+    AuditQuery('query2_api_errors_by_endpoint', 'api_logs', ('endpoint', 'latency_ms'),
+               (('status_code', '>=', 500),), _errors_by_endpoint),
+    AuditQuery('query3_slowest_api_calls', 'api_logs',
+               ('log_id', 'timestamp', 'endpoint', 'latency_ms', 'method'), finish=_top('latency_ms', 100)),
+    AuditQuery('query4_api_success_rate_hourly', 'api_logs', ('timestamp', 'status_code'),
+               finish=_success_rate_hourly),
+    AuditQuery('query13_failed_webhooks_for_retry', 'webhook_events',
+               ('webhook_id', 'event_type', 'event_id', 'webhook_url', 'retry_count', 'next_retry_at',
+                'error_message'),
+               (('status', '=', 'failed'), ('retry_count', '<', 5), ('next_retry_at', '<=', '@now')),
+               lambda frame: frame.sort_values('next_retry_at', kind='stable')),
+    AuditQuery('query14_webhook_stats_by_event_type', 'webhook_events',
+               ('event_type', 'status', 'response_time_ms', 'retry_count'), finish=_webhook_stats),
+    AuditQuery('query15_slow_webhook_endpoints', 'webhook_events',
+               ('webhook_id', 'event_type', 'webhook_url', 'response_time_ms', 'created_at'),
+               (('status', '=', 'sent'), ('response_time_ms', '>', 5000)), _top('response_time_ms', 50)),
+    AuditQuery('query16_webhook_delivery_time', 'webhook_events',
+               ('webhook_id', 'event_type', 'created_at', 'delivered_at', 'retry_count'),
+               (('status', '=', 'sent'), ('delivered_at', 'defined', True)), _delivery_time),
+    AuditQuery('query17_transaction_audit_trail', 'api_logs',
+               tuple(f.name for f in COLLECTIONS['api_logs'].schema),
+               (('request_body', 'contains', '@paymentId'),),
+               _top('timestamp')),
+]}
+
+
+def _utc(value) -> pd.Timestamp:
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+
+def _cosmos_clause(i: int, field: str, op: str) -> str:
+    if op == 'contains':
+        return f"CONTAINS(ToString(c.{field}), @c{i})"
+    if op == 'defined':
+        return f"IS_DEFINED(c.{field}) = @c{i}"
+    return f"c.{field} {op} @c{i}"
+
+
+def _mask(frame: pd.DataFrame, field: str, op: str, value) -> pd.Series:
+    column = frame[field]
+    if op == 'contains':
+        return column.fillna('').str.contains(value, regex=False)
+    if op == 'defined':
+        return column.notna() if value else column.isna()
+    return {'=': column == value, '!=': column != value, '<': column < value, '<=': column <= value,
+            '>': column > value, '>=': column >= value}[op].fillna(False).astype(bool)
+
+
+def _fetched(query: AuditQuery) -> list:
+    """Projection plus the id, time and filtered fields (union and residual filters)."""
+    spec = COLLECTIONS[query.collection]
+    return list(dict.fromkeys([spec.id_field, spec.time_field] + list(query.columns) +
+                              [field for field, _, _ in query.conditions]))
+
+
+class TieredStore:
+    """Audit queries over the hot containers and the cold archive."""
+
+    def __init__(self, containers: Dict, archive: ColdArchive):
+        """
+        Args:
+            containers: Hot container per collection name (partitioned by merchant_id)
+            archive: Cold tier written by tiering_job.py
+        """
+        self.containers = containers
+        self.archive = archive
+        self.stats = {'queries': 0, 'hot_queries': 0, 'hot_documents': 0, 'cold_files': 0, 'cold_rows': 0}
+
+    def _conditions(self, query: AuditQuery, params: Dict) -> Sequence[Tuple[str, str, object]]:
+        resolved = []
+        for field, op, value in query.conditions:
+            if isinstance(value, str) and value.startswith('@'):
+                value = params[value[1:]]
+            resolved.append((field, op, value))
+        return resolved
+
+    def _hot(self, query: AuditQuery, merchant_id, since: datetime, until: Optional[datetime],
+             conditions) -> pd.DataFrame:
+        spec = COLLECTIONS[query.collection]
+        columns = _fetched(query)
+        clauses = ["c.merchant_id = @merchantId", f"c.{spec.time_field} >= @since"]
+        parameters = [{'name': '@merchantId', 'value': merchant_id}, {'name': '@since', 'value': to_iso(since)}]
+        if until is not None:
+            clauses.append(f"c.{spec.time_field} <= @until")
+            parameters.append({'name': '@until', 'value': to_iso(until)})
+        for i, (field, op, value) in enumerate(conditions):
+            clauses.append(_cosmos_clause(i, field, op))
+            parameters.append({'name': f"@c{i}", 'value': to_iso(value) if isinstance(value, datetime) else value})
+        sql = f"SELECT {', '.join(f'c.{c}' for c in columns)} FROM c WHERE {' AND '.join(clauses)}"
+        documents = list(self.containers[query.collection].query_items(
+            sql, parameters=parameters, partition_key=merchant_id))
+        self.stats['hot_queries'] += 1
+        self.stats['hot_documents'] += len(documents)
+        return to_table(spec, documents, columns).to_pandas()
+
+    def _hot_needed(self, collection: str, until: Optional[datetime]) -> bool:
+        state = self.archive.state(collection)
+        return (until is None or state['watermark'] is None or state.get('kept', 0) > 0
+                or to_iso(until) >= state['watermark'])
+
+    def run(self, name: str, merchant_id, since: datetime, until: Optional[datetime] = None,
+            **params) -> pd.DataFrame:
+        """
+        Run an audit query over both tiers.
+
+        Args:
+            name: Key of AUDIT_QUERIES (queries.js export name)
+            merchant_id: Partition key (@merchantId)
+            since: Start of the time range (@since / @startTime)
+            until: End of the time range (default: open; @endTime of Q17)
+            params: The query's other parameters (now=..., paymentId=...)
+
+        Returns:
+            The query's result rows
+        """
+        query = AUDIT_QUERIES[name]
+        spec = COLLECTIONS[query.collection]
+        since, until = _utc(since), None if until is None else _utc(until)
+        conditions = [(field, op, _utc(value) if isinstance(value, datetime) else value)
+                      for field, op, value in self._conditions(query, params)]
+        columns = _fetched(query)
+        self.stats['queries'] += 1
+
+        frames = []
+        if query.collection in self.containers and self._hot_needed(query.collection, until):
+            frames.append(self._hot(query, merchant_id, since, until, conditions))
+        files = self.archive.files(query.collection, merchant_id, since, until)
+        self.stats['cold_files'] += len(files)
+        cold = self.archive.read(query.collection, merchant_id, since, until, columns, conditions, files).to_pandas()
+        self.stats['cold_rows'] += len(cold)
+        frames.append(cold)
+
+        frame = pd.concat([f for f in frames if len(f)] or frames[-1:], ignore_index=True)
+        frame = frame.drop_duplicates(spec.id_field, keep='first')
+        # Stand-in hot stores may ignore some clauses: filters are re-applied on the union
+        time = frame[spec.time_field]
+        keep = (time >= since) if until is None else (time >= since) & (time <= until)
+        for field, op, value in conditions:
+            keep &= _mask(frame, field, op, value)
+        # Canonical order first: ties of the ORDER BY do not depend on the tier
+        frame = frame[keep.to_numpy()].sort_values(spec.id_field, kind='stable')
+        if query.finish is not None:
+            frame = query.finish(frame)
+        return frame[[c for c in frame.columns if c in query.columns or c not in columns]].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit query over the hot and cold tiers')
+    parser.add_argument('query', choices=sorted(AUDIT_QUERIES))
+    parser.add_argument('--merchant', required=True)
+    parser.add_argument('--since', required=True, help='ISO date / datetime (UTC)')
+    parser.add_argument('--until', help='ISO date / datetime (UTC)')
+    parser.add_argument('--payment-id', help='@paymentId of query17')
+    parser.add_argument('--archive', required=True)
+    parser.add_argument('--endpoint', default=os.environ.get('COSMOS_ENDPOINT'))
+    parser.add_argument('--key', default=os.environ.get('COSMOS_KEY'))
+    parser.add_argument('--database', default='stripe_nosql_db')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from azure.cosmos import CosmosClient
+    database = CosmosClient(args.endpoint, credential=args.key).get_database_client(args.database)
+    collection = AUDIT_QUERIES[args.query].collection
+    store = TieredStore({collection: database.get_container_client(collection)}, ColdArchive(args.archive))
+    started = time.perf_counter()
+    result = store.run(args.query, args.merchant, pd.Timestamp(args.since).to_pydatetime(),
+                       pd.Timestamp(args.until).to_pydatetime() if args.until else None,
+                       now=datetime.now(timezone.utc), paymentId=args.payment_id)
+    print(result.to_string(index=False))
+    logger.info(f"{len(result)} rows in {(time.perf_counter() - started) * 1000:.0f} ms, {store.stats}")
+
+
+if __name__ == "__main__":
+    main()
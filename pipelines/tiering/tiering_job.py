@@ -0,0 +1,266 @@
+"""
+Hot/Cold Tiering Job
+Stripe Data Architecture - Pipelines
+
+Purpose: Move api_logs and webhook_events documents older than a
+         configurable age from Cosmos DB to the Parquet archive
+         (cold_archive.py), so the hot containers only hold the recent
+         window the dashboards and retry jobs query. The large,
+         non-indexed request / response bodies and payloads leave the hot
+         store with their documents.
+
+Each run, per collection:
+    1. cutoff = now - min_age; documents with time < cutoff (and the
+       policy's conditions) are read by a cross-partition query, in pages
+    2. per batch: staged as Parquet (temporary names), committed by a
+       journal listing files and document keys, files published
+    3. hot copies deleted (404 = already gone), journal removed
+    4. watermark = cutoff: every document older has left the hot store,
+       unless some were kept (tiered_query.py skips the hot store for
+       ranges before a watermark with nothing kept)
+A crash between 2 and 3 leaves the journal: the next run re-publishes the
+files and finishes the deletes before moving anything else. Staged files
+never committed are removed.
+
+webhook_events: pending events and failed events still scheduled for a
+retry stay hot whatever their age (query13_failed_webhooks_for_retry).
+
+Usage:
+    python tiering_job.py run --endpoint $COSMOS_ENDPOINT --key $COSMOS_KEY --archive /data/cold
+    python tiering_job.py run ... --age-days 14 --interval 3600        # continuous
+    python tiering_job.py compact --archive /data/cold --before 2025-10-01
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from cold_archive import COLLECTIONS, ColdArchive, StagedBatch, to_iso
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BATCH_SIZE = 50_000
+DEFAULT_PAGE_SIZE = 1_000
+DEFAULT_DELETE_WORKERS = 8
+MAX_WEBHOOK_RETRIES = 5
+
+
+def _awaiting_retry(document: Dict, now: str) -> bool:
+    return (document.get('status') == 'failed' and document.get('retry_count', 0) < MAX_WEBHOOK_RETRIES
+            and (document.get('next_retry_at') or '') > now)
+
+
+class TieringPolicy(NamedTuple):
+    collection: str
+    min_age: timedelta
+    # AND-ed (field, op, value) filters of the hot query (ops = != < <= > >=)
+    conditions: Tuple[Tuple[str, str, object], ...] = ()
+    # Documents kept hot even when old enough: keep(document, now_iso)
+    keep: Optional[Callable[[Dict, str], bool]] = None
+
+
+DEFAULT_POLICIES = [
+    TieringPolicy('api_logs', timedelta(days=7)),
+    TieringPolicy('webhook_events', timedelta(days=7), (('status', '!=', 'pending'),), _awaiting_retry),
+]
+
+
+def hot_query(policy: TieringPolicy, cutoff: str) -> Tuple[str, List[Dict]]:
+    """Cosmos SQL selecting the documents of the policy older than cutoff."""
+    time_field = COLLECTIONS[policy.collection].time_field
+    clauses = [f"c.{time_field} < @cutoff"]
+    parameters = [{'name': '@cutoff', 'value': cutoff}]
+    for i, (field, op, value) in enumerate(policy.conditions):
+        clauses.append(f"c.{field} {op} @p{i}")
+        parameters.append({'name': f"@p{i}", 'value': value})
+    return f"SELECT * FROM c WHERE {' AND '.join(clauses)}", parameters
+
+
+def _not_found(error: Exception) -> bool:
+    return getattr(error, 'status_code', None) == 404
+
+
+class TieringJob:
+    """Moves old documents from hot containers to the cold archive."""
+
+    def __init__(self, containers: Dict, archive: ColdArchive,
+                 policies: Optional[List[TieringPolicy]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, page_size: int = DEFAULT_PAGE_SIZE,
+                 delete_workers: int = DEFAULT_DELETE_WORKERS):
+        """
+        Args:
+            containers: Hot container per collection name (azure.cosmos
+                        ContainerProxy or a local stand-in), partitioned by merchant_id
+            archive: Cold tier
+            policies: Collections to tier (default: DEFAULT_POLICIES)
+            batch_size: Documents per archived batch (bounds memory and the
+                        work redone after a crash)
+            page_size: Query page size
+            delete_workers: Concurrent point deletes
+        """
+        self.containers = containers
+        self.archive = archive
+        self.policies = [p for p in (policies or DEFAULT_POLICIES) if p.collection in containers]
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.delete_workers = delete_workers
+
+    def _delete(self, collection: str, keys: List[Tuple[str, object]]) -> int:
+        container = self.containers[collection]
+
+        def delete(key) -> int:
+            try:
+                container.delete_item(item=key[0], partition_key=key[1])
+                return 1
+            except Exception as e:
+                if _not_found(e):
+                    return 0
+                raise
+
+        with ThreadPoolExecutor(max_workers=self.delete_workers) as pool:
+            return sum(pool.map(delete, keys))
+
+    def _finish(self, batch: StagedBatch) -> int:
+        deleted = self._delete(batch.collection, batch.keys)
+        self.archive.complete(batch)
+        return deleted
+
+    def recover(self) -> int:
+        """Finish the batches of an interrupted run; returns hot documents deleted."""
+        deleted = 0
+        for policy in self.policies:
+            for batch in self.archive.pending(policy.collection):
+                logger.info(f"Recovering {policy.collection} batch {batch.batch_id} ({batch.rows} documents)")
+                deleted += self._finish(batch)
+        return deleted
+
+    def _move(self, policy: TieringPolicy, documents: List[Dict], batch_id: str) -> Dict:
+        batch = self.archive.stage(policy.collection, documents, batch_id)
+        self.archive.commit(batch)
+        deleted = self._finish(batch)
+        hot_bytes = sum(len(json.dumps(d, separators=(',', ':'))) for d in documents)
+        logger.info(f"{policy.collection} batch {batch_id}: {batch.rows:,} documents, {len(batch.files)} files, "
+                    f"{hot_bytes / 1e6:.1f} MB JSON -> {batch.bytes / 1e6:.1f} MB Parquet")
+        return {'documents': batch.rows, 'deleted': deleted, 'files': len(batch.files),
+                'hot_bytes': hot_bytes, 'cold_bytes': batch.bytes}
+
+    def run_collection(self, policy: TieringPolicy, now: datetime) -> Dict:
+        """Move the documents of one collection older than now - min_age."""
+        started = time.perf_counter()
+        now_iso, cutoff = to_iso(now), to_iso(now - policy.min_age)
+        query, parameters = hot_query(policy, cutoff)
+        items = self.containers[policy.collection].query_items(
+            query, parameters=parameters, enable_cross_partition_query=True, max_item_count=self.page_size)
+
+        summary = {'cutoff': cutoff, 'documents': 0, 'deleted': 0, 'kept': 0, 'files': 0,
+                   'hot_bytes': 0, 'cold_bytes': 0}
+        batch, sequence = [], 0
+
+        def flush():
+            nonlocal batch, sequence
+            moved = self._move(policy, batch, f"{now:%Y%m%dT%H%M%S}-{sequence:05d}")
+            for key, value in moved.items():
+                summary[key] += value
+            batch, sequence = [], sequence + 1
+
+        for document in items:
+            if policy.keep is not None and policy.keep(document, now_iso):
+                summary['kept'] += 1
+                continue
+            batch.append(document)
+            if len(batch) >= self.batch_size:
+                flush()
+        if batch:
+            flush()
+
+        # Documents older than the cutoff are all archived, except `kept` ones
+        state = self.archive.state(policy.collection)
+        self.archive.set_state(policy.collection, {
+            'watermark': max(filter(None, [state['watermark'], cutoff])),
+            'kept': summary['kept'],
+            'documents': state['documents'] + summary['documents'],
+            'bytes': state['bytes'] + summary['cold_bytes'],
+            'updated_at': now_iso,
+        })
+        summary['seconds'] = round(time.perf_counter() - started, 3)
+        logger.info(f"{policy.collection}: {summary['documents']:,} documents older than {cutoff} archived, "
+                    f"{summary['kept']} kept hot, {summary['seconds']:.1f} s")
+        return summary
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[str, Dict]:
+        """Recover, then tier every collection; returns a summary per collection."""
+        now = now or datetime.now(timezone.utc)
+        self.recover()
+        return {policy.collection: self.run_collection(policy, now) for policy in self.policies}
+
+    def run_forever(self, interval_seconds: float) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                self.run_once()
+            except Exception:
+                # Next run recovers from the journal
+                logger.exception("Tiering run failed")
+            time.sleep(max(0.0, interval_seconds - (time.monotonic() - started)))
+
+
+def compact_before(archive: ColdArchive, collection: str, before: str) -> int:
+    """Compact every date partition of the collection before `before` (YYYY-MM-DD)."""
+    removed = 0
+    directory = os.path.join(archive.root, collection)
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if name.startswith('date=') and name[5:] < before:
+            removed += archive.compact(collection, name[5:])
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tier old api_logs / webhook_events to Parquet')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Move old documents to the archive')
+    run.add_argument('--endpoint', default=os.environ.get('COSMOS_ENDPOINT'))
+    run.add_argument('--key', default=os.environ.get('COSMOS_KEY'))
+    run.add_argument('--database', default='stripe_nosql_db')
+    run.add_argument('--archive', required=True)
+    run.add_argument('--collections', nargs='+', default=[p.collection for p in DEFAULT_POLICIES])
+    run.add_argument('--age-days', type=float, help='Minimum age (default: 7 days)')
+    run.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    run.add_argument('--buckets', type=int, help='merchant_id buckets of a new archive')
+    run.add_argument('--interval', type=float, help='Run continuously, every N seconds')
+
+    compact = commands.add_parser('compact', help='Merge the files of closed date partitions')
+    compact.add_argument('--archive', required=True)
+    compact.add_argument('--collections', nargs='+', default=list(COLLECTIONS))
+    compact.add_argument('--before', help='YYYY-MM-DD (default: the date of each watermark)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'compact':
+        archive = ColdArchive(args.archive)
+        for collection in args.collections:
+            before = args.before or (archive.state(collection)['watermark'] or '')[:10]
+            removed = compact_before(archive, collection, before)
+            logger.info(f"{collection}: {removed} files compacted (dates before {before})")
+        return
+
+    from azure.cosmos import CosmosClient
+    database = CosmosClient(args.endpoint, credential=args.key).get_database_client(args.database)
+    policies = [p._replace(min_age=timedelta(days=args.age_days)) if args.age_days else p
+                for p in DEFAULT_POLICIES if p.collection in args.collections]
+    job = TieringJob({p.collection: database.get_container_client(p.collection) for p in policies},
+                     ColdArchive(args.archive, buckets=args.buckets), policies, batch_size=args.batch_size)
+    if args.interval:
+        job.run_forever(args.interval)
+    else:
+        print(json.dumps(job.run_once(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,848 @@
+"""
+Synapse Distribution and Partition Advisor
+Stripe Data Architecture - Queries
+
+Purpose: Check the distribution and partitioning of the OLAP schema
+         (models/olap/schema.sql) against the analytical workload
+         (queries/sql/olap_queries.sql, the aggregate refresh procedures and
+         the materialized view) and the data of a Parquet lake:
+             - data movement: each workload query is parsed (DuckDB parser)
+               and replayed against every candidate distribution column of
+               fact_transactions; joins and aggregations that are not aligned
+               with the distribution are costed in rows shuffled
+             - skew: rows per distribution (60) for each candidate column
+             - partition size: rows per distribution and partition for each
+               granularity, against the 1M-row columnstore row group
+             - partition DDL: ALTER TABLE ... SPLIT RANGE script extending
+               the partition boundaries before the last one is reached, at
+               the recommended granularity; a table whose recommendation
+               differs from its current grain (coarser, or no partitioning)
+               is rebuilt at that grain instead (CREATE TABLE + INSERT ...
+               SELECT + RENAME OBJECT)
+
+Usage:
+    python distribution_advisor.py --lake ./lake [--scale 20] [--ddl roll_partitions.sql] [--json]
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import statistics
+from datetime import date
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+import duckdb
+
+from query_catalog import (MAX_TIME_KEY, MIN_TIME_KEY, OLAP_SCHEMA_PATH, load_catalog, materialized_views,
+                           scan_bounds, to_duckdb)
+from star_schema_lake import FACT_TABLE, StarSchemaLake
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Dedicated SQL pool: every table is spread over 60 distributions
+DISTRIBUTIONS = 60
+# Rows per columnstore row group (compression and segment elimination need full row groups)
+ROW_GROUP_ROWS = 1_048_576
+# Replicated tables above this compressed size cost more to copy than to move
+REPLICATE_MAX_BYTES = 2 * 1024 ** 3
+MAX_SKEW = 0.10
+
+REPLICATE = 'REPLICATE'
+ROUND_ROBIN = 'ROUND_ROBIN'
+
+FACT_CANDIDATES = ['customer_key', 'merchant_key', 'transaction_key', 'payment_method_key',
+                   'geography_key', 'time_key']
+GRANULARITIES = ['day', 'month', 'quarter', 'year']
+
+AGGREGATE_FUNCTIONS = {'sum', 'count', 'count_star', 'avg', 'min', 'max', 'stddev_samp', 'stdev',
+                       'approx_count_distinct', 'first', 'last'}
+# Aggregates returning one of their input values (same domain as the argument)
+VALUE_AGGREGATES = {'min', 'max', 'first', 'last'}
+# Largest number of values of date_part(<part>, ...)
+DATE_PART_VALUES = {'hour': 24, 'dow': 7, 'dayofweek': 7, 'weekday': 7, 'month': 12, 'quarter': 4,
+                    'day': 31, 'week': 53, 'minute': 60}
+
+
+# ============================================================================
+# SCHEMA
+# ============================================================================
+
+class TableLayout(NamedTuple):
+    name: str
+    columns: List[str]
+    distribution: str               # HASH, REPLICATE or ROUND_ROBIN
+    distribution_column: Optional[str]
+    partition_column: Optional[str]
+    boundaries: List[int]
+    materialized_view: bool = False
+
+
+def _closing(text: str, start: int) -> int:
+    """Index after the parenthesis closing the one at text[start]."""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    raise ValueError(f"Unbalanced parenthesis at offset {start}")
+
+
+def _distribution(options: str) -> Tuple[str, Optional[str]]:
+    match = re.search(r"DISTRIBUTION\s*=\s*(?:HASH\s*\(\s*(\w+)\s*\)|(REPLICATE|ROUND_ROBIN))", options, re.I)
+    if match is None:
+        return ROUND_ROBIN, None
+    return ('HASH', match.group(1)) if match.group(1) else (match.group(2).upper(), None)
+
+
+def parse_schema(path: str = OLAP_SCHEMA_PATH) -> Dict[str, TableLayout]:
+    """Distribution and partitioning of each table / materialized view."""
+    with open(path) as f:
+        text = f.read()
+    layouts = {}
+    for match in re.finditer(r"CREATE TABLE (\w+)\s*\(", text):
+        body_end = _closing(text, match.end() - 1)
+        body = text[match.end():body_end - 1]
+        columns = [line.split()[0] for line in body.split('\n')
+                   if re.match(r"\s+\w+\s+[A-Z]", line) and not line.strip().startswith('CONSTRAINT')]
+        with_match = re.match(r"\s*WITH\s*\(", text[body_end:])
+        options = ''
+        if with_match:
+            start = body_end + with_match.end() - 1
+            options = text[start:_closing(text, start)]
+        kind, column = _distribution(options)
+        partition = re.search(r"PARTITION\s*\(\s*(\w+)\s+RANGE\s+(?:RIGHT|LEFT)\s+FOR\s+VALUES\s*\(([^)]*)\)",
+                              options, re.I)
+        layouts[match.group(1)] = TableLayout(
+            match.group(1), columns, kind, column,
+            partition.group(1) if partition else None,
+            [int(v) for v in re.findall(r"\d+", partition.group(2))] if partition else [])
+    for match in re.finditer(r"CREATE MATERIALIZED VIEW (\w+)\s+WITH\s*(\((?:[^()]|\([^()]*\))*\))", text):
+        kind, column = _distribution(match.group(2))
+        layouts[match.group(1)] = TableLayout(match.group(1), [], kind, column, None, [], True)
+    return layouts
+
+
+# ============================================================================
+# WORKLOAD
+# ============================================================================
+
+class WorkloadQuery(NamedTuple):
+    query_id: str
+    title: str
+    sql: str       # DuckDB dialect
+    weight: float
+
+
+def _procedure_statements(schema_text: str, last_day: int) -> List[Tuple[str, str]]:
+    """INSERT ... SELECT of the aggregate refresh procedures, parameters bound to the last loaded day / month."""
+    month = last_day // 100
+    next_month = (month // 100 + 1) * 100 + 1 if month % 100 == 12 else month + 1
+    values = {'@date_key': last_day, '@year_month': month,
+              '@start_date_key': month * 100 + 1, '@end_date_key': next_month * 100 + 1}
+    statements = []
+    for match in re.finditer(r"CREATE PROCEDURE (\w+)(.*?)\nEND;", schema_text, re.S):
+        insert = re.search(r"INSERT INTO agg_\w+\s*\([^)]*\)\s*(SELECT.*?);", match.group(2), re.S)
+        if insert is None:
+            continue
+        sql = re.sub(r"@\w+", lambda m: str(values.get(m.group(0), 0)), insert.group(1))
+        statements.append((match.group(1), sql))
+    return statements
+
+
+def load_workload(last_day: int, as_of: date, weights: Optional[Dict[str, float]] = None) -> List[WorkloadQuery]:
+    """Catalog queries, aggregate refresh procedures and materialized view maintenance."""
+    weights = weights or {}
+    workload = [WorkloadQuery(q.query_id, q.title, to_duckdb(q.sql, as_of), weights.get(q.query_id, 1.0))
+                for q in load_catalog()]
+    with open(OLAP_SCHEMA_PATH) as f:
+        schema_text = f.read()
+    for name, sql in _procedure_statements(schema_text, last_day):
+        workload.append(WorkloadQuery(name, 'Aggregate refresh', to_duckdb(sql, as_of), weights.get(name, 1.0)))
+    for name, sql in materialized_views().items():
+        workload.append(WorkloadQuery(name, 'Materialized view maintenance', to_duckdb(sql, as_of),
+                                      weights.get(name, 1.0)))
+    return workload
+
+
+# ============================================================================
+# DATA PROFILE
+# ============================================================================
+
+class DataProfile:
+    """Row counts, distinct counts and skew measured on the lake (DuckDB)."""
+
+    def __init__(self, lake: StarSchemaLake, sample_percent: float = 100.0):
+        self.lake = lake
+        self.sample_percent = sample_percent
+        self.conn = duckdb.connect()
+        files = [f for paths in lake.partitions().values() for f in paths]
+        if not files:
+            raise FileNotFoundError(f"No {FACT_TABLE} partitions under {lake.fact_root}")
+        self.conn.execute(f"CREATE VIEW {FACT_TABLE} AS SELECT * FROM read_parquet([{', '.join(repr(f) for f in files)}])")
+        for table in ('agg_daily_revenue', 'agg_monthly_metrics'):
+            path = lake.table_path(table)
+            if path:
+                self.conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+        self._ndv: Dict[Tuple[FrozenSet[str], int, int], float] = {}
+        self._rows: Dict[Tuple[int, int], float] = {}
+
+    def evaluate_date(self, expression: str) -> date:
+        return self.conn.execute(f"SELECT CAST({expression} AS DATE)").fetchone()[0]
+
+    def last_day(self) -> int:
+        return max(self.lake.partitions())
+
+    def fact_rows(self, bounds: Tuple[int, int]) -> float:
+        if bounds not in self._rows:
+            self._rows[bounds] = float(self.conn.execute(
+                f"SELECT COUNT(*) FROM {FACT_TABLE} WHERE time_key BETWEEN ? AND ?", list(bounds)).fetchone()[0])
+        return self._rows[bounds]
+
+    def ndv(self, columns: Iterable[str], bounds: Tuple[int, int]) -> float:
+        """Approximate distinct combinations of fact columns in the time bounds."""
+        columns = frozenset(columns)
+        if not columns:
+            return 1.0
+        key = (columns, bounds[0], bounds[1])
+        if key not in self._ndv:
+            self._ndv[key] = float(self.conn.execute(
+                f"SELECT approx_count_distinct(hash({', '.join(sorted(columns))})) FROM {FACT_TABLE} "
+                f"WHERE time_key BETWEEN ? AND ?", list(bounds)).fetchone()[0])
+        return self._ndv[key]
+
+    def table_rows(self, table: str) -> float:
+        try:
+            return float(self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+        except duckdb.Error:
+            return 0.0
+
+    def table_bytes(self, table: str) -> int:
+        if table == FACT_TABLE:
+            return sum(os.path.getsize(f) for paths in self.lake.partitions().values() for f in paths)
+        path = self.lake.table_path(table)
+        return os.path.getsize(path) if path else 0
+
+    def skew(self, table: str, column: str) -> Dict:
+        """Rows per distribution for HASH(column) (hash emulated; Synapse's differs, the spread is comparable)."""
+        sample = f" USING SAMPLE {self.sample_percent}%" if self.sample_percent < 100 else ''
+        counts = [r[0] for r in self.conn.execute(
+            f"SELECT COUNT(*) FROM (SELECT {column} FROM {table}{sample}) "
+            f"GROUP BY hash({column}) % {DISTRIBUTIONS}").fetchall()]
+        counts += [0] * (DISTRIBUTIONS - len(counts))
+        mean = statistics.mean(counts)
+        top = self.conn.execute(
+            f"SELECT COUNT(*) FROM (SELECT {column} FROM {table}{sample}) GROUP BY {column} "
+            f"ORDER BY 1 DESC LIMIT 1").fetchone()[0]
+        return {'skew': round(max(counts) / mean - 1, 4) if mean else 0.0,
+                'empty_distributions': counts.count(0),
+                'top_value_share': round(top / sum(counts), 4) if sum(counts) else 0.0,
+                'distinct_values': int(self.conn.execute(
+                    f"SELECT approx_count_distinct({column}) FROM {table}").fetchone()[0])}
+
+    def period_rows(self, table: str, key_column: str, granularity: str) -> List[int]:
+        """Rows per period (day / month / quarter / year) of a YYYYMMDD key column."""
+        period = {'day': key_column, 'month': f"{key_column} // 100",
+                  'quarter': f"{key_column} // 10000 * 10 + ({key_column} // 100 % 100 + 2) // 3",
+                  'year': f"{key_column} // 10000"}[granularity]
+        return [r[0] for r in self.conn.execute(
+            f"SELECT COUNT(*) FROM {table} GROUP BY {period}").fetchall()]
+
+
+# ============================================================================
+# DATA MOVEMENT MODEL
+# ============================================================================
+
+class Stream(NamedTuple):
+    rows: float
+    # Fact column the rows are hashed on, REPLICATE, or None (round robin / no usable key)
+    distribution: Optional[str]
+    # Output column -> (equal fact column, fact column it depends on)
+    columns: Dict[str, Tuple[Optional[str], Optional[str]]]
+
+
+def _walk(node) -> Iterable[Dict]:
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _conjuncts(expression: Optional[Dict]) -> List[Dict]:
+    if expression is None:
+        return []
+    if expression.get('class') == 'CONJUNCTION' and expression.get('type') == 'CONJUNCTION_AND':
+        return [c for child in expression['children'] for c in _conjuncts(child)]
+    return [expression]
+
+
+def _is_aggregate(expression: Dict) -> bool:
+    return expression.get('class') == 'FUNCTION' and expression.get('function_name', '').lower() in AGGREGATE_FUNCTIONS
+
+
+def _date_part_values(expression: Dict) -> Optional[int]:
+    """Bounded cardinality of a date_part('<part>', ...) expression."""
+    if expression.get('class') != 'FUNCTION' or expression.get('function_name', '').lower() != 'date_part':
+        return None
+    part = expression['children'][0].get('value', {}).get('value') if expression.get('children') else None
+    return DATE_PART_VALUES.get(str(part).lower())
+
+
+def _output_name(expression: Dict) -> Optional[str]:
+    if expression.get('alias'):
+        return expression['alias']
+    if expression.get('class') == 'COLUMN_REF':
+        return expression['column_names'][-1]
+    return None
+
+
+class MovementModel:
+    """Rows shuffled by one query when fact_transactions is distributed on `distribution`."""
+
+    def __init__(self, layouts: Dict[str, TableLayout], profile: DataProfile,
+                 distribution: Optional[str], bounds: Tuple[int, int]):
+        self.layouts = layouts
+        self.profile = profile
+        self.distribution = distribution
+        self.bounds = bounds
+        self.steps: List[Tuple[str, float]] = []
+
+    @property
+    def rows_moved(self) -> float:
+        return sum(rows for _, rows in self.steps)
+
+    def _move(self, reason: str, rows: float) -> None:
+        if rows > 0:
+            self.steps.append((reason, rows))
+
+    def statement(self, sql: str) -> Stream:
+        tree = json.loads(self.profile.conn.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+        if tree.get('error'):
+            raise ValueError(tree.get('error_message', 'unparseable statement'))
+        return self.node(tree['statements'][0]['node'], {})
+
+    def node(self, node: Dict, ctes: Dict[str, Stream]) -> Stream:
+        if node['type'] == 'SET_OPERATION_NODE':
+            left, right = self.node(node['left'], ctes), self.node(node['right'], ctes)
+            return Stream(left.rows + right.rows, None, left.columns)
+        ctes = dict(ctes)
+        for entry in node.get('cte_map', {}).get('map', []):
+            ctes[entry['key']] = self.node(entry['value']['query']['node'], ctes)
+
+        aliases: Dict[str, Stream] = {}
+        order: List[str] = []
+        equalities: List[Tuple[Tuple[str, str], Tuple[str, str]]] = []
+        self._sources(node['from_table'], ctes, aliases, order, equalities)
+        resolve = self._resolver(aliases, equalities)
+        stream = self._join(aliases, order, equalities, resolve)
+
+        select = node.get('select_list', [])
+        groups = node.get('group_expressions', [])
+        aggregated = bool(groups) or any(_is_aggregate(e) for s in select for e in _walk(s)
+                                        if e.get('class') != 'WINDOW')
+        if aggregated:
+            stream = self._aggregate(stream, groups, select, resolve)
+        else:
+            columns = {}
+            for expression in select:
+                if expression.get('class') == 'STAR':
+                    for alias in order:
+                        columns.update(aliases[alias].columns)
+                    continue
+                name = _output_name(expression)
+                if name:
+                    columns[name] = self._expression_keys(expression, resolve)
+            stream = Stream(stream.rows, stream.distribution, columns)
+        self._windows(stream, select, resolve)
+        return stream
+
+    def _sources(self, ref: Dict, ctes: Dict[str, Stream], aliases: Dict[str, Stream], order: List[str],
+                 equalities: List) -> None:
+        kind = ref['type']
+        if kind == 'JOIN':
+            self._sources(ref['left'], ctes, aliases, order, equalities)
+            self._sources(ref['right'], ctes, aliases, order, equalities)
+            for condition in _conjuncts(ref.get('condition')):
+                if condition.get('type') == 'COMPARE_EQUAL' and condition['left'].get('class') == 'COLUMN_REF' \
+                        and condition['right'].get('class') == 'COLUMN_REF':
+                    equalities.append((tuple(condition['left']['column_names'][-2:]),
+                                       tuple(condition['right']['column_names'][-2:])))
+            return
+        if kind == 'SUBQUERY':
+            stream = self.node(ref['subquery']['node'], ctes)
+            alias = ref.get('alias') or f"subquery{len(aliases)}"
+        elif kind == 'BASE_TABLE':
+            table = ref['table_name']
+            alias = ref.get('alias') or table
+            stream = ctes[table] if table in ctes else self._table(table)
+        else:
+            return
+        aliases[alias] = stream
+        order.append(alias)
+
+    def _table(self, table: str) -> Stream:
+        if table == FACT_TABLE:
+            columns = {c: (c, c) for c in self.layouts[FACT_TABLE].columns}
+            return Stream(self.profile.fact_rows(self.bounds), self.distribution, columns)
+        layout = self.layouts.get(table)
+        if layout is None or layout.distribution == REPLICATE:
+            return Stream(0.0, REPLICATE, {})
+        if layout.materialized_view:
+            # Rows keyed like the fact table (time_key, merchant_key)
+            columns = {c: (c, c) for c in ('time_key', 'merchant_key')}
+            return Stream(self.profile.ndv(columns, self.bounds), layout.distribution_column, columns)
+        # Aggregate tables: own distribution, not affected by the fact layout
+        return Stream(self.profile.table_rows(table), f"{table}.{layout.distribution_column}", {})
+
+    def _resolver(self, aliases: Dict[str, Stream], equalities: List):
+        """(alias, column) -> (equal fact column, fact column it depends on)."""
+        equal: Dict[Tuple[str, str], str] = {}
+        for alias, stream in aliases.items():
+            for column, (same, _) in stream.columns.items():
+                if same:
+                    equal[(alias, column)] = same
+        # Equi-join columns share their fact column (both directions, to a fixpoint)
+        changed = True
+        while changed:
+            changed = False
+            for left, right in equalities:
+                for a, b in ((left, right), (right, left)):
+                    if a in equal and b not in equal:
+                        equal[b] = equal[a]
+                        changed = True
+        # A replicated table joined on a fact column depends on it
+        bound = {}
+        for left, right in equalities:
+            for a, b in ((left, right), (right, left)):
+                if b[0] in aliases and aliases[b[0]].distribution == REPLICATE and a in equal:
+                    bound.setdefault(b[0], equal[a])
+
+        def resolve(names: List[str]) -> Tuple[Optional[str], Optional[str]]:
+            if len(names) >= 2:
+                alias, column = names[-2], names[-1]
+            else:
+                column = names[-1]
+                owners = [a for a, s in aliases.items() if column in s.columns] or list(aliases)
+                alias = owners[0] if len(owners) == 1 else None
+                if alias is None:
+                    return None, None
+            stream = aliases.get(alias)
+            if stream is None:
+                return None, None
+            same, depends = stream.columns.get(column, (None, None))
+            same = same or equal.get((alias, column))
+            return same, depends or same or bound.get(alias)
+        return resolve
+
+    def _expression_keys(self, expression: Dict, resolve) -> Tuple[Optional[str], Optional[str]]:
+        if expression.get('class') == 'COLUMN_REF':
+            return resolve(expression['column_names'])
+        if _is_aggregate(expression) and expression['function_name'].lower() in VALUE_AGGREGATES \
+                and len(expression.get('children', [])) == 1:
+            return None, self._expression_keys(expression['children'][0], resolve)[1]
+        if any(_is_aggregate(e) or e.get('class') == 'WINDOW' for e in _walk(expression)):
+            return None, None
+        depends = [resolve(e['column_names'])[1] for e in _walk(expression) if e.get('class') == 'COLUMN_REF']
+        depends = [d for d in depends if d]
+        return None, depends[0] if len(set(depends)) == 1 else None
+
+    def _join(self, aliases: Dict[str, Stream], order: List[str], equalities: List, resolve) -> Stream:
+        distributed = [a for a in order if aliases[a].distribution != REPLICATE]
+        if not distributed:
+            return Stream(max([aliases[a].rows for a in order] or [0.0]), REPLICATE, {})
+        joined = {distributed[0]}
+        current = aliases[distributed[0]]
+        for alias in distributed[1:]:
+            stream = aliases[alias]
+            keys = []
+            for left, right in equalities:
+                for a, b in ((left, right), (right, left)):
+                    if a[0] in joined and b[0] == alias:
+                        keys.append((resolve(list(a))[0], resolve(list(b))[0]))
+            aligned = any(l == current.distribution and r == stream.distribution and l for l, r in keys)
+            if not aligned:
+                left_ok = any(l == current.distribution and l for l, _ in keys)
+                right_ok = any(r == stream.distribution and r for _, r in keys)
+                if left_ok:
+                    self._move(f"shuffle {alias} to join on {current.distribution}", stream.rows)
+                elif right_ok:
+                    self._move(f"shuffle join input to {stream.distribution}", current.rows)
+                    current = Stream(current.rows, stream.distribution, current.columns)
+                else:
+                    self._move(f"shuffle both join inputs ({alias})", current.rows + stream.rows)
+                    key = next((l for l, _ in keys if l), None)
+                    current = Stream(current.rows, key, current.columns)
+            current = Stream(max(current.rows, stream.rows), current.distribution, current.columns)
+            joined.add(alias)
+        return current
+
+    def _aggregate(self, stream: Stream, groups: List[Dict], select: List[Dict], resolve) -> Stream:
+        keys = [self._expression_keys(g, resolve) for g in groups]
+        bounded = [_date_part_values(g) for g in groups]
+        determinants = {d for (_, d), b in zip(keys, bounded) if d and not b}
+        unknown = any(d is None and not b for (_, d), b in zip(keys, bounded))
+        if unknown:
+            groups_count = stream.rows
+        else:
+            factor = 1
+            for b in bounded:
+                factor *= b or 1
+            groups_count = min(stream.rows, self.profile.ndv(determinants, self.bounds) * factor) \
+                if groups else 1.0
+        aligned = stream.distribution not in (None, REPLICATE) and any(s == stream.distribution for s, _ in keys)
+
+        if stream.distribution != REPLICATE and not aligned:
+            # COUNT(DISTINCT x): local when x is the distribution column, else (groups, x) pairs move
+            distinct = {frozenset(resolve(c['column_names'])[1] for c in _walk(f['children'])
+                                  if c.get('class') == 'COLUMN_REF')
+                        for e in select for f in _walk(e) if _is_aggregate(f) and f.get('distinct')}
+            for columns in distinct:
+                if stream.distribution in columns:
+                    continue
+                pairs = stream.rows if None in columns or unknown else \
+                    min(stream.rows, self.profile.ndv(determinants | columns, self.bounds))
+                self._move(f"shuffle distinct ({', '.join(sorted(c or '?' for c in columns))}) per group", pairs)
+            self._move("shuffle partial aggregates to group keys", min(stream.rows, groups_count * DISTRIBUTIONS))
+
+        columns = {}
+        for expression in select:
+            name = _output_name(expression)
+            if name:
+                columns[name] = self._expression_keys(expression, resolve)
+        if stream.distribution == REPLICATE:
+            distribution = REPLICATE
+        elif aligned:
+            distribution = stream.distribution
+        else:
+            # Aggregation shuffles on the group keys: usable only with a single fact key
+            equal = [s for s, _ in keys if s]
+            distribution = equal[0] if len(keys) == 1 and equal else None
+        return Stream(groups_count, distribution, columns)
+
+    def _windows(self, stream: Stream, select: List[Dict], resolve) -> None:
+        if stream.distribution == REPLICATE:
+            return
+        for expression in select:
+            for window in _walk(expression):
+                if window.get('class') != 'WINDOW':
+                    continue
+                partitions = [resolve(p['column_names'])[0] for p in window.get('partitions', [])
+                              if p.get('class') == 'COLUMN_REF']
+                if not (stream.distribution and stream.distribution in partitions):
+                    self._move(f"shuffle rows for {window.get('function_name', 'window')}", stream.rows)
+                    return
+
+
+# ============================================================================
+# ADVISOR
+# ============================================================================
+
+def _fact_bounds(sql: str, profile: DataProfile) -> Tuple[int, int]:
+    return scan_bounds(sql, (FACT_TABLE, 'mv_daily_merchant_summary'), profile.evaluate_date)
+
+
+def movement_report(workload: List[WorkloadQuery], layouts: Dict[str, TableLayout], profile: DataProfile,
+                    candidates: List[Optional[str]]) -> Dict[str, Dict[str, float]]:
+    """query_id -> candidate -> rows shuffled."""
+    report = {}
+    for query in workload:
+        if not re.search(rf"\b({FACT_TABLE}|mv_daily_merchant_summary)\b", query.sql):
+            continue
+        bounds = _fact_bounds(query.sql, profile)
+        costs = {}
+        for candidate in candidates:
+            model = MovementModel(layouts, profile, candidate, bounds)
+            try:
+                model.statement(query.sql)
+            except (ValueError, KeyError, duckdb.Error) as e:
+                logger.warning(f"Query {query.query_id} not analysed: {e}")
+                break
+            costs[candidate or ROUND_ROBIN] = model.rows_moved
+        if costs:
+            report[query.query_id] = costs
+    return report
+
+
+def partition_report(profile: DataProfile, table: str, key_column: str, scale: float) -> Dict:
+    """Median rows per distribution and partition for each granularity; finest granularity filling row groups."""
+    sizes = {}
+    for granularity in GRANULARITIES:
+        rows = profile.period_rows(table, key_column, granularity)
+        sizes[granularity] = int(statistics.median(rows) * scale / DISTRIBUTIONS) if rows else 0
+    recommended = next((g for g in GRANULARITIES if sizes[g] >= ROW_GROUP_ROWS), None)
+    return {'rows_per_distribution_partition': sizes, 'recommended': recommended or 'none'}
+
+
+def advise(lake: StarSchemaLake, as_of: date, scale: float = 1.0, sample_percent: float = 100.0,
+           weights: Optional[Dict[str, float]] = None, max_skew: float = MAX_SKEW) -> Dict:
+    """
+    Args:
+        lake: Parquet lake (export or synthetic) sampled for sizes and skew
+        as_of: Date used for GETDATE() in the workload
+        scale: Production volume / lake volume (for partition sizing)
+        sample_percent: Sample used for the skew measurements
+        weights: Executions per query id (default 1)
+        max_skew: Largest acceptable (max distribution / mean) - 1
+
+    Returns:
+        Report: per-table layouts, skew, data movement, partition sizing, recommendations
+    """
+    layouts = parse_schema()
+    profile = DataProfile(lake, sample_percent)
+    workload = load_workload(profile.last_day(), as_of, weights)
+    weight = {q.query_id: q.weight for q in workload}
+    fact = layouts[FACT_TABLE]
+
+    skew = {c: profile.skew(FACT_TABLE, c) for c in FACT_CANDIDATES}
+    movement = movement_report(workload, layouts, profile, FACT_CANDIDATES + [None])
+    totals = {c: sum(costs[c] * weight[q] for q, costs in movement.items())
+              for c in FACT_CANDIDATES + [ROUND_ROBIN]}
+    eligible = [c for c in FACT_CANDIDATES
+                if skew[c]['skew'] <= max_skew and skew[c]['distinct_values'] >= DISTRIBUTIONS * 10]
+    recommended = min(eligible, key=lambda c: (totals[c], skew[c]['skew'])) if eligible else ROUND_ROBIN
+
+    report = {
+        'lake_rows': int(profile.fact_rows((MIN_TIME_KEY, MAX_TIME_KEY))),
+        'scale': scale,
+        FACT_TABLE: {
+            'current': {'distribution': f"HASH({fact.distribution_column})",
+                        'partitions': f"{fact.partition_column}, {len(fact.boundaries)} boundaries "
+                                      f"{fact.boundaries[0]}..{fact.boundaries[-1]}"},
+            'skew': skew,
+            'rows_moved_by_candidate': {c: int(v) for c, v in totals.items()},
+            'rows_moved_by_query': {q: {c: int(v) for c, v in costs.items()} for q, costs in movement.items()},
+            'recommended_distribution': recommended if recommended == ROUND_ROBIN else f"HASH({recommended})",
+            'partitioning': partition_report(profile, FACT_TABLE, 'time_key', scale),
+        },
+    }
+
+    for name, layout in layouts.items():
+        if name == FACT_TABLE or layout.materialized_view:
+            continue
+        rows = profile.table_rows(name) if name.startswith('agg_') else None
+        entry = {'current': layout.distribution + (f"({layout.distribution_column})"
+                                                   if layout.distribution_column else '')}
+        size = profile.table_bytes(name) * scale
+        if size:
+            entry['estimated_bytes'] = int(size)
+        if layout.distribution == REPLICATE and size > REPLICATE_MAX_BYTES:
+            entry['advice'] = 'replicated copy above 2 GB: consider HASH on its join key'
+        if layout.distribution == 'HASH' and rows:
+            entry['skew'] = profile.skew(name, layout.distribution_column)
+            per_distribution = rows * scale / DISTRIBUTIONS
+            entry['rows_per_distribution'] = int(per_distribution)
+            if per_distribution < ROW_GROUP_ROWS:
+                entry['advice'] = ('fewer rows than one row group per distribution: '
+                                   + ('REPLICATE (small, joined to replicated dimensions)'
+                                      if size < REPLICATE_MAX_BYTES else 'ROUND_ROBIN heap'))
+        if layout.partition_column and rows:
+            entry['partitioning'] = partition_report(profile, name, layout.partition_column, scale)
+        report[name] = entry
+    return report
+
+
+# ============================================================================
+# ROLLING PARTITION WINDOW
+# ============================================================================
+
+def _next_boundary(key: int, granularity: str) -> int:
+    year, month, day = key // 10000, key // 100 % 100, key % 100
+    if granularity == 'day':
+        return int(date.fromordinal(date(year, month, day).toordinal() + 1).strftime('%Y%m%d'))
+    step = {'month': 1, 'quarter': 3, 'year': 12}[granularity]
+    months = year * 12 + month - 1 + step
+    return (months // 12) * 10000 + (months % 12 + 1) * 100 + 1
+
+
+def _grain(boundaries: List[int]) -> Optional[str]:
+    """Granularity of consecutive YYYYMMDD boundaries."""
+    if len(boundaries) < 2:
+        return None
+    first, second = sorted(boundaries)[:2]
+    return next((g for g in GRANULARITIES if _next_boundary(first, g) == second), None)
+
+
+def _align(key: int, granularity: str) -> int:
+    """First day of the `granularity` period containing key."""
+    year, month = key // 10000, key // 100 % 100
+    if granularity == 'day':
+        return key
+    month = {'month': month, 'quarter': month - (month - 1) % 3, 'year': 1}[granularity]
+    return year * 10000 + month * 100 + 1
+
+
+def _rebuild_ddl(name: str, layout: TableLayout, granularity: str, through: int,
+                 schema_text: str, views: List[str]) -> List[str]:
+    """
+    Statements rebuilding `name` at `granularity` ('none': not partitioned):
+    new table with the schema's columns and constraints, rows copied, names
+    swapped. Materialized views over the table are dropped and recreated.
+    """
+    match = re.search(rf"CREATE TABLE {name}\s*\(", schema_text)
+    body = schema_text[match.end() - 1:_closing(schema_text, match.end() - 1)]
+    staging = f"{name}_repartitioned"
+    options = [f"HASH({layout.distribution_column})" if layout.distribution == 'HASH'
+               else layout.distribution]
+    options = [f"DISTRIBUTION = {options[0]}", "CLUSTERED COLUMNSTORE INDEX"]
+    current = _grain(layout.boundaries) or 'custom'
+    if granularity != 'none':
+        boundaries = [_align(min(layout.boundaries), granularity)]
+        while _next_boundary(boundaries[-1], granularity) <= through:
+            boundaries.append(_next_boundary(boundaries[-1], granularity))
+        values = ',\n            '.join(', '.join(str(b) for b in boundaries[i:i + 6])
+                                        for i in range(0, len(boundaries), 6))
+        options.append(f"PARTITION (\n        {layout.partition_column} RANGE RIGHT FOR VALUES (\n"
+                       f"            {values}\n        )\n    )")
+    # Constraint names are per schema: the staging copy takes them once the original is dropped
+    body = re.sub(r"CONSTRAINT (\w+)", rf"CONSTRAINT \1_repartitioned", body)
+
+    lines = [f"-- {name} ({layout.partition_column}): {current}ly partitions -> "
+             + ("not partitioned" if granularity == 'none' else f"{granularity}ly through {through}")
+             + " (recommended); rebuilt, run with the loads paused"]
+    for view in views:
+        lines.append(f"DROP VIEW {view};")
+    lines.append(f"CREATE TABLE {staging} {body}\nWITH (\n    " + ',\n    '.join(options) + "\n);")
+    columns = ', '.join(layout.columns)
+    identity = 'IDENTITY' in body
+    if identity:
+        lines.append(f"SET IDENTITY_INSERT {staging} ON;")
+    lines.append(f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {name};")
+    if identity:
+        lines.append(f"SET IDENTITY_INSERT {staging} OFF;")
+    lines.append(f"RENAME OBJECT {name} TO {name}_old;")
+    lines.append(f"RENAME OBJECT {staging} TO {name};")
+    lines.append(f"DROP TABLE {name}_old;")
+    for view in views:
+        definition = re.search(rf"CREATE MATERIALIZED VIEW {view}\b.*?;", schema_text, re.S)
+        lines.append(definition.group(0))
+    lines.append("")
+    return lines
+
+
+def rolling_window_ddl(layouts: Dict[str, TableLayout], granularity: Dict[str, str], through: int,
+                       schema_path: str = OLAP_SCHEMA_PATH) -> str:
+    """
+    Partition DDL at each table's `granularity` (default: its current grain).
+
+    Same grain as the current boundaries: ALTER TABLE ... SPLIT RANGE
+    statements adding boundaries after the last one up to `through`
+    (YYYYMMDD). Splitting a columnstore partition requires it to be empty:
+    run before the data reaches the last boundary. Another grain, or 'none':
+    the table is rebuilt (see _rebuild_ddl).
+    """
+    with open(schema_path) as f:
+        schema_text = f.read()
+    views = [name for name, layout in layouts.items() if layout.materialized_view]
+    lines = ["-- Partition DDL (generated by queries/engine/distribution_advisor.py)",
+             "-- Rolling window: run before the data reaches each table's last boundary, SPLIT RANGE",
+             "-- on a clustered columnstore table only applies to an empty partition.", ""]
+    for name, layout in layouts.items():
+        if not layout.boundaries:
+            continue
+        last = max(layout.boundaries)
+        step = granularity.get(name) or _grain(layout.boundaries) or 'month'
+        if step != _grain(layout.boundaries):
+            lines.extend(_rebuild_ddl(name, layout, step, through, schema_text,
+                                      views if name == FACT_TABLE else []))
+            continue
+        boundaries = []
+        key = _next_boundary(last, step)
+        while key <= through:
+            boundaries.append(key)
+            key = _next_boundary(key, step)
+        if not boundaries:
+            continue
+        referencing = [v for v in views if name == FACT_TABLE]
+        lines.append(f"-- {name} ({layout.partition_column}): last boundary {last}, {step}ly -> {boundaries[-1]}")
+        lines.append(f"IF NOT EXISTS (SELECT 1 FROM {name} WHERE {layout.partition_column} >= {last})")
+        lines.append("BEGIN")
+        for view in referencing:
+            lines.append(f"    ALTER MATERIALIZED VIEW {view} DISABLE;")
+        for boundary in boundaries:
+            lines.append(f"    ALTER TABLE {name} SPLIT RANGE ({boundary});")
+        for view in referencing:
+            lines.append(f"    ALTER MATERIALIZED VIEW {view} REBUILD;")
+        lines.append("END")
+        lines.append("ELSE")
+        lines.append(f"    RAISERROR('{name}: rows at or after {last}, the last partition is not empty', 16, 1);")
+        lines.append("")
+    return '\n'.join(lines)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def format_report(report: Dict) -> str:
+    fact = report[FACT_TABLE]
+    lines = [f"fact_transactions: {fact['current']['distribution']}, {fact['current']['partitions']}",
+             f"  lake rows {report['lake_rows']:,} (x{report['scale']} for sizing)", "",
+             f"  {'candidate':<20} {'skew':>7} {'empty':>6} {'top value':>10} {'distinct':>10} {'rows moved':>14}"]
+    for candidate, moved in sorted(fact['rows_moved_by_candidate'].items(), key=lambda kv: kv[1]):
+        s = fact['skew'].get(candidate)
+        if s:
+            lines.append(f"  {candidate:<20} {s['skew']:>7.1%} {s['empty_distributions']:>6} "
+                         f"{s['top_value_share']:>10.1%} {s['distinct_values']:>10,} {moved:>14,}")
+        else:
+            lines.append(f"  {candidate:<20} {'-':>7} {'-':>6} {'-':>10} {'-':>10} {moved:>14,}")
+    lines.append(f"  recommended: {fact['recommended_distribution']}")
+    sizing = fact['partitioning']
+    lines.append("  rows per distribution and partition: " + ', '.join(
+        f"{g} {n:,}" for g, n in sizing['rows_per_distribution_partition'].items())
+        + f" -> partition by {sizing['recommended']}")
+    for name, entry in report.items():
+        if name in (FACT_TABLE, 'lake_rows', 'scale'):
+            continue
+        detail = [entry['current']]
+        if 'rows_per_distribution' in entry:
+            detail.append(f"{entry['rows_per_distribution']:,} rows/distribution")
+        if 'skew' in entry:
+            detail.append(f"skew {entry['skew']['skew']:.1%}")
+        if 'partitioning' in entry:
+            detail.append(f"partition by {entry['partitioning']['recommended']}")
+        if 'advice' in entry:
+            detail.append(entry['advice'])
+        lines.append(f"{name}: " + ', '.join(detail))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Synapse distribution / partition advisor')
+    parser.add_argument('--lake', required=True, help='Parquet lake (olap_runner.py export / generate)')
+    parser.add_argument('--as-of', default=date.today().isoformat(), help='Date used for GETDATE()')
+    parser.add_argument('--scale', type=float, default=1.0, help='Production rows / lake rows')
+    parser.add_argument('--sample-percent', type=float, default=100.0, help='Sample for skew measurements')
+    parser.add_argument('--weight', nargs='*', default=[], help='Executions per query, e.g. 5.1=96 7.1=288')
+    parser.add_argument('--max-skew', type=float, default=MAX_SKEW)
+    parser.add_argument('--ddl', help='Write the partition script (SPLIT RANGE or rebuild) to this file')
+    parser.add_argument('--through', default='20281201', help='Last boundary to create (YYYYMMDD)')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    weights = {k: float(v) for k, v in (w.split('=', 1) for w in args.weight)}
+    report = advise(StarSchemaLake(args.lake), date.fromisoformat(args.as_of), args.scale,
+                    args.sample_percent, weights, args.max_skew)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+    if args.ddl:
+        granularity = {FACT_TABLE: report[FACT_TABLE]['partitioning']['recommended']}
+        for name, entry in report.items():
+            if isinstance(entry, dict) and 'partitioning' in entry and name != FACT_TABLE:
+                granularity[name] = entry['partitioning']['recommended']
+        with open(args.ddl, 'w') as f:
+            f.write(rolling_window_ddl(parse_schema(), granularity, int(args.through)))
+        logger.info(f"Partition DDL written to {args.ddl}")
+
+
+if __name__ == "__main__":
+    main()
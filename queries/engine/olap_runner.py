@@ -0,0 +1,336 @@
+"""
+Local OLAP Analytics Runner
+Stripe Data Architecture - Queries
+
+Purpose: Run the analytical queries of queries/sql/olap_queries.sql on an
+         embedded columnar engine (DuckDB) over a Parquet export of the star
+         schema, without a Synapse pool:
+             - partition pruning: only the time_key=... directories inside
+               the bounds implied by the query are scanned
+             - projection pushdown: the fact view exposes only the columns
+               the query references
+             - per-query timing (median of --repeat runs), rows returned,
+               partitions and columns read
+             - optional result cache, invalidated by partition after ETL
+               runs (result_cache.py)
+
+Usage:
+    python olap_runner.py generate --lake ./lake --rows 10000000
+    python olap_runner.py export --olap ../../pipelines/etl/olap.db --lake ./lake
+    python olap_runner.py run --lake ./lake --as-of 2025-10-16 [--queries 1.1 6.1] [--no-pruning] [--cache]
+    python olap_runner.py sync --olap ../../pipelines/etl/olap.db --etl-lake ../../pipelines/etl/lake --lake ./lake
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import statistics
+import time
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+
+from query_catalog import (AGGREGATE_RELATIONS, MAX_TIME_KEY, MIN_TIME_KEY, CatalogQuery,
+                           analyse_fact_scan, load_catalog, materialized_views, scan_bounds, to_duckdb)
+from result_cache import DEFAULT_MAX_BYTES, ResultCache, cache_key
+from star_schema_lake import (AGGREGATE_TABLES, DIMENSION_TABLES, FACT_TABLE, StarSchemaLake,
+                              export_warehouse, generate_lake, refresh_from_etl)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# sp_refresh_daily_aggregates / sp_calculate_monthly_metrics over the whole lake
+AGGREGATE_SQL = {
+    'agg_daily_revenue': """
+        SELECT f.time_key AS date_key, f.merchant_key, f.geography_key, f.payment_method_key,
+               COUNT(*) AS transaction_count,
+               SUM(CASE WHEN f.is_successful THEN 1 ELSE 0 END) AS successful_count,
+               SUM(CASE WHEN NOT f.is_successful THEN 1 ELSE 0 END) AS failed_count,
+               SUM(CASE WHEN f.is_refunded THEN 1 ELSE 0 END) AS refunded_count,
+               SUM(f.amount) AS total_amount, SUM(f.processing_fee) AS total_fees,
+               SUM(f.net_amount) AS total_net,
+               CAST(AVG(f.amount) AS DECIMAL(18,2)) AS avg_transaction_amount,
+               MAX(f.amount) AS max_transaction_amount, MIN(f.amount) AS min_transaction_amount,
+               COUNT(DISTINCT f.customer_key) AS unique_customers
+        FROM fact_transactions f
+        GROUP BY f.time_key, f.merchant_key, f.geography_key, f.payment_method_key
+    """,
+    'agg_monthly_metrics': """
+        SELECT f.time_key / 100 AS year_month, f.merchant_key,
+               SUM(f.amount) AS gross_revenue, SUM(f.net_amount) AS net_revenue,
+               COUNT(*) AS transaction_count,
+               COUNT(DISTINCT f.customer_key) AS unique_customers,
+               COUNT(DISTINCT CASE WHEN ft.first_month >= f.time_key / 100 THEN f.customer_key END) AS new_customers,
+               COUNT(DISTINCT CASE WHEN ft.first_month < f.time_key / 100 THEN f.customer_key END) AS returning_customers,
+               CAST(AVG(f.amount) AS DECIMAL(18,2)) AS avg_order_value,
+               CAST(SUM(f.amount) / COUNT(DISTINCT f.customer_key) AS DECIMAL(18,2)) AS customer_lifetime_value,
+               CAST(0 AS DECIMAL(5,2)) AS churn_rate,
+               CAST(SUM(CASE WHEN f.is_refunded THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS DECIMAL(5,2)) AS refund_rate,
+               CAST(SUM(CASE WHEN f.is_disputed THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS DECIMAL(5,2)) AS chargeback_rate,
+               CAST(SUM(CASE WHEN f.is_fraudulent THEN 1 ELSE 0 END) * 100.0 / COUNT(*) AS DECIMAL(5,2)) AS fraud_rate
+        FROM fact_transactions f
+        LEFT JOIN (SELECT customer_key, MIN(time_key) / 100 AS first_month
+                   FROM fact_transactions GROUP BY customer_key) ft
+            ON f.customer_key = ft.customer_key
+        WHERE f.is_successful
+        GROUP BY f.time_key / 100, f.merchant_key
+    """,
+}
+
+
+def _fetch_arrow(result) -> pa.Table:
+    table = result.arrow()
+    # Recent DuckDB versions return a RecordBatchReader
+    return table.read_all() if isinstance(table, pa.RecordBatchReader) else table
+
+
+class QueryReport(NamedTuple):
+    query_id: str
+    title: str
+    status: str
+    seconds: Optional[float]
+    rows: Optional[int]
+    partitions_scanned: int
+    partitions_total: int
+    columns_read: int
+    columns_total: int
+    error: Optional[str] = None
+
+
+class OLAPRunner:
+    """DuckDB session over a StarSchemaLake."""
+
+    def __init__(self, lake: StarSchemaLake, as_of: date, pruning: bool = True,
+                 threads: Optional[int] = None, cache: Optional[ResultCache] = None):
+        """
+        Args:
+            lake: Parquet star schema
+            as_of: Date substituted for GETDATE()
+            pruning: Partition pruning and projection pushdown (False: full scans)
+            threads: DuckDB worker threads (None: all cores)
+            cache: Result cache (None: every query is executed)
+        """
+        self.lake = lake
+        self.as_of = as_of
+        self.pruning = pruning
+        self.cache = cache
+        self.conn = duckdb.connect()
+        # T-SQL semantics: INT / INT truncates (the catalog casts to FLOAT where it needs to)
+        self.conn.execute("SET integer_division = true")
+        if threads:
+            self.conn.execute(f"SET threads = {int(threads)}")
+        self.fact_columns = lake.fact_columns()
+        self.views = materialized_views()
+        for table in DIMENSION_TABLES + AGGREGATE_TABLES:
+            path = lake.table_path(table)
+            if path is not None:
+                self.conn.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+
+    def build_aggregates(self) -> Dict[str, int]:
+        """Write the aggregate tables missing from the lake (synthetic lakes have none)."""
+        self._bind_facts(list(self.lake.partitions()), list(self.fact_columns), [])
+        built = {}
+        for table, sql in AGGREGATE_SQL.items():
+            if self.lake.table_path(table) is not None:
+                continue
+            path = os.path.join(self.lake.root, f"{table}.parquet")
+            self.conn.execute(f"COPY ({sql}) TO '{path}' (FORMAT PARQUET)")
+            self.conn.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+            built[table] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        return built
+
+    def _evaluate_date(self, expression: str) -> date:
+        return self.conn.execute(f"SELECT CAST({expression} AS DATE)").fetchone()[0]
+
+    def _bind_facts(self, partitions: List[int], columns: List[str], views: List[str]) -> None:
+        """(Re)define the fact view over the selected partitions and columns, and the views on it."""
+        all_files = [f for files in self.lake.partitions().values() for f in files]
+        if not all_files:
+            raise FileNotFoundError(f"No {FACT_TABLE} partitions under {self.lake.fact_root}")
+        files = [f for key in partitions for f in self.lake.partitions()[key]]
+        # Bounds outside the data: empty relation with the fact schema
+        source = f"read_parquet([{', '.join(repr(f) for f in files)}])" if files else \
+            f"(SELECT * FROM read_parquet('{all_files[0]}') LIMIT 0)"
+        self.conn.execute(f"CREATE OR REPLACE VIEW {FACT_TABLE} AS SELECT {', '.join(columns)} FROM {source}")
+        for name in views:
+            self.conn.execute(f"CREATE OR REPLACE VIEW {name} AS {self.views[name]}")
+
+    def _dependencies(self, sql: str, fact_bounds: Optional[Tuple[int, int]]) -> Dict[str, Tuple[int, int]]:
+        """Relations a result depends on, with the time_key interval read from each."""
+        dependencies = {FACT_TABLE: fact_bounds} if fact_bounds else {}
+        for table in AGGREGATE_RELATIONS:
+            if re.search(rf"\b{table}\b", sql):
+                dependencies[table] = scan_bounds(sql, (table,), self._evaluate_date)
+        for table in DIMENSION_TABLES:
+            if re.search(rf"\b{table}\b", sql) or (fact_bounds and any(
+                    re.search(rf"\b{table}\b", self.views[v]) for v in self.views if v in sql)):
+                dependencies[table] = (MIN_TIME_KEY, MAX_TIME_KEY)
+        return dependencies
+
+    def run(self, query: CatalogQuery, repeat: int = 1) -> QueryReport:
+        sql = to_duckdb(query.sql, self.as_of)
+        total = len(self.lake.partitions())
+        views = [name for name in self.views if re.search(rf"\b{name}\b", sql)]
+        reads_facts = bool(views) or bool(re.search(rf"\b{FACT_TABLE}\b", sql))
+        try:
+            scan = None
+            if reads_facts:
+                view_sql = '\n'.join(self.views[name] for name in views)
+                scan = analyse_fact_scan(sql, self.fact_columns, self._evaluate_date, view_sql)
+
+            key = None
+            if self.cache is not None:
+                key = cache_key(sql)
+                start = time.perf_counter()
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return QueryReport(query.query_id, query.title, 'cached',
+                                       round(time.perf_counter() - start, 4), cached.num_rows,
+                                       0, total, 0, len(self.fact_columns))
+
+            partitions, columns = [], []
+            if reads_facts:
+                lower, upper, columns = MIN_TIME_KEY, MAX_TIME_KEY, list(self.fact_columns)
+                if self.pruning:
+                    lower, upper = scan.lower, scan.upper
+                    if scan.columns is not None:
+                        # Keep at least one column so COUNT(*) has rows to count
+                        columns = [c for c in self.fact_columns if c in scan.columns] or ['time_key']
+                partitions = self.lake.prune(lower, upper)
+                self._bind_facts(partitions, columns, views)
+
+            timings, result = [], None
+            for _ in range(max(1, repeat)):
+                start = time.perf_counter()
+                result = _fetch_arrow(self.conn.execute(sql))
+                timings.append(time.perf_counter() - start)
+            if key is not None:
+                self.cache.put(key, result, self._dependencies(sql, (scan.lower, scan.upper) if scan else None),
+                               query.query_id)
+            return QueryReport(query.query_id, query.title, 'ok', round(statistics.median(timings), 4),
+                               result.num_rows, len(partitions), total, len(columns), len(self.fact_columns))
+        except (duckdb.Error, FileNotFoundError) as e:
+            return QueryReport(query.query_id, query.title, 'error', None, None, 0, total,
+                               0, len(self.fact_columns), str(e).split('\n')[0])
+
+    def run_catalog(self, query_ids: Optional[List[str]] = None, repeat: int = 1) -> List[QueryReport]:
+        reports = []
+        for query in load_catalog():
+            if query_ids and query.query_id not in query_ids:
+                continue
+            report = self.run(query, repeat)
+            logger.info(f"Query {report.query_id}: {report.status} "
+                        f"{report.seconds if report.seconds is not None else '-'}s, "
+                        f"{report.partitions_scanned}/{report.partitions_total} partitions, "
+                        f"{report.columns_read}/{report.columns_total} columns")
+            reports.append(report)
+        return reports
+
+
+def format_reports(reports: List[QueryReport]) -> str:
+    lines = [f"{'query':<6} {'status':<6} {'seconds':>8} {'rows':>8} {'partitions':>11} {'columns':>8}  title"]
+    for r in reports:
+        seconds = f"{r.seconds:.3f}" if r.seconds is not None else '-'
+        rows = str(r.rows) if r.rows is not None else '-'
+        lines.append(f"{r.query_id:<6} {r.status:<6} {seconds:>8} {rows:>8} "
+                     f"{r.partitions_scanned:>5}/{r.partitions_total:<5} "
+                     f"{r.columns_read:>3}/{r.columns_total:<4}  {r.title}")
+        if r.error:
+            lines.append(f"       {r.error}")
+    total = sum(r.seconds for r in reports if r.seconds is not None)
+    lines.append(f"total {total:.3f}s over {sum(r.status != 'error' for r in reports)}/{len(reports)} queries")
+    return '\n'.join(lines)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+CACHE_DIRECTORY = '_cache'
+
+
+def _connect(args):
+    if args.olap:
+        import sqlite3
+        return sqlite3.connect(args.olap)
+    import pyodbc
+    return pyodbc.connect(args.synapse_connection)
+
+
+def _warehouse_arguments(parser: argparse.ArgumentParser) -> None:
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--olap', help='SQLite warehouse stand-in')
+    source.add_argument('--synapse-connection', help='Synapse connection string')
+    parser.add_argument('--lake', required=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OLAP analytics runner (DuckDB over Parquet)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    generate = sub.add_parser('generate', help='Synthetic star-schema lake')
+    generate.add_argument('--lake', required=True)
+    generate.add_argument('--rows', type=int, default=10_000_000)
+    generate.add_argument('--customers', type=int, default=200_000)
+    generate.add_argument('--merchants', type=int, default=5_000)
+    generate.add_argument('--start', default='2024-01-01')
+    generate.add_argument('--days', type=int, default=730)
+    generate.add_argument('--seed', type=int, default=42)
+
+    export = sub.add_parser('export', help='Export a warehouse to the lake')
+    _warehouse_arguments(export)
+
+    sync = sub.add_parser('sync', help='Refresh the partitions changed by ETL runs, invalidate cached results')
+    _warehouse_arguments(sync)
+    sync.add_argument('--etl-lake', required=True, help='ETL Parquet root (_merge manifests)')
+
+    run = sub.add_parser('run', help='Run the catalog queries')
+    run.add_argument('--lake', required=True)
+    run.add_argument('--as-of', default=date.today().isoformat(), help='Date used for GETDATE()')
+    run.add_argument('--queries', nargs='*', help='Query ids (default: all)')
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--threads', type=int)
+    run.add_argument('--no-pruning', action='store_true', help='Scan every partition and column')
+    run.add_argument('--cache', action='store_true', help=f"Serve / store results in <lake>/{CACHE_DIRECTORY}")
+    run.add_argument('--cache-mb', type=int, default=DEFAULT_MAX_BYTES // 2 ** 20)
+    run.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    cache_directory = os.path.join(args.lake, CACHE_DIRECTORY)
+    if args.command in ('generate', 'export'):
+        if args.command == 'generate':
+            counts = generate_lake(args.lake, args.rows, args.customers, args.merchants,
+                                   date.fromisoformat(args.start), args.days, seed=args.seed)
+        else:
+            counts = export_warehouse(_connect(args), args.lake)
+        counts.update(OLAPRunner(StarSchemaLake(args.lake), date.today()).build_aggregates())
+        if os.path.isdir(cache_directory):
+            ResultCache(cache_directory).clear()
+        print(json.dumps(counts, indent=2))
+    elif args.command == 'sync':
+        changes = refresh_from_etl(_connect(args), args.lake, args.etl_lake)
+        OLAPRunner(StarSchemaLake(args.lake), date.today()).build_aggregates()
+        invalidated = ResultCache(cache_directory).invalidate(changes) if os.path.isdir(cache_directory) else 0
+        print(json.dumps({'changed': {t: ('all' if c is None else len(c)) for t, c in changes.items()},
+                          'invalidated_results': invalidated}, indent=2))
+    else:
+        cache = ResultCache(cache_directory, args.cache_mb * 2 ** 20) if args.cache else None
+        runner = OLAPRunner(StarSchemaLake(args.lake), date.fromisoformat(args.as_of),
+                            pruning=not args.no_pruning, threads=args.threads, cache=cache)
+        reports = runner.run_catalog(args.queries, args.repeat)
+        if args.json:
+            print(json.dumps([r._asdict() for r in reports], indent=2))
+        else:
+            print(format_reports(reports))
+            if cache is not None:
+                print(f"cache: {cache.stats}, {len(cache.index)} entries, {cache.size_bytes() / 2 ** 20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
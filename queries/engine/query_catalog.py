@@ -0,0 +1,287 @@
+"""
+OLAP Query Catalog and T-SQL Translation
+Stripe Data Architecture - Queries
+
+Purpose: Read the named analytical queries of queries/sql/olap_queries.sql,
+         rewrite their Synapse (T-SQL) constructs for DuckDB, and analyse
+         each query's scan of fact_transactions:
+             - time_key bounds implied by the WHERE clause of the fact scope
+               (time_key literals, dim_time year / full_date predicates),
+               used for partition pruning (and, for the aggregate tables,
+               for result-cache dependencies)
+             - fact columns referenced, used for projection pushdown
+
+The analysis is conservative: a query gets bounds only when it scans the
+fact data once, without OR in the filtering scope; otherwise every
+partition is read.
+"""
+
+import os
+import re
+from datetime import date, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+OLAP_QUERIES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'sql', 'olap_queries.sql'
+)
+OLAP_SCHEMA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'models', 'olap', 'schema.sql'
+)
+
+# Relations backed by fact_transactions partitions (grouped by time_key, so
+# a time_key filter on them selects the same partitions)
+FACT_RELATIONS = ('fact_transactions', 'mv_daily_merchant_summary')
+
+# Aggregate tables and their period column (date_key: YYYYMMDD, year_month: YYYYMM)
+AGGREGATE_RELATIONS = {'agg_daily_revenue': 'date_key', 'agg_monthly_metrics': 'year_month'}
+
+MIN_TIME_KEY, MAX_TIME_KEY = 19000101, 99991231
+
+
+class CatalogQuery(NamedTuple):
+    query_id: str
+    title: str
+    use_case: str
+    sql: str
+
+
+def load_catalog(path: str = OLAP_QUERIES_PATH) -> List[CatalogQuery]:
+    """Queries introduced by '-- Query <id>: <title>' comments."""
+    with open(path) as f:
+        text = f.read()
+    queries = []
+    headers = list(re.finditer(r"^-- Query ([\d.]+): (.*)$", text, re.M))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        body = text[header.end():end]
+        use_case = re.search(r"^-- Use case: (.*)$", body, re.M)
+        statement = body.split(';')[0]
+        sql = '\n'.join(line for line in statement.split('\n') if not line.strip().startswith('--'))
+        queries.append(CatalogQuery(header.group(1), header.group(2).strip(),
+                                    use_case.group(1).strip() if use_case else '', sql.strip()))
+    return queries
+
+
+def materialized_views(path: str = OLAP_SCHEMA_PATH) -> Dict[str, str]:
+    """name -> SELECT of each CREATE MATERIALIZED VIEW in the OLAP schema."""
+    with open(path) as f:
+        text = f.read()
+    views = {}
+    for match in re.finditer(r"CREATE MATERIALIZED VIEW (\w+)\s+WITH\s*\((?:[^()]|\([^()]*\))*\)\s+AS\s+(.*?);", text, re.S):
+        views[match.group(1)] = match.group(2).strip()
+    return views
+
+
+# ============================================================================
+# T-SQL -> DUCKDB
+# ============================================================================
+
+def _split_args(text: str, start: int) -> Tuple[List[str], int]:
+    """Top-level arguments of the call whose '(' is at text[start]; returns (args, end)."""
+    depth, args, current = 0, [], start + 1
+    for i in range(start, len(text)):
+        char = text[i]
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                args.append(text[current:i].strip())
+                return args, i + 1
+        elif char == ',' and depth == 1:
+            args.append(text[current:i].strip())
+            current = i + 1
+    raise ValueError(f"Unbalanced call at offset {start}")
+
+
+def _rewrite_calls(sql: str, name: str, rewrite: Callable[[List[str]], str]) -> str:
+    pattern = re.compile(rf"\b{name}\s*\(", re.I)
+    while True:
+        match = pattern.search(sql)
+        if match is None:
+            return sql
+        args, end = _split_args(sql, match.end() - 1)
+        sql = sql[:match.start()] + rewrite(args) + sql[end:]
+
+
+def to_duckdb(sql: str, as_of: date) -> str:
+    """
+    Rewrite the T-SQL constructs used by the catalog. GETDATE() becomes a
+    fixed as-of date so runs are reproducible and time bounds can be derived.
+    """
+    sql = re.sub(r"\bGETDATE\(\)", f"DATE '{as_of.isoformat()}'", sql, flags=re.I)
+    sql = _rewrite_calls(sql, 'DATEADD',
+                         lambda a: f"CAST({a[2]} + INTERVAL ({a[1]}) {a[0].upper()} AS DATE)")
+    sql = _rewrite_calls(sql, 'DATEDIFF', lambda a: f"date_diff('{a[0].lower()}', {a[1]}, {a[2]})")
+    sql = _rewrite_calls(sql, 'DATEPART', lambda a: f"date_part('{a[0].lower()}', {a[1]})")
+    sql = re.sub(r"\bSTDEV\s*\(", 'stddev_samp(', sql, flags=re.I)
+    return sql
+
+
+# ============================================================================
+# SCAN ANALYSIS
+# ============================================================================
+
+class FactScan(NamedTuple):
+    lower: int                 # inclusive time_key bounds
+    upper: int
+    columns: Optional[Set[str]]  # None: all columns
+    relations: Set[str]        # FACT_RELATIONS referenced
+
+
+_CLAUSE_END = re.compile(r"\b(GROUP\s+BY|ORDER\s+BY|HAVING|UNION)\b", re.I)
+
+
+def _depths(sql: str) -> List[int]:
+    depth, depths = 0, []
+    for char in sql:
+        if char == ')':
+            depth -= 1
+        depths.append(depth)
+        if char == '(':
+            depth += 1
+    return depths
+
+
+def _scope_where(sql: str, position: int) -> Optional[str]:
+    """WHERE clause of the scope (paren depth) containing `position`."""
+    depths = _depths(sql)
+    depth = depths[position]
+    start = None
+    for i in range(position, len(sql)):
+        if depths[i] < depth:
+            return None
+        if depths[i] == depth and re.match(r"WHERE\b", sql[i:i + 6], re.I) and not sql[i - 1].isalnum():
+            start = i + len('WHERE')
+            break
+    if start is None:
+        return None
+    end = start
+    while end < len(sql) and depths[end] >= depth and sql[end] != ';':
+        if depths[end] == depth and _CLAUSE_END.match(sql, end):
+            break
+        end += 1
+    return sql[start:end]
+
+
+def _conjuncts(clause: str) -> List[str]:
+    depths = _depths(clause)
+    parts, start = [], 0
+    for match in re.finditer(r"\bAND\b", clause, re.I):
+        if depths[match.start()] == 0 and not re.search(r"\bBETWEEN\s+\S+\s*$", clause[start:match.start()], re.I):
+            parts.append(clause[start:match.start()])
+            start = match.end()
+    parts.append(clause[start:])
+    return [p.strip() for p in parts]
+
+
+def _time_key(day: date) -> int:
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def _apply(bounds: List[int], op: str, value: int, step: Callable[[int, int], int]) -> None:
+    if op in ('>=', '='):
+        bounds[0] = max(bounds[0], value)
+    if op == '>':
+        bounds[0] = max(bounds[0], step(value, 1))
+    if op in ('<=', '='):
+        bounds[1] = min(bounds[1], value)
+    if op == '<':
+        bounds[1] = min(bounds[1], step(value, -1))
+
+
+def _aliases(sql: str, table: str) -> Set[str]:
+    return {m.group(1) for m in re.finditer(
+        rf"\b{table}\s+(?:AS\s+)?(?!ON\b|WHERE\b|INNER\b|LEFT\b|JOIN\b|GROUP\b)(\w+)", sql, re.I)}
+
+
+def _month_step(key: int, n: int) -> int:
+    """First (n > 0) or last (n < 0) day key of the month after / before `key`'s month."""
+    months = key // 10000 * 12 + key // 100 % 100 - 1 + n
+    year, month = divmod(months, 12)
+    if n > 0:
+        return year * 10000 + (month + 1) * 100 + 1
+    return year * 10000 + (month + 1) * 100 + 31
+
+
+def scan_bounds(sql: str, relations: Tuple[str, ...], evaluate_date: Callable[[str], date]) -> Tuple[int, int]:
+    """
+    Inclusive time_key bounds of the rows of `relations` a query reads.
+    Periods are day keys (YYYYMMDD); a YYYYMM year_month covers its month
+    (..01 to ..31).
+    """
+    references = [m for m in re.finditer(rf"\b({'|'.join(relations)})\b", sql, re.I)]
+    bounds = [MIN_TIME_KEY, MAX_TIME_KEY]
+
+    where = _scope_where(sql, references[0].start()) if len(references) == 1 else None
+    if where is None or re.search(r"\bOR\b", where, re.I):
+        return bounds[0], bounds[1]
+    time_aliases = _aliases(sql, 'dim_time')
+    day_step = lambda key, n: _time_key(
+        date(key // 10000, key // 100 % 100, key % 100) + timedelta(days=n))
+    for predicate in _conjuncts(where):
+        match = re.fullmatch(r"(\w+)\.(?:time_key|date_key)\s*(>=|<=|=|>|<)\s*(\d{8})", predicate)
+        if match:
+            _apply(bounds, match.group(2), int(match.group(3)), day_step)
+            continue
+        match = re.fullmatch(r"(\w+)\.(?:time_key|date_key)\s+BETWEEN\s+(\d{8})\s+AND\s+(\d{8})", predicate, re.I)
+        if match:
+            _apply(bounds, '>=', int(match.group(2)), day_step)
+            _apply(bounds, '<=', int(match.group(3)), day_step)
+            continue
+        match = re.fullmatch(r"(\w+)\.year_month\s*(>=|<=|=|>|<)\s*(\d{6})", predicate)
+        if match:
+            month, op = int(match.group(3)), match.group(2)
+            if op in ('>=', '='):
+                bounds[0] = max(bounds[0], month * 100 + 1)
+            if op in ('<=', '='):
+                bounds[1] = min(bounds[1], month * 100 + 31)
+            if op == '>':
+                bounds[0] = max(bounds[0], _month_step(month * 100 + 1, 1))
+            if op == '<':
+                bounds[1] = min(bounds[1], _month_step(month * 100 + 1, -1))
+            continue
+        match = re.fullmatch(r"(\w+)\.year\s*(>=|<=|=|>|<)\s*(\d{4})", predicate)
+        if match and match.group(1) in time_aliases:
+            year, op = int(match.group(3)), match.group(2)
+            lower = {'>=': year, '=': year, '>': year + 1}.get(op)
+            upper = {'<=': year, '=': year, '<': year - 1}.get(op)
+            if lower is not None:
+                bounds[0] = max(bounds[0], lower * 10000 + 101)
+            if upper is not None:
+                bounds[1] = min(bounds[1], upper * 10000 + 1231)
+            continue
+        match = re.fullmatch(r"(\w+)\.full_date\s*(>=|<=|=|>|<)\s*(.+)", predicate, re.S)
+        if match and match.group(1) in time_aliases:
+            _apply(bounds, match.group(2), _time_key(evaluate_date(match.group(3))), day_step)
+    return bounds[0], bounds[1]
+
+
+def analyse_fact_scan(sql: str, fact_columns: List[str], evaluate_date: Callable[[str], date],
+                      view_sql: str = '') -> FactScan:
+    """
+    Args:
+        sql: DuckDB SQL (after to_duckdb)
+        fact_columns: Columns of fact_transactions
+        evaluate_date: Evaluates a constant SQL date expression
+        view_sql: Definitions of the views over the fact data the query uses
+                  (their columns are projected too)
+
+    Returns:
+        FactScan with inclusive time_key bounds and the referenced fact columns
+    """
+    relations = {m.group(1).lower() for m in re.finditer(rf"\b({'|'.join(FACT_RELATIONS)})\b", sql, re.I)}
+    lower, upper = scan_bounds(sql, FACT_RELATIONS, evaluate_date)
+
+    # Projection: columns qualified by an alias of fact_transactions
+    columns: Optional[Set[str]] = set()
+    for text in (sql, view_sql):
+        if not re.search(r"\bfact_transactions\b", text, re.I):
+            continue
+        aliases = _aliases(text, 'fact_transactions')
+        if not aliases:
+            columns = None
+            break
+        for alias in aliases:
+            columns |= {c for c in re.findall(rf"\b{alias}\.(\w+)", text) if c in fact_columns}
+    return FactScan(lower, upper, columns, relations)
@@ -0,0 +1,174 @@
+"""
+Query Result Cache
+Stripe Data Architecture - Queries
+
+Purpose: Cache of analytical query results for the OLAP runner, so
+         dashboard refreshes (queries 5.1, 6.1, 7.1, ...) do not re-scan
+         data that has not changed since the last ETL run:
+             - key: normalized query text + parameters
+             - dependencies: time_key interval read from each partitioned
+               relation (fact_transactions, agg_daily_revenue,
+               agg_monthly_metrics) and the dimension tables used
+             - invalidation: only the entries whose dependencies overlap the
+               partitions changed by an ETL run (refresh_from_etl)
+             - storage: one Arrow IPC file (zstd) per result, LRU eviction
+               above a size budget
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+import pyarrow as pa
+
+from star_schema_lake import Changes
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+INDEX_FILE = 'index.json'
+
+
+def normalize_sql(sql: str) -> str:
+    """Comments removed, whitespace collapsed and keywords lower-cased outside string literals."""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        text = re.sub(r"--[^\n]*", ' ', parts[i])
+        parts[i] = re.sub(r"\s+", ' ', text).lower()
+    return ''.join(parts).strip()
+
+
+def cache_key(sql: str, params: Optional[Dict] = None) -> str:
+    payload = normalize_sql(sql) + '\n' + json.dumps(params or {}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """Arrow IPC result files + JSON index in one directory (single writer)."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Args:
+            directory: Cache directory (created if missing)
+            max_bytes: Size budget of the result files
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.index: Dict[str, Dict] = {}
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def _save_index(self) -> None:
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(path + '.tmp', path)
+
+    def _remove(self, key: str) -> None:
+        self.index.pop(key, None)
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def get(self, key: str) -> Optional[pa.Table]:
+        entry = self.index.get(key)
+        if entry is None or not os.path.exists(self._path(key)):
+            self.stats['misses'] += 1
+            return None
+        with pa.memory_map(self._path(key)) as source:
+            table = pa.ipc.open_file(source).read_all()
+        entry['last_access'] = time.time()
+        entry['hits'] += 1
+        self._save_index()
+        self.stats['hits'] += 1
+        return table
+
+    def put(self, key: str, table: pa.Table, dependencies: Dict[str, Tuple[int, int]],
+            label: str = '') -> bool:
+        """
+        Store a result.
+
+        Args:
+            key: cache_key of the query
+            table: Result
+            dependencies: relation -> inclusive time_key interval read
+                          (dimension tables: their full range)
+            label: Query id, for reporting
+
+        Returns:
+            False when the result alone exceeds the size budget
+        """
+        path = self._path(key)
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+        size = os.path.getsize(path + '.tmp')
+        if size > self.max_bytes:
+            os.remove(path + '.tmp')
+            return False
+        os.replace(path + '.tmp', path)
+        now = time.time()
+        self.index[key] = {'label': label, 'bytes': size, 'rows': table.num_rows,
+                           'dependencies': {r: list(b) for r, b in dependencies.items()},
+                           'created': now, 'last_access': now, 'hits': 0}
+        self.stats['stores'] += 1
+        self._evict()
+        self._save_index()
+        return True
+
+    def _evict(self) -> None:
+        total = sum(e['bytes'] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['bytes']
+            self._remove(key)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, changes: Changes) -> int:
+        """
+        Drop the entries depending on changed data.
+
+        Args:
+            changes: relation -> changed time_key intervals (None: whole relation),
+                     as returned by refresh_from_etl
+
+        Returns:
+            Number of entries dropped
+        """
+        stale = []
+        for key, entry in self.index.items():
+            for relation, (lower, upper) in entry['dependencies'].items():
+                if relation not in changes:
+                    continue
+                intervals = changes[relation]
+                if intervals is None or any(start <= upper and end >= lower for start, end in intervals):
+                    stale.append(key)
+                    break
+        for key in stale:
+            self._remove(key)
+        self.stats['invalidations'] += len(stale)
+        self._save_index()
+        if stale:
+            logger.info(f"Invalidated {len(stale)} cached results")
+        return len(stale)
+
+    def clear(self) -> None:
+        for key in list(self.index):
+            self._remove(key)
+        self._save_index()
+
+    def size_bytes(self) -> int:
+        return sum(e['bytes'] for e in self.index.values())
@@ -0,0 +1,412 @@
+"""
+Parquet Star-Schema Lake
+Stripe Data Architecture - Queries
+
+Purpose: Local Parquet export of the OLAP star schema for the analytics
+         runner:
+             <root>/fact_transactions/time_key=YYYYMMDD/*.parquet
+             <root>/<dim_* | agg_*>.parquet
+         Facts are written by the ETL's partitioned writer
+         (pipelines/etl/fact_writer.py: sorted by merchant and time, exact
+         DECIMAL(18,2), row-group statistics). The lake is filled either by
+         exporting a warehouse (Synapse / SQLite stand-in), refreshed
+         partition by partition after ETL runs, or by a vectorized synthetic
+         generator for benchmarks at scale.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'pipelines', 'etl'))
+from fact_writer import FACT_COLUMNS, write_partitioned_parquet  # noqa: E402
+
+from query_catalog import AGGREGATE_RELATIONS  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+FACT_TABLE = 'fact_transactions'
+DIMENSION_TABLES = ['dim_time', 'dim_customer', 'dim_merchant', 'dim_payment_method',
+                    'dim_geography', 'dim_product']
+AGGREGATE_TABLES = ['agg_daily_revenue', 'agg_monthly_metrics']
+
+
+class StarSchemaLake:
+    """Paths and partition index of a lake root."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.fact_root = os.path.join(root, FACT_TABLE)
+        self._partitions: Optional[Dict[int, List[str]]] = None
+
+    def partitions(self) -> Dict[int, List[str]]:
+        """time_key -> Parquet files, from the directory names (no file is opened)."""
+        if self._partitions is None:
+            partitions = {}
+            for directory in glob.glob(os.path.join(self.fact_root, 'time_key=*')):
+                key = int(os.path.basename(directory).split('=', 1)[1])
+                files = sorted(glob.glob(os.path.join(directory, '*.parquet')))
+                if files:
+                    partitions[key] = files
+            self._partitions = dict(sorted(partitions.items()))
+        return self._partitions
+
+    def prune(self, lower: int, upper: int) -> List[int]:
+        return [key for key in self.partitions() if lower <= key <= upper]
+
+    def fact_columns(self) -> List[str]:
+        for files in self.partitions().values():
+            if files:
+                return pq.read_schema(files[0]).names
+        return list(FACT_COLUMNS)
+
+    def table_path(self, table: str) -> Optional[str]:
+        path = os.path.join(self.root, f"{table}.parquet")
+        return path if os.path.exists(path) else None
+
+    def write_table(self, table: str, frame: pd.DataFrame) -> str:
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"{table}.parquet")
+        frame.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def replace_table(self, table: str, frame: pd.DataFrame) -> bool:
+        """Write a table; returns False when the file content is unchanged."""
+        path = os.path.join(self.root, f"{table}.parquet")
+        previous = _digest(path) if os.path.exists(path) else None
+        self.write_table(table, frame)
+        return _digest(path) != previous
+
+    def clear_partitions(self, time_keys: Iterable[int]) -> None:
+        for key in time_keys:
+            for path in glob.glob(os.path.join(self.fact_root, f"time_key={key}", '*.parquet')):
+                os.remove(path)
+        self._partitions = None
+
+
+def _digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# ============================================================================
+# DIM_TIME (sp_load_dim_time)
+# ============================================================================
+
+def build_dim_time(start_year: int, end_year: int) -> pd.DataFrame:
+    """
+    Calendar rows as sp_load_dim_time builds them (DATEFIRST 7: Sunday = 1).
+    Numeric attributes are stored as INT: T-SQL widens SMALLINT arithmetic
+    (year * 100 + month), DuckDB keeps the narrow type and overflows.
+    """
+    days = pd.date_range(f"{start_year}-01-01", f"{end_year}-12-31", freq='D')
+    weekday = (days.dayofweek.to_numpy() + 1) % 7 + 1
+    jan1 = pd.to_datetime(days.year.astype(str) + '-01-01')
+    jan1_weekday = (jan1.dayofweek.to_numpy() + 1) % 7 + 1
+    return pd.DataFrame({
+        'time_key': (days.year * 10000 + days.month * 100 + days.day).astype(np.int32),
+        'full_date': days.date,
+        'year': days.year.astype(np.int32),
+        'quarter': days.quarter.astype(np.int32),
+        'month': days.month.astype(np.int32),
+        'month_name': days.month_name(),
+        # DATEPART(WEEK): week 1 contains January 1st, weeks start on Sunday
+        'week_of_year': ((days.dayofyear.to_numpy() + jan1_weekday - 2) // 7 + 1).astype(np.int32),
+        'day_of_month': days.day.astype(np.int32),
+        'day_of_week': weekday.astype(np.int32),
+        'day_name': days.day_name(),
+        'is_weekend': np.isin(weekday, (1, 7)),
+        'is_holiday': False,
+        'fiscal_year': days.year.astype(np.int32),
+        'fiscal_quarter': days.quarter.astype(np.int32),
+        'fiscal_period': days.month.astype(np.int32),
+    })
+
+
+# ============================================================================
+# EXPORT
+# ============================================================================
+
+def _export_facts(olap_conn, lake: StarSchemaLake, where: str, prefix: str, chunk_rows: int) -> int:
+    cursor = olap_conn.cursor()
+    cursor.execute(f"SELECT {', '.join(FACT_COLUMNS)} FROM {FACT_TABLE}{where}")
+    rows, part = 0, 0
+    while True:
+        chunk = cursor.fetchmany(chunk_rows)
+        if not chunk:
+            break
+        facts = pd.DataFrame([tuple(r) for r in chunk], columns=FACT_COLUMNS)
+        facts['transaction_datetime'] = pd.to_datetime(facts['transaction_datetime'])
+        write_partitioned_parquet(facts, lake.fact_root, f"{prefix}-{part:05d}")
+        rows += len(facts)
+        part += 1
+    return rows
+
+
+def export_warehouse(olap_conn, root: str, chunk_rows: int = 500_000) -> Dict[str, int]:
+    """
+    Export fact_transactions (by time_key partition) and the dimension /
+    aggregate tables of a DB-API warehouse connection. dim_time is built
+    for the years of the facts when the warehouse has none.
+
+    Returns:
+        Rows exported per table
+    """
+    lake = StarSchemaLake(root)
+    exported = {}
+    lake.clear_partitions(list(lake.partitions()))
+    exported[FACT_TABLE] = _export_facts(olap_conn, lake, '', 'export', chunk_rows)
+
+    for table in DIMENSION_TABLES + AGGREGATE_TABLES:
+        try:
+            frame = pd.read_sql_query(f"SELECT * FROM {table}", olap_conn)
+        except Exception as e:
+            logger.info(f"{table} not exported: {e}")
+            continue
+        if table == 'dim_time' and frame.empty:
+            continue
+        lake.write_table(table, frame)
+        exported[table] = len(frame)
+
+    if 'dim_time' not in exported:
+        years = [key // 10000 for key in lake.partitions()] or [date.today().year]
+        exported['dim_time'] = len(lake.write_table('dim_time', build_dim_time(min(years) - 1, max(years) + 1)))
+    logger.info(f"Exported to {root}: {exported}")
+    return exported
+
+
+# ============================================================================
+# REFRESH FROM ETL RUNS
+# ============================================================================
+
+SYNC_STATE = '_sync.json'
+
+# Changed time_key intervals per relation; None: the whole relation changed
+Changes = Dict[str, Optional[List[Tuple[int, int]]]]
+
+
+def _period_hashes(frame: pd.DataFrame, period: str) -> Dict[int, int]:
+    """Content hash of each period's rows (surrogate key and load timestamp excluded)."""
+    columns = [c for c in frame.columns if c not in ('agg_key', 'calculated_at')]
+    hashes = pd.util.hash_pandas_object(frame[columns], index=False)
+    return hashes.groupby(frame[period].to_numpy()).sum().to_dict()
+
+
+def _period_interval(period: str, value: int) -> Tuple[int, int]:
+    return (value, value) if period == 'date_key' else (value * 100 + 1, value * 100 + 31)
+
+
+def refresh_from_etl(olap_conn, root: str, etl_lake_root: str, chunk_rows: int = 500_000) -> Changes:
+    """
+    Bring the lake up to date after ETL runs (Update_CDC_Watermark): the
+    merge manifests written since the last refresh give the changed
+    time_key partitions, which are re-exported; dimension and aggregate
+    tables are re-exported and compared (per day / month for aggregates).
+    Without a previous refresh the whole lake is exported.
+
+    Args:
+        olap_conn: Warehouse connection (merged state)
+        root: Lake root
+        etl_lake_root: ETL Parquet root holding _merge/*.json manifests
+
+    Returns:
+        Changed time_key intervals per relation (None: whole relation)
+    """
+    lake = StarSchemaLake(root)
+    state_path = os.path.join(root, SYNC_STATE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    manifests = []
+    for path in glob.glob(os.path.join(etl_lake_root, '_merge', '*.json')):
+        with open(path) as f:
+            manifests.append(json.load(f))
+    new = [m for m in manifests if m['to_lsn'] > state.get(m['table'], -1)]
+    changes: Changes = {}
+
+    if not state:
+        export_warehouse(olap_conn, root, chunk_rows)
+        changes = {table: None for table in [FACT_TABLE] + DIMENSION_TABLES + AGGREGATE_TABLES}
+    else:
+        if any(m['deleted_ids'] for m in new):
+            # The partitions of deleted rows are not in the manifests
+            keys = None
+        else:
+            keys = sorted({int(re.search(r"time_key=(\d+)", path).group(1))
+                           for m in new for path in m['files']})
+        if keys is None:
+            lake.clear_partitions(list(lake.partitions()))
+            _export_facts(olap_conn, lake, '', 'export', chunk_rows)
+            changes[FACT_TABLE] = None
+        elif keys:
+            lake.clear_partitions(keys)
+            for i in range(0, len(keys), 100):
+                in_list = ', '.join(str(k) for k in keys[i:i + 100])
+                _export_facts(olap_conn, lake, f" WHERE time_key IN ({in_list})", f"sync-{i // 100:05d}", chunk_rows)
+            changes[FACT_TABLE] = [(k, k) for k in keys]
+
+        for table in DIMENSION_TABLES:
+            try:
+                frame = pd.read_sql_query(f"SELECT * FROM {table}", olap_conn)
+            except Exception:
+                continue
+            if not frame.empty and lake.replace_table(table, frame):
+                changes[table] = None
+
+        for table, period in AGGREGATE_RELATIONS.items():
+            try:
+                frame = pd.read_sql_query(f"SELECT * FROM {table}", olap_conn)
+            except Exception:
+                continue
+            path = lake.table_path(table)
+            previous = _period_hashes(pd.read_parquet(path), period) if path else {}
+            current = _period_hashes(frame, period)
+            changed = sorted(k for k in set(previous) | set(current) if previous.get(k) != current.get(k))
+            if changed:
+                lake.write_table(table, frame)
+                changes[table] = [_period_interval(period, int(k)) for k in changed]
+
+    for m in new:
+        state[m['table']] = max(state.get(m['table'], -1), m['to_lsn'])
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_path + '.tmp', state_path)
+    logger.info(f"Refreshed {root} from {len(new)} merge batches: "
+                f"{ {t: ('all' if c is None else len(c)) for t, c in changes.items()} }")
+    return changes
+
+
+# ============================================================================
+# SYNTHETIC LAKE
+# ============================================================================
+
+GEOGRAPHIES = [
+    # country, name, region, sub_region, continent, currency, gdpr
+    ('FR', 'France', 'Europe', 'Western Europe', 'Europe', 'EUR', 1),
+    ('US', 'United States', 'Americas', 'Northern America', 'North America', 'USD', 0),
+    ('GB', 'United Kingdom', 'Europe', 'Northern Europe', 'Europe', 'GBP', 1),
+    ('DE', 'Germany', 'Europe', 'Western Europe', 'Europe', 'EUR', 1),
+    ('BR', 'Brazil', 'Americas', 'South America', 'South America', 'BRL', 0),
+    ('JP', 'Japan', 'Asia', 'Eastern Asia', 'Asia', 'JPY', 0),
+]
+PAYMENT_METHODS = [
+    # type, card_brand, digital wallet, processing cost
+    ('card', 'visa', 0, 0.0290), ('card', 'mastercard', 0, 0.0290), ('card', 'amex', 0, 0.0350),
+    ('sepa_debit', None, 0, 0.0080), ('wallet', 'apple_pay', 1, 0.0250), ('wallet', 'google_pay', 1, 0.0250),
+]
+SEGMENTS = ['Regular', 'Premium', 'VIP']
+INDUSTRIES = [('retail', 'commerce'), ('saas', 'software'), ('travel', 'services'), ('gaming', 'digital')]
+TIERS = ['standard', 'plus', 'enterprise']
+
+
+def _dimensions(n_customers: int, n_merchants: int, rng: np.random.Generator, start: date) -> Dict[str, pd.DataFrame]:
+    geo = pd.DataFrame(GEOGRAPHIES, columns=['country_code', 'country_name', 'region', 'sub_region',
+                                             'continent', 'currency_code', 'is_gdpr_country'])
+    geo.insert(0, 'geography_key', np.arange(1, len(geo) + 1, dtype=np.int32))
+    geo['currency_name'] = geo['currency_code']
+    geo['timezone'] = 'UTC'
+    geo['is_high_risk'] = False
+
+    country = rng.integers(0, len(GEOGRAPHIES), n_customers)
+    customers = pd.DataFrame({
+        'customer_key': np.arange(1, n_customers + 1, dtype=np.int32),
+        'customer_id': np.arange(1, n_customers + 1, dtype=np.int64),
+        'email': [f"c{i}@example.com" for i in range(1, n_customers + 1)],
+        'full_name': [f"Customer {i}" for i in range(1, n_customers + 1)],
+        'country_code': geo['country_code'].to_numpy()[country],
+        'country_name': geo['country_name'].to_numpy()[country],
+        'customer_segment': np.array(SEGMENTS)[rng.choice(len(SEGMENTS), n_customers, p=[0.8, 0.15, 0.05])],
+        'effective_date': start, 'is_current': True, 'version': 1,
+    })
+    industry = rng.integers(0, len(INDUSTRIES), n_merchants)
+    merchant_country = rng.integers(0, len(GEOGRAPHIES), n_merchants)
+    merchants = pd.DataFrame({
+        'merchant_key': np.arange(1, n_merchants + 1, dtype=np.int32),
+        'merchant_id': np.arange(1, n_merchants + 1, dtype=np.int64),
+        'business_name': [f"Merchant {i}" for i in range(1, n_merchants + 1)],
+        'country_code': geo['country_code'].to_numpy()[merchant_country],
+        'country_name': geo['country_name'].to_numpy()[merchant_country],
+        'industry': [INDUSTRIES[i][0] for i in industry],
+        'industry_group': [INDUSTRIES[i][1] for i in industry],
+        'merchant_tier': np.array(TIERS)[rng.choice(len(TIERS), n_merchants, p=[0.7, 0.25, 0.05])],
+        'is_active': True, 'effective_date': start, 'is_current': True, 'version': 1,
+    })
+    methods = pd.DataFrame(PAYMENT_METHODS, columns=['type', 'card_brand', 'is_digital_wallet',
+                                                     'processing_cost_pct'])
+    methods.insert(0, 'payment_method_key', np.arange(1, len(methods) + 1, dtype=np.int32))
+    methods['is_digital_wallet'] = methods['is_digital_wallet'].astype(bool)
+    products = pd.DataFrame({
+        'product_key': np.array([1, 2], dtype=np.int32), 'product_code': ['PAY-001', 'SUB-001'],
+        'product_name': ['Standard Payment', 'Subscription Payment'],
+        'base_fee': [0.00, 0.00], 'percentage_fee': [0.0290, 0.0250],
+    })
+    return {'dim_geography': geo, 'dim_customer': customers, 'dim_merchant': merchants,
+            'dim_payment_method': methods, 'dim_product': products}
+
+
+def generate_lake(root: str, n_rows: int, n_customers: int = 200_000, n_merchants: int = 5_000,
+                  start: date = date(2024, 1, 1), days: int = 730, batch_rows: int = 2_000_000,
+                  seed: int = 42) -> Dict[str, int]:
+    """
+    Synthetic star schema: dimensions, dim_time and n_rows facts spread over
+    `days` days, written in batches of partitioned Parquet.
+    """
+    rng = np.random.default_rng(seed)
+    lake = StarSchemaLake(root)
+    dims = _dimensions(n_customers, n_merchants, rng, start)
+    for table, frame in dims.items():
+        lake.write_table(table, frame)
+    end_year = (pd.Timestamp(start) + pd.Timedelta(days=days)).year
+    lake.write_table('dim_time', build_dim_time(start.year - 1, end_year + 1))
+
+    customer_country = dims['dim_customer']['country_code'].map(
+        dict(zip(dims['dim_geography']['country_code'], dims['dim_geography']['geography_key']))
+    ).to_numpy(np.int32)
+    for batch, offset in enumerate(range(0, n_rows, batch_rows)):
+        size = min(batch_rows, n_rows - offset)
+        # Volume grows over the period (later days are busier)
+        day = (days * np.sqrt(rng.random(size))).astype(np.int64)
+        timestamps = np.datetime64(start) + day.astype('timedelta64[D]') + \
+            rng.integers(0, 86_400, size).astype('timedelta64[s]')
+        dates = pd.DatetimeIndex(timestamps)
+        customer = rng.integers(0, n_customers, size)
+        amount = np.round(rng.lognormal(3.5, 1.0, size), 2)
+        fee = np.round(amount * 0.029, 2)
+        successful = rng.random(size) < 0.95
+        refunded = successful & (rng.random(size) < 0.02)
+        disputed = successful & (rng.random(size) < 0.005)
+        ids = np.arange(offset + 1, offset + size + 1, dtype=np.int64)
+        facts = pd.DataFrame({
+            'transaction_key': ids, 'transaction_id': ids,
+            'time_key': (dates.year * 10000 + dates.month * 100 + dates.day).to_numpy(np.int32),
+            'customer_key': (customer + 1).astype(np.int32),
+            # Skewed merchant activity
+            'merchant_key': np.minimum(rng.zipf(1.3, size), n_merchants).astype(np.int32),
+            'payment_method_key': rng.integers(1, len(PAYMENT_METHODS) + 1, size).astype(np.int32),
+            'geography_key': customer_country[customer],
+            'product_key': np.int32(1),
+            'amount': amount, 'processing_fee': fee, 'net_amount': np.round(amount - fee, 2),
+            'refund_amount': np.where(refunded, amount, 0.0),
+            'chargeback_amount': np.where(disputed, amount, 0.0),
+            'is_successful': successful, 'is_refunded': refunded, 'is_disputed': disputed,
+            'is_fraudulent': rng.random(size) < 0.003,
+            'transaction_count': np.int32(1),
+            'transaction_datetime': timestamps.astype('datetime64[us]'),
+        })
+        write_partitioned_parquet(facts, lake.fact_root, f"synthetic-{batch:05d}")
+        logger.info(f"Generated {offset + size:,}/{n_rows:,} fact rows")
+    return {FACT_TABLE: n_rows, **{table: len(frame) for table, frame in dims.items()}}
@@ -208,11 +208,10 @@ SELECT
     MAX(t.full_date) AS last_transaction_date,
     DATEDIFF(DAY, MAX(t.full_date), GETDATE()) AS days_inactive,
     
-    -- Average days between transactions
-    AVG(DATEDIFF(DAY, 
-        LAG(t.full_date) OVER (PARTITION BY c.customer_key ORDER BY t.full_date),
-        t.full_date
-    )) AS avg_days_between_purchases,
+    -- Average days between transactions: the consecutive gaps sum to
+    -- last - first (a window function is not allowed inside AVG)
+    DATEDIFF(DAY, MIN(t.full_date), MAX(t.full_date)) * 1.0 /
+        NULLIF(COUNT(f.transaction_key) - 1, 0) AS avg_days_between_purchases,
     
     -- Declining transaction trend
     SUM(CASE WHEN t.year = 2025 THEN f.amount ELSE 0 END) AS revenue_2025,
@@ -345,7 +344,7 @@ ORDER BY fraud_rate DESC;
 -- Use case: Detect temporal fraud trends
 SELECT 
     t.day_name,
-    t.hour_of_day,
+    DATEPART(HOUR, f.transaction_datetime) AS hour_of_day,
     
     COUNT(*) AS transaction_count,
     SUM(CASE WHEN f.is_fraudulent = 1 THEN 1 ELSE 0 END) AS fraud_count,
@@ -356,15 +355,10 @@ SELECT
     AVG(f.amount) AS avg_transaction_amount
     
 FROM fact_transactions f
-INNER JOIN (
-    SELECT 
-        time_key,
-        day_name,
-        DATEPART(HOUR, CAST(time_key AS VARCHAR(8)) + ' 00:00:00') AS hour_of_day
-    FROM dim_time
-) t ON f.time_key = t.time_key
+INNER JOIN dim_time t ON f.time_key = t.time_key
 WHERE f.time_key >= 20250901
-GROUP BY t.day_name, t.hour_of_day
+-- The hour comes from the transaction timestamp (time_key is a date)
+GROUP BY t.day_name, DATEPART(HOUR, f.transaction_datetime)
 ORDER BY fraud_rate DESC;
 
 -- 5. BUSINESS PERFORMANCE METRICS (KPIs)
@@ -512,9 +506,9 @@ ORDER BY t.full_date;
 -- Query 6.2: Seasonality analysis
 -- Use case: Identify seasonal patterns
 SELECT 
-    t.month,
-    t.month_name,
-    t.week_of_year,
+    daily_data.month,
+    daily_data.month_name,
+    daily_data.week_of_year,
     
     AVG(daily_revenue) AS avg_daily_revenue,
     MIN(daily_revenue) AS min_daily_revenue,
@@ -541,8 +535,8 @@ FROM (
         AND t.year >= 2024
     GROUP BY t.full_date, t.month, t.month_name, t.week_of_year
 ) daily_data
-GROUP BY t.month, t.month_name, t.week_of_year
-ORDER BY t.month, t.week_of_year;
+GROUP BY daily_data.month, daily_data.month_name, daily_data.week_of_year
+ORDER BY daily_data.month, daily_data.week_of_year;
 
 -- 7. USING PRE-COMPUTED AGGREGATES (for ultra-fast queries)
 